@@ -5,14 +5,21 @@ from enum import Enum
 import os
 import sys
 from textwrap import dedent
-from typing import Any, Generator
+from typing import Any, AsyncGenerator, Generator
 
-from config import USE_CHATBOT_V1
-from foundation import AnswerUsingStreamCommand, AnswerUsingTemplatesCommand, AskChatbotV1Command, ChatAction, ChatbotController, CheckingAnswerRelatedToContentCommand, FollowupQuestionsCommand, GenerateQuestionCommand, GetHistoriesBySessionIdCommand, History, IntentCommand, LogActivitiesCommand, QuestionResponse, RankingDocsCommand, SaveSessionCommand, SearchDocsByChunkIdCommand, SearchDocsCommand, SearchQueryCommand
+from config import CHATBOT_PIPELINE, ADAPTIVE_WIDE_N_RESULTS, PRECOMPUTED_FOLLOWUPS, DEGRADE_RANKING_MIN_REMAINING, DEGRADED_TOP_K, FAQ_DEGRADED_MIN_SIMILARITY
+from foundation import AnswerUsingStreamCommand, AnswerUsingTemplatesCommand, AskChatbotV1Command, AsyncChatbotController, ChatAction, ChatbotController, CheckingAnswerRelatedToContentCommand, FaqLookupCommand, FollowupQuestionsCommand, GenerateQuestionCommand, GetHistoriesBySessionIdCommand, History, IntentCommand, LogActivitiesCommand, PendingCommand, QuestionResponse, RankingDocsCommand, RetrievalDecisionCommand, PickFollowupQuestionsCommand, SaveSessionCommand, SearchDocsByChunkIdCommand, SearchDocsCommand, SearchQueryCommand, UpdateConversationMemoryCommand
 from models import RoleEnum
+from resources import ensure_created_async
+from retrieval_policy import RetrievalBranch, rank_by_distance
 import random
 
 
+# Answers of the degraded modes, when the LLM cannot answer in time
+DEGRADED_DOCS_ANSWER = "Hệ thống đang quá tải, dưới đây là thông tin liên quan đến câu hỏi của bạn:"
+DEGRADED_ANSWER = "Hệ thống đang quá tải, xin bạn vui lòng thử lại sau."
+
+
 class ChatbotResponse:
 
     def __init__(self, ques: str, ans: str, followup_ques: list[str]):
@@ -57,20 +64,41 @@ class Chatbot(ABC):
 
 
 class ChatbotV1(Chatbot):
+    # LLM calls a cheaper variant may leave out, see ChatbotV1Lite
+    llm_ranking = True
+    llm_followups = True
 
     def ask(self, question: str, session_id: str, **kwargs) -> Generator[tuple[ChatCommand, str], None, ChatbotResponse]:
 
         start_time = datetime.now(timezone.utc)
 
-        controller = ChatbotController()
+        # AsyncChatbotRun passes an AsyncChatbotController and awaits the commands yielded by run()
+        controller = kwargs.get("controller") or ChatbotController()
+        # shadow runs answer without streaming to anyone and leave the session untouched
+        shadow = kwargs.get("shadow", False)
 
-        histories_res = controller.executeCommand(
-            GetHistoriesBySessionIdCommand(session_id=session_id, num=6))
+        # a shadow run answers from the turns its primary run loaded, handed over by on_histories
+        histories_res = kwargs.get("histories")
+        if histories_res is None:
+            histories_res = yield from controller.run(
+                GetHistoriesBySessionIdCommand(session_id=session_id, num=6))
+        if kwargs.get("on_histories"):
+            kwargs["on_histories"](histories_res)
 
         histories = [History(**history) for history in histories_res]
 
-        intent_result = controller.executeCommand(
-            IntentCommand(question=question, histories=histories))
+        faq_result = yield from self._run_or_degrade(
+            controller, FaqLookupCommand(question=question), "faq lookup skipped",
+            {"match": None, "followup_questions": []})
+        if faq_result["match"] is not None:
+            faq_response = yield from self._ask_using_faq(
+                question, session_id, histories, controller, faq_result, start_time, shadow)
+            if faq_response is not None:
+                return faq_response
+
+        intent_result = yield from self._run_or_degrade(
+            controller, IntentCommand(question=question, histories=histories), "intent failed",
+            {"intent": None, "rephased_intent": None})
         predicted_intent = intent_result.get("intent")
 
         rephased_intent = intent_result["rephased_intent"]
@@ -81,20 +109,25 @@ class ChatbotV1(Chatbot):
             full_answer = f"Hệ thống đang được cập nhật, xin bạn vui lòng qua lại sau."
             yield ChatCommand.INTENT, full_answer
             followup_question_result = []
+            # degraded answers are logged too, with the reason in main_error
+            yield from self._log_activities(controller, session_id, question, full_answer, histories, start_time, shadow)
             return ChatbotResponse(ques=question, ans=full_answer, followup_ques=followup_question_result)
 
         question_with_rephrased_intent = f"{question}\n(DETECTED INTENT: {rephased_intent})"
 
         search_terms = []
         full_answer = ""
+        all_docs, nodes = [], None
         action = intent_result["intent_payload"]["ACTION"]
         print("=" * 50)
         print(predicted_intent)
         print("=" * 5)
         if action["CMD"] == ChatAction.SEARCH_DOCS.value:
             yield ChatCommand.SEARCH_TERM, f"Đang tìm kiếm thông tin...."
-            search_result = controller.executeCommand(
-                SearchQueryCommand(question=question, histories=histories))
+            # without the breakdown the question and the rephrased intent are still searched
+            search_result = yield from self._run_or_degrade(
+                controller, SearchQueryCommand(question=question, histories=histories), "search query skipped",
+                {"search_terms": []})
             search_terms = search_result.get("search_terms")
 
             # adding original search terms and rephased terms
@@ -104,16 +137,45 @@ class ChatbotV1(Chatbot):
             print("=" * 5)
 
             yield ChatCommand.DOCUMENTS, f"{random.randrange(40,60)}%"
-            search_docs_result = controller.executeCommand(SearchDocsCommand(
-                intent=predicted_intent, search_terms=search_terms, DB=action["DB"]))
+            # without documents the answer is generated from the question alone
+            search_docs_result = yield from self._run_or_degrade(controller, SearchDocsCommand(
+                intent=predicted_intent, search_terms=search_terms, DB=action["DB"]), "search docs failed",
+                {"documents": [], "nodes": None})
             print("\n".join(search_docs_result.get('documents')))
             print("=" * 5)
 
+            if search_docs_result.get('nodes') is not None:
+                # the branch taken is logged with the other commands, see RetrievalDecisionCommand
+                decision = yield from controller.run(RetrievalDecisionCommand(
+                    nodes=search_docs_result.get('nodes')))
+                print("retrieval branch:", decision["branch"], decision["top_distance"], decision["gap"])
+                if decision["branch"] == RetrievalBranch.WIDEN.value:
+                    search_docs_result = yield from self._run_or_degrade(controller, SearchDocsCommand(
+                        intent=predicted_intent, search_terms=search_terms, DB=action["DB"], n_results=ADAPTIVE_WIDE_N_RESULTS),
+                        "widened search skipped", search_docs_result)
+                nodes = search_docs_result.get('nodes')
+
             yield ChatCommand.RANKING_DOCUMENTS, f"{random.randrange(80,95)}%"
-            ranking_docs_results = controller.executeCommand(RankingDocsCommand(
-                question=question_with_rephrased_intent, histories=histories, docs=search_docs_result.get('documents')))
-            all_docs = [doc['document']
-                        for doc in ranking_docs_results["docs"]]
+            if nodes is None:
+                all_docs = []
+            elif decision["branch"] == RetrievalBranch.CONFIDENT.value:
+                all_docs = decision["documents"]
+            else:
+                ranking_docs_results = None
+                if not self.llm_ranking:
+                    print("LLM ranking disabled by the pipeline")
+                elif controller.deadline.remaining() < DEGRADE_RANKING_MIN_REMAINING:
+                    controller.degrade("ranking skipped: deadline")
+                else:
+                    ranking_docs_results = yield from self._run_or_degrade(controller, RankingDocsCommand(
+                        question=question_with_rephrased_intent, histories=histories, docs=search_docs_result.get('documents')),
+                        "ranking skipped")
+                if ranking_docs_results is not None:
+                    all_docs = [doc['document']
+                                for doc in ranking_docs_results["docs"]]
+                else:
+                    # closest chunks first, see retrieval_policy.rank_by_distance
+                    all_docs = [doc for doc, _ in rank_by_distance(nodes)][:DEGRADED_TOP_K]
             print("RANKED DOCS\n", "\n".join(all_docs))
             print("=" * 5)
 
@@ -122,23 +184,11 @@ class ChatbotV1(Chatbot):
             print("question_with_rephrased_intent: ",
                   question_with_rephrased_intent)
 
-            answer_gen: Any = controller.executeCommand(
-                AnswerUsingStreamCommand(question=question_with_rephrased_intent, docs=all_docs, histories=histories))
-            while True:
-                try:
-                    msg = next(answer_gen)
-                    yield ChatCommand.ANSWERING, msg
-                except StopIteration as e:
-                    result = e.value
-                    full_answer = result.get('answer')
-                    yield ChatCommand.END_ANSWER, full_answer
-                    break
-                except Exception as e:
-                    print("Error", e)
-                    break
+            full_answer = yield from self._stream_answer(
+                controller, question_with_rephrased_intent, all_docs, histories)
 
         if action["CMD"] == ChatAction.ANSWER_TEMPLATE.value:
-            answer_obj = controller.executeCommand(
+            answer_obj = yield from controller.run(
                 AnswerUsingTemplatesCommand(question=question, templates=action["TEMPLATES"]))
             full_answer = answer_obj.get('answer')
             yield ChatCommand.BEGIN_ANSWER, "Generating answer...."
@@ -147,37 +197,192 @@ class ChatbotV1(Chatbot):
                 yield ChatCommand.ANSWERING, full_answer[step:step + 3]
             yield ChatCommand.END_ANSWER, full_answer
 
-        controller.executeCommand(SaveSessionCommand(
-            session_id=session_id, role=RoleEnum.user, content=question),
-            exclude_save_history=True
-        )
+        yield from self._save_turn(controller, session_id, question, full_answer, shadow)
+
+        followup_questions = []
+        if PRECOMPUTED_FOLLOWUPS and all_docs and nodes is not None:
+            picked_result = yield from controller.run(PickFollowupQuestionsCommand(
+                session_id=session_id, question=question, docs=all_docs, nodes=nodes))
+            followup_questions = picked_result.get('followup_questions')
+        if self.llm_followups and len(followup_questions) < 3:
+            # chunks ingested before follow-up questions were precomputed, or templated answers
+            followup_question_result = yield from self._run_or_degrade(controller, FollowupQuestionsCommand(search_term="\n".join(
+                search_terms), intent=predicted_intent, answer=full_answer, histories=histories), "follow-up questions skipped",
+                {"followup_questions": followup_questions})
+            followup_questions = followup_question_result.get('followup_questions')
+        yield ChatCommand.FOLLOWUP_QUESTIONS, "<|>".join(followup_questions)
 
-        controller.executeCommand(SaveSessionCommand(
-            session_id=session_id, role=RoleEnum.system, content=full_answer),
-            exclude_save_history=True
-        )
+        yield from self._log_activities(controller, session_id, question, full_answer, histories, start_time, shadow)
 
-        followup_question_result = controller.executeCommand(FollowupQuestionsCommand(search_term="\n".join(
-            search_terms), intent=predicted_intent, answer=full_answer, histories=histories))
-        followup_questions = followup_question_result.get('followup_questions')
-        yield ChatCommand.FOLLOWUP_QUESTIONS, "<|>".join(followup_questions)
+        return ChatbotResponse(ques=question, ans=full_answer, followup_ques=followup_questions)
 
-        controller.executeCommand(LogActivitiesCommand(
+    def _log_activities(self, controller: ChatbotController, session_id: str, question: str, answer: str, histories: list[History], start_time: datetime, shadow: bool) -> Generator[Any, Any, None]:
+        yield from controller.run(LogActivitiesCommand(
             session_id=session_id,
             question=question,
-            answer=full_answer,
+            answer=answer,
             histories=histories,
             commandHistories=controller.commandHistories,
             start_time=start_time,
             end_time=datetime.now(tz=timezone.utc),
+            degraded=controller.degraded,
+            persist=not shadow,
         ),
             include_execution_time=False
         )
 
+    def _save_turn(self, controller: ChatbotController, session_id: str, question: str, answer: str, shadow: bool) -> Generator[Any, Any, None]:
+        if shadow:
+            return
+        yield from controller.run(SaveSessionCommand(
+            session_id=session_id, role=RoleEnum.user, content=question),
+            exclude_save_history=True
+        )
+
+        yield from controller.run(SaveSessionCommand(
+            session_id=session_id, role=RoleEnum.system, content=answer),
+            exclude_save_history=True
+        )
+
+        yield from controller.run(UpdateConversationMemoryCommand(session_id=session_id),
+                                  exclude_save_history=True)
+
+    def _run_or_degrade(self, controller: ChatbotController, command, reason: str, default: Any = None, **kwargs) -> Generator[Any, Any, Any]:
+        """Run an optional stage; when it fails, times out or its circuit is open the request goes on with ``default``."""
+        try:
+            return (yield from controller.run(command, **kwargs))
+        except Exception as e:
+            controller.degrade(f"{reason}: {e.__class__.__name__}: {e}")
+            return default
+
+    def _stream_answer(self, controller: ChatbotController, question: str, docs: list[str], histories: list[History]) -> Generator[tuple[ChatCommand, str], None, str]:
+        streamed = []
+
+        def wrap(msg: str):
+            streamed.append(msg)
+            return ChatCommand.ANSWERING, msg
+
+        try:
+            result = yield from controller.stream(
+                AnswerUsingStreamCommand(question=question, docs=docs, histories=histories), wrap=wrap)
+            full_answer = result.get('answer')
+        except Exception as e:
+            controller.degrade(f"answer failed: {e.__class__.__name__}: {e}")
+            full_answer = "".join(streamed)
+            if not full_answer:
+                full_answer = yield from self._degraded_answer(controller, question, docs)
+                yield ChatCommand.ANSWERING, full_answer
+        yield ChatCommand.END_ANSWER, full_answer
+        return full_answer
+
+    def _degraded_answer(self, controller: ChatbotController, question: str, docs: list[str]) -> Generator[Any, Any, str]:
+        # a close enough FAQ answer, else the best document as it is
+        faq_result = yield from self._run_or_degrade(
+            controller, FaqLookupCommand(question=question, min_similarity=FAQ_DEGRADED_MIN_SIMILARITY),
+            "degraded faq lookup failed", {"match": None})
+        if faq_result["match"] is not None and faq_result["match"]["answer"]:
+            return faq_result["match"]["answer"]
+        if docs:
+            return f"{DEGRADED_DOCS_ANSWER}\n{docs[0]}"
+        return DEGRADED_ANSWER
+
+    def _ask_using_faq(self, question: str, session_id: str, histories: list[History], controller: ChatbotController, faq_result: dict, start_time: datetime, shadow: bool = False) -> Generator[tuple[ChatCommand, str], None, ChatbotResponse | None]:
+        # Fast path: the question matches an indexed FAQ question, so intent detection,
+        # query breakdown and ranking are skipped and the linked chunk is answered from directly.
+        # None when there is nothing to answer from, the caller then runs the full pipeline.
+        faq_match = faq_result["match"]
+        print("FAQ match:", faq_match["question"], faq_match["similarity"])
+
+        chunk_result = yield from self._run_or_degrade(
+            controller, SearchDocsByChunkIdCommand(chunk_id=faq_match["chunk_id"]), "faq chunk skipped",
+            {"document": None, "node": None})
+        document = chunk_result.get("document") or faq_match["answer"]
+        if not document:
+            # generated entries have no answer and their chunk was deleted or not reachable;
+            # the index only drops such entries when it is rebuilt
+            print("FAQ match without a document, answering with the pipeline:", faq_match["chunk_id"])
+            return None
+        docs = [document]
+
+        yield ChatCommand.INTENT, f"Bạn muốn hỏi: {faq_match['question']}"
+
+        yield ChatCommand.BEGIN_ANSWER, "Đang tổng hợp thông tin...."
+        full_answer = yield from self._stream_answer(controller, question, docs, histories)
+
+        yield from self._save_turn(controller, session_id, question, full_answer, shadow)
+
+        followup_questions = faq_result["followup_questions"]
+        if PRECOMPUTED_FOLLOWUPS and len(followup_questions) < 3 and chunk_result.get("node") is not None:
+            picked_result = yield from controller.run(PickFollowupQuestionsCommand(
+                session_id=session_id, question=question, docs=docs, nodes=chunk_result.get("node")))
+            followup_questions = [*followup_questions, *[
+                q for q in picked_result.get('followup_questions') if q not in followup_questions]][:3]
+        # no LLM call on the fast path: sibling FAQ questions and the chunk's pool are enough
+        yield ChatCommand.FOLLOWUP_QUESTIONS, "<|>".join(followup_questions)
+
+        yield from self._log_activities(controller, session_id, question, full_answer, histories, start_time, shadow)
+
         return ChatbotResponse(ques=question, ans=full_answer, followup_ques=followup_questions)
 
 
-def get_chatbot_instance() -> Chatbot:
-    if USE_CHATBOT_V1:
-        return ChatbotV1()
-    return ChatbotV1()
+class AsyncChatbotRun:
+    """Drives ``Chatbot.ask`` on the event loop: ``async for cmd, msg in AsyncChatbotRun(...)``.
+
+    The pipeline is the same generator as the synchronous path; the commands it yields are
+    awaited here (native async LLM, Chroma and DB calls) and their results sent back in.
+    ``response`` holds the returned ChatbotResponse once iteration is over.
+    """
+
+    def __init__(self, chatbot: Chatbot, question: str, session_id: str, **kwargs):
+        self.controller = AsyncChatbotController()
+        self.pipeline = chatbot.ask(
+            question, session_id=session_id, controller=self.controller, **kwargs)
+        self.response: ChatbotResponse | None = None
+
+    def __aiter__(self) -> AsyncGenerator[tuple[ChatCommand, str], None]:
+        return self._events()
+
+    async def _events(self) -> AsyncGenerator[tuple[ChatCommand, str], None]:
+        # dependencies not created by the warmup yet are created off the event loop
+        await ensure_created_async()
+        value, error = None, None
+        while True:
+            try:
+                event = self.pipeline.throw(error) if error else self.pipeline.send(value)
+            except StopIteration as e:
+                self.response = e.value
+                return
+            value, error = None, None
+            if not isinstance(event, PendingCommand):
+                yield event
+                continue
+            try:
+                if event.wrap is None:
+                    value = await self.controller.executeCommandAsync(event.command, **event.kwargs)
+                else:
+                    async for msg in self.controller.streamCommandAsync(event.command, event.wrap):
+                        yield msg
+                    value = event.command.result
+            except Exception as e:
+                # raised inside the pipeline so that its own error handling applies
+                error = e
+
+
+class ChatbotV1Lite(ChatbotV1):
+    """ChatbotV1 without LLM ranking (closest chunks first) nor LLM follow-up questions (precomputed ones only)."""
+    llm_ranking = False
+    llm_followups = False
+
+
+# Pipelines selectable by CHATBOT_PIPELINE, the X-Chatbot-Pipeline header or SHADOW_PIPELINE
+PIPELINES: dict[str, type[Chatbot]] = {
+    "v1": ChatbotV1,
+    "v1-lite": ChatbotV1Lite,
+}
+
+
+def get_chatbot_instance(pipeline: str | None = None) -> Chatbot:
+    pipeline = pipeline or CHATBOT_PIPELINE
+    if pipeline not in PIPELINES:
+        raise ValueError(f"Unknown pipeline {pipeline}, expected one of {', '.join(PIPELINES)}")
+    return PIPELINES[pipeline]()
@@ -0,0 +1,170 @@
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, TypedDict
+
+import numpy as np
+import sqlalchemy as db
+
+from ChatbotAgent.bot import ChatCommand, ChatbotResponse, get_chatbot_instance
+from config import REQUEST_DEADLINE, SHADOW_FRACTION, SHADOW_MAX_CONCURRENCY, SHADOW_PIPELINE
+from foundation import ChatbotController, LogActivitiesCommand, embedding_function
+from log_metrics import compute_log_metrics
+from models import ShadowComparison, get_session
+
+# Shadow mode: a sampled request is also answered by a candidate pipeline on a background
+# thread, never streamed and never saved to the session, and both runs are stored side by
+# side in ``shadow_comparisons`` to validate a pipeline change on real traffic.
+
+
+class RunMetricsTypeDict(TypedDict):
+    answer: str
+    duration_ms: float
+    ttfb_ms: Optional[float]
+    total_tokens: int
+    cost: float
+
+
+class RunMetrics:
+    """Latency of one pipeline run as seen by the client, tokens and cost from its log."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.ttfb_ms: Optional[float] = None
+
+    def observe(self, cmd: ChatCommand):
+        if cmd == ChatCommand.ANSWERING and self.ttfb_ms is None:
+            self.ttfb_ms = (time.perf_counter() - self.started) * 1000
+
+    def finish(self, response: ChatbotResponse, controller: ChatbotController) -> RunMetricsTypeDict:
+        logs = [cmd.result for cmd in controller.commandHistories
+                if isinstance(cmd, LogActivitiesCommand) and cmd.result]
+        metrics = compute_log_metrics(logs[-1]) if logs else {"total_tokens": 0, "cost": 0.0}
+        return {
+            "answer": response.answer if response else "",
+            "duration_ms": (time.perf_counter() - self.started) * 1000,
+            "ttfb_ms": self.ttfb_ms,
+            "total_tokens": metrics["total_tokens"],
+            "cost": metrics["cost"],
+        }
+
+
+def answer_similarity(a: str, b: str) -> Optional[float]:
+    if not a or not b:
+        return None
+    try:
+        x, y = (np.asarray(e, dtype=float) for e in embedding_function.get()([a, b]))
+        return float(np.dot(x, y) / (np.linalg.norm(x) * np.linalg.norm(y)))
+    except Exception as e:
+        print(f"Answer similarity failed: {e}")
+        return None
+
+
+class ShadowRun:
+    """Handle of one shadowed request; the serving side reports its own run to it."""
+
+    def __init__(self, primary_pipeline: str, candidate_pipeline: str, question: str, session_id: str):
+        self.primary_pipeline = primary_pipeline
+        self.candidate_pipeline = candidate_pipeline
+        self.question = question
+        self.session_id = session_id
+        self.primary = RunMetrics()
+        self._primary_result: Future = Future()
+        self._histories: Future = Future()
+
+    def share_histories(self, histories: list[dict]):
+        """on_histories of the primary run: the candidate gets its own copy of the turns it loaded."""
+        if not self._histories.done():
+            self._histories.set_result([dict(history) for history in histories])
+
+    def histories(self) -> list[dict]:
+        # the primary saves its turn when done, the candidate must not read the session after that
+        return self._histories.result(timeout=REQUEST_DEADLINE)
+
+    def observe(self, cmd: ChatCommand):
+        self.primary.observe(cmd)
+
+    def finish(self, response: ChatbotResponse, controller: ChatbotController):
+        if not self._primary_result.done():
+            self._primary_result.set_result(self.primary.finish(response, controller))
+
+    def primary_result(self) -> RunMetricsTypeDict:
+        # a client that disconnects mid-stream never finishes the run, its comparison is dropped
+        return self._primary_result.result(timeout=REQUEST_DEADLINE)
+
+
+class ShadowRunner:
+
+    def __init__(self, candidate_pipeline: str, fraction: float, max_concurrency: int):
+        self.candidate_pipeline = candidate_pipeline
+        self.fraction = fraction
+        self._slots = threading.BoundedSemaphore(max(max_concurrency, 1))
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(max_concurrency, 1), thread_name_prefix="shadow")
+
+    def maybe_start(self, primary_pipeline: str, question: str, session_id: str) -> Optional[ShadowRun]:
+        """Start the candidate on a sampled request, None when the request is not shadowed."""
+        if not self.candidate_pipeline or self.candidate_pipeline == primary_pipeline:
+            return None
+        if random.random() >= self.fraction:
+            return None
+        # never queues: shadow load is shed instead of growing behind slow candidates
+        if not self._slots.acquire(blocking=False):
+            return None
+        run = ShadowRun(primary_pipeline, self.candidate_pipeline, question, session_id)
+        self._executor.submit(self._run, run)
+        return run
+
+    def _run(self, run: ShadowRun):
+        # the slot is held until the comparison is recorded, so waiting runs count against max_concurrency
+        try:
+            try:
+                candidate, error = self._run_candidate(run), None
+            except Exception as e:
+                candidate, error = None, f"{e.__class__.__name__}: {e}"
+            try:
+                self._record(run, run.primary_result(), candidate, error)
+            except Exception as e:
+                print(f"Shadow comparison of {run.session_id} not recorded: {e}")
+        finally:
+            self._slots.release()
+
+    def _run_candidate(self, run: ShadowRun) -> RunMetricsTypeDict:
+        histories = run.histories()
+        metrics = RunMetrics()
+        controller = ChatbotController()
+        chat_gen = get_chatbot_instance(run.candidate_pipeline).ask(
+            run.question, session_id=run.session_id, controller=controller, shadow=True, histories=histories)
+        while True:
+            try:
+                cmd, _ = next(chat_gen)
+                metrics.observe(cmd)
+            except StopIteration as e:
+                return metrics.finish(e.value, controller)
+
+    def _record(self, run: ShadowRun, primary: RunMetricsTypeDict, candidate: Optional[RunMetricsTypeDict], error: Optional[str]):
+        candidate = candidate or {}
+        with get_session().connect() as conn:
+            conn.execute(db.insert(ShadowComparison).values(
+                session_id=run.session_id,
+                question=run.question,
+                primary_pipeline=run.primary_pipeline,
+                candidate_pipeline=run.candidate_pipeline,
+                primary_answer=primary["answer"],
+                candidate_answer=candidate.get("answer"),
+                answer_similarity=answer_similarity(primary["answer"], candidate.get("answer")),
+                primary_duration_ms=primary["duration_ms"],
+                candidate_duration_ms=candidate.get("duration_ms"),
+                primary_ttfb_ms=primary["ttfb_ms"],
+                candidate_ttfb_ms=candidate.get("ttfb_ms"),
+                primary_total_tokens=primary["total_tokens"],
+                candidate_total_tokens=candidate.get("total_tokens"),
+                primary_cost=primary["cost"],
+                candidate_cost=candidate.get("cost"),
+                candidate_error=error,
+            ))
+            conn.commit()
+
+
+shadow_runner = ShadowRunner(SHADOW_PIPELINE, SHADOW_FRACTION, SHADOW_MAX_CONCURRENCY)
@@ -5,45 +5,69 @@ import json
 
 
 from ChatbotAgent.bot import ChatCommand, ChatbotResponse, get_chatbot_instance
-from config import CHATBOT_AGENT_PORT
-from ChatbotAgent.v1.commands import database_cli
-from models import get_session, Session, Dialogue, Feedback, CSATEnum
+from ChatbotAgent.shadow import shadow_runner
+from config import CHATBOT_AGENT_PORT, WARMUP_ON_START, CHATBOT_PIPELINE
+from ChatbotAgent.v1.commands import database_cli, faq_cli, intent_cli, partitions_cli
+from models import get_session, Session, Dialogue, Feedback, CSATEnum, ShadowComparison
+from log_format import load_dialogues
+from log_metrics import compute_log_metrics
+from resources import readiness, start_warmup
+from resilience import breakers_status
+from foundation import ChatbotController, retrieval_cache
 import sqlalchemy as db
 
 app = Flask(__name__)
 
 app.cli.add_command(database_cli)
+app.cli.add_command(faq_cli)
+app.cli.add_command(intent_cli)
+app.cli.add_command(partitions_cli)
+
+
+def format_event(cmd: ChatCommand, msg: str, session_id: str) -> str | None:
+    """One streamed /completion event, shared with the ASGI server. END_ANSWER is not sent."""
+    if cmd == ChatCommand.END_ANSWER:
+        print(f"cmd: {cmd} msg: {msg}")
+        return None
+    return json.dumps({"event": cmd.name, "data": msg, "session_id": session_id}) + "\n\n"
+
+
+# Selects the pipeline of one request, see ChatbotAgent.bot.PIPELINES
+PIPELINE_HEADER = "X-Chatbot-Pipeline"
 
 
 @app.post('/completion')
 def output():
-    c = get_chatbot_instance()
+    pipeline = request.headers.get(PIPELINE_HEADER) or CHATBOT_PIPELINE
+    try:
+        c = get_chatbot_instance(pipeline)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     stream = request.args.get("stream")
     body = json.loads(request.data)
     session_id = body.get("session_id")
     question = body.get("msg")
     if not session_id:
         session_id = str(uuid.uuid4())
-    chat_gen = c.ask(question, session_id=session_id)
+    shadow_run = shadow_runner.maybe_start(pipeline, question, session_id)
+    controller = ChatbotController()
+    chat_gen = c.ask(question, session_id=session_id, controller=controller,
+                     on_histories=shadow_run.share_histories if shadow_run else None)
 
     if stream:
         def generate():
             while True:
                 try:
                     cmd, msg = next(chat_gen)
-                    # print(f"cmd: {cmd} msg: {msg}")
-                    if cmd == ChatCommand.ANSWERING:
-                        if preCmd == ChatCommand.BEGIN_ANSWER.name:
-                            yield json.dumps({"event": ChatCommand.BEGIN_ANSWER.name, "data": "", "session_id": session_id}) + "\n\n"
-                        yield json.dumps({"event": ChatCommand.ANSWERING.name, "data": msg, "session_id": session_id}) + "\n\n"
-                    elif cmd != ChatCommand.END_ANSWER:
-                        yield json.dumps({"event": cmd.name, "data": msg, "session_id": session_id}) + "\n\n"
-                    elif cmd == ChatCommand.END_ANSWER:
-                        print(f"cmd: {cmd} msg: {msg}")
-
-                    preCmd = cmd
+                    if shadow_run:
+                        shadow_run.observe(cmd)
+                    event = format_event(cmd, msg, session_id)
+                    if event is not None:
+                        yield event
                 except StopIteration as e:
                     returned = e.value
+                    if shadow_run:
+                        shadow_run.finish(returned, controller)
                     return returned
         return Response(generate(), mimetype='text/event-stream')
     else:
@@ -51,9 +75,13 @@ def output():
             while True:
                 try:
                     cmd, msg = next(chat_gen)
+                    if shadow_run:
+                        shadow_run.observe(cmd)
                     print(f"cmd: {cmd} msg: {msg}")
                 except StopIteration as e:
                     returned = e.value
+                    if shadow_run:
+                        shadow_run.finish(returned, controller)
                     return returned
         res = generate()
         return jsonify({
@@ -69,6 +97,26 @@ def hello_world():
     return 'Running'
 
 
+@app.get('/healthz')
+def healthz():
+    # liveness only, never touches a dependency; breakers are the last known state of each
+    return jsonify({"status": "ok", "breakers": breakers_status()})
+
+
+@app.get('/retrieval_cache')
+def retrieval_cache_stats():
+    # hit rate of the shared retrieval cache since the worker started, see retrieval_cache.py
+    return jsonify(retrieval_cache.stats())
+
+
+@app.get('/readyz')
+def readyz():
+    if WARMUP_ON_START:
+        start_warmup()
+    status = readiness()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
 @app.get("/conversations/<session_id>")
 def get_conversations(session_id: str):
     histories = []
@@ -84,17 +132,71 @@ def get_conversations(session_id: str):
 
 @app.get("/logs/<session_id>")
 def get_logs(session_id: str):
-    logs = []
     with get_session().connect() as conn:
-        for row in conn.execute(
+        rows = conn.execute(
             db.select(Dialogue).where(Dialogue.c.conversation_id ==
                                       session_id).order_by(Dialogue.c.created_at.asc())
-        ):
-            logs.append(dict(row._mapping))
+        ).fetchall()
+        logs = load_dialogues(conn, rows)
 
     return jsonify(logs)
 
 
+ANALYTICS_COLUMNS = ["id", "record_id", "main_input", "main_output", "created_at", "intent", "retrieval_branch",
+                     "duration_ms", "prompt_tokens", "cached_tokens", "completion_tokens", "total_tokens", "cost",
+                     "metrics"]
+
+
+@app.get("/logs/<session_id>/analytics")
+def get_logs_analytics(session_id: str):
+    """Token, cost and duration aggregates of a session, without the logged prompts and documents."""
+    with get_session().connect() as conn:
+        rows = conn.execute(
+            db.select(*[Dialogue.c[name] for name in ANALYTICS_COLUMNS]).where(
+                Dialogue.c.conversation_id == session_id).order_by(Dialogue.c.created_at.asc())
+        ).fetchall()
+        records = [dict(row._mapping) for row in rows]
+
+        # dialogues logged before the aggregates were stored
+        legacy_ids = [record["id"] for record in records if record["total_tokens"] is None]
+        if legacy_ids:
+            legacy = load_dialogues(conn, conn.execute(
+                db.select(Dialogue).where(Dialogue.c.id.in_(legacy_ids))).fetchall())
+            computed = {log["id"]: compute_log_metrics(log) for log in legacy}
+            records = [{**record, **computed.get(record["id"], {})} for record in records]
+
+    totals = {key: sum(record[key] or 0 for record in records)
+              for key in ("prompt_tokens", "cached_tokens", "completion_tokens", "total_tokens", "cost", "duration_ms")}
+    return jsonify({
+        "session_id": session_id,
+        "count": len(records),
+        **totals,
+        "records": records,
+    })
+
+
+@app.get("/shadow/comparisons")
+def get_shadow_comparisons():
+    """Serving and candidate pipelines side by side: averages per pair, then the latest comparisons."""
+    c = ShadowComparison.c
+    averaged = ["answer_similarity", "primary_duration_ms", "candidate_duration_ms", "primary_ttfb_ms",
+                "candidate_ttfb_ms", "primary_total_tokens", "candidate_total_tokens", "primary_cost", "candidate_cost"]
+    limit = request.args.get("limit", 100, type=int)
+    with get_session().connect() as conn:
+        pairs = conn.execute(
+            db.select(c.primary_pipeline, c.candidate_pipeline, db.func.count().label("count"),
+                      db.func.count(c.candidate_error).label("candidate_errors"),
+                      *[db.func.avg(c[name]).label(name) for name in averaged])
+            .group_by(c.primary_pipeline, c.candidate_pipeline)
+        ).fetchall()
+        latest = conn.execute(
+            db.select(ShadowComparison).order_by(c.created_at.desc()).limit(limit)).fetchall()
+    return jsonify({
+        "pairs": [dict(row._mapping) for row in pairs],
+        "comparisons": [dict(row._mapping) for row in latest],
+    })
+
+
 @app.get("/sessions")
 def get_sessions():
     sessions = []
@@ -154,5 +256,7 @@ def get_feedbacks_by_session_id(session_id: str):
 
 
 if __name__ == '__main__':
+    if WARMUP_ON_START:
+        start_warmup()
     port = int(CHATBOT_AGENT_PORT)
     app.run(debug=True, port=port)
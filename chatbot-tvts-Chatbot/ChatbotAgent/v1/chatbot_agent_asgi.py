@@ -0,0 +1,83 @@
+import asyncio
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from ChatbotAgent.bot import AsyncChatbotRun, get_chatbot_instance
+from ChatbotAgent.shadow import shadow_runner
+from ChatbotAgent.v1.chatbot_agent_app import PIPELINE_HEADER, app as flask_app, format_event
+from config import ASYNC_THREAD_POOL_SIZE, CHATBOT_PIPELINE, WARMUP_ON_START
+from resources import start_warmup
+
+# Async serving mode: /completion runs on the event loop (AsyncOpenAI stream, async Chroma
+# and asyncpg), so an open stream costs a coroutine instead of a worker thread. Every other
+# route is served by the Flask app unchanged.
+#
+#   uvicorn ChatbotAgent.v1.chatbot_agent_asgi:app --host 0.0.0.0 --port 6811
+
+
+async def completion(request: Request):
+    pipeline = request.headers.get(PIPELINE_HEADER) or CHATBOT_PIPELINE
+    try:
+        chatbot = get_chatbot_instance(pipeline)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    stream = request.query_params.get("stream")
+    body = json.loads(await request.body())
+    session_id = body.get("session_id")
+    question = body.get("msg")
+    if not session_id:
+        session_id = str(uuid.uuid4())
+    # the candidate runs the synchronous pipeline on a shadow thread, off the event loop
+    shadow_run = shadow_runner.maybe_start(pipeline, question, session_id)
+    run = AsyncChatbotRun(chatbot, question, session_id=session_id,
+                          on_histories=shadow_run.share_histories if shadow_run else None)
+
+    if stream:
+        async def generate():
+            async for cmd, msg in run:
+                if shadow_run:
+                    shadow_run.observe(cmd)
+                event = format_event(cmd, msg, session_id)
+                if event is not None:
+                    yield event
+            if shadow_run:
+                shadow_run.finish(run.response, run.controller)
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    async for cmd, msg in run:
+        if shadow_run:
+            shadow_run.observe(cmd)
+        print(f"cmd: {cmd} msg: {msg}")
+    if shadow_run:
+        shadow_run.finish(run.response, run.controller)
+    return JSONResponse({
+        "question": run.response.question,
+        "answer": run.response.answer,
+        "session_id": session_id
+    })
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_THREAD_POOL_SIZE))
+    if WARMUP_ON_START:
+        start_warmup()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/completion", completion, methods=["POST"]),
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
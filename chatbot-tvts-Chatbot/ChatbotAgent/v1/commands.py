@@ -1,10 +1,107 @@
+import json
+import click
 from flask import Flask
 from flask.cli import AppGroup
 from models import init_database
 
 database_cli = AppGroup('database')
+faq_cli = AppGroup('faq')
+intent_cli = AppGroup('intent')
+partitions_cli = AppGroup('partitions')
 
 @database_cli.command('init')
 def init_data():
     print("init database")
     init_database()
+
+@faq_cli.command('build')
+@click.option('--generate', default=0, help='Number of extra questions to synthesize per chunk with the LLM')
+@click.option('--page-size', default=100, help='Number of chunks fetched from Chroma per request')
+def build_faq(generate: int, page_size: int):
+    from foundation import generation_instance
+    from faq_index import build_faq_index
+
+    def generate_questions(content: str, num: int) -> list[str]:
+        questions, _, _ = generation_instance.generate_questions(content=content, num=num)
+        return questions
+
+    print("build faq index")
+    stats = build_faq_index(
+        generation_instance.faq_index,
+        generation_instance.knowledge_base.collection,
+        generate_questions=generate_questions,
+        num_generated=generate,
+        page_size=page_size,
+    )
+    print(stats)
+
+@intent_cli.command('train')
+@click.option('--output', default=None, help='Directory the versioned model file is written to')
+@click.option('--min-samples', default=5, help='Intents with fewer logged examples are left to the LLM')
+def train_intent_classifier(output: str, min_samples: int):
+    import sqlalchemy as db
+    from config import INTENT_CLASSIFIER_PATH, INTENT_CLASSIFIER_CONTEXT_TURNS, ROOT_DIR
+    from intent_classifier import IntentClassifier, extract_training_samples
+    from log_format import load_dialogues
+    from models import get_session, Dialogue
+
+    with open(f"{ROOT_DIR}/intents.json", "r") as file:
+        intents = json.load(file)
+
+    print("load intent samples from dialogues")
+    with get_session().connect() as conn:
+        rows = conn.execution_options(stream_results=True).execute(
+            db.select(Dialogue.c.calls, Dialogue.c.calls_compressed, Dialogue.c.log_format).where(
+                db.or_(Dialogue.c.calls != None, Dialogue.c.calls_compressed != None)))
+        samples = []
+        for batch in rows.partitions(500):
+            logs = load_dialogues(conn, batch)
+            samples += extract_training_samples(
+                (log["calls"] for log in logs), intents, context_turns=INTENT_CLASSIFIER_CONTEXT_TURNS)
+    print(f"{len(samples)} samples")
+
+    classifier, stats = IntentClassifier.train(
+        samples, intents, min_samples=min_samples, context_turns=INTENT_CLASSIFIER_CONTEXT_TURNS)
+    path = classifier.save(output or INTENT_CLASSIFIER_PATH, stats)
+    print(f"saved {path}")
+    print(stats)
+
+@partitions_cli.command('maintain')
+@click.option('--months-ahead', default=None, type=int, help='Monthly partitions created ahead of the current month')
+def maintain_partitions_command(months_ahead: int):
+    """Daily job: create upcoming partitions, refresh the recent rollups and apply retention."""
+    from datetime import datetime, timedelta
+    from config import PARTITION_MONTHS_AHEAD, DIALOGUE_RETENTION_MONTHS, SESSION_RETENTION_MONTHS, LOG_ARCHIVE_DIR
+    from models import get_session
+    from partitions import maintain_partitions, rollup_day, apply_retention
+
+    today = datetime.utcnow().date()
+    with get_session().connect() as conn:
+        maintain_partitions(conn, PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead)
+        for day in (today - timedelta(days=1), today):
+            print(f"rollup {day}: {rollup_day(conn, day)} dialogues")
+        conn.commit()
+        for table, retention_months in (("dialogues", DIALOGUE_RETENTION_MONTHS), ("sessions", SESSION_RETENTION_MONTHS)):
+            for path in apply_retention(conn, table, retention_months, LOG_ARCHIVE_DIR):
+                print(f"archived {path}")
+
+@partitions_cli.command('rollup')
+@click.option('--date', 'day', required=True, help='Day to aggregate, YYYY-MM-DD')
+def rollup_command(day: str):
+    from datetime import date
+    from models import get_session
+    from partitions import rollup_day
+
+    with get_session().connect() as conn:
+        print(f"rollup {day}: {rollup_day(conn, date.fromisoformat(day))} dialogues")
+        conn.commit()
+
+@partitions_cli.command('list')
+def list_partitions_command():
+    from models import get_session
+    from partitions import PARTITIONED_TABLES, list_partitions
+
+    with get_session().connect() as conn:
+        for table in PARTITIONED_TABLES:
+            for name, month in list_partitions(conn, table):
+                print(f"{table}\t{name}\t{month}")
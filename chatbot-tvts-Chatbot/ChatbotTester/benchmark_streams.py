@@ -0,0 +1,139 @@
+"""Concurrent /completion stream capacity: Flask (gunicorn) vs the ASGI server.
+
+1. Start a fake OpenAI endpoint so that the benchmark measures the servers, not the LLM:
+     python ChatbotTester/benchmark_streams.py fake-openai --port 9100 --chunks 200 --delay 0.05
+2. Start both agents with OPENAI_BASE_URL=http://127.0.0.1:9100/v1, e.g.
+     gunicorn -w 2 --threads 8 --bind 0.0.0.0:6811 wsgi:app
+     uvicorn ChatbotAgent.v1.chatbot_agent_asgi:app --workers 2 --port 6821
+3. Sweep concurrency levels against both:
+     python ChatbotTester/benchmark_streams.py run http://127.0.0.1:6811 http://127.0.0.1:6821 -c 10 100 1000
+
+Chroma and Postgres are the real ones configured in the environment.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+
+import httpx
+
+sys.path.append(os.path.abspath("."))
+
+
+def _default_intent() -> str:
+    with open("intents.json", "r") as file:
+        intents = json.load(file)
+    return next(name for name, intent in intents.items() if intent["ACTION"]["CMD"] == "SEARCH_DOCS")
+
+
+def fake_openai_app(intent: str, chunks: int, delay: float):
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    usage = {"prompt_tokens": 1000, "completion_tokens": chunks, "total_tokens": 1000 + chunks}
+    # one content that every non-streamed prompt of the pipeline can parse
+    content = json.dumps({
+        "INTENT_NAME": intent,
+        "REPHRASED_INTENT": "Benchmark question",
+        "chunks": [],
+        "tags": "<QUERY_1>benchmark</QUERY_1>"
+                "<QUESTION_1>Q1</QUESTION_1><QUESTION_2>Q2</QUESTION_2><QUESTION_3>Q3</QUESTION_3>",
+    })
+
+    def chunk(choices: list, **kwargs) -> str:
+        return "data: " + json.dumps({
+            "id": "bench", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": "benchmark", "choices": choices, **kwargs}) + "\n\n"
+
+    async def completions(request: Request):
+        body = await request.json()
+        if not body.get("stream"):
+            return JSONResponse({
+                "id": "bench", "object": "chat.completion", "created": int(time.time()), "model": "benchmark",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+
+        async def stream():
+            for i in range(chunks):
+                await asyncio.sleep(delay)
+                yield chunk([{"index": 0, "delta": {"content": f"{i} "}, "finish_reason": None}])
+            yield chunk([], usage=usage)
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return Starlette(routes=[Route("/v1/chat/completions", completions, methods=["POST"])])
+
+
+async def _one_stream(client: httpx.AsyncClient, url: str, question: str) -> tuple[float, float]:
+    start = time.perf_counter()
+    first_event = None
+    async with client.stream("POST", f"{url}/completion", params={"stream": "1"},
+                             json={"msg": question, "session_id": str(uuid.uuid4())}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line and first_event is None:
+                first_event = time.perf_counter() - start
+    return first_event or 0.0, time.perf_counter() - start
+
+
+async def run_level(url: str, concurrency: int, question: str, timeout: float) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *[_one_stream(client, url, question) for _ in range(concurrency)], return_exceptions=True)
+        wall = time.perf_counter() - start
+    ok = [r for r in results if not isinstance(r, BaseException)]
+    first, total = [r[0] for r in ok], [r[1] for r in ok]
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "first_event_p50_s": statistics.median(first) if first else None,
+        "first_event_max_s": max(first) if first else None,
+        "stream_p50_s": statistics.median(total) if total else None,
+        "wall_s": wall,
+        "streams_per_s": len(ok) / wall if wall else None,
+    }
+
+
+async def run(urls: list[str], levels: list[int], question: str, timeout: float):
+    print("url\tconcurrency\tok\tfailed\tfirst_event_p50_s\tfirst_event_max_s\tstream_p50_s\twall_s\tstreams_per_s")
+    for url in urls:
+        for concurrency in levels:
+            stats = await run_level(url, concurrency, question, timeout)
+            print("\t".join(f"{v:.3f}" if isinstance(v, float) else str(v) for v in stats.values()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fake = subparsers.add_parser("fake-openai")
+    fake.add_argument("--port", type=int, default=9100)
+    fake.add_argument("--chunks", type=int, default=200)
+    fake.add_argument("--delay", type=float, default=0.05, help="Seconds between streamed chunks")
+    fake.add_argument("--intent", default=None, help="Intent returned to IntentCommand (a SEARCH_DOCS one by default)")
+
+    bench = subparsers.add_parser("run")
+    bench.add_argument("urls", nargs="+")
+    bench.add_argument("-c", "--concurrency", type=int, nargs="+", default=[10, 100, 1000])
+    bench.add_argument("--question", default="Học phí năm nay là bao nhiêu?")
+    bench.add_argument("--timeout", type=float, default=300)
+
+    args = parser.parse_args()
+    if args.command == "fake-openai":
+        import uvicorn
+        uvicorn.run(fake_openai_app(args.intent or _default_intent(), args.chunks, args.delay),
+                    host="0.0.0.0", port=args.port, log_level="warning")
+    else:
+        asyncio.run(run(args.urls, args.concurrency, args.question, args.timeout))
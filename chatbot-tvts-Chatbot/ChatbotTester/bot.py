@@ -6,7 +6,7 @@ from typing import Generator
 
 sys.path.append(os.path.abspath("."))
 
-from foundation import AskChatbotV1Command, ChatbotController, CheckingAnswerRelatedToContentCommand, GenerateQuestionCommand, SearchDocsByChunkIdCommand
+from foundation import AskChatbotV1Command, ChatbotController, CheckingAnswerRelatedToContentCommand, GenerateQuestionCommand, SearchDocsByChunkIdCommand, SearchDocsByChunkIdsCommand
 
 
 class ChatCommand(Enum):
@@ -71,6 +71,17 @@ class ChatEvaluation:
 
         return ChatEvaluationResponse(chunk_id=chunk_id, question=results.get('questions'), ans=ans, document=document)
 
+    def ask_many(self, session_id: str, chunk_ids: list[str], batch_size=100, **kwargs) -> Generator[tuple[ChatCommand, str], None, list[ChatEvaluationResponse]]:
+        """Evaluate several chunks; each batch is fetched in one request and ask() reads it from the chunk cache."""
+        responses = []
+        for i in range(0, len(chunk_ids), batch_size):
+            batch = chunk_ids[i:i + batch_size]
+            ChatbotController().executeCommand(SearchDocsByChunkIdsCommand(chunk_ids=batch))
+            for chunk_id in batch:
+                response = yield from self.ask(session_id, chunk_id, **kwargs)
+                responses.append(response)
+        return responses
+
 
 def get_chatbot_evaluation_instance() -> ChatEvaluation:
     return ChatEvaluation()
@@ -165,8 +165,8 @@ def get_conversations(session_id: str):
     return response.json()
 
 
-def get_logs(session_id):
-    url = f"{API_URL}/logs/{session_id}"
+def get_logs_analytics(session_id):
+    url = f"{API_URL}/logs/{session_id}/analytics"
     response = requests.get(url)
     return response.json()
 
@@ -195,20 +195,8 @@ styles = {
 }
 
 
-def _get_tokens(rets):
-    try:
-        return rets['completion']['usage']['total_tokens']
-    except:
-        return 0
-
-
-def _calculate_tokens_and_price(log):
-    total_tokens = sum(map(lambda e: e['total_tokens'], log.get("calls")))
-    return total_tokens, _calculate_price(total_tokens)
-
-
 def _calulate_tokens_by_command(log):
-    commands = log.get("calls")
+    commands = log["metrics"]["commands"]
     labels = []
     values = []
     for cmd in commands:
@@ -219,32 +207,21 @@ def _calulate_tokens_by_command(log):
 
 def _calulate_data_frame(log):
     data = []
-    for e in log.get("calls"):
-        if e['call_name'] == "AnswerUsingStreamCommand":
-            data.append(
-                {
-                    "call_name": e['call_name'],
-                    "duration": f"{(datetime.fromisoformat(e['perf']['end_time']) - datetime.fromisoformat(e['perf']['start_time'])).total_seconds()}s",
-                    "total_tokens": e['total_tokens'],
-                    "prices": _calculate_price(e['total_tokens']),
-                    "input": json.dumps(e['args']),
-                    "output": json.dumps(e['rets']),
-                }
-            )
+    for e in log["metrics"]["commands"]:
+        data.append(
+            {
+                "call_name": e['call_name'],
+                "duration": f"{(e['duration_ms'] or 0) / 1000}s",
+                "total_tokens": e['total_tokens'],
+                "prices": e['cost'],
+            }
+        )
     return data
 
 
 def _get_docs(log):
-    try:
-        log_call = list(filter(lambda e: e['call_name'] ==
-                               'AnswerUsingStreamCommand', log['calls']))
-        log_call = log_call[0] if len(log_call) else None
-
-        docs = log_call['args']['docs']
-
-        return docs if len(docs) else None
-    except:
-        return None
+    docs = log["metrics"].get("documents")
+    return docs if docs else None
 
 
 def render_detail(log):
@@ -257,11 +234,11 @@ def render_detail(log):
         <h2>Câu trả lời</h2>
         <p>{log['main_output']}</p>
         <h2>Tổng thời gian thực hiện</h2>
-        <p>{(datetime.fromisoformat(log['perf']['end_time']) - datetime.fromisoformat(log['perf']['start_time'])).total_seconds()}s</p>
+        <p>{(log['duration_ms'] or 0) / 1000}s</p>
         """,
         width=600,
     )
-    total_tokens, total_prices = _calculate_tokens_and_price(log)
+    total_tokens, total_prices = log['total_tokens'], log['cost']
 
     indicators2 = pn.Row(
         pn.indicators.Number(
@@ -338,31 +315,6 @@ def render_detail(log):
     return detail_dashboard
 
 
-def _calculate_all_logs(logs):
-    for log in logs:
-        totals = 0
-        commands = log.get("calls")
-        for cmd in commands:
-            if type(cmd['rets']) is list:
-                total_tokens = 0
-                for ret in cmd['rets']:
-                    total_tokens = total_tokens + _get_tokens(ret)
-                cmd['total_tokens'] = total_tokens
-            else:
-                cmd['total_tokens'] = _get_tokens(cmd['rets'])
-            totals = totals + cmd['total_tokens']
-        log['total_tokens'] = totals
-    return logs
-
-
-def _calculate_total_tokens_of_logs(logs):
-    return sum(map(lambda e: e['total_tokens'], logs))
-
-
-def _calculate_price(tokens):
-    return (tokens * 0.150) / 1e6
-
-
 def dashboard_refresher_func(event):
     if not event:
         return
@@ -409,14 +361,13 @@ def build_dashboard() -> list:
     # total dashboard
     if not session_input.value:
         return [dashboard_refresher]
-    logs = get_logs(session_input.value)
-
-    _calculate_all_logs(logs)
+    analytics = get_logs_analytics(session_input.value)
+    logs = analytics["records"]
 
     # indication
-    count = len(logs)
-    total_tokens = _calculate_total_tokens_of_logs(logs)
-    prices = _calculate_price(total_tokens)
+    count = analytics["count"]
+    total_tokens = analytics["total_tokens"]
+    prices = analytics["cost"]
     indicators_total_1 = pn.Row(
         pn.indicators.Number(
             value=count, name="Số lượng phản hồi", format="{value:,.0f}", styles=styles
@@ -436,11 +387,17 @@ def build_dashboard() -> list:
             styles=styles,
         ),
         pn.indicators.Number(
-            value=prices / count,
+            value=prices / count if count else 0,
             name="Chi phí trung bình",
             format="${value:,.6f}",
             styles=styles,
         ),
+        pn.indicators.Number(
+            value=analytics["cached_tokens"],
+            name="Token từ cache",
+            format="{value:,.0f}",
+            styles=styles,
+        ),
     )
 
     feedbacks = get_feedbacks(session_input.value)
@@ -0,0 +1,120 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterator, Optional, Sequence, TypedDict
+
+import chromadb
+
+# Bulk access to the chunks of a collection: ``get_many`` fetches every missing id in one
+# request (hot ids served from an LRU), ``iter_pages`` walks a whole collection one page
+# per request with only the fields a job needs, so whole-collection jobs (FAQ index,
+# evaluation) cost one round-trip per page instead of one per chunk.
+
+DOCUMENTS = ("documents",)
+METADATAS = ("metadatas",)
+DOCUMENTS_AND_METADATAS = ("documents", "metadatas")
+
+
+class ChunkTypeDict(TypedDict):
+    id: str
+    document: Optional[str]
+    metadata: Optional[dict]
+
+
+def iter_pages(
+    collection: chromadb.Collection,
+    page_size=100,
+    include: Sequence[str] = DOCUMENTS_AND_METADATAS,
+    where: Optional[dict] = None,
+) -> Iterator[chromadb.GetResult]:
+    offset = 0
+    while True:
+        page = collection.get(limit=page_size, offset=offset, include=list(include), where=where)
+        if not page["ids"]:
+            return
+        yield page
+        if len(page["ids"]) < page_size:
+            return
+        offset += len(page["ids"])
+
+
+def to_chunks(result: chromadb.GetResult) -> list[ChunkTypeDict]:
+    ids = result["ids"]
+    documents = result.get("documents") or [None] * len(ids)
+    metadatas = result.get("metadatas") or [None] * len(ids)
+    return [{"id": id, "document": document, "metadata": metadata}
+            for id, document, metadata in zip(ids, documents, metadatas)]
+
+
+def to_get_result(chunks: list[ChunkTypeDict]) -> chromadb.GetResult:
+    """Chunks in the shape of ``collection.get``, for code written against Chroma results."""
+    return {
+        "ids": [chunk["id"] for chunk in chunks],
+        "documents": [chunk["document"] for chunk in chunks],
+        "metadatas": [chunk["metadata"] for chunk in chunks],
+        "embeddings": None,
+        "uris": None,
+        "data": None,
+        "included": list(DOCUMENTS_AND_METADATAS),
+    }
+
+
+class ChunkStore:
+    """Chunks of one collection by id, cached; ``version`` (see retrieval_cache) drops the cache on change."""
+
+    def __init__(self, collection: chromadb.Collection, cache_size: int, version: Optional[Callable[[], str]] = None):
+        self.collection = collection
+        self.cache_size = cache_size
+        self.version = version
+        self._lock = threading.Lock()
+        self._cache: OrderedDict[str, ChunkTypeDict] = OrderedDict()
+        self._cache_version: Optional[str] = None
+
+    def _check_version(self):
+        if self.version is None:
+            return
+        version = self.version()
+        with self._lock:
+            if version != self._cache_version:
+                self._cache.clear()
+                self._cache_version = version
+
+    def get_many(self, ids: list[str]) -> list[ChunkTypeDict]:
+        """Chunks of ``ids`` that exist, in the order of ``ids``."""
+        if not ids:
+            return []
+        self._check_version()
+        found = {}
+        with self._lock:
+            for id in ids:
+                if id in self._cache:
+                    self._cache.move_to_end(id)
+                    found[id] = self._cache[id]
+        missing = list(dict.fromkeys(id for id in ids if id not in found))
+        if missing:
+            fetched = to_chunks(self.collection.get(ids=missing, include=list(DOCUMENTS_AND_METADATAS)))
+            found.update((chunk["id"], chunk) for chunk in fetched)
+            self._put(fetched)
+        return [found[id] for id in ids if id in found]
+
+    def get(self, id: str) -> Optional[ChunkTypeDict]:
+        chunks = self.get_many([id])
+        return chunks[0] if chunks else None
+
+    def iter_pages(self, page_size=100, include: Sequence[str] = DOCUMENTS_AND_METADATAS,
+                   where: Optional[dict] = None) -> Iterator[chromadb.GetResult]:
+        return iter_pages(self.collection, page_size=page_size, include=include, where=where)
+
+    def iter_chunks(self, page_size=100, include: Sequence[str] = DOCUMENTS_AND_METADATAS,
+                    where: Optional[dict] = None) -> Iterator[ChunkTypeDict]:
+        for page in self.iter_pages(page_size=page_size, include=include, where=where):
+            yield from to_chunks(page)
+
+    def _put(self, chunks: list[ChunkTypeDict]):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            for chunk in chunks:
+                self._cache[chunk["id"]] = chunk
+                self._cache.move_to_end(chunk["id"])
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
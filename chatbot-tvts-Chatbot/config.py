@@ -1,14 +1,28 @@
+import json
 import os
 import urllib.parse
 
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
 OPENAI_API_KEY = str(os.environ.get("OPENAI_API_KEY"))
 
 MODEL = str(os.environ.get("MODEL"))
 
-USE_CHATBOT_V1 = str(os.environ.get("SETTING_CHATBOT_VERSION")) == '1'
+# Pipeline answering requests, a name of ChatbotAgent.bot.PIPELINES; the X-Chatbot-Pipeline header overrides it
+CHATBOT_PIPELINE = os.environ.get("CHATBOT_PIPELINE", "v1")
+
+# Candidate pipeline also run in the background on a fraction of the requests, see ChatbotAgent/shadow.py
+SHADOW_PIPELINE = os.environ.get("SHADOW_PIPELINE", "")
+
+SHADOW_FRACTION = float(os.environ.get("SHADOW_FRACTION", 0))
+
+# Shadow runs in flight per worker; requests sampled while they are all busy are not shadowed
+SHADOW_MAX_CONCURRENCY = int(os.environ.get("SHADOW_MAX_CONCURRENCY", 2))
 
 POSTGRESQL_URL= f"postgresql+psycopg2://{str(os.environ.get('DB_USER'))}:{urllib.parse.quote_plus(str(os.environ.get('DB_PASSWORD')))}@{str(os.environ.get('DB_HOST'))}:{str(os.environ.get('DB_PORT'))}/{str(os.environ.get('DB_CHATNAME'))}"
 
+POSTGRESQL_ASYNC_URL = POSTGRESQL_URL.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+
 CHROMA_HOST = str(os.environ.get('CHROMA_HOST'))
 
 CHROMA_PORT = str(os.environ.get('CHROMA_PORT'))
@@ -21,4 +35,119 @@ CHATBOT_AGENT_PORT=str(os.getenv('CHATBOT_AGENT_PORT', 6811))
 
 API_URL = str(os.environ.get("API_URL", "http://127.0.0.1:6811")) 
 
-N_RESULTS = int(os.environ.get("N_RESULTS", 5))
\ No newline at end of file
+N_RESULTS = int(os.environ.get("N_RESULTS", 5))
+
+FAQ_CHROMA_DB = str(os.environ.get("FAQ_CHROMA_DB", f"{CHROMA_DB}_faq"))
+
+FAQ_MIN_SIMILARITY = float(os.environ.get("FAQ_MIN_SIMILARITY", 0.92))
+
+
+INTENT_CLASSIFIER_PATH = str(os.environ.get("INTENT_CLASSIFIER_PATH", os.path.join(ROOT_DIR, "artifacts", "intent_classifier")))
+
+INTENT_CLASSIFIER_MIN_CONFIDENCE = float(os.environ.get("INTENT_CLASSIFIER_MIN_CONFIDENCE", 0.85))
+# Earlier user questions of the session the classifier is trained and run with
+INTENT_CLASSIFIER_CONTEXT_TURNS = int(os.environ.get("INTENT_CLASSIFIER_CONTEXT_TURNS", 1))
+
+# "compact" stores template ids, slot values and document references, "full" the raw calls
+LOG_FORMAT = str(os.environ.get("LOG_FORMAT", "compact"))
+
+LOG_COMPRESS = str(os.environ.get("LOG_COMPRESS", "0")) == "1"
+
+LOG_DOC_MIN_LENGTH = int(os.environ.get("LOG_DOC_MIN_LENGTH", 200))
+
+PARTITION_MONTHS_AHEAD = int(os.environ.get("PARTITION_MONTHS_AHEAD", 2))
+
+# 0 keeps every partition; older monthly partitions are archived to LOG_ARCHIVE_DIR
+DIALOGUE_RETENTION_MONTHS = int(os.environ.get("DIALOGUE_RETENTION_MONTHS", 0))
+
+SESSION_RETENTION_MONTHS = int(os.environ.get("SESSION_RETENTION_MONTHS", 0))
+
+LOG_ARCHIVE_DIR = str(os.environ.get("LOG_ARCHIVE_DIR", os.path.join(ROOT_DIR, "data", "archives")))
+
+# Level of the agent's loggers; the prompt tokens of every completion request are logged at INFO
+LOG_LEVEL = str(os.environ.get("LOG_LEVEL", "INFO"))
+
+# Max prompt tokens of an answer, counted before sending: the lowest ranked documents are
+# dropped until the prompt fits. 0 sends every document
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 0))
+
+# Create Chroma/OpenAI/DB clients in a background thread at startup, see /readyz
+WARMUP_ON_START = str(os.environ.get("WARMUP_ON_START", "1")) == "1"
+
+# Threads for the pipeline steps that have no async implementation (FAQ lookup, logging) in the ASGI server
+ASYNC_THREAD_POOL_SIZE = int(os.environ.get("ASYNC_THREAD_POOL_SIZE", 64))
+
+# Adaptive retrieval, see retrieval_policy.py. Distances are in the space of the CHROMA_DB collection.
+ADAPTIVE_RETRIEVAL = str(os.environ.get("ADAPTIVE_RETRIEVAL", "1")) == "1"
+
+ADAPTIVE_CONFIDENT_DISTANCE = float(os.environ.get("ADAPTIVE_CONFIDENT_DISTANCE", 0.35))
+
+ADAPTIVE_MIN_GAP = float(os.environ.get("ADAPTIVE_MIN_GAP", 0.1))
+
+ADAPTIVE_CONFIDENT_TOP_K = int(os.environ.get("ADAPTIVE_CONFIDENT_TOP_K", 2))
+
+ADAPTIVE_WEAK_DISTANCE = float(os.environ.get("ADAPTIVE_WEAK_DISTANCE", 0.8))
+
+ADAPTIVE_WIDE_N_RESULTS = int(os.environ.get("ADAPTIVE_WIDE_N_RESULTS", N_RESULTS * 2))
+
+# Rolling conversation summary + last raw messages instead of the last N raw messages
+CONVERSATION_MEMORY = str(os.environ.get("CONVERSATION_MEMORY", "1")) == "1"
+
+# raw messages (user and system) kept out of the summary, 4 = the last two turns
+MEMORY_RECENT_MESSAGES = int(os.environ.get("MEMORY_RECENT_MESSAGES", 4))
+
+MEMORY_SUMMARY_MAX_WORDS = int(os.environ.get("MEMORY_SUMMARY_MAX_WORDS", 200))
+
+# sessions waiting for a summary update; more are skipped and summarized on a later turn
+MEMORY_MAX_PENDING = int(os.environ.get("MEMORY_MAX_PENDING", 100))
+
+# Follow-up questions from the pools KMS precomputes per chunk, the LLM only when they are missing
+PRECOMPUTED_FOLLOWUPS = str(os.environ.get("PRECOMPUTED_FOLLOWUPS", "1")) == "1"
+
+# Whole request budget in seconds, each stage gets at most what is left of it
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 60))
+
+# Seconds per pipeline stage (command class name); commands missing here only get the call timeouts
+STAGE_TIMEOUTS = json.loads(os.environ.get("STAGE_TIMEOUTS", json.dumps({
+    "FaqLookupCommand": 3,
+    "IntentCommand": 8,
+    "SearchQueryCommand": 8,
+    "SearchDocsCommand": 5,
+    "SearchDocsByChunkIdCommand": 3,
+    "RankingDocsCommand": 10,
+    "AnswerUsingStreamCommand": 30,
+    "FollowupQuestionsCommand": 8,
+})))
+
+# Per call, when no stage timeout applies; for streams it bounds the wait between two chunks
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 30))
+
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", 1))
+
+CHROMA_TIMEOUT = float(os.environ.get("CHROMA_TIMEOUT", 5))
+
+# Threads running blocking Chroma calls, stalled calls never hold more than this
+CHROMA_MAX_CONCURRENCY = int(os.environ.get("CHROMA_MAX_CONCURRENCY", 16))
+
+# Consecutive failures that open the circuit of a dependency (openai, chroma)
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+
+# Seconds an open circuit rejects calls before one trial call is let through
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", 30))
+
+# LLM ranking is skipped (documents kept in Chroma distance order) when less is left of the deadline
+DEGRADE_RANKING_MIN_REMAINING = float(os.environ.get("DEGRADE_RANKING_MIN_REMAINING", 35))
+
+DEGRADED_TOP_K = int(os.environ.get("DEGRADED_TOP_K", 3))
+
+# FAQ match accepted as the answer when the LLM cannot answer
+FAQ_DEGRADED_MIN_SIMILARITY = float(os.environ.get("FAQ_DEGRADED_MIN_SIMILARITY", 0.8))
+
+# Chroma results cached per (collection, normalized search term, n_results), 0 to disable
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", 2048))
+
+# Seconds between two reads of the collection version; changes show up in the cache after at most this
+RETRIEVAL_CACHE_POLL_INTERVAL = float(os.environ.get("RETRIEVAL_CACHE_POLL_INTERVAL", 10))
+
+# Chunks kept by id for SearchDocsByChunkId(s)Command, dropped with the retrieval cache on KMS changes
+CHUNK_CACHE_SIZE = int(os.environ.get("CHUNK_CACHE_SIZE", 1024))
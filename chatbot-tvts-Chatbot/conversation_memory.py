@@ -0,0 +1,128 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Optional
+
+import sqlalchemy as db
+from sqlalchemy.dialects.postgresql import insert
+from models import Session, SessionSummary
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncConnection
+
+# Bounded conversation memory: the prompt gets one rolling summary of the older turns of a
+# session plus its last few raw messages, so prompt tokens stay flat as a session grows.
+# The summary is folded in a background thread after each turn, off the response path.
+
+SUMMARY_ROLE = "summary"
+
+# summarize(current_summary, messages) -> (new_summary, completion.to_dict())
+Summarizer = Callable[[str, list[dict]], tuple[str, dict]]
+
+
+def _summary_query(session_id: str) -> db.Select:
+    return db.select(SessionSummary).where(SessionSummary.c.session_id == session_id)
+
+
+def _messages_query(session_id: str, summarized_until: Optional[datetime]) -> db.Select:
+    query = db.select(Session).where(Session.c.session_id == session_id)
+    if summarized_until is not None:
+        query = query.where(Session.c.created_at > summarized_until)
+    return query
+
+
+def _to_histories(summary, rows) -> list[dict]:
+    histories = [{"role": row.role.value, "content": row.content} for row in rows]
+    if summary is not None and summary.summary:
+        histories.insert(0, {"role": SUMMARY_ROLE, "content": summary.summary})
+    return histories
+
+
+def load_histories(conn: db.Connection, session_id: str, num: int) -> list[dict]:
+    """Summary (if any) followed by the last ``num`` messages that are not in it, oldest first."""
+    summary = conn.execute(_summary_query(session_id)).first()
+    rows = conn.execute(
+        _messages_query(session_id, summary.summarized_until if summary else None)
+        .order_by(Session.c.created_at.desc()).limit(num)).fetchall()
+    return _to_histories(summary, reversed(rows))
+
+
+async def load_histories_async(conn: "AsyncConnection", session_id: str, num: int) -> list[dict]:
+    summary = (await conn.execute(_summary_query(session_id))).first()
+    rows = (await conn.execute(
+        _messages_query(session_id, summary.summarized_until if summary else None)
+        .order_by(Session.c.created_at.desc()).limit(num))).fetchall()
+    return _to_histories(summary, reversed(rows))
+
+
+def update_summary(conn: db.Connection, session_id: str, summarize: Summarizer, recent_messages: int) -> bool:
+    """Fold every message of the session except the last ``recent_messages`` into its summary."""
+    summary = conn.execute(_summary_query(session_id)).first()
+    rows = conn.execute(
+        _messages_query(session_id, summary.summarized_until if summary else None)
+        .order_by(Session.c.created_at.asc())).fetchall()
+    folded = rows[:-recent_messages] if recent_messages > 0 else rows
+    if not folded:
+        return False
+
+    text, completion = summarize(
+        summary.summary if summary else "",
+        [{"role": row.role.value, "content": row.content} for row in folded])
+    usage = (completion or {}).get("usage") or {}
+    values = {
+        "summary": text,
+        "summarized_until": folded[-1].created_at,
+        "messages": (summary.messages if summary else 0) + len(folded),
+        "prompt_tokens": (summary.prompt_tokens if summary else 0) + (usage.get("prompt_tokens") or 0),
+        "completion_tokens": (summary.completion_tokens if summary else 0) + (usage.get("completion_tokens") or 0),
+        "updated_at": datetime.utcnow(),
+    }
+    statement = insert(SessionSummary).values(session_id=session_id, **values)
+    # an update that read an older state (another process) never overwrites a newer summary
+    conn.execute(statement.on_conflict_do_update(
+        index_elements=[SessionSummary.c.session_id],
+        set_=values,
+        where=SessionSummary.c.summarized_until < statement.excluded.summarized_until,
+    ))
+    conn.commit()
+    return True
+
+
+class ConversationMemory:
+    """Schedules summary updates on one background thread, at most one pending per session.
+
+    At most ``max_pending`` sessions wait for the thread; updates beyond that are dropped,
+    the messages they would have folded are picked up by the next update of their session.
+    """
+
+    def __init__(self, engine: db.Engine, summarize: Summarizer, recent_messages: int, max_pending=100):
+        self.engine = engine
+        self.summarize = summarize
+        self.recent_messages = recent_messages
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-memory")
+        self._lock = threading.Lock()
+        self._pending: set[str] = set()
+
+    def schedule_update(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id in self._pending:
+                return False
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                print(f"Conversation summary of {session_id} skipped: {len(self._pending)} updates pending")
+                return False
+            self._pending.add(session_id)
+        self._executor.submit(self._update, session_id)
+        return True
+
+    def _update(self, session_id: str):
+        with self._lock:
+            # messages saved from now on are picked up by this run or by the next scheduled one
+            self._pending.discard(session_id)
+        try:
+            with self.engine.connect() as conn:
+                update_summary(conn, session_id, self.summarize, self.recent_messages)
+        except Exception as e:
+            print(f"Conversation summary of {session_id} failed: {e}")
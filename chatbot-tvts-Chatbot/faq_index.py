@@ -0,0 +1,186 @@
+import hashlib
+import re
+from typing import Callable, Optional, TypedDict
+
+import chromadb
+
+from utils import _normalize_text
+from chunk_store import DOCUMENTS_AND_METADATAS, METADATAS, iter_pages
+
+# Prefixes used by GPTProcessor when it rewrites a chunk into FAQs style
+QUESTION_PREFIX = re.compile(r"^(?:Q|Hỏi|Câu hỏi)\s*\d*\s*[:.]\s*", re.IGNORECASE)
+ANSWER_PREFIX = re.compile(r"^(?:A|Đáp|Trả lời)\s*\d*\s*[:.]\s*", re.IGNORECASE)
+BULLET_PREFIX = re.compile(r"^(?:[-*•]|\d+[.)])\s*")
+
+
+class FaqEntryTypeDict(TypedDict):
+    question: str
+    answer: str
+    chunk_id: str
+    source: str
+
+
+class FaqMatchTypeDict(TypedDict):
+    faq_id: str
+    question: str
+    answer: str
+    chunk_id: str
+    similarity: float
+    exact: bool
+
+
+def _parse_faq_pairs(revised_chunk: str) -> list[tuple[str, str]]:
+    pairs = []
+    question, answer = None, None
+    current = None
+    for line in str(revised_chunk or "").splitlines():
+        line = BULLET_PREFIX.sub("", line.strip())
+        if not line:
+            continue
+        if QUESTION_PREFIX.match(line):
+            if question and answer:
+                pairs.append((question.strip(), answer.strip()))
+            question, answer = QUESTION_PREFIX.sub("", line), None
+            current = "question"
+        elif ANSWER_PREFIX.match(line) and question:
+            answer = ANSWER_PREFIX.sub("", line)
+            current = "answer"
+        elif current == "question":
+            question += f" {line}"
+        elif current == "answer":
+            answer += f"\n{line}"
+    if question and answer:
+        pairs.append((question.strip(), answer.strip()))
+    return pairs
+
+
+def _faq_id(chunk_id: str, question: str) -> str:
+    key = f"{chunk_id}:{_normalize_text(question)}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class FaqIndex:
+    """Canonical questions (embedding + normalized text) pointing at the chunk that answers them."""
+
+    def __init__(self, client: chromadb.ClientAPI, embedding_function, name: str, min_similarity: float):
+        self.min_similarity = min_similarity
+        # cosine space so that 1 - distance is the similarity of the two questions
+        self.collection = client.get_or_create_collection(
+            name=name,
+            embedding_function=embedding_function,
+            metadata={"hnsw:space": "cosine"},
+        )
+
+    def lookup(self, question: str, min_similarity: Optional[float] = None) -> Optional[FaqMatchTypeDict]:
+        normalized = _normalize_text(question)
+        if not normalized:
+            return None
+
+        # one round trip: an exact question is its own nearest neighbour
+        res = self.collection.query(query_texts=[question], n_results=1)
+        if not res["ids"] or not res["ids"][0]:
+            return None
+        metadata = res["metadatas"][0][0]
+        if metadata["normalized_question"] == normalized:
+            return self._to_match(res["ids"][0][0], metadata, 1.0, True)
+        similarity = 1 - res["distances"][0][0]
+        if similarity < (self.min_similarity if min_similarity is None else min_similarity):
+            return None
+        return self._to_match(res["ids"][0][0], metadata, similarity, False)
+
+    def siblings(self, chunk_id: str, exclude: Optional[list[str]] = None, n=3) -> list[str]:
+        res = self.collection.get(where={"chunk_id": chunk_id}, include=list(METADATAS))
+        excluded = set(map(_normalize_text, exclude or []))
+        questions = []
+        for metadata in res["metadatas"] or []:
+            if metadata["normalized_question"] in excluded:
+                continue
+            excluded.add(metadata["normalized_question"])
+            questions.append(metadata["question"])
+        return questions[:n]
+
+    def upsert(self, entries: list[FaqEntryTypeDict]) -> int:
+        unique = {}
+        for entry in entries:
+            unique[_faq_id(entry["chunk_id"], entry["question"])] = entry
+        if not unique:
+            return 0
+        self.collection.upsert(
+            ids=list(unique.keys()),
+            documents=[e["question"] for e in unique.values()],
+            metadatas=[
+                {
+                    "question": e["question"],
+                    "normalized_question": _normalize_text(e["question"]),
+                    "answer": e["answer"],
+                    "chunk_id": e["chunk_id"],
+                    "source": e["source"],
+                } for e in unique.values()
+            ],
+        )
+        return len(unique)
+
+    def delete_chunks(self, chunk_ids: list[str]):
+        if chunk_ids:
+            self.collection.delete(where={"chunk_id": {"$in": chunk_ids}})
+
+    def prune(self, chunk_ids: set[str], page_size=500) -> int:
+        # drop questions whose chunk no longer exists in the knowledge base
+        stale = []
+        for page in iter_pages(self.collection, page_size=page_size, include=METADATAS):
+            stale += [id for id, metadata in zip(page["ids"], page["metadatas"])
+                      if metadata["chunk_id"] not in chunk_ids]
+        if stale:
+            self.collection.delete(ids=stale)
+        return len(stale)
+
+    def _to_match(self, faq_id: str, metadata: dict, similarity: float, exact: bool) -> FaqMatchTypeDict:
+        return {
+            "faq_id": faq_id,
+            "question": metadata["question"],
+            "answer": metadata["answer"],
+            "chunk_id": metadata["chunk_id"],
+            "similarity": similarity,
+            "exact": exact,
+        }
+
+
+def build_faq_index(
+    index: FaqIndex,
+    collection: chromadb.Collection,
+    generate_questions: Optional[Callable[[str, int], list[str]]] = None,
+    num_generated=0,
+    page_size=100,
+) -> dict:
+    """Populate the FAQ index from every chunk of a knowledge base collection.
+
+    Q&A pairs are parsed from the ``revised_chunk`` metadata written by KMS. When
+    ``generate_questions`` is given, ``num_generated`` extra questions per chunk are
+    synthesized and linked to the whole chunk document.
+    """
+    stats = {"chunks": 0, "parsed": 0, "generated": 0, "indexed": 0, "pruned": 0}
+    seen_chunk_ids = set()
+    for page in iter_pages(collection, page_size=page_size, include=DOCUMENTS_AND_METADATAS):
+        entries: list[FaqEntryTypeDict] = []
+        for chunk_id, document, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+            metadata = metadata or {}
+            if str(metadata.get("is_enabled", True)).lower() == "false":
+                continue
+            stats["chunks"] += 1
+            for question, answer in _parse_faq_pairs(metadata.get("revised_chunk", "")):
+                entries.append({"question": question, "answer": answer,
+                               "chunk_id": chunk_id, "source": "revised_chunk"})
+                stats["parsed"] += 1
+            if generate_questions and num_generated > 0:
+                for question in generate_questions(document, num_generated):
+                    question = BULLET_PREFIX.sub("", question.strip())
+                    if not question:
+                        continue
+                    entries.append({"question": question, "answer": "",
+                                   "chunk_id": chunk_id, "source": "generated"})
+                    stats["generated"] += 1
+        seen_chunk_ids.update(page["ids"])
+        index.delete_chunks(page["ids"])
+        stats["indexed"] += index.upsert(entries)
+    stats["pruned"] = index.prune(seen_chunk_ids)
+    return stats
@@ -0,0 +1,60 @@
+import itertools
+import json
+
+import chromadb
+
+from utils import _normalize_text
+
+# Follow-up questions precomputed by KMS for every chunk when it is ingested or updated
+# (``followup_questions`` metadata, a JSON list). The answered turn offers questions from
+# the pools of the chunks it was answered from instead of asking the LLM for new ones.
+
+FOLLOWUP_METADATA_KEY = "followup_questions"
+
+
+def chunk_followup_questions(metadata: dict | None) -> list[str]:
+    try:
+        questions = json.loads((metadata or {}).get(FOLLOWUP_METADATA_KEY) or "[]")
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(questions, list):
+        return []
+    return [str(question).strip() for question in questions if str(question).strip()]
+
+
+def document_metadatas(nodes: chromadb.QueryResult | chromadb.GetResult) -> dict[str, dict]:
+    """Metadata of every document of a (multi-query) query result or of a get result."""
+    documents = nodes.get("documents") or []
+    metadatas = nodes.get("metadatas") or []
+    if documents and isinstance(documents[0], list):
+        documents = itertools.chain.from_iterable(documents)
+        metadatas = itertools.chain.from_iterable(metadatas)
+    return {document: metadata for document, metadata in zip(documents, metadatas) if document}
+
+
+def pick_followup_questions(
+    docs: list[str],
+    nodes: chromadb.QueryResult | chromadb.GetResult,
+    asked: list[str],
+    n=3,
+) -> list[str]:
+    """Up to ``n`` precomputed questions of ``docs`` that were not asked yet.
+
+    Chunks take turns in ``docs`` order (ranked first), so the best chunk contributes
+    first without taking every slot.
+    """
+    metadatas = document_metadatas(nodes)
+    pools = [chunk_followup_questions(metadatas.get(doc)) for doc in docs]
+    excluded = set(map(_normalize_text, asked))
+    picked = []
+    for question in itertools.chain.from_iterable(itertools.zip_longest(*pools)):
+        if question is None:
+            continue
+        normalized = _normalize_text(question)
+        if normalized in excluded:
+            continue
+        excluded.add(normalized)
+        picked.append(question)
+        if len(picked) == n:
+            break
+    return picked
@@ -2,10 +2,12 @@ import asyncio
 from datetime import datetime, timezone
 from enum import Enum
 import json
+import logging
 import os
 import random
 import uuid
-from openai import OpenAI, Stream
+import openai
+from openai import AsyncOpenAI, AsyncStream, OpenAI, Stream
 from openai.types.chat import ChatCompletion
 from textwrap import dedent
 import chromadb
@@ -13,19 +15,90 @@ from chromadb.config import Settings
 from abc import ABC, abstractmethod
 import sys
 import requests
+import httpx
 import sqlalchemy as db
 import chromadb.utils.embedding_functions as embedding_functions
-from typing import TypeVar, Generic, TypedDict, Any
+from typing import AsyncGenerator, Callable, Generator, TypeVar, Generic, TypedDict, Any
 from json import JSONEncoder
 import itertools
+from concurrent.futures import ThreadPoolExecutor
 
-from models import RoleEnum, get_session, Session, Dialogue
-from config import API_URL, OPENAI_API_KEY, MODEL, POSTGRESQL_URL, CHROMA_HOST, CHROMA_PORT, EMBEDDING_MODEL_NAME, CHROMA_DB, N_RESULTS
+from models import RoleEnum, get_session, get_async_session, Session, Dialogue
+from config import API_URL, OPENAI_API_KEY, MODEL, POSTGRESQL_URL, CHROMA_HOST, CHROMA_PORT, EMBEDDING_MODEL_NAME, CHROMA_DB, N_RESULTS, FAQ_CHROMA_DB, FAQ_MIN_SIMILARITY, INTENT_CLASSIFIER_PATH, INTENT_CLASSIFIER_MIN_CONFIDENCE, LOG_FORMAT, LOG_COMPRESS, LOG_DOC_MIN_LENGTH, PARTITION_MONTHS_AHEAD, ADAPTIVE_RETRIEVAL, ADAPTIVE_CONFIDENT_DISTANCE, ADAPTIVE_MIN_GAP, ADAPTIVE_CONFIDENT_TOP_K, ADAPTIVE_WEAK_DISTANCE, CONVERSATION_MEMORY, MEMORY_RECENT_MESSAGES, MEMORY_SUMMARY_MAX_WORDS, MEMORY_MAX_PENDING, REQUEST_DEADLINE, STAGE_TIMEOUTS, OPENAI_TIMEOUT, OPENAI_MAX_RETRIES, CHROMA_TIMEOUT, CHROMA_MAX_CONCURRENCY, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT, RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_POLL_INTERVAL, CHUNK_CACHE_SIZE, PROMPT_TOKEN_BUDGET, LOG_LEVEL
 from prompts import *
 from utils import _extract_tag_content, _get_content
+from faq_index import FaqIndex, FaqMatchTypeDict
+from intent_classifier import IntentClassifier, IntentPredictionTypeDict
+from log_format import write_compact_log
+from partitions import maintain_partitions
+from log_metrics import compute_log_metrics
+from resources import register
+from retrieval_policy import RetrievalBranch, RetrievalDecisionTypeDict, decide_retrieval
+from conversation_memory import ConversationMemory, load_histories, load_histories_async
+from followup_pool import pick_followup_questions
+from resilience import Deadline, call_timeout, current_call_timeout, register_breaker, run_with_timeout, wait_with_timeout
+from retrieval_cache import RetrievalCache, collection_version
+from chunk_store import ChunkStore, to_get_result
+from token_accounting import count_message_tokens, count_tokens_batch
+
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+# the dialogue logger of this module is ``logger``
+token_logger = logging.getLogger(__name__)
+
+# Dependencies are created on first use (or by resources.warmup), never at import time
+
+
+def _connect_database() -> db.Engine:
+    engine = get_session()
+    with engine.connect() as conn:
+        conn.execute(db.text("SELECT 1"))
+    return engine
+
+
+def _create_embedding_function():
+    if EMBEDDING_MODEL_NAME:
+        return embedding_functions.OpenAIEmbeddingFunction(
+            api_key=OPENAI_API_KEY,
+            model_name=EMBEDDING_MODEL_NAME
+        )
+    ef = embedding_functions.ONNXMiniLM_L6_V2(
+        preferred_providers=['CPUExecutionProvider'])
+    # downloads and loads the ONNX model
+    ef(["warmup"])
+    return ef
+
+
+database = register("database", _connect_database)
+
+chroma_client = register("chroma", lambda: chromadb.HttpClient(host=CHROMA_HOST, port=int(
+    CHROMA_PORT), settings=Settings(allow_reset=True, anonymized_telemetry=False)))
+
+embedding_function = register("embedding_function", _create_embedding_function)
+
+openai_client = register("openai", lambda: OpenAI(
+    api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT, max_retries=OPENAI_MAX_RETRIES))
+
+# used by the ASGI server only, see ChatbotAgent/v1/chatbot_agent_asgi.py
+async_openai_client = register("async_openai", lambda: AsyncOpenAI(
+    api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT, max_retries=OPENAI_MAX_RETRIES))
+
+# rejected requests (bad prompt...) do not count as failures of the dependency
+openai_breaker = register_breaker(
+    "openai", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT,
+    failure_types=(openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError,
+                   openai.RateLimitError, TimeoutError))
 
-chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=int(
-    CHROMA_PORT), settings=Settings(allow_reset=True, anonymized_telemetry=False))
+# shared by every request of the process, stats at /retrieval_cache
+retrieval_cache = RetrievalCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_POLL_INTERVAL)
+
+# only an unreachable or stalled Chroma opens the circuit, a bad query (missing collection...) does not
+chroma_breaker = register_breaker(
+    "chroma", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT,
+    failure_types=(httpx.TransportError, requests.ConnectionError, requests.Timeout,
+                   ConnectionError, TimeoutError))
+
+# the Chroma HTTP client has no timeout, its blocking calls run here, see run_with_timeout
+chroma_executor = ThreadPoolExecutor(max_workers=CHROMA_MAX_CONCURRENCY, thread_name_prefix="chroma")
 
 # Generation
 
@@ -33,12 +106,30 @@ chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=int(
 class Logger:
     def __init__(self):
         self.engine = get_session()
+        self.partitioned_month = None
+
+    def _ensure_partitions(self, conn: db.Connection):
+        # once per month per process; rows of a missing month still land in the default partition
+        month = datetime.now(timezone.utc).strftime("%Y%m")
+        if self.partitioned_month == month:
+            return
+        try:
+            maintain_partitions(conn, PARTITION_MONTHS_AHEAD)
+            self.partitioned_month = month
+        except Exception as e:
+            conn.rollback()
+            print(f"Could not create partitions: {e}")
 
     async def create_async(self, docs: dict):
-        insert = db.insert(Dialogue).values(
-            **docs
-        )
         with self.engine.connect() as conn:
+            self._ensure_partitions(conn)
+            docs = {**docs, **compute_log_metrics(docs)}
+            if LOG_FORMAT == "compact":
+                docs = write_compact_log(
+                    conn, docs, min_ref_length=LOG_DOC_MIN_LENGTH, compress=LOG_COMPRESS)
+            insert = db.insert(Dialogue).values(
+                **docs
+            )
             conn.execute(insert)
             conn.commit()
         return insert
@@ -88,61 +179,129 @@ class QuestionResponse:
 class KnowledgeBase:
 
     def __init__(self):
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        self.client = openai_client.get()
         self.collection = chroma_client.get_collection(
             name=CHROMA_DB, embedding_function=self.get_ef())
+        self.async_client = None
+        self.async_collection = None
+        # concurrent first requests create a single async client
+        self.async_collection_lock = asyncio.Lock()
+        self.chunks = ChunkStore(self.collection, CHUNK_CACHE_SIZE, version=lambda: retrieval_cache.version(
+            CHROMA_DB, lambda: self._collection_version(CHROMA_DB)))
 
     def get_ef(self):
-        if EMBEDDING_MODEL_NAME:
-            ef = embedding_functions.OpenAIEmbeddingFunction(
-                api_key=OPENAI_API_KEY,
-                model_name=EMBEDDING_MODEL_NAME
-            )
-        else:
-            ef = embedding_functions.ONNXMiniLM_L6_V2(
-                preferred_providers=['CPUExecutionProvider'])
-        return ef
+        # shared by every collection, the ONNX model is loaded once
+        return embedding_function.get()
 
     def gen(
             self,
             user: str,
             system: str, **kwargs) -> ChatCompletion:
+        return openai_breaker.call(
+            self.client.chat.completions.create, **self._completion_params(user, system, **kwargs))
+
+    async def gen_async(self, user: str, system: str, **kwargs) -> ChatCompletion | AsyncStream:
+        return await openai_breaker.call_async(
+            async_openai_client.chat.completions.create, **self._completion_params(user, system, **kwargs))
+
+    def _completion_params(self, user: str, system: str, **kwargs) -> dict:
         stream = kwargs.get("stream", False)
         json_object = kwargs.get("json_object", False)
-        completion = self.client.chat.completions.create(
-            model=MODEL,
-            messages=[
+        # static instructions first and the variable parts (histories, docs...) as the next
+        # messages, so that consecutive requests share a cacheable prefix, see MESSAGE_BREAK
+        system_messages = system.messages if isinstance(system, RenderedPrompt) else [system]
+        messages = [
+            *[
                 {
                     "role": "system",
-                    "content": system,
-                },
-                {
-                    "role": "user",
-                    "content": user,
-                },
+                    "content": message,
+                } for message in system_messages
             ],
+            {
+                "role": "user",
+                "content": user,
+            },
+        ]
+        template_id = system.template_id if isinstance(system, RenderedPrompt) else None
+        prompt_tokens = count_message_tokens(messages, MODEL)
+        token_logger.info(f"Prompt {template_id}: {prompt_tokens} tokens ({MODEL})")
+        if PROMPT_TOKEN_BUDGET and prompt_tokens > PROMPT_TOKEN_BUDGET:
+            token_logger.warning(f"Prompt {template_id} has {prompt_tokens} tokens, over PROMPT_TOKEN_BUDGET={PROMPT_TOKEN_BUDGET}")
+        return dict(
+            model=MODEL,
+            messages=messages,
             stream=stream,
             stream_options={
                 "include_usage": True
             } if stream else None,
             response_format={
                 "type": "json_object",
-            } if json_object else None
+            } if json_object else None,
+            # stage budget of the running command, see ChatbotController
+            timeout=current_call_timeout(OPENAI_TIMEOUT),
         )
-        return completion
 
-    def search_docs(self, intent: str, terms: list[str], **kwargs) -> chromadb.QueryResult:
+    def search_docs(self, intent: str, terms: list[str], n_results=N_RESULTS, **kwargs) -> chromadb.QueryResult:
         collection = self.collection
         DB = kwargs.get("DB")
         if DB:
             collection = chroma_client.get_collection(
                 name=DB, embedding_function=self.get_ef())
-        res = collection.query(
-            query_texts=terms,
-            n_results=N_RESULTS,
+        res = chroma_breaker.call(
+            run_with_timeout, chroma_executor, current_call_timeout(CHROMA_TIMEOUT), self._query,
+            collection, terms, n_results,
         )
         return res
 
+    def _query(self, collection: chromadb.Collection, terms: list[str], n_results: int) -> chromadb.QueryResult:
+        if not retrieval_cache.enabled:
+            return collection.query(query_texts=terms, n_results=n_results)
+        version = retrieval_cache.version(collection.name, lambda: self._collection_version(collection.name))
+        return retrieval_cache.query(
+            collection.name, version, terms, n_results,
+            lambda missing: collection.query(query_texts=missing, n_results=n_results))
+
+    def _collection_version(self, name: str) -> str:
+        # fetched again for its current metadata, see retrieval_cache.VERSION_METADATA_KEY
+        collection = chroma_client.get_collection(name=name, embedding_function=self.get_ef())
+        return collection_version(collection.count(), collection.metadata)
+
+    async def search_docs_async(self, intent: str, terms: list[str], n_results=N_RESULTS) -> chromadb.QueryResult:
+        return await chroma_breaker.call_async(
+            wait_with_timeout, self._query_async(terms, n_results), current_call_timeout(CHROMA_TIMEOUT))
+
+    async def _get_async_collection(self):
+        if self.async_collection is None:
+            async with self.async_collection_lock:
+                if self.async_collection is None:
+                    client = await chromadb.AsyncHttpClient(host=CHROMA_HOST, port=int(
+                        CHROMA_PORT), settings=Settings(anonymized_telemetry=False))
+                    self.async_client = client
+                    self.async_collection = await client.get_collection(name=CHROMA_DB)
+        return self.async_collection
+
+    async def _query_async(self, terms: list[str], n_results: int) -> chromadb.QueryResult:
+        await self._get_async_collection()
+        if not retrieval_cache.enabled:
+            return await self._query_embeddings_async(terms, n_results)
+        version = retrieval_cache.current_version(CHROMA_DB)
+        if version is None:
+            collection = await self.async_client.get_collection(name=CHROMA_DB)
+            version = collection_version(await collection.count(), collection.metadata)
+            retrieval_cache.set_version(CHROMA_DB, version)
+        return await retrieval_cache.query_async(
+            CHROMA_DB, version, terms, n_results,
+            lambda missing: self._query_embeddings_async(missing, n_results))
+
+    async def _query_embeddings_async(self, terms: list[str], n_results: int) -> chromadb.QueryResult:
+        # the embedding functions are synchronous (ONNX on CPU or a blocking HTTP call)
+        embeddings = await asyncio.to_thread(self.get_ef(), terms)
+        return await self.async_collection.query(
+            query_embeddings=embeddings,
+            n_results=n_results,
+            include=["documents", "metadatas", "distances"],
+        )
+
     def search_ques(self, intent: str, term: str) -> list[QuestionResponse]:
         return [
             QuestionResponse(id="1", question="abc"),
@@ -156,10 +315,16 @@ class Generation:
     def __init__(self):
         self.knowledge_base = KnowledgeBase()
         self.logger = Logger()
+        self.faq_index = FaqIndex(
+            chroma_client, self.knowledge_base.get_ef(), name=FAQ_CHROMA_DB, min_similarity=FAQ_MIN_SIMILARITY)
+        with open(f"{ROOT_DIR}/intents.json", "r") as file:
+            self.intents = json.load(file)
+        self.intent_classifier = IntentClassifier.load(
+            INTENT_CLASSIFIER_PATH, self.intents, min_confidence=INTENT_CLASSIFIER_MIN_CONFIDENCE)
 
     def intent(self, question: str, histories: list[History]) -> tuple[str, ChatCompletion, str]:
         his = "\n".join(map(lambda e: e.to_str(), histories))
-        prompt = INTENT_PROMPT_TEMPLATE.replace("[HISTORIES]", his)
+        prompt = render_prompt("INTENT_PROMPT_TEMPLATE", HISTORIES=his)
         completion = self.knowledge_base.gen(
             system=prompt,
             user=question,
@@ -167,9 +332,25 @@ class Generation:
         )
         return _get_content(completion), completion, prompt
 
+    async def intent_async(self, question: str, histories: list[History]) -> tuple[str, ChatCompletion, str]:
+        his = "\n".join(map(lambda e: e.to_str(), histories))
+        prompt = render_prompt("INTENT_PROMPT_TEMPLATE", HISTORIES=his)
+        completion = await self.knowledge_base.gen_async(
+            system=prompt,
+            user=question,
+            json_object=True
+        )
+        return _get_content(completion), completion, prompt
+
+    def local_intent(self, question: str, histories: list[History]) -> IntentPredictionTypeDict | None:
+        if self.intent_classifier is None:
+            return None
+        recent_questions = [history.content for history in histories if history.role == RoleEnum.user]
+        return self.intent_classifier.predict(question, recent_questions)
+
     def search_query(self, question: str, histories: list[History]) -> tuple[str, ChatCompletion, str]:
         his = "\n".join(map(lambda e: e.to_str(), histories))
-        prompt = SEARCH_QUERY_PROMPT_TEMPLATE.replace("[HISTORIES]", his)
+        prompt = render_prompt("SEARCH_QUERY_PROMPT_TEMPLATE", HISTORIES=his)
         completion = self.knowledge_base.gen(
             system=prompt,
             user=question,
@@ -178,13 +359,25 @@ class Generation:
 
     def search_query_using_breakdown_template(self, question: str, histories: list[History], **kwargs) -> tuple[list[str], ChatCompletion, str]:
         his = "\n".join(map(lambda e: e.to_str(), histories))
-        prompt = SEARCH_QUERY_BREAKDOWN_PROMPT_TEMPLATE.replace(
-            "[HISTORIES]", his)
+        prompt = render_prompt(
+            "SEARCH_QUERY_BREAKDOWN_PROMPT_TEMPLATE", HISTORIES=his)
         completion = self.knowledge_base.gen(
             system=prompt,
             user=question,
         )
-        contents = _get_content(completion)
+        return self._parse_search_queries(_get_content(completion)), completion, prompt
+
+    async def search_query_using_breakdown_template_async(self, question: str, histories: list[History]) -> tuple[list[str], ChatCompletion, str]:
+        his = "\n".join(map(lambda e: e.to_str(), histories))
+        prompt = render_prompt(
+            "SEARCH_QUERY_BREAKDOWN_PROMPT_TEMPLATE", HISTORIES=his)
+        completion = await self.knowledge_base.gen_async(
+            system=prompt,
+            user=question,
+        )
+        return self._parse_search_queries(_get_content(completion)), completion, prompt
+
+    def _parse_search_queries(self, contents: str) -> list[str]:
         query_1 = _extract_tag_content(contents, "QUERY_1")
         query_2 = _extract_tag_content(contents, "QUERY_2")
         query_3 = _extract_tag_content(contents, "QUERY_3")
@@ -195,58 +388,79 @@ class Generation:
             result.append(query_2)
         if query_3:
             result.append(query_3)
-        return result, completion, prompt
+        return result
 
-    def search_docs(self, intent: str, search_terms: list[str], **kwargs) -> tuple[list[str], chromadb.QueryResult]:
+    def search_docs(self, intent: str, search_terms: list[str], n_results=N_RESULTS, **kwargs) -> tuple[list[str], chromadb.QueryResult]:
         node = self.knowledge_base.search_docs(
-            intent=intent, terms=search_terms, kwargs=kwargs)
+            intent=intent, terms=search_terms, n_results=n_results, kwargs=kwargs)
+        return self._unique_documents(node, search_terms), node
+
+    async def search_docs_async(self, intent: str, search_terms: list[str], n_results=N_RESULTS, **kwargs) -> tuple[list[str], chromadb.QueryResult]:
+        node = await self.knowledge_base.search_docs_async(intent=intent, terms=search_terms, n_results=n_results)
+        return self._unique_documents(node, search_terms), node
+
+    def _unique_documents(self, node: chromadb.QueryResult, search_terms: list[str]) -> list[str]:
         if node['documents'] is not None:
             docs = list(itertools.chain.from_iterable(node['documents']))
             result = list(set(docs))
         else:
             result = []
         if not len(result):
-            return [f"Không tìm thấy được thông tin liên quan đến câu hỏi", *search_terms], node
-        return result, node
+            return [f"Không tìm thấy được thông tin liên quan đến câu hỏi", *search_terms]
+        return result
 
     def search_docs_by_chunk_id(self, chunk_id: str) -> tuple[str, chromadb.GetResult]:
-        node = self.knowledge_base.collection.get(ids=[chunk_id])
-        if node['documents'] is not None:
-            result = node['documents'][0]
-        else:
-            result = [""]
-        return result, node
+        documents, node = self.search_docs_by_chunk_ids([chunk_id])
+        return (documents[0] if documents else ""), node
+
+    def search_docs_by_chunk_ids(self, chunk_ids: list[str]) -> tuple[list[str], chromadb.GetResult]:
+        """Documents of the chunks that exist, in the order of ``chunk_ids``, in one request at most."""
+        chunks = chroma_breaker.call(
+            run_with_timeout, chroma_executor, current_call_timeout(CHROMA_TIMEOUT),
+            self.knowledge_base.chunks.get_many, chunk_ids)
+        return [chunk["document"] for chunk in chunks], to_get_result(chunks)
+
+    def faq_lookup(self, question: str, min_similarity: float = None) -> tuple[FaqMatchTypeDict | None, list[str]]:
+        return chroma_breaker.call(
+            run_with_timeout, chroma_executor, current_call_timeout(CHROMA_TIMEOUT),
+            self._faq_lookup, question, min_similarity)
+
+    def _faq_lookup(self, question: str, min_similarity: float = None) -> tuple[FaqMatchTypeDict | None, list[str]]:
+        match = self.faq_index.lookup(question, min_similarity=min_similarity)
+        if match is None:
+            return None, []
+        siblings = self.faq_index.siblings(
+            match["chunk_id"], exclude=[question, match["question"]])
+        return match, siblings
 
     def ranking_docs(self, question, histories, docs) -> tuple[float, ChatCompletion, str, str]:
         his = "\n".join(map(lambda e: e.to_str(), histories))
         system_prompt = RANKING_DOCS_SYSTEM_PROMPT_TEMPLATE
 
-        documents2 = []
-        for i in range(len(docs)):
-            id = f"id_{i}"
-            doc = docs[i]
-            documents2.append(
-                {
-                    "chunk_id": id,
-                    "text": doc
-                }
-            )
-
-        user_prompt = RANKING_DOCS_USER_PROMPT_TEMPLATE.replace(
-            "[HISTORIES]", his
-        ).replace(
-            "[DOCS]", json.dumps(documents2)
-        ).replace(
-            "[QUERY]", question
-        )
+        # DOCS are listed as {"chunk_id": "id_<i>", "text": <doc>}, see SLOT_FORMATTERS
+        user_prompt = render_prompt(
+            "RANKING_DOCS_USER_PROMPT_TEMPLATE", HISTORIES=his, DOCS=docs, QUERY=question)
         completion = self.knowledge_base.gen(
             system=system_prompt,
             user=user_prompt,
             json_object=True
         )
+        return self._parse_ranked_documents(_get_content(completion), docs), completion
+
+    async def ranking_docs_async(self, question, histories, docs) -> tuple[list[dict], ChatCompletion]:
+        his = "\n".join(map(lambda e: e.to_str(), histories))
+        user_prompt = render_prompt(
+            "RANKING_DOCS_USER_PROMPT_TEMPLATE", HISTORIES=his, DOCS=docs, QUERY=question)
+        completion = await self.knowledge_base.gen_async(
+            system=RANKING_DOCS_SYSTEM_PROMPT_TEMPLATE,
+            user=user_prompt,
+            json_object=True
+        )
+        return self._parse_ranked_documents(_get_content(completion), docs), completion
 
-        print(_get_content(completion))
-        chunks = json.loads(_get_content(completion))
+    def _parse_ranked_documents(self, contents: str, docs: list[str]) -> list[dict]:
+        print(contents)
+        chunks = json.loads(contents)
         if 'chunks' not in chunks:
             return []
         chunks = chunks['chunks']
@@ -266,11 +480,28 @@ class Generation:
                 "document": docs[id_i],
             })
 
-        return ranked_documents, completion
+        return ranked_documents
+
+    def _fit_docs(self, question: str, docs: list[str], histories: str = "") -> list[str]:
+        """The best ranked docs whose answer prompt stays within PROMPT_TOKEN_BUDGET."""
+        if not PROMPT_TOKEN_BUDGET or not docs:
+            return docs
+        base = render_prompt("ANSWER_PROMPT_TEMPLATE", DOCS=[], HISTORIES=histories)
+        used = count_message_tokens(
+            [{"content": message} for message in base.messages] + [{"content": question}], MODEL)
+        fitted = []
+        for doc, tokens in zip(docs, count_tokens_batch(docs, MODEL)):
+            used += tokens + 1  # newline between docs
+            if used > PROMPT_TOKEN_BUDGET and fitted:
+                break
+            fitted.append(doc)
+        if len(fitted) < len(docs):
+            token_logger.info(f"Dropped {len(docs) - len(fitted)} of {len(docs)} docs to fit PROMPT_TOKEN_BUDGET={PROMPT_TOKEN_BUDGET}")
+        return fitted
 
     def answers(self, question: str, docs: list[str], **kwargs) -> tuple[str, ChatCompletion, str]:
-        documents = "\n".join(docs)
-        prompt = ANSWER_PROMPT_TEMPLATE.replace("[DOCS]", documents)
+        docs = self._fit_docs(question, docs)
+        prompt = render_prompt("ANSWER_PROMPT_TEMPLATE", DOCS=docs)
         completion = self.knowledge_base.gen(
             system=prompt,
             user=question,
@@ -279,9 +510,9 @@ class Generation:
 
     def answers_using_stream(self, question: str, docs: list[str], histories: list[History]) -> tuple[Stream, str]:
         his = "\n".join(map(lambda e: e.to_str(), histories))
-        documents = "\n".join(docs)
-        prompt = ANSWER_PROMPT_TEMPLATE.replace(
-            "[DOCS]", documents).replace("[HISTORIES]", his)
+        docs = self._fit_docs(question, docs, his)
+        prompt = render_prompt(
+            "ANSWER_PROMPT_TEMPLATE", DOCS=docs, HISTORIES=his)
         completion = self.knowledge_base.gen(
             system=prompt,
             user=question,
@@ -289,6 +520,18 @@ class Generation:
         )
         return completion, prompt
 
+    async def answers_using_stream_async(self, question: str, docs: list[str], histories: list[History]) -> tuple[AsyncStream, str]:
+        his = "\n".join(map(lambda e: e.to_str(), histories))
+        docs = self._fit_docs(question, docs, his)
+        prompt = render_prompt(
+            "ANSWER_PROMPT_TEMPLATE", DOCS=docs, HISTORIES=his)
+        completion = await self.knowledge_base.gen_async(
+            system=prompt,
+            user=question,
+            stream=True
+        )
+        return completion, prompt
+
     def followup_questions(
         self,
         search_term: str,
@@ -298,15 +541,26 @@ class Generation:
         n=3,
     ) -> tuple[ChatCompletion, str, list[str]]:
         his = "\n".join(map(lambda e: e.to_str(), histories))
-        prompt = FOLLOWUP_QUESTIONS_PROMPT_TEMPLATE.replace(
-            "[SEARCH_TERM]", search_term
-        ).replace("[ANSWER]", answer).replace("[HISTORIES]", his)
+        prompt = render_prompt(
+            "FOLLOWUP_QUESTIONS_PROMPT_TEMPLATE", SEARCH_TERM=search_term, ANSWER=answer, HISTORIES=his)
 
         chat_completion = self.knowledge_base.gen(
             system=prompt,
             user=search_term,
         )
-        contents = _get_content(chat_completion)
+        return chat_completion, prompt, self._parse_followup_questions(_get_content(chat_completion))
+
+    async def followup_questions_async(self, search_term: str, answer: str, histories: list[History], intent: str) -> tuple[ChatCompletion, str, list[str]]:
+        his = "\n".join(map(lambda e: e.to_str(), histories))
+        prompt = render_prompt(
+            "FOLLOWUP_QUESTIONS_PROMPT_TEMPLATE", SEARCH_TERM=search_term, ANSWER=answer, HISTORIES=his)
+        chat_completion = await self.knowledge_base.gen_async(
+            system=prompt,
+            user=search_term,
+        )
+        return chat_completion, prompt, self._parse_followup_questions(_get_content(chat_completion))
+
+    def _parse_followup_questions(self, contents: str) -> list[str]:
         ques_1 = _extract_tag_content(contents, "QUESTION_1")
         ques_2 = _extract_tag_content(contents, "QUESTION_2")
         ques_3 = _extract_tag_content(contents, "QUESTION_3")
@@ -318,11 +572,11 @@ class Generation:
             results.append(ques_2)
         if ques_3:
             results.append(ques_3)
-        return chat_completion, prompt, results
+        return results
 
     def generate_questions(self, content: str, num=1) -> tuple[list[str], ChatCompletion, str]:
-        prompt = GENERATE_QUESTIONS_PROMPT_TEMPLATE.replace(
-            "[NUMBER_QUESTIONS]", str(num)).replace("[CONTENT]", content)
+        prompt = render_prompt(
+            "GENERATE_QUESTIONS_PROMPT_TEMPLATE", NUMBER_QUESTIONS=str(num), CONTENT=content)
         completion = self.knowledge_base.gen(
             system=prompt,
             user=content
@@ -332,9 +586,8 @@ class Generation:
         return questions, completion, prompt
 
     def check_if_answer_related_to_content(self, question: str, answer: str, content: str) -> tuple[bool, ChatCompletion, str]:
-        prompt = CHECKING_ANSWER_PROMPT_TEMPLATE.replace(
-            "[CONTENT]", content
-        ).replace("[QUESTION]", question)
+        prompt = render_prompt(
+            "CHECKING_ANSWER_PROMPT_TEMPLATE", CONTENT=content, QUESTION=question)
 
         completion = self.knowledge_base.gen(
             system=prompt,
@@ -344,14 +597,29 @@ class Generation:
         is_related = _extract_tag_content(contents, "RELATED") == "YES"
         return is_related, completion, prompt
 
+    def summarize_conversation(self, summary: str, histories: list[dict]) -> tuple[str, dict]:
+        his = "\n".join(map(lambda e: History(**e).to_str(), histories))
+        prompt = render_prompt(
+            "CONVERSATION_SUMMARY_PROMPT_TEMPLATE", SUMMARY=summary or "(empty)", HISTORIES=his,
+            MAX_WORDS=str(MEMORY_SUMMARY_MAX_WORDS))
+        completion = self.knowledge_base.gen(
+            system=prompt,
+            user="Update the summary.",
+        )
+        contents = _get_content(completion)
+        return _extract_tag_content(contents, "SUMMARY") or contents, completion.to_dict()
+
 
 # Command
 
 T = TypeVar('T')
 R = TypeVar('R')
 
-generation_instance = Generation()
-logger = Logger()
+generation_instance: Generation = register("generation", Generation)
+logger: Logger = register("logger", Logger)
+conversation_memory: ConversationMemory = register("conversation_memory", lambda: ConversationMemory(
+    database.get(), generation_instance.summarize_conversation, MEMORY_RECENT_MESSAGES,
+    max_pending=MEMORY_MAX_PENDING))
 
 
 class IntentTypeDict(TypedDict):
@@ -425,6 +693,17 @@ class SearchDocsByChunkIdTypeDict(TypedDict):
     node: chromadb.GetResult
 
 
+class SearchDocsByChunkIdsTypeDict(TypedDict):
+    chunk_ids: list[str]
+    documents: list[str]
+    nodes: chromadb.GetResult
+
+
+class FaqLookupTypeDict(TypedDict):
+    match: FaqMatchTypeDict | None
+    followup_questions: list[str]
+
+
 class SessionTypeDict(TypedDict):
     session_id: str
     role: RoleEnum
@@ -436,12 +715,22 @@ class GetHistoriesBySessionIdTypeDict(TypedDict):
     content: str
 
 
+class UpdateConversationMemoryTypeDict(TypedDict):
+    session_id: str
+    scheduled: bool
+
+
 class FollowupQuestionsTypeDict(TypedDict):
     followup_questions: list[str]
     completion: dict
     prompt: str
 
 
+class PickFollowupQuestionsTypeDict(TypedDict):
+    followup_questions: list[str]
+    asked: int
+
+
 class Command(ABC, Generic[T]):
     input: dict[str, Any]
     result: T
@@ -459,6 +748,10 @@ class Command(ABC, Generic[T]):
     def execute(self) -> Any:
         pass
 
+    async def execute_async(self) -> Any:
+        # commands without a native async implementation run on the default executor
+        return await asyncio.to_thread(self.execute)
+
     def set_execution_time(self, start_time: datetime, end_time: datetime):
         if not self.include_execution_time:
             raise Exception("Cannot set execution time")
@@ -482,8 +775,46 @@ class IntentCommand(Command[IntentTypeDict]):
         }
 
     def execute(self):
+        prediction = generation_instance.local_intent(
+            question=self.question, histories=self.histories)
+        if prediction is not None:
+            return self._local_result(prediction)
+
         intent, intent_completion, intent_prompt = generation_instance.intent(
             question=self.question, histories=self.histories)
+        return self._llm_result(intent, intent_completion, intent_prompt)
+
+    async def execute_async(self):
+        # the classifier runs on CPU and the intent payload is read from disk
+        prediction = await asyncio.to_thread(
+            generation_instance.local_intent, question=self.question, histories=self.histories)
+        if prediction is not None:
+            return await asyncio.to_thread(self._local_result, prediction)
+
+        intent, intent_completion, intent_prompt = await generation_instance.intent_async(
+            question=self.question, histories=self.histories)
+        return await asyncio.to_thread(self._llm_result, intent, intent_completion, intent_prompt)
+
+    def _local_result(self, prediction: IntentPredictionTypeDict) -> IntentTypeDict:
+        # Confident local prediction: no chat completion is spent on classification
+        self.result = {
+            "intent": json.dumps({
+                "INTENT_NAME": prediction["intent_name"],
+                "REPHRASED_INTENT": prediction["rephrased_intent"]
+            }, ensure_ascii=False),
+            "rephased_intent": prediction["rephrased_intent"],
+            "completion": {},
+            "prompt": "",
+            "intent_payload": self._get_payload_intent(prediction["intent_name"]),
+            "classifier": {
+                "source": "local",
+                "confidence": prediction["confidence"],
+                "version": prediction["version"]
+            }
+        }
+        return self.result
+
+    def _llm_result(self, intent: str, intent_completion: ChatCompletion, intent_prompt: str) -> IntentTypeDict:
         try:
             intent_object = json.loads(intent)
         except:
@@ -508,7 +839,10 @@ class IntentCommand(Command[IntentTypeDict]):
             "rephased_intent": rephased_intent,
             "completion": intent_completion.to_dict(),
             "prompt": intent_prompt,
-            "intent_payload": intent_payload
+            "intent_payload": intent_payload,
+            "classifier": {
+                "source": "llm"
+            }
         }
 
         return self.result
@@ -530,6 +864,14 @@ class SearchQueryCommand(Command[SearchTermTypeDict]):
     def execute(self):
         search_terms, search_term_completion, search_term_prompt = generation_instance.search_query_using_breakdown_template(
             question=self.question, histories=self.histories)
+        return self._to_result(search_terms, search_term_completion, search_term_prompt)
+
+    async def execute_async(self):
+        search_terms, search_term_completion, search_term_prompt = await generation_instance.search_query_using_breakdown_template_async(
+            question=self.question, histories=self.histories)
+        return self._to_result(search_terms, search_term_completion, search_term_prompt)
+
+    def _to_result(self, search_terms: list[str], search_term_completion: ChatCompletion, search_term_prompt: str) -> SearchTermTypeDict:
         self.result = {
             "search_terms": search_terms,
             "completion": search_term_completion.to_dict(),
@@ -544,16 +886,50 @@ class SearchDocsCommand(Command[SearchDocsTypeDict]):
         self.intent = intent
         self.search_terms = search_terms
         self.DB = kwargs.get("DB")
+        self.n_results = kwargs.get("n_results", N_RESULTS)
 
     def execute(self):
         docs, docs_list_nodes = generation_instance.search_docs(
-            intent=self.intent, search_terms=self.search_terms, DB=self.DB)
+            intent=self.intent, search_terms=self.search_terms, n_results=self.n_results, DB=self.DB)
         self.result = {
             "documents": docs,
             "nodes": docs_list_nodes
         }
         return self.result
 
+    async def execute_async(self):
+        docs, docs_list_nodes = await generation_instance.search_docs_async(
+            intent=self.intent, search_terms=self.search_terms, n_results=self.n_results, DB=self.DB)
+        self.result = {
+            "documents": docs,
+            "nodes": docs_list_nodes
+        }
+        return self.result
+
+
+class RetrievalDecisionCommand(Command[RetrievalDecisionTypeDict]):
+    def __init__(self, nodes: chromadb.QueryResult, **kwargs) -> None:
+        # ids and distances replay the decision; the documents are logged by SearchDocsCommand
+        super().__init__(nodes={"ids": nodes.get("ids"), "distances": nodes.get("distances")}, **kwargs)
+        self.nodes = nodes
+
+    def execute(self):
+        if not ADAPTIVE_RETRIEVAL:
+            self.result = {"branch": RetrievalBranch.RANKING.value,
+                           "top_distance": None, "gap": None, "documents": []}
+            return self.result
+        self.result = decide_retrieval(
+            self.nodes,
+            confident_distance=ADAPTIVE_CONFIDENT_DISTANCE,
+            min_gap=ADAPTIVE_MIN_GAP,
+            weak_distance=ADAPTIVE_WEAK_DISTANCE,
+            top_k=ADAPTIVE_CONFIDENT_TOP_K,
+        )
+        return self.result
+
+    async def execute_async(self):
+        return self.execute()
+
 
 class SearchDocsByChunkIdCommand(Command[SearchDocsByChunkIdTypeDict]):
     def __init__(self, chunk_id: str, **kwargs) -> None:
@@ -572,6 +948,40 @@ class SearchDocsByChunkIdCommand(Command[SearchDocsByChunkIdTypeDict]):
         return self.result
 
 
+class SearchDocsByChunkIdsCommand(Command[SearchDocsByChunkIdsTypeDict]):
+    def __init__(self, chunk_ids: list[str], **kwargs) -> None:
+        super().__init__(chunk_ids=chunk_ids, **kwargs)
+        self.chunk_ids = chunk_ids
+
+    def execute(self):
+        docs, nodes = generation_instance.search_docs_by_chunk_ids(
+            chunk_ids=self.chunk_ids)
+        self.result = {
+            "documents": docs,
+            "nodes": nodes,
+            "chunk_ids": self.chunk_ids
+        }
+
+        return self.result
+
+
+class FaqLookupCommand(Command[FaqLookupTypeDict]):
+    def __init__(self, question: str, **kwargs) -> None:
+        super().__init__(question=question, **kwargs)
+        self.question = question
+        # lower than FAQ_MIN_SIMILARITY when the FAQ answer replaces an LLM answer
+        self.min_similarity = kwargs.get("min_similarity")
+
+    def execute(self):
+        match, siblings = generation_instance.faq_lookup(
+            question=self.question, min_similarity=self.min_similarity)
+        self.result = {
+            "match": match,
+            "followup_questions": siblings
+        }
+        return self.result
+
+
 class RankingDocsCommand(Command[list[RankdingDocsTypeDict]]):
     def __init__(self, question: str, histories: list[History], docs: list[str], **kwargs) -> None:
         his = "\n".join(map(lambda e: e.to_str(), histories))
@@ -592,6 +1002,16 @@ class RankingDocsCommand(Command[list[RankdingDocsTypeDict]]):
         }
         return self.result
 
+    async def execute_async(self):
+        ranked_documents, completion = await generation_instance.ranking_docs_async(
+            question=self.question, histories=self.histories, docs=self.docs)
+
+        self.result = {
+            "completion": completion.to_dict(),
+            "docs": ranked_documents
+        }
+        return self.result
+
 
 class ChatAction(Enum):
     SEARCH_DOCS = "SEARCH_DOCS"
@@ -647,6 +1067,30 @@ class AnswerUsingStreamCommand(Command[AnswerUsingStreamTypeDict]):
         }
         return self.result
 
+    async def execute_async(self) -> AsyncGenerator[str, None]:
+        # async generators cannot return a value, the caller reads self.result when exhausted
+        full_answer = ""
+        actual_ans_completion = None
+        docs = self.docs
+        ans_completion, ans_prompt = await generation_instance.answers_using_stream_async(
+            question=self.question, docs=docs, histories=self.histories)
+        async for chunk in ans_completion:
+            if chunk is not None:
+                if len(chunk.choices) == 0:
+                    actual_ans_completion = chunk  # Usage on the end of chunk
+                    break
+                else:
+                    content = str(chunk.choices[0].delta.content)
+                    if content != "None":
+                        yield content
+                        full_answer += content
+        self.result = {
+            "answer": full_answer,
+            "completion": actual_ans_completion.to_dict() if actual_ans_completion is not None else {},
+            "prompt": ans_prompt,
+            "docs": docs
+        }
+
 
 class FollowupQuestionsCommand(Command[list[FollowupQuestionsTypeDict]]):
     def __init__(self, search_term: str, intent: str, answer: str, histories: list[History], **kwargs) -> None:
@@ -670,6 +1114,51 @@ class FollowupQuestionsCommand(Command[list[FollowupQuestionsTypeDict]]):
 
         return self.result
 
+    async def execute_async(self):
+        completion, prompt, followup_questions = await generation_instance.followup_questions_async(
+            search_term=self.search_term, answer=self.answer, intent=self.intent, histories=self.histories)
+
+        self.result = {
+            "completion": completion.to_dict(),
+            "prompt": prompt,
+            "followup_questions": followup_questions,
+        }
+
+        return self.result
+
+
+class PickFollowupQuestionsCommand(Command[PickFollowupQuestionsTypeDict]):
+    """Follow-up questions from the precomputed pools of the answered chunks, see followup_pool.py"""
+
+    def __init__(self, session_id: str, question: str, docs: list[str], nodes: chromadb.QueryResult | chromadb.GetResult, **kwargs) -> None:
+        super().__init__(session_id=session_id, question=question, docs=docs, nodes=nodes, **kwargs)
+        self.session_id = session_id
+        self.question = question
+        self.docs = docs
+        self.nodes = nodes
+
+    def _asked_query(self):
+        return db.select(Session.c.content).where(
+            Session.c.session_id == self.session_id, Session.c.role == RoleEnum.user)
+
+    def _to_result(self, asked: list[str]) -> PickFollowupQuestionsTypeDict:
+        asked = [*asked, self.question]
+        self.result = {
+            "followup_questions": pick_followup_questions(self.docs, self.nodes, asked),
+            "asked": len(asked),
+        }
+        return self.result
+
+    def execute(self):
+        with get_session().connect() as conn:
+            asked = conn.execute(self._asked_query()).scalars().all()
+        return self._to_result(list(asked))
+
+    async def execute_async(self):
+        async with get_async_session().connect() as conn:
+            asked = (await conn.execute(self._asked_query())).scalars().all()
+        return self._to_result(list(asked))
+
 
 class LogActivitiesCommand(Command[LogActivitiesTypeDict]):
 
@@ -683,6 +1172,9 @@ class LogActivitiesCommand(Command[LogActivitiesTypeDict]):
         self.commandHistories = commandHistories
         self.start_time = start_time
         self.end_time = end_time
+        self.degraded = kwargs.get("degraded") or []
+        # shadow runs build their log for the comparison without storing it
+        self.persist = kwargs.get("persist", True)
 
     def execute(self):
         calls = []
@@ -695,14 +1187,15 @@ class LogActivitiesCommand(Command[LogActivitiesTypeDict]):
             "app_id": "chatbot",
             "main_input": self.question,
             "main_output": self.answer,
-            "main_error": "",
+            "main_error": "; ".join(self.degraded),
             "perf": {
                 "start_time": self.start_time.isoformat(),
                 "end_time": self.end_time.isoformat()
             },
             "calls": calls,
         }
-        asyncio.run(logger.create_async(log))
+        if self.persist:
+            asyncio.run(logger.create_async(log))
         self.result = log
         return self.result
 
@@ -798,6 +1291,10 @@ class GetHistoriesBySessionIdCommand(Command[list[GetHistoriesBySessionIdTypeDic
         self.num = num
 
     def execute(self) -> Any:
+        if CONVERSATION_MEMORY:
+            with get_session().connect() as conn:
+                self.result = load_histories(conn, self.session_id, self.num)
+            return self.result
         histories = []
         with get_session().connect() as conn:
             for row in conn.execute(db.select(Session).where(Session.c.session_id == self.session_id).order_by(Session.c.created_at.desc())).fetchmany(self.num):
@@ -809,6 +1306,23 @@ class GetHistoriesBySessionIdCommand(Command[list[GetHistoriesBySessionIdTypeDic
         self.result = histories
         return self.result
 
+    async def execute_async(self) -> Any:
+        if CONVERSATION_MEMORY:
+            async with get_async_session().connect() as conn:
+                self.result = await load_histories_async(conn, self.session_id, self.num)
+            return self.result
+        histories = []
+        async with get_async_session().connect() as conn:
+            res = await conn.execute(db.select(Session).where(Session.c.session_id == self.session_id).order_by(Session.c.created_at.desc()).limit(self.num))
+            for row in res.fetchall():
+                histories.insert(0, {
+                    "role": row.role.value,
+                    "content": row.content
+
+                })
+        self.result = histories
+        return self.result
+
 
 class SaveSessionCommand(Command[SessionTypeDict]):
     def __init__(self, session_id: str, role: RoleEnum, content: str, **kwargs) -> None:
@@ -825,25 +1339,145 @@ class SaveSessionCommand(Command[SessionTypeDict]):
         self.result = {"session_id": self.session_id}
         return self.result
 
+    async def execute_async(self) -> Any:
+        async with get_async_session().connect() as conn:
+            await conn.execute(Session.insert().values(
+                session_id=self.session_id, role=self.role, content=self.content))
+            await conn.commit()
+        self.result = {"session_id": self.session_id}
+        return self.result
+
+
+class UpdateConversationMemoryCommand(Command[UpdateConversationMemoryTypeDict]):
+    """Schedules folding the older turns of the session into its summary, returns right away."""
+
+    def __init__(self, session_id: str, **kwargs) -> None:
+        super().__init__(session_id=session_id, **kwargs)
+        self.session_id = session_id
+
+    def execute(self) -> Any:
+        scheduled = CONVERSATION_MEMORY and conversation_memory.schedule_update(self.session_id)
+        self.result = {"session_id": self.session_id, "scheduled": scheduled}
+        return self.result
+
+    async def execute_async(self) -> Any:
+        return self.execute()
+
 
 class ChatbotController:
     commandHistories: list[Command]
+    deadline: Deadline
+    # degraded modes taken by the request, logged as its main_error
+    degraded: list[str]
+
+    def stage_timeout(self, command: Command) -> float | None:
+        """Seconds the command may take, None for stages without a timeout (DB writes...).
+
+        Raises DeadlineExceeded when the request deadline has passed.
+        """
+        stage_timeout = STAGE_TIMEOUTS.get(command.__class__.__name__)
+        if stage_timeout is None:
+            return None
+        return self.deadline.budget(stage_timeout)
+
+    def degrade(self, reason: str):
+        print("Degraded:", reason)
+        self.degraded.append(reason)
 
     def executeCommand(self, command: Command[T], **kwargs) -> T:
         include_execution_time = kwargs.pop("include_execution_time", True)
         exclude_save_history = kwargs.pop("exclude_save_history", False)
+        with call_timeout(self.stage_timeout(command)):
+            if include_execution_time:
+                start_time = datetime.now(tz=timezone.utc)
+                cmd = command.execute(**kwargs)
+                end_time = datetime.now(tz=timezone.utc)
+                command.set_execution_time(
+                    start_time=start_time, end_time=end_time
+                )
+            else:
+                cmd = command.execute(**kwargs)
+        if not exclude_save_history:
+            self.commandHistories.append(command)
+        return cmd
+
+    def run(self, command: Command[T], **kwargs) -> Generator[Any, Any, T]:
+        """``result = yield from controller.run(command)`` inside a chatbot pipeline.
+
+        Executes right away here; AsyncChatbotController hands the command to its driver instead.
+        """
+        return self.executeCommand(command, **kwargs)
+        yield
+
+    def stream(self, command: Command[T], wrap: Callable[[str], Any]) -> Generator[Any, Any, T]:
+        """Run a command whose execute() yields chunks, yielding ``wrap(chunk)`` for each of them."""
+        timeout = self.stage_timeout(command)
+        start_time = datetime.now(tz=timezone.utc)
+        chunks = command.execute()
+        while True:
+            try:
+                with call_timeout(timeout):
+                    chunk = next(chunks)
+            except StopIteration as e:
+                result = e.value
+                break
+            yield wrap(chunk)
+        command.set_execution_time(
+            start_time=start_time, end_time=datetime.now(tz=timezone.utc))
+        self.commandHistories.append(command)
+        return result
+
+    def __init__(self, deadline: Deadline = None) -> None:
+        self.commandHistories = []
+        self.deadline = deadline or Deadline(REQUEST_DEADLINE)
+        self.degraded = []
+
+
+class PendingCommand:
+    """A command yielded by a pipeline run with AsyncChatbotController, to be awaited by the driver."""
+
+    def __init__(self, command: Command, kwargs: dict, wrap: Callable[[str], Any] = None):
+        self.command = command
+        self.kwargs = kwargs
+        # set for streaming commands, see ChatbotController.stream
+        self.wrap = wrap
+
+
+class AsyncChatbotController(ChatbotController):
+
+    def run(self, command: Command[T], **kwargs) -> Generator[Any, Any, T]:
+        return (yield PendingCommand(command, kwargs))
+
+    def stream(self, command: Command[T], wrap: Callable[[str], Any]) -> Generator[Any, Any, T]:
+        return (yield PendingCommand(command, {}, wrap=wrap))
+
+    async def executeCommandAsync(self, command: Command[T], **kwargs) -> T:
+        include_execution_time = kwargs.pop("include_execution_time", True)
+        exclude_save_history = kwargs.pop("exclude_save_history", False)
+        timeout = self.stage_timeout(command)
+        start_time = datetime.now(tz=timezone.utc)
+        with call_timeout(timeout):
+            # cancelled on timeout, unlike the threads of the synchronous path
+            cmd = await wait_with_timeout(command.execute_async(**kwargs), timeout)
         if include_execution_time:
-            start_time = datetime.now(tz=timezone.utc)
-            cmd = command.execute(**kwargs)
-            end_time = datetime.now(tz=timezone.utc)
             command.set_execution_time(
-                start_time=start_time, end_time=end_time
-            )
-        else:
-            cmd = command.execute(**kwargs)
+                start_time=start_time, end_time=datetime.now(tz=timezone.utc))
         if not exclude_save_history:
             self.commandHistories.append(command)
         return cmd
 
-    def __init__(self) -> None:
-        self.commandHistories = []
+    async def streamCommandAsync(self, command: Command[T], wrap: Callable[[str], Any]) -> AsyncGenerator[Any, None]:
+        timeout = self.stage_timeout(command)
+        start_time = datetime.now(tz=timezone.utc)
+        chunks = command.execute_async()
+        while True:
+            try:
+                with call_timeout(timeout):
+                    # bounds the first chunk (TTFB) and every gap between chunks
+                    chunk = await wait_with_timeout(chunks.__anext__(), timeout)
+            except StopAsyncIteration:
+                break
+            yield wrap(chunk)
+        command.set_execution_time(
+            start_time=start_time, end_time=datetime.now(tz=timezone.utc))
+        self.commandHistories.append(command)
@@ -0,0 +1,155 @@
+import json
+import os
+import re
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Sequence, TypedDict
+
+from utils import _normalize_text
+
+# Bumped whenever the on-disk layout of the model file changes
+MODEL_FORMAT_VERSION = 1
+
+# IntentCommand logs its histories as "role: content" blocks, see History.to_str
+HISTORY_ROLE = re.compile(r"^(user|system|summary): ", re.MULTILINE)
+
+
+class IntentPredictionTypeDict(TypedDict):
+    intent_name: str
+    rephrased_intent: str
+    confidence: float
+    version: str
+
+
+def classifier_input(question: str, recent_questions: Sequence[str], context_turns: int) -> str:
+    """The question followed by the last ``context_turns`` user questions it may refer to."""
+    context = list(recent_questions)[-context_turns:] if context_turns > 0 else []
+    return "\n".join([question, *context])
+
+
+def _logged_user_questions(histories: str) -> list[str]:
+    parts = HISTORY_ROLE.split(histories or "")
+    return [content.strip() for role, content in zip(parts[1::2], parts[2::2]) if role == "user"]
+
+
+def _extract_intent_sample(call: dict, context_turns: int) -> Optional[tuple[str, str]]:
+    if call.get("call_name") != "IntentCommand":
+        return None
+    args = call.get("args") or {}
+    question = args.get("question")
+    rets = call.get("rets") or {}
+    # samples produced by the local classifier itself would only reinforce its own mistakes
+    if not question or rets.get("classifier", {}).get("source") == "local":
+        return None
+    try:
+        intent_name = json.loads(rets.get("intent") or "").get("INTENT_NAME")
+    except Exception:
+        return None
+    if not intent_name:
+        return None
+    recent_questions = _logged_user_questions(args.get("histories"))
+    return classifier_input(question, recent_questions, context_turns), intent_name
+
+
+def extract_training_samples(calls_rows: Iterable[list[dict]], intents: dict, context_turns=0) -> list[tuple[str, str]]:
+    """Collect (classifier input, INTENT_NAME) pairs from the IntentCommand calls of logged dialogues."""
+    samples = []
+    for calls in calls_rows:
+        for call in calls or []:
+            sample = _extract_intent_sample(call, context_turns)
+            if sample and sample[1] in intents:
+                samples.append(sample)
+    return samples
+
+
+class IntentClassifier:
+    """Char n-gram TF-IDF + logistic regression, run on CPU in front of the LLM intent prompt."""
+
+    def __init__(self, pipeline, intents: dict, version: str, min_confidence: float, context_turns=0):
+        self.pipeline = pipeline
+        self.intents = intents
+        self.version = version
+        self.min_confidence = min_confidence
+        # earlier user questions appended to the input, as in the training samples
+        self.context_turns = context_turns
+
+    @staticmethod
+    def train(samples: list[tuple[str, str]], intents: dict, min_samples=5, context_turns=0):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import make_pipeline
+
+        counts = {}
+        for _, label in samples:
+            counts[label] = counts.get(label, 0) + 1
+        samples = [(q, label) for q, label in samples
+                   if counts[label] >= min_samples]
+        labels = set(label for _, label in samples)
+        if len(labels) < 2:
+            raise ValueError(
+                f"Not enough labelled dialogues to train: {counts}")
+
+        pipeline = make_pipeline(
+            TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4),
+                            sublinear_tf=True, preprocessor=_normalize_text),
+            LogisticRegression(max_iter=1000, class_weight="balanced"),
+        )
+        pipeline.fit([q for q, _ in samples], [label for _, label in samples])
+        version = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+        return IntentClassifier(pipeline, intents, version, min_confidence=1.0, context_turns=context_turns), {
+            label: counts[label] for label in sorted(labels)}
+
+    def save(self, directory: str, stats: dict) -> str:
+        import joblib
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"intent_classifier_{self.version}.joblib")
+        joblib.dump({
+            "format_version": MODEL_FORMAT_VERSION,
+            "version": self.version,
+            "trained_at": datetime.now(timezone.utc).isoformat(),
+            "stats": stats,
+            "context_turns": self.context_turns,
+            "pipeline": self.pipeline,
+        }, path)
+        return path
+
+    @staticmethod
+    def load(path: str, intents: dict, min_confidence: float) -> Optional["IntentClassifier"]:
+        """Load a model file, or the newest one when ``path`` is a directory. Returns None when unavailable."""
+        try:
+            import joblib
+        except ImportError:
+            return None
+        if os.path.isdir(path):
+            files = sorted(f for f in os.listdir(path)
+                           if f.startswith("intent_classifier_") and f.endswith(".joblib"))
+            if not files:
+                return None
+            path = os.path.join(path, files[-1])
+        if not os.path.isfile(path):
+            return None
+        model = joblib.load(path)
+        if model.get("format_version") != MODEL_FORMAT_VERSION:
+            print(f"Ignoring intent classifier {path}: unsupported format {model.get('format_version')}")
+            return None
+        print(f"Loaded intent classifier {model['version']} from {path}")
+        return IntentClassifier(model["pipeline"], intents, model["version"], min_confidence,
+                                context_turns=model.get("context_turns", 0))
+
+    def predict(self, question: str, recent_questions: Sequence[str] = ()) -> Optional[IntentPredictionTypeDict]:
+        if not _normalize_text(question):
+            return None
+        text = classifier_input(question, recent_questions, self.context_turns)
+        probabilities = self.pipeline.predict_proba([text])[0]
+        best = probabilities.argmax()
+        confidence = float(probabilities[best])
+        intent_name = str(self.pipeline.classes_[best])
+        intent = self.intents.get(intent_name)
+        if confidence < self.min_confidence or not intent or "REPHRASE" not in intent:
+            return None
+        return {
+            "intent_name": intent_name,
+            "rephrased_intent": intent["REPHRASE"].format(question=question.strip()),
+            "confidence": confidence,
+            "version": self.version,
+        }
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import zlib
+from typing import Any
+
+import sqlalchemy as db
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import Dialogue, LogDocument, LogPromptTemplate
+from prompts import RenderedPrompt, _render_template, PROMPT_TEMPLATES
+
+# Compact dialogue logs
+#
+# Strings longer than ``min_ref_length`` (documents, histories, answers) are moved to
+# ``log_documents`` and replaced by {"$doc": <sha256>}; prompts become
+# {"$prompt": <template sha256>, "slots": {...}} with the template text in
+# ``log_prompt_templates``; completions keep only model and usage; Chroma results keep
+# ids and distances. ``load_dialogues`` rehydrates rows back to the original shape.
+
+LOG_FORMAT_FULL = 1
+LOG_FORMAT_COMPACT = 2
+
+COMPLETION_KEYS = ("completion",)
+CHROMA_RESULT_KEYS = ("nodes", "node")
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _chunk_ids_by_content(calls: list[dict]) -> dict[str, str]:
+    chunk_ids = {}
+
+    def walk(ids, documents):
+        for id, document in zip(ids or [], documents or []):
+            if isinstance(id, list):
+                walk(id, document)
+            elif isinstance(document, str):
+                chunk_ids.setdefault(document, id)
+
+    for call in calls:
+        rets = call.get("rets")
+        for key in CHROMA_RESULT_KEYS:
+            if isinstance(rets, dict) and isinstance(rets.get(key), dict):
+                walk(rets[key].get("ids"), rets[key].get("documents"))
+    return chunk_ids
+
+
+class CompactLogBuilder:
+
+    def __init__(self, min_ref_length: int):
+        self.min_ref_length = min_ref_length
+        self.documents: dict[str, dict] = {}
+        self.templates: dict[str, dict] = {}
+        self.chunk_ids: dict[str, str] = {}
+
+    def compact_calls(self, calls: list[dict]) -> list[dict]:
+        self.chunk_ids = _chunk_ids_by_content(calls)
+        return [
+            {**call, "args": self._compact(call.get("args")),
+             "rets": self._compact(call.get("rets"))}
+            for call in calls
+        ]
+
+    def _compact(self, value: Any, key: str = None) -> Any:
+        if isinstance(value, RenderedPrompt):
+            template = PROMPT_TEMPLATES[value.template_id]
+            template_hash = _hash(template)
+            self.templates[template_hash] = {
+                "template_hash": template_hash,
+                "template_id": value.template_id,
+                "content": template,
+            }
+            return {
+                "$prompt": template_hash,
+                "slots": {name: self._compact(slot) for name, slot in value.slots.items()}
+            }
+        if key in COMPLETION_KEYS and isinstance(value, dict) and "usage" in value:
+            return {"model": value.get("model"), "usage": value.get("usage")}
+        if key in CHROMA_RESULT_KEYS and isinstance(value, dict) and "ids" in value:
+            return {
+                "ids": value.get("ids"),
+                "distances": value.get("distances"),
+                "documents": self._compact(value.get("documents")),
+                "metadatas": None,
+            }
+        if isinstance(value, str):
+            if len(value) < self.min_ref_length:
+                return value
+            content_hash = _hash(value)
+            self.documents[content_hash] = {
+                "content_hash": content_hash,
+                "chunk_id": self.chunk_ids.get(value),
+                "content": value,
+            }
+            return {"$doc": content_hash}
+        if isinstance(value, dict):
+            return {k: self._compact(v, k) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._compact(v) for v in value]
+        return value
+
+
+def _encode_calls(calls: list[dict]) -> bytes:
+    return zlib.compress(json.dumps(calls, ensure_ascii=False).encode("utf-8"))
+
+
+def _decode_calls(row: dict) -> list[dict]:
+    if row.get("calls_compressed") is not None:
+        return json.loads(zlib.decompress(bytes(row["calls_compressed"])).decode("utf-8"))
+    return row.get("calls") or []
+
+
+def write_compact_log(conn: db.Connection, log: dict, min_ref_length: int, compress=False) -> dict:
+    """Store the side rows of a dialogue log and return the compact values for ``dialogues``."""
+    builder = CompactLogBuilder(min_ref_length)
+    calls = builder.compact_calls(log.get("calls") or [])
+    if builder.documents:
+        conn.execute(pg_insert(LogDocument).values(
+            list(builder.documents.values())).on_conflict_do_nothing())
+    if builder.templates:
+        conn.execute(pg_insert(LogPromptTemplate).values(
+            list(builder.templates.values())).on_conflict_do_nothing())
+    compact = {**log, "log_format": LOG_FORMAT_COMPACT}
+    if compress:
+        compact["calls"] = None
+        compact["calls_compressed"] = _encode_calls(calls)
+    else:
+        compact["calls"] = calls
+    return compact
+
+
+def _collect_refs(value: Any, documents: set, templates: set):
+    if isinstance(value, dict):
+        if "$doc" in value:
+            documents.add(value["$doc"])
+            return
+        if "$prompt" in value:
+            templates.add(value["$prompt"])
+        for v in value.values():
+            _collect_refs(v, documents, templates)
+    elif isinstance(value, list):
+        for v in value:
+            _collect_refs(v, documents, templates)
+
+
+def _rehydrate(value: Any, documents: dict[str, str], templates: dict[str, tuple[str, str]]) -> Any:
+    if isinstance(value, dict):
+        if "$doc" in value:
+            return documents.get(value["$doc"], "")
+        if "$prompt" in value:
+            slots = {name: _rehydrate(slot, documents, templates)
+                     for name, slot in value["slots"].items()}
+            template_id, content = templates.get(value["$prompt"], ("", ""))
+            return _render_template(template_id, content, slots)
+        return {k: _rehydrate(v, documents, templates) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_rehydrate(v, documents, templates) for v in value]
+    return value
+
+
+def load_dialogues(conn: db.Connection, rows: list) -> list[dict]:
+    """Rehydrate ``dialogues`` rows of any log format into the full log shape."""
+    logs = []
+    for row in rows:
+        log = dict(row._mapping) if hasattr(row, "_mapping") else dict(row)
+        if log.get("log_format") == LOG_FORMAT_COMPACT:
+            log["calls"] = _decode_calls(log)
+        log.pop("calls_compressed", None)
+        logs.append(log)
+
+    doc_hashes, template_hashes = set(), set()
+    for log in logs:
+        if log.get("log_format") == LOG_FORMAT_COMPACT:
+            _collect_refs(log["calls"], doc_hashes, template_hashes)
+    if not doc_hashes and not template_hashes:
+        return logs
+
+    documents, templates = {}, {}
+    if doc_hashes:
+        for row in conn.execute(db.select(LogDocument.c.content_hash, LogDocument.c.content).where(
+                LogDocument.c.content_hash.in_(doc_hashes))):
+            documents[row.content_hash] = row.content
+    if template_hashes:
+        for row in conn.execute(db.select(LogPromptTemplate).where(
+                LogPromptTemplate.c.template_hash.in_(template_hashes))):
+            templates[row.template_hash] = (row.template_id, row.content)
+
+    for log in logs:
+        if log.get("log_format") == LOG_FORMAT_COMPACT:
+            log["calls"] = _rehydrate(log["calls"], documents, templates)
+    return logs
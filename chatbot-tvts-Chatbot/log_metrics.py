@@ -0,0 +1,103 @@
+import json
+from datetime import datetime
+from typing import Optional, TypedDict
+
+from token_accounting import estimate_cost
+
+# Aggregates of a dialogue log, computed once when the log is written (before it is
+# compacted) and stored next to it in ``dialogues`` so dashboards never walk the calls.
+
+DOCUMENT_PREVIEW_LENGTH = 300
+
+
+class CommandMetricsTypeDict(TypedDict):
+    call_name: str
+    duration_ms: Optional[float]
+    prompt_tokens: int
+    cached_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    cost: float
+
+
+class LogMetricsTypeDict(TypedDict):
+    intent: Optional[str]
+    retrieval_branch: Optional[str]
+    duration_ms: Optional[float]
+    prompt_tokens: int
+    cached_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    cost: float
+    metrics: dict
+
+
+def _duration_ms(perf: Optional[dict]) -> Optional[float]:
+    try:
+        return (datetime.fromisoformat(perf["end_time"]) -
+                datetime.fromisoformat(perf["start_time"])).total_seconds() * 1000
+    except Exception:
+        return None
+
+
+def cached_tokens(usage: dict) -> int:
+    """Prompt tokens served from the provider's prompt cache."""
+    return ((usage or {}).get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+
+
+def completion_cost(completion: Optional[dict]) -> float:
+    """USD cost of one ``completion.to_dict()``, from MODEL_PRICES (per 1M tokens)."""
+    usage = (completion or {}).get("usage") or {}
+    return estimate_cost(usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0,
+                         (completion or {}).get("model"), cached_tokens(usage))["total_cost"]
+
+
+def _completions(rets) -> list[dict]:
+    return [ret["completion"] for ret in (rets if isinstance(rets, list) else [rets])
+            if isinstance(ret, dict) and isinstance(ret.get("completion"), dict)]
+
+
+def _intent_name(rets) -> Optional[str]:
+    try:
+        return json.loads(rets.get("intent") or "").get("INTENT_NAME")
+    except Exception:
+        return None
+
+
+def compute_log_metrics(log: dict) -> LogMetricsTypeDict:
+    """Per-record and per-command token, cost and duration aggregates of a full log."""
+    commands: list[CommandMetricsTypeDict] = []
+    intent = None
+    retrieval = None
+    documents = []
+    for call in log.get("calls") or []:
+        rets = call.get("rets")
+        command = {"call_name": call.get("call_name"), "duration_ms": _duration_ms(call.get("perf")),
+                   "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost": 0.0}
+        for completion in _completions(rets):
+            usage = completion.get("usage") or {}
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                command[key] += usage.get(key) or 0
+            command["cached_tokens"] += cached_tokens(usage)
+            command["cost"] += completion_cost(completion)
+        commands.append(command)
+
+        if call.get("call_name") == "IntentCommand" and isinstance(rets, dict):
+            intent = _intent_name(rets) or intent
+        if call.get("call_name") == "RetrievalDecisionCommand" and isinstance(rets, dict):
+            retrieval = {key: rets.get(key) for key in ("branch", "top_distance", "gap")}
+        if call.get("call_name") == "AnswerUsingStreamCommand":
+            documents = [str(doc)[:DOCUMENT_PREVIEW_LENGTH]
+                         for doc in (call.get("args") or {}).get("docs") or []]
+
+    return {
+        "intent": intent,
+        "retrieval_branch": (retrieval or {}).get("branch"),
+        "duration_ms": _duration_ms(log.get("perf")),
+        "prompt_tokens": sum(c["prompt_tokens"] for c in commands),
+        "cached_tokens": sum(c["cached_tokens"] for c in commands),
+        "completion_tokens": sum(c["completion_tokens"] for c in commands),
+        "total_tokens": sum(c["total_tokens"] for c in commands),
+        "cost": sum(c["cost"] for c in commands),
+        "metrics": {"commands": commands, "documents": documents, "retrieval": retrieval},
+    }
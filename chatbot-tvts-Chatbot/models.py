@@ -2,7 +2,7 @@ import datetime
 import enum
 import sqlalchemy as db
 import os
-from config import POSTGRESQL_URL
+from config import POSTGRESQL_URL, POSTGRESQL_ASYNC_URL
 
 metadata = db.MetaData()
 
@@ -34,9 +34,60 @@ Dialogue = db.Table(
     db.Column("main_error", db.String(), nullable=True),
     db.Column("perf", db.JSON(), nullable=True),
     db.Column("calls", db.ARRAY(db.JSON), nullable=True),
+    db.Column("created_at", db.DateTime(), default=datetime.datetime.utcnow),
+    # 1 (or NULL): calls stored as-is, 2: compact calls, see log_format.py
+    db.Column("log_format", db.SmallInteger(), nullable=True),
+    db.Column("calls_compressed", db.LargeBinary(), nullable=True),
+    # aggregates computed at write time, see log_metrics.py
+    db.Column("intent", db.String(), nullable=True),
+    # RetrievalDecisionCommand branch: confident, ranking or widen
+    db.Column("retrieval_branch", db.String(), nullable=True),
+    db.Column("duration_ms", db.Float(), nullable=True),
+    db.Column("prompt_tokens", db.Integer(), nullable=True),
+    # part of prompt_tokens served from the provider's prompt cache
+    db.Column("cached_tokens", db.Integer(), nullable=True),
+    db.Column("completion_tokens", db.Integer(), nullable=True),
+    db.Column("total_tokens", db.Integer(), nullable=True),
+    db.Column("cost", db.Float(), nullable=True),
+    db.Column("metrics", db.JSON(), nullable=True)
+)
+
+# Side tables of the compact log format, deduplicated by content hash
+
+LogDocument = db.Table(
+    "log_documents",
+    metadata,
+    db.Column("content_hash", db.String(64), primary_key=True),
+    db.Column("chunk_id", db.String(), nullable=True),
+    db.Column("content", db.Text()),
     db.Column("created_at", db.DateTime(), default=datetime.datetime.utcnow)
 )
 
+LogPromptTemplate = db.Table(
+    "log_prompt_templates",
+    metadata,
+    db.Column("template_hash", db.String(64), primary_key=True),
+    db.Column("template_id", db.String()),
+    db.Column("content", db.Text()),
+    db.Column("created_at", db.DateTime(), default=datetime.datetime.utcnow)
+)
+
+DialogueRollup = db.Table(
+    "dialogue_rollups",
+    metadata,
+    db.Column("day", db.Date(), primary_key=True),
+    # "__all__" holds the totals of the day
+    db.Column("intent", db.String(), primary_key=True),
+    db.Column("dialogues", db.Integer()),
+    db.Column("prompt_tokens", db.BigInteger()),
+    db.Column("completion_tokens", db.BigInteger()),
+    db.Column("total_tokens", db.BigInteger()),
+    db.Column("latency_p50_ms", db.Float(), nullable=True),
+    db.Column("latency_p90_ms", db.Float(), nullable=True),
+    db.Column("latency_p99_ms", db.Float(), nullable=True),
+    db.Column("updated_at", db.DateTime(), default=datetime.datetime.utcnow)
+)
+
 Session = db.Table(
     "sessions",
     metadata,
@@ -47,6 +98,45 @@ Session = db.Table(
     db.Column("created_at", db.DateTime(), default=datetime.datetime.utcnow)
 )
 
+# Rolling summary of the turns of a session older than the last few, see conversation_memory.py
+SessionSummary = db.Table(
+    "session_summaries",
+    metadata,
+    db.Column("session_id", db.UUID(), primary_key=True),
+    db.Column("summary", db.Text()),
+    # created_at of the newest sessions row folded into the summary
+    db.Column("summarized_until", db.DateTime()),
+    db.Column("messages", db.Integer()),
+    db.Column("prompt_tokens", db.BigInteger()),
+    db.Column("completion_tokens", db.BigInteger()),
+    db.Column("updated_at", db.DateTime(), default=datetime.datetime.utcnow)
+)
+
+# One request answered by the serving pipeline and, in the background, by a candidate one
+ShadowComparison = db.Table(
+    "shadow_comparisons",
+    metadata,
+    db.Column("id", db.Integer(), primary_key=True, autoincrement=True),
+    db.Column("session_id", db.UUID()),
+    db.Column("question", db.Text()),
+    db.Column("primary_pipeline", db.String()),
+    db.Column("candidate_pipeline", db.String()),
+    db.Column("primary_answer", db.Text()),
+    db.Column("candidate_answer", db.Text()),
+    # cosine similarity of the embeddings of the two answers
+    db.Column("answer_similarity", db.Float(), nullable=True),
+    db.Column("primary_duration_ms", db.Float()),
+    db.Column("candidate_duration_ms", db.Float(), nullable=True),
+    db.Column("primary_ttfb_ms", db.Float(), nullable=True),
+    db.Column("candidate_ttfb_ms", db.Float(), nullable=True),
+    db.Column("primary_total_tokens", db.Integer()),
+    db.Column("candidate_total_tokens", db.Integer(), nullable=True),
+    db.Column("primary_cost", db.Float()),
+    db.Column("candidate_cost", db.Float(), nullable=True),
+    db.Column("candidate_error", db.Text(), nullable=True),
+    db.Column("created_at", db.DateTime(), default=datetime.datetime.utcnow)
+)
+
 Feedback = db.Table(
     "feedbacks",
     metadata,
@@ -65,5 +155,43 @@ def get_session():
     return connection
 
 
+async_connection = None
+
+
+def get_async_session():
+    """asyncpg engine for the ASGI server, created on first use so that WSGI workers never import asyncpg."""
+    global async_connection
+    if async_connection is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        async_connection = create_async_engine(POSTGRESQL_ASYNC_URL)
+    return async_connection
+
+
+# Columns added after the first release; create_all does not alter existing tables
+MIGRATIONS = [
+    "ALTER TABLE dialogues ADD COLUMN IF NOT EXISTS log_format SMALLINT",
+    "ALTER TABLE dialogues ADD COLUMN IF NOT EXISTS calls_compressed BYTEA",
+    "ALTER TABLE dialogues ADD COLUMN IF NOT EXISTS intent VARCHAR",
+    "ALTER TABLE dialogues ADD COLUMN IF NOT EXISTS retrieval_branch VARCHAR",
+    "ALTER TABLE dialogues ADD COLUMN IF NOT EXISTS duration_ms FLOAT",
+    "ALTER TABLE dialogues ADD COLUMN IF NOT EXISTS prompt_tokens INTEGER",
+    "ALTER TABLE dialogues ADD COLUMN IF NOT EXISTS completion_tokens INTEGER",
+    "ALTER TABLE dialogues ADD COLUMN IF NOT EXISTS total_tokens INTEGER",
+    "ALTER TABLE dialogues ADD COLUMN IF NOT EXISTS cost FLOAT",
+    "ALTER TABLE dialogues ADD COLUMN IF NOT EXISTS metrics JSON",
+    "ALTER TABLE dialogues ADD COLUMN IF NOT EXISTS cached_tokens INTEGER",
+]
+
+
 def init_database():
+    from config import PARTITION_MONTHS_AHEAD
+    from partitions import PARTITIONED_TABLES, convert_to_partitioned, maintain_partitions
+
     metadata.create_all(connection)
+    with connection.connect() as conn:
+        for migration in MIGRATIONS:
+            conn.execute(db.text(migration))
+        for table in PARTITIONED_TABLES:
+            convert_to_partitioned(conn, table)
+        conn.commit()
+        maintain_partitions(conn, PARTITION_MONTHS_AHEAD)
@@ -0,0 +1,192 @@
+import gzip
+import math
+import os
+from datetime import date, datetime, timedelta
+
+import sqlalchemy as db
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from log_format import load_dialogues
+from log_metrics import compute_log_metrics
+from models import Dialogue, DialogueRollup
+
+# Monthly range partitions on created_at: <table>_pYYYYMM, plus <table>_default for
+# rows of a month whose partition has not been created yet.
+PARTITIONED_TABLES = {
+    "dialogues": ["conversation_id", "created_at"],
+    "sessions": ["session_id", "created_at"],
+}
+
+
+def _month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _add_months(d: date, months: int) -> date:
+    month = d.month - 1 + months
+    return date(d.year + month // 12, month % 12 + 1, 1)
+
+
+def _partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.strftime('%Y%m')}"
+
+
+def _is_partitioned(conn: db.Connection, table: str) -> bool:
+    return conn.execute(db.text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :table"
+    ), {"table": table}).first() is not None
+
+
+def list_partitions(conn: db.Connection, table: str) -> list[tuple[str, date]]:
+    rows = conn.execute(db.text(
+        """
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :table
+        """
+    ), {"table": table}).fetchall()
+    partitions = []
+    for (name,) in rows:
+        suffix = name[len(table) + 2:]
+        if name.startswith(f"{table}_p") and len(suffix) == 6 and suffix.isdigit():
+            partitions.append((name, date(int(suffix[:4]), int(suffix[4:]), 1)))
+    return sorted(partitions, key=lambda e: e[1])
+
+
+def create_partition(conn: db.Connection, table: str, month: date):
+    conn.execute(db.text(
+        f"CREATE TABLE IF NOT EXISTS {_partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+    ))
+
+
+def convert_to_partitioned(conn: db.Connection, table: str):
+    """Turn a plain table created by ``metadata.create_all`` into a partitioned one, copying its rows."""
+    if _is_partitioned(conn, table):
+        return
+    legacy = f"{table}_legacy"
+    print(f"partitioning {table}")
+    conn.execute(db.text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+    conn.execute(db.text(f"ALTER TABLE {legacy} DROP CONSTRAINT IF EXISTS {table}_pkey"))
+    conn.execute(db.text(
+        f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"))
+    # the primary key of a partitioned table has to contain the partition key
+    conn.execute(db.text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)"))
+    conn.execute(db.text(f"ALTER TABLE {table} ALTER COLUMN created_at SET DEFAULT (now() AT TIME ZONE 'utc')"))
+    conn.execute(db.text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+    for column in PARTITIONED_TABLES[table]:
+        conn.execute(db.text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})"))
+
+    # created_at becomes part of the primary key, hence NOT NULL
+    conn.execute(db.text(f"UPDATE {legacy} SET created_at = now() AT TIME ZONE 'utc' WHERE created_at IS NULL"))
+    bounds = conn.execute(db.text(f"SELECT min(created_at), max(created_at) FROM {legacy}")).first()
+    if bounds[0] is not None:
+        month = _month_start(bounds[0].date())
+        while month <= bounds[1].date():
+            create_partition(conn, table, month)
+            month = _add_months(month, 1)
+    conn.execute(db.text(f"INSERT INTO {table} SELECT * FROM {legacy}"))
+    # keep the serial sequence when the legacy table is dropped
+    conn.execute(db.text(f"ALTER SEQUENCE IF EXISTS {table}_id_seq OWNED BY {table}.id"))
+    conn.execute(db.text(f"DROP TABLE {legacy}"))
+
+
+def ensure_partitions(conn: db.Connection, table: str, months_ahead: int, today: date = None):
+    month = _month_start(today or datetime.utcnow().date())
+    for i in range(months_ahead + 1):
+        create_partition(conn, table, _add_months(month, i))
+
+
+def maintain_partitions(conn: db.Connection, months_ahead: int, today: date = None):
+    for table in PARTITIONED_TABLES:
+        if _is_partitioned(conn, table):
+            ensure_partitions(conn, table, months_ahead, today=today)
+    conn.commit()
+
+
+def _percentile(values: list[float], p: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    # nearest-rank percentile
+    k = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[k]
+
+
+def _row_metrics(conn: db.Connection, rows: list) -> list[dict]:
+    # rows logged before the metric columns existed are aggregated from their calls
+    legacy = [row for row in rows if row.total_tokens is None]
+    computed = [compute_log_metrics(log) for log in load_dialogues(conn, legacy)] if legacy else []
+    return [m for m in (dict(row._mapping) for row in rows) if m["total_tokens"] is not None] + computed
+
+
+def rollup_day(conn: db.Connection, day: date) -> int:
+    """Write per-day and per-intent aggregates of ``dialogues`` into ``dialogue_rollups``."""
+    start = datetime(day.year, day.month, day.day)
+    rows = conn.execute(
+        db.select(Dialogue.c.perf, Dialogue.c.calls, Dialogue.c.calls_compressed, Dialogue.c.log_format,
+                  Dialogue.c.intent, Dialogue.c.duration_ms, Dialogue.c.prompt_tokens,
+                  Dialogue.c.completion_tokens, Dialogue.c.total_tokens).where(
+            Dialogue.c.created_at >= start, Dialogue.c.created_at < start + timedelta(days=1))
+    ).fetchall()
+
+    groups: dict[str, dict] = {}
+    for metrics in _row_metrics(conn, rows):
+        for key in ("__all__", metrics["intent"] or "unknown"):
+            group = groups.setdefault(key, {"dialogues": 0, "latencies": [],
+                                            "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0})
+            group["dialogues"] += 1
+            for k in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                group[k] += metrics[k] or 0
+            if metrics["duration_ms"] is not None:
+                group["latencies"].append(metrics["duration_ms"])
+
+    conn.execute(db.delete(DialogueRollup).where(DialogueRollup.c.day == day))
+    if groups:
+        values = [{
+            "day": day,
+            "intent": intent,
+            "dialogues": group["dialogues"],
+            "prompt_tokens": group["prompt_tokens"],
+            "completion_tokens": group["completion_tokens"],
+            "total_tokens": group["total_tokens"],
+            "latency_p50_ms": _percentile(group["latencies"], 50),
+            "latency_p90_ms": _percentile(group["latencies"], 90),
+            "latency_p99_ms": _percentile(group["latencies"], 99),
+            "updated_at": datetime.utcnow(),
+        } for intent, group in groups.items()]
+        conn.execute(pg_insert(DialogueRollup).values(values))
+    return len(rows)
+
+
+def archive_partition(conn: db.Connection, table: str, name: str, archive_dir: str) -> str:
+    """Detach a partition, dump it to <archive_dir>/<name>.csv.gz and drop it."""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    conn.execute(db.text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+    cursor = conn.connection.cursor()
+    with gzip.open(path, "wb") as file:
+        cursor.copy_expert(f"COPY {name} TO STDOUT WITH CSV HEADER", file)
+    cursor.close()
+    conn.execute(db.text(f"DROP TABLE {name}"))
+    return path
+
+
+def apply_retention(conn: db.Connection, table: str, retention_months: int, archive_dir: str, today: date = None) -> list[str]:
+    if retention_months <= 0:
+        return []
+    cutoff = _add_months(_month_start(today or datetime.utcnow().date()), -retention_months)
+    archived = []
+    for name, month in list_partitions(conn, table):
+        if month >= cutoff:
+            continue
+        if table == "dialogues":
+            # aggregates must survive the raw rows
+            day = month
+            while day < _add_months(month, 1):
+                rollup_day(conn, day)
+                day += timedelta(days=1)
+        archived.append(archive_partition(conn, table, name, archive_dir))
+        conn.commit()
+    return archived
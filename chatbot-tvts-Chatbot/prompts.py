@@ -6,6 +6,11 @@ import json
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Templates start with their static instructions, which never contain a slot, then list
+# their variable parts after MESSAGE_BREAK lines. Each part is sent as its own message, so
+# every request of a template begins with the same bytes and hits the provider's prompt cache.
+MESSAGE_BREAK = "[MESSAGE_BREAK]"
+
 intents = ""
 with open(f"{ROOT_DIR}/intents.json", "r") as file:
     f = json.load(file)
@@ -27,10 +32,10 @@ Do not include any clarifying information or additional text.
 List of intentions:
 <INTENT_NAME>: <DESCRIPTION>
 {intents}
-
+NO YAPPING
+{MESSAGE_BREAK}
 Chat histories:
 [HISTORIES]
-NO YAPPING
     """
 )
 
@@ -43,7 +48,7 @@ SEARCH_QUERY_PROMPT_TEMPLATE = dedent(
 
     Please only output the question that contained the related information and use the sample language of user's input. 
     Do not output anything except for the prompt. Do not add any clarifying information. Output must be in text format and follow the intruction specified above.
-
+    [MESSAGE_BREAK]
     Chat histories:
     [HISTORIES]
     """
@@ -60,7 +65,7 @@ SEARCH_QUERY_BREAKDOWN_PROMPT_TEMPLATE = dedent(
 
     Please only output the question contained the information related to user's input and use the same language of user's input. 
     Do not output anything except for the prompt. Do not add any clarifying information. Output must be in text format and follow the intruction specified above.
-
+    [MESSAGE_BREAK]
     Chat histories:
     [HISTORIES]
     """
@@ -112,15 +117,16 @@ RANKING_DOCS_USER_PROMPT_TEMPLATE = dedent(
 ANSWER_PROMPT_TEMPLATE = dedent(
     """
     You are an admissions consultant for the Vietnam National University Ho Chi Minh City.
-    The following information is provided:
+    The context and the chat histories are provided in the following messages.
+
+    Please answer the user's question using the information available in the provided context. If the context lacks sufficient information, make a reasonable attempt to address the query based on relevant knowledge or logical inference. If no suitable answer can be provided, state: "Dữ liệu về chưa được cung cấp, tuy nhiên yêu cầu của bạn đã được ghi nhận."
+    Keep responses clear and concise.
+    [MESSAGE_BREAK]
     Context:
     [DOCS]
-    
+    [MESSAGE_BREAK]
     Chat histories:
     [HISTORIES]
-
-    Please answer the user's question using the information available in the provided context. If the context lacks sufficient information, make a reasonable attempt to address the query based on relevant knowledge or logical inference. If no suitable answer can be provided, state: "Dữ liệu về chưa được cung cấp, tuy nhiên yêu cầu của bạn đã được ghi nhận."
-    Keep responses clear and concise.
     """
 )
 
@@ -135,13 +141,14 @@ FOLLOWUP_QUESTIONS_PROMPT_TEMPLATE = dedent(
     Please only output follow-up questions that contained all related information and will be asked by the user.
     Do not output anything except for three follow-up questions. Do not add any clarifying information. Output must be in text format and follow the intruction specified above.
     NO YAPPING
-
+    [MESSAGE_BREAK]
+    Chat histories:
+    [HISTORIES]
+    [MESSAGE_BREAK]
     User's input:
     [SEARCH_TERM]
     Answer:
     [ANSWER]
-    Chat histories:
-    [HISTORIES]
     """
 )
 
@@ -149,19 +156,91 @@ FOLLOWUP_QUESTIONS_PROMPT_TEMPLATE = dedent(
 GENERATE_QUESTIONS_PROMPT_TEMPLATE = dedent(
     """
     Your goal is to generate [NUMBER_QUESTIONS] questions that contain all the information of the content below: 
-    Content: [CONTENT]
-    
     all questions must be warpped into tags: <QUESTIONS></QUESTIONS>
     Please use the same langauge as content.
     NO YAPPING
+    [MESSAGE_BREAK]
+    Content: [CONTENT]
     """
 )
 
 CHECKING_ANSWER_PROMPT_TEMPLATE = dedent("""
     Your goal is to check the answer related to the content and question below:
-    Content: [CONTENT]
-    Question: [QUESTION]
     Please answer YES if it is related to both content and question, otherwise answer NO and the answer must be warpped into tags: <RELATED></RELATED>
     NO YAPPING
+    [MESSAGE_BREAK]
+    Content: [CONTENT]
+    Question: [QUESTION]
     """
                                          )
+
+CONVERSATION_SUMMARY_PROMPT_TEMPLATE = dedent(
+    """
+    Your goal is to maintain a running summary of a conversation between a user and an admission consulting chatbot.
+    Merge the current summary with the new messages below into ONE updated summary of at most [MAX_WORDS] words.
+    Keep what the user asked for, facts about the user (major, scores, location...), and the key facts, numbers and dates given in the answers.
+    Drop greetings and repeated information. Write in the same language as the conversation.
+    Output the summary only, warpped between tags: <SUMMARY></SUMMARY>
+    NO YAPPING
+    [MESSAGE_BREAK]
+    Current summary:
+    [SUMMARY]
+    [MESSAGE_BREAK]
+    New messages:
+    [HISTORIES]
+    """
+)
+
+PROMPT_TEMPLATES = {
+    "INTENT_PROMPT_TEMPLATE": INTENT_PROMPT_TEMPLATE,
+    "SEARCH_QUERY_PROMPT_TEMPLATE": SEARCH_QUERY_PROMPT_TEMPLATE,
+    "SEARCH_QUERY_BREAKDOWN_PROMPT_TEMPLATE": SEARCH_QUERY_BREAKDOWN_PROMPT_TEMPLATE,
+    "RANKING_DOCS_SYSTEM_PROMPT_TEMPLATE": RANKING_DOCS_SYSTEM_PROMPT_TEMPLATE,
+    "RANKING_DOCS_USER_PROMPT_TEMPLATE": RANKING_DOCS_USER_PROMPT_TEMPLATE,
+    "ANSWER_PROMPT_TEMPLATE": ANSWER_PROMPT_TEMPLATE,
+    "FOLLOWUP_QUESTIONS_PROMPT_TEMPLATE": FOLLOWUP_QUESTIONS_PROMPT_TEMPLATE,
+    "GENERATE_QUESTIONS_PROMPT_TEMPLATE": GENERATE_QUESTIONS_PROMPT_TEMPLATE,
+    "CHECKING_ANSWER_PROMPT_TEMPLATE": CHECKING_ANSWER_PROMPT_TEMPLATE,
+    "CONVERSATION_SUMMARY_PROMPT_TEMPLATE": CONVERSATION_SUMMARY_PROMPT_TEMPLATE,
+}
+
+
+def _format_ranking_chunks(docs: list[str]) -> str:
+    return json.dumps([{"chunk_id": f"id_{i}", "text": doc} for i, doc in enumerate(docs)])
+
+
+# List-valued slots are joined by line unless the template needs another layout
+SLOT_FORMATTERS = {
+    ("RANKING_DOCS_USER_PROMPT_TEMPLATE", "DOCS"): _format_ranking_chunks,
+}
+
+
+class RenderedPrompt(str):
+    """A prompt string that remembers the template and slot values it was rendered from.
+
+    ``messages`` are its MESSAGE_BREAK separated parts, the static instructions first.
+    """
+
+    def __new__(cls, text: str, template_id: str, slots: dict, messages: list[str] = None):
+        prompt = super().__new__(cls, text)
+        prompt.template_id = template_id
+        prompt.slots = slots
+        prompt.messages = messages if messages is not None else [text]
+        return prompt
+
+
+def _render_template(template_id: str, template: str, slots: dict) -> str:
+    text = template
+    for name, value in slots.items():
+        if isinstance(value, list):
+            value = SLOT_FORMATTERS.get((template_id, name), "\n".join)(value)
+        text = text.replace(f"[{name}]", str(value))
+    return text.replace(MESSAGE_BREAK, "")
+
+
+def render_prompt(template_id: str, **slots) -> RenderedPrompt:
+    template = PROMPT_TEMPLATES[template_id]
+    text = _render_template(template_id, template, slots)
+    messages = [_render_template(template_id, part, slots).strip()
+                for part in template.split(MESSAGE_BREAK)]
+    return RenderedPrompt(text, template_id, slots, [message for message in messages if message])
@@ -0,0 +1,179 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Executor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import Enum
+from typing import Awaitable, Callable, Optional, TypeVar, TypedDict
+
+T = TypeVar('T')
+
+# Bounds on how long a request waits for its dependencies: a deadline per request, a
+# timeout per pipeline stage (capped by what is left of the deadline) and a circuit breaker
+# per dependency so that an outage fails fast instead of holding worker threads.
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class Deadline:
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def budget(self, stage_timeout: float) -> float:
+        """Seconds a stage may take: its own timeout, at most what is left of the request."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.seconds}s exceeded")
+        return min(stage_timeout, remaining)
+
+
+# Timeout of the dependency calls made by the command being executed, set by the controller
+_call_timeout: ContextVar[Optional[float]] = ContextVar("call_timeout", default=None)
+
+
+@contextmanager
+def call_timeout(seconds: Optional[float]):
+    token = _call_timeout.set(seconds)
+    try:
+        yield
+    finally:
+        _call_timeout.reset(token)
+
+
+def current_call_timeout(default: float) -> float:
+    timeout = _call_timeout.get()
+    return default if timeout is None else min(timeout, default)
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"  # calls rejected until reset_timeout has passed
+    HALF_OPEN = "half_open"  # one trial call decides
+
+
+class CircuitStatusTypeDict(TypedDict):
+    state: str
+    failures: int
+    opened_at: Optional[float]
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures of ``failure_types``."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float,
+                 failure_types: tuple[type[BaseException], ...] = (Exception,)):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_types = failure_types
+        self._lock = threading.Lock()
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return CircuitState.HALF_OPEN
+            return self._state
+
+    def _before_call(self):
+        with self._lock:
+            if self._state == CircuitState.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError(f"{self.name} circuit is open")
+                self._state = CircuitState.HALF_OPEN
+            if self._state == CircuitState.HALF_OPEN:
+                if self._trial_running:
+                    raise CircuitOpenError(f"{self.name} circuit is half open")
+                self._trial_running = True
+
+    def _after_call(self, error: Optional[BaseException]):
+        with self._lock:
+            self._trial_running = False
+            if error is None or not isinstance(error, self.failure_types):
+                self._state = CircuitState.CLOSED
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._state == CircuitState.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = CircuitState.OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        self._before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._after_call(e)
+            raise
+        self._after_call(None)
+        return result
+
+    async def call_async(self, fn: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        self._before_call()
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            self._after_call(e)
+            raise
+        self._after_call(None)
+        return result
+
+    def status(self) -> CircuitStatusTypeDict:
+        return {"state": self.state.value, "failures": self._failures, "opened_at": self._opened_at}
+
+
+BREAKERS: dict[str, CircuitBreaker] = {}
+
+
+def register_breaker(name: str, failure_threshold: int, reset_timeout: float,
+                     failure_types: tuple[type[BaseException], ...] = (Exception,)) -> CircuitBreaker:
+    breaker = CircuitBreaker(name, failure_threshold, reset_timeout, failure_types)
+    BREAKERS[name] = breaker
+    return breaker
+
+
+def breakers_status() -> dict[str, CircuitStatusTypeDict]:
+    return {name: breaker.status() for name, breaker in BREAKERS.items()}
+
+
+def run_with_timeout(executor: Executor, timeout: float, fn: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking call that has no timeout of its own on a bounded pool.
+
+    The caller gets its thread back after ``timeout``; a stalled call keeps one pool thread,
+    and when the pool is full later calls wait in its queue and time out the same way.
+    """
+    future = executor.submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise TimeoutError(f"{getattr(fn, '__name__', fn)} did not finish in {timeout:.1f}s")
+
+
+async def wait_with_timeout(awaitable: Awaitable[T], timeout: Optional[float]) -> T:
+    if timeout is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"did not finish in {timeout:.1f}s")
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Generic, Optional, TypeVar, TypedDict
+
+T = TypeVar('T')
+
+
+class ResourceStatusTypeDict(TypedDict):
+    ready: bool
+    duration_ms: Optional[float]
+    error: Optional[str]
+
+
+class LazyResource(Generic[T]):
+    """A dependency created on first use, at most once per process, safe to share between threads.
+
+    Attribute access is forwarded to the created object, so a module level
+    ``generation_instance = LazyResource(...)`` is used exactly like the instance itself.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self._name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value: Optional[T] = None
+        self._ready = False
+        self._duration_ms: Optional[float] = None
+        self._error: Optional[str] = None
+
+    def get(self) -> T:
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                start = time.perf_counter()
+                try:
+                    self._value = self._factory()
+                except Exception as e:
+                    self._error = f"{e.__class__.__name__}: {e}"
+                    raise
+                finally:
+                    self._duration_ms = (time.perf_counter() - start) * 1000
+                self._error = None
+                self._ready = True
+        return self._value
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def status(self) -> ResourceStatusTypeDict:
+        return {"ready": self._ready, "duration_ms": self._duration_ms, "error": self._error}
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __repr__(self) -> str:
+        return f"LazyResource({self._name}, ready={self._ready})"
+
+
+# Registered in dependency order, warmup creates them in this order
+RESOURCES: dict[str, LazyResource] = {}
+
+_warmup_lock = threading.Lock()
+_warmup_thread: Optional[threading.Thread] = None
+_warmup = {"started_at": None, "finished_at": None, "duration_ms": None}
+
+
+def register(name: str, factory: Callable[[], T]) -> LazyResource[T]:
+    resource = LazyResource(name, factory)
+    RESOURCES[name] = resource
+    return resource
+
+
+def warmup() -> dict[str, ResourceStatusTypeDict]:
+    """Create every registered resource now instead of on the first request."""
+    _warmup["started_at"] = time.time()
+    start = time.perf_counter()
+    for name, resource in RESOURCES.items():
+        try:
+            resource.get()
+        except Exception as e:
+            print(f"Warmup of {name} failed: {e}")
+    _warmup["finished_at"] = time.time()
+    _warmup["duration_ms"] = (time.perf_counter() - start) * 1000
+    return readiness()["resources"]
+
+
+async def ensure_created_async():
+    """Create the missing resources on a worker thread, so that the event loop never blocks on one."""
+    for name, resource in RESOURCES.items():
+        if resource.ready:
+            continue
+        try:
+            await asyncio.to_thread(resource.get)
+        except Exception as e:
+            # created again on use, where the failure is handled by the caller
+            print(f"Creation of {name} failed: {e}")
+
+
+def start_warmup() -> threading.Thread:
+    """Run ``warmup`` in a daemon thread once per process; failed resources are retried on use."""
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(
+                target=warmup, name="warmup", daemon=True)
+            _warmup_thread.start()
+    return _warmup_thread
+
+
+def readiness() -> dict:
+    resources = {name: resource.status() for name, resource in RESOURCES.items()}
+    return {
+        "ready": all(status["ready"] for status in resources.values()),
+        "warmup": dict(_warmup),
+        "resources": resources,
+    }
@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, TypedDict
+
+import chromadb
+
+from utils import _normalize_text
+
+# Chroma results of single search terms, shared by every request of the process. Entries
+# are stamped with the version of their collection (its count plus the change token KMS
+# writes in the collection metadata), polled at most every ``poll_interval`` seconds; when
+# the version changes every entry of the collection is dropped. A query only sends (and
+# embeds) the terms that missed.
+
+VERSION_METADATA_KEY = "kms_version"
+
+# keys of a query result that hold one list per query text
+_PER_QUERY_KEYS = ("ids", "embeddings", "documents", "uris", "data", "metadatas", "distances")
+
+
+class RetrievalCacheStatsTypeDict(TypedDict):
+    entries: int
+    hits: int
+    misses: int
+    hit_rate: Optional[float]
+    invalidations: int
+    versions: dict[str, str]
+
+
+def collection_version(count: int, metadata: Optional[dict]) -> str:
+    return f"{count}:{(metadata or {}).get(VERSION_METADATA_KEY, 0)}"
+
+
+def _split(result: chromadb.QueryResult, i: int) -> dict:
+    return {key: (value[i] if key in _PER_QUERY_KEYS and value is not None else value)
+            for key, value in result.items()}
+
+
+def _merge(entries: list[dict]) -> chromadb.QueryResult:
+    merged = {}
+    for key, value in entries[0].items():
+        if key in _PER_QUERY_KEYS and value is not None:
+            merged[key] = [entry[key] for entry in entries]
+        else:
+            merged[key] = value
+    return merged
+
+
+class RetrievalCache:
+
+    def __init__(self, max_entries: int, poll_interval: float):
+        self.max_entries = max_entries
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple[str, dict]] = OrderedDict()
+        # collection name -> (version, polled at)
+        self._versions: dict[str, tuple[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def current_version(self, name: str) -> Optional[str]:
+        """Version of the collection if it was polled recently enough, else None (poll it)."""
+        with self._lock:
+            version = self._versions.get(name)
+            if version is None or time.monotonic() - version[1] >= self.poll_interval:
+                return None
+            return version[0]
+
+    def set_version(self, name: str, version: str):
+        with self._lock:
+            previous = self._versions.get(name)
+            self._versions[name] = (version, time.monotonic())
+            if previous is not None and previous[0] != version:
+                stale = [key for key in self._entries if key[0] == name]
+                for key in stale:
+                    del self._entries[key]
+                self.invalidations += 1
+
+    def version(self, name: str, poll: Callable[[], str]) -> str:
+        version = self.current_version(name)
+        if version is None:
+            version = poll()
+            self.set_version(name, version)
+        return version
+
+    def _key(self, name: str, term: str, n_results: int) -> tuple[str, str, int]:
+        return name, _normalize_text(term), n_results
+
+    def get_many(self, name: str, version: str, terms: list[str], n_results: int) -> dict[int, dict]:
+        """Cached results of ``terms`` by index in ``terms``."""
+        found = {}
+        with self._lock:
+            for i, term in enumerate(terms):
+                key = self._key(name, term, n_results)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == version:
+                    self._entries.move_to_end(key)
+                    found[i] = entry[1]
+            self.hits += len(found)
+            self.misses += len(terms) - len(found)
+        return found
+
+    def put_many(self, name: str, version: str, terms: list[str], n_results: int, result: chromadb.QueryResult):
+        with self._lock:
+            if self._versions.get(name, (version,))[0] != version:
+                # the collection changed while querying
+                return
+            for i, term in enumerate(terms):
+                key = self._key(name, term, n_results)
+                self._entries[key] = (version, _split(result, i))
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def query(self, name: str, version: str, terms: list[str], n_results: int,
+              query: Callable[[list[str]], chromadb.QueryResult]) -> chromadb.QueryResult:
+        """Result of ``terms`` as one multi-query result, ``query`` runs for the missed terms only."""
+        if not self.enabled or not terms:
+            return query(terms)
+        found = self.get_many(name, version, terms, n_results)
+        missing = [term for i, term in enumerate(terms) if i not in found]
+        result = query(missing) if missing else None
+        return self._assemble(name, version, terms, n_results, found, missing, result)
+
+    async def query_async(self, name: str, version: str, terms: list[str], n_results: int,
+                          query: Callable[[list[str]], Awaitable[chromadb.QueryResult]]) -> chromadb.QueryResult:
+        if not self.enabled or not terms:
+            return await query(terms)
+        found = self.get_many(name, version, terms, n_results)
+        missing = [term for i, term in enumerate(terms) if i not in found]
+        result = await query(missing) if missing else None
+        return self._assemble(name, version, terms, n_results, found, missing, result)
+
+    def _assemble(self, name: str, version: str, terms: list[str], n_results: int, found: dict[int, dict],
+                  missing: list[str], result: Optional[chromadb.QueryResult]) -> chromadb.QueryResult:
+        if missing:
+            self.put_many(name, version, missing, n_results, result)
+            missed = iter(range(len(missing)))
+            for i in range(len(terms)):
+                if i not in found:
+                    found[i] = _split(result, next(missed))
+        return _merge([found[i] for i in range(len(terms))])
+
+    def stats(self) -> RetrievalCacheStatsTypeDict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "invalidations": self.invalidations,
+                "versions": {name: version for name, (version, _) in self._versions.items()},
+            }
@@ -0,0 +1,56 @@
+from enum import Enum
+from typing import TypedDict
+
+import chromadb
+
+# Decides, from the Chroma distances of the first search, how much work the rest of the
+# pipeline does: answer from the dominating chunks directly, rank with the LLM as usual,
+# or search again with more results first.
+
+
+class RetrievalBranch(str, Enum):
+    CONFIDENT = "confident"  # LLM ranking skipped
+    RANKING = "ranking"
+    WIDEN = "widen"  # weak retrieval, searched again with more results then ranked
+
+
+class RetrievalDecisionTypeDict(TypedDict):
+    branch: str
+    top_distance: float | None
+    gap: float | None
+    documents: list[str]
+
+
+def rank_by_distance(nodes: chromadb.QueryResult) -> list[tuple[str, float]]:
+    """Unique documents of a multi-query result with their best distance, closest first."""
+    best: dict[str, float] = {}
+    for documents, distances in zip(nodes.get("documents") or [], nodes.get("distances") or []):
+        for document, distance in zip(documents or [], distances or []):
+            if document not in best or distance < best[document]:
+                best[document] = distance
+    return sorted(best.items(), key=lambda e: e[1])
+
+
+def decide_retrieval(
+    nodes: chromadb.QueryResult,
+    confident_distance: float,
+    min_gap: float,
+    weak_distance: float,
+    top_k: int,
+) -> RetrievalDecisionTypeDict:
+    ranked = rank_by_distance(nodes)
+    if not ranked:
+        return {"branch": RetrievalBranch.WIDEN.value, "top_distance": None, "gap": None, "documents": []}
+
+    top_distance = ranked[0][1]
+    gap = ranked[1][1] - top_distance if len(ranked) > 1 else None
+    if top_distance <= confident_distance and (gap is None or gap >= min_gap):
+        branch = RetrievalBranch.CONFIDENT
+        documents = [document for document, _ in ranked[:top_k]]
+    elif top_distance > weak_distance:
+        branch = RetrievalBranch.WIDEN
+        documents = []
+    else:
+        branch = RetrievalBranch.RANKING
+        documents = []
+    return {"branch": branch.value, "top_distance": top_distance, "gap": gap, "documents": documents}
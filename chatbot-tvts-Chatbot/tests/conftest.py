@@ -0,0 +1,43 @@
+import os
+import sys
+import uuid
+
+import pytest
+import sqlalchemy as db
+
+# modules of the agent are imported from the project root, as in the Dockerfiles
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py reads these at import time; tests never reach the real services
+for name, value in {
+    "OPENAI_API_KEY": "test",
+    "MODEL": "gpt-4o-mini",
+    "DB_USER": "postgres",
+    "DB_PASSWORD": "postgres",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_CHATNAME": "chatbot",
+    "CHROMA_HOST": "localhost",
+    "CHROMA_PORT": "8000",
+    "CHROMA_DB": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+
+@pytest.fixture
+def pg_engine():
+    """Engine on a throwaway schema of TEST_DATABASE_URL; database tests are skipped without it."""
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = db.create_engine(url)
+    with admin.begin() as conn:
+        conn.execute(db.text(f"CREATE SCHEMA {schema}"))
+    engine = db.create_engine(url, connect_args={"options": f"-csearch_path={schema}"})
+    yield engine
+    engine.dispose()
+    with admin.begin() as conn:
+        conn.execute(db.text(f"DROP SCHEMA {schema} CASCADE"))
+    admin.dispose()
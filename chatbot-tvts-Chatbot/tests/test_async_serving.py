@@ -0,0 +1,78 @@
+import asyncio
+import threading
+
+import foundation
+import resources
+from foundation import IntentCommand, KnowledgeBase
+
+
+class FakeAsyncCollection:
+    pass
+
+
+def test_concurrent_requests_create_one_async_chroma_client(monkeypatch):
+    created = []
+
+    class FakeAsyncClient:
+        async def get_collection(self, name):
+            await asyncio.sleep(0.01)
+            return FakeAsyncCollection()
+
+    async def async_http_client(**kwargs):
+        created.append(kwargs)
+        await asyncio.sleep(0.01)
+        return FakeAsyncClient()
+
+    monkeypatch.setattr(foundation.chromadb, "AsyncHttpClient", async_http_client)
+    knowledge_base = KnowledgeBase.__new__(KnowledgeBase)
+    knowledge_base.async_client = None
+    knowledge_base.async_collection = None
+    knowledge_base.async_collection_lock = asyncio.Lock()
+
+    async def first_requests():
+        return await asyncio.gather(*[knowledge_base._get_async_collection() for _ in range(10)])
+
+    collections = asyncio.run(first_requests())
+
+    assert len(created) == 1
+    assert all(collection is collections[0] for collection in collections)
+
+
+def test_local_intent_runs_off_the_event_loop(monkeypatch):
+    threads = {}
+
+    class FakeGeneration:
+        def local_intent(self, question, histories):
+            threads["classifier"] = threading.current_thread()
+            return {"intent_name": "tuition", "rephrased_intent": "Học phí", "confidence": 0.99, "version": "1"}
+
+    def payload(self, intent):
+        threads["payload"] = threading.current_thread()
+        return {"ID": intent}
+
+    monkeypatch.setattr(foundation, "generation_instance", FakeGeneration())
+    monkeypatch.setattr(IntentCommand, "_get_payload_intent", payload)
+
+    async def classify():
+        threads["loop"] = threading.current_thread()
+        return await IntentCommand(question="học phí", histories=[]).execute_async()
+
+    result = asyncio.run(classify())
+
+    assert result["intent_payload"] == {"ID": "tuition"}
+    assert threads["classifier"] is not threads["loop"] and threads["payload"] is not threads["loop"]
+
+
+def test_missing_resources_are_created_on_a_worker_thread(monkeypatch):
+    monkeypatch.setattr(resources, "RESOURCES", {})
+    threads = []
+    created = resources.register("generation", lambda: threads.append(threading.current_thread()) or object())
+    resources.register("broken", lambda: 1 / 0)
+
+    async def serve():
+        await resources.ensure_created_async()
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(serve())
+
+    assert created.ready and threads[0] is not loop_thread
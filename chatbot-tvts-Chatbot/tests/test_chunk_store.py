@@ -0,0 +1,88 @@
+from ChatbotTester import bot as tester
+from ChatbotTester.bot import ChatEvaluation
+from chunk_store import ChunkStore, iter_pages
+
+
+class FakeCollection:
+    def __init__(self, n):
+        self.chunks = {f"c{i}": f"content {i}" for i in range(n)}
+        self.gets = []
+
+    def get(self, ids=None, limit=None, offset=None, include=None, where=None):
+        self.gets.append({"ids": ids, "limit": limit, "offset": offset})
+        if ids is not None:
+            found = [id for id in ids if id in self.chunks]
+        else:
+            found = list(self.chunks)[offset:offset + limit]
+        return {"ids": found, "documents": [self.chunks[id] for id in found],
+                "metadatas": [{"source": id} for id in found]}
+
+
+def test_get_many_fetches_every_missing_id_in_one_request():
+    collection = FakeCollection(5)
+    store = ChunkStore(collection, cache_size=10)
+
+    chunks = store.get_many(["c3", "missing", "c1", "c3"])
+
+    assert [chunk["id"] for chunk in chunks] == ["c3", "c1", "c3"]
+    assert collection.gets == [{"ids": ["c3", "missing", "c1"], "limit": None, "offset": None}]
+
+
+def test_cached_chunks_are_not_fetched_again():
+    collection = FakeCollection(5)
+    store = ChunkStore(collection, cache_size=10)
+    store.get_many(["c1", "c2"])
+
+    assert store.get("c1")["document"] == "content 1"
+    store.get_many(["c1", "c4"])
+
+    assert [get["ids"] for get in collection.gets] == [["c1", "c2"], ["c4"]]
+
+
+def test_a_new_collection_version_clears_the_cache():
+    collection = FakeCollection(5)
+    version = ["1:a"]
+    store = ChunkStore(collection, cache_size=10, version=lambda: version[0])
+    store.get("c1")
+    store.get("c1")
+    version[0] = "1:b"
+    store.get("c1")
+
+    assert [get["ids"] for get in collection.gets] == [["c1"], ["c1"]]
+
+
+def test_iter_pages_stops_on_a_short_page():
+    collection = FakeCollection(5)
+
+    pages = list(iter_pages(collection, page_size=2))
+
+    assert [page["ids"] for page in pages] == [["c0", "c1"], ["c2", "c3"], ["c4"]]
+    assert len(collection.gets) == 3
+
+
+def test_ask_many_prefetches_each_batch_in_one_command(monkeypatch):
+    prefetched, asked = [], []
+
+    class FakeController:
+        def executeCommand(self, command):
+            prefetched.append(list(command.chunk_ids))
+
+    def ask(self, session_id, chunk_id, **kwargs):
+        asked.append((len(prefetched), chunk_id))
+        yield tester.ChatCommand.FOUND_DOCUMENT.name, chunk_id
+        return chunk_id
+
+    monkeypatch.setattr(tester, "ChatbotController", FakeController)
+    monkeypatch.setattr(ChatEvaluation, "ask", ask)
+    run = ChatEvaluation().ask_many("", ["c0", "c1", "c2"], batch_size=2)
+    events = []
+    try:
+        while True:
+            events.append(next(run))
+    except StopIteration as stop:
+        responses = stop.value
+
+    assert prefetched == [["c0", "c1"], ["c2"]]
+    assert asked == [(1, "c0"), (1, "c1"), (2, "c2")]
+    assert responses == ["c0", "c1", "c2"]
+    assert len(events) == 3
@@ -0,0 +1,49 @@
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import sqlalchemy as db
+
+from conversation_memory import SUMMARY_ROLE, ConversationMemory, load_histories, update_summary
+from models import RoleEnum, Session, metadata
+
+
+def test_updates_beyond_max_pending_are_dropped():
+    release = threading.Event()
+    memory = ConversationMemory(None, None, recent_messages=2, max_pending=2)
+    # the summary thread is busy with another session
+    memory._executor.submit(release.wait)
+
+    scheduled = [memory.schedule_update(session_id) for session_id in ("a", "a", "b", "c")]
+
+    assert scheduled == [True, False, True, False]
+    assert memory.dropped == 1
+    release.set()
+    memory._executor.shutdown(wait=True)
+
+
+def test_older_turns_are_folded_into_one_summary(pg_engine):
+    metadata.create_all(pg_engine)
+    session_id = uuid.uuid4()
+    start = datetime(2026, 1, 1)
+    with pg_engine.connect() as conn:
+        conn.execute(db.insert(Session), [
+            {"session_id": session_id, "role": RoleEnum.user if i % 2 == 0 else RoleEnum.system,
+             "content": f"message {i}", "created_at": start + timedelta(minutes=i)} for i in range(6)])
+        conn.commit()
+        calls = []
+
+        def summarize(summary, messages):
+            calls.append((summary, [m["content"] for m in messages]))
+            return f"{summary}+{len(messages)}", {"usage": {"prompt_tokens": 10, "completion_tokens": 2}}
+
+        assert update_summary(conn, session_id, summarize, recent_messages=2)
+        assert not update_summary(conn, session_id, summarize, recent_messages=2)
+
+        assert calls == [("", ["message 0", "message 1", "message 2", "message 3"])]
+        histories = load_histories(conn, str(session_id), num=10)
+        assert histories == [
+            {"role": SUMMARY_ROLE, "content": "+4"},
+            {"role": "user", "content": "message 4"},
+            {"role": "system", "content": "message 5"},
+        ]
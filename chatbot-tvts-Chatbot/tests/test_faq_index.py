@@ -0,0 +1,82 @@
+from faq_index import FaqIndex, _parse_faq_pairs
+from utils import _normalize_text
+
+
+def _words(text):
+    return set(_normalize_text(text).split())
+
+
+class FakeCollection:
+    """Questions of one chunk collection, with word overlap as the cosine distance."""
+
+    def __init__(self):
+        self.metadatas = {}
+        self.queries = 0
+        self.gets = 0
+
+    def upsert(self, ids, documents, metadatas):
+        self.metadatas.update(zip(ids, metadatas))
+
+    def query(self, query_texts, n_results):
+        self.queries += 1
+        words = _words(query_texts[0])
+        scored = sorted(
+            (1 - len(words & _words(m["question"])) / len(words | _words(m["question"])), id)
+            for id, m in self.metadatas.items())[:n_results]
+        return {"ids": [[id for _, id in scored]],
+                "distances": [[distance for distance, _ in scored]],
+                "metadatas": [[self.metadatas[id] for _, id in scored]]}
+
+    def get(self, where, include=None):
+        self.gets += 1
+        ((key, value),) = where.items()
+        ids = [id for id, m in self.metadatas.items() if m[key] == value]
+        return {"ids": ids, "metadatas": [self.metadatas[id] for id in ids]}
+
+
+class FakeClient:
+    def __init__(self):
+        self.collection = FakeCollection()
+
+    def get_or_create_collection(self, **kwargs):
+        return self.collection
+
+
+def _index():
+    index = FaqIndex(FakeClient(), None, "faq", min_similarity=0.6)
+    index.upsert([
+        {"question": "Học phí năm nay là bao nhiêu?", "answer": "10 triệu", "chunk_id": "c1", "source": "revised_chunk"},
+        {"question": "Đóng học phí ở đâu?", "answer": "Phòng tài vụ", "chunk_id": "c1", "source": "revised_chunk"},
+        {"question": "Khi nào nhập học?", "answer": "Tháng 9", "chunk_id": "c2", "source": "revised_chunk"},
+    ])
+    return index
+
+
+def test_parse_faq_pairs_reads_multiline_answers():
+    pairs = _parse_faq_pairs("Q1: Học phí?\nA1: 10 triệu\nmỗi năm\n- Hỏi: Ở đâu?\nTrả lời: Tài vụ")
+
+    assert pairs == [("Học phí?", "10 triệu\nmỗi năm"), ("Ở đâu?", "Tài vụ")]
+
+
+def test_lookup_exact_question_in_one_query():
+    index = _index()
+
+    match = index.lookup("học phí năm nay là bao nhiêu")
+
+    assert match["exact"] and match["similarity"] == 1.0
+    assert match["chunk_id"] == "c1"
+    assert (index.collection.queries, index.collection.gets) == (1, 0)
+
+
+def test_lookup_rejects_distant_questions():
+    index = _index()
+
+    assert index.lookup("Học phí bao nhiêu?") is None
+    assert index.lookup("Học phí bao nhiêu?", min_similarity=0.3)["chunk_id"] == "c1"
+
+
+def test_siblings_skip_the_asked_questions():
+    index = _index()
+
+    assert index.siblings("c1", exclude=["học phí năm nay là bao nhiêu"]) == ["Đóng học phí ở đâu?"]
+    assert len(index.siblings("c1")) == 2
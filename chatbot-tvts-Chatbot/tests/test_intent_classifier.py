@@ -0,0 +1,51 @@
+import json
+
+from intent_classifier import IntentClassifier, classifier_input, extract_training_samples
+
+INTENTS = {
+    "tuition": {"REPHRASE": "Học phí: {question}"},
+    "admission": {"REPHRASE": "Tuyển sinh: {question}"},
+}
+
+
+def _call(question, intent_name, histories="", source=None):
+    rets = {"intent": json.dumps({"INTENT_NAME": intent_name})}
+    if source:
+        rets["classifier"] = {"source": source}
+    return {"call_name": "IntentCommand", "args": {"question": question, "histories": histories}, "rets": rets}
+
+
+def test_training_samples_carry_the_previous_user_question():
+    histories = "\nuser: học phí ngành CNTT\n\nsystem: 10 triệu\nmỗi năm\n"
+    calls = [[
+        _call("còn ngành khác thì sao", "tuition", histories),
+        _call("ngày nhập học", "admission", source="local"),
+        _call("xin chào", "greeting"),
+    ]]
+
+    samples = extract_training_samples(calls, INTENTS, context_turns=1)
+
+    assert samples == [("còn ngành khác thì sao\nhọc phí ngành CNTT", "tuition")]
+    assert extract_training_samples(calls, INTENTS) == [("còn ngành khác thì sao", "tuition")]
+
+
+def test_classifier_input_keeps_the_last_turns():
+    assert classifier_input("q", ["a", "b", "c"], 2) == "q\nb\nc"
+    assert classifier_input("q", ["a"], 0) == "q"
+
+
+def test_prediction_reads_the_recent_questions():
+    samples = []
+    for _ in range(6):
+        samples += [
+            ("còn ngành khác thì sao\nhọc phí ngành CNTT", "tuition"),
+            ("học phí bao nhiêu", "tuition"),
+            ("còn ngành khác thì sao\nlịch nhập học ngành CNTT", "admission"),
+            ("lịch nhập học", "admission"),
+        ]
+    classifier, stats = IntentClassifier.train(samples, INTENTS, min_samples=5, context_turns=1)
+    classifier.min_confidence = 0.5
+
+    assert stats == {"admission": 12, "tuition": 12}
+    assert classifier.predict("còn ngành khác thì sao", ["lịch nhập học ngành CNTT"])["intent_name"] == "admission"
+    assert classifier.predict("còn ngành khác thì sao", ["học phí ngành CNTT"])["intent_name"] == "tuition"
@@ -0,0 +1,52 @@
+from log_format import LOG_FORMAT_COMPACT, CompactLogBuilder, _collect_refs, _decode_calls, _encode_calls, _rehydrate
+from prompts import render_prompt
+
+DOCUMENT = "Học phí năm học 2026 của ngành Công nghệ thông tin là 10 triệu đồng. " * 5
+
+
+def _calls():
+    prompt = render_prompt("ANSWER_PROMPT_TEMPLATE", DOCS=[DOCUMENT], HISTORIES="", QUERY="Học phí?")
+    return [
+        {"call_name": "SearchDocsCommand", "args": {"question": "Học phí?"},
+         "rets": {"nodes": {"ids": [["c1"]], "documents": [[DOCUMENT]], "distances": [[0.1]],
+                            "metadatas": [[{"source": "a.pdf"}]]}}},
+        {"call_name": "AnswerCommand", "args": {"docs": [DOCUMENT]},
+         "rets": {"prompt": prompt, "completion": {"model": "gpt-4o-mini", "usage": {"prompt_tokens": 10},
+                                                   "choices": [{"message": {"content": "10 triệu"}}]}}},
+    ], prompt
+
+
+def _round_trip(compact_calls, builder):
+    documents = {h: row["content"] for h, row in builder.documents.items()}
+    templates = {h: (row["template_id"], row["content"]) for h, row in builder.templates.items()}
+    return _rehydrate(compact_calls, documents, templates)
+
+
+def test_compact_calls_reference_documents_once_and_round_trip():
+    calls, prompt = _calls()
+    builder = CompactLogBuilder(min_ref_length=100)
+
+    compact = builder.compact_calls(calls)
+
+    assert list(builder.documents.values())[0]["chunk_id"] == "c1"
+    assert len(builder.documents) == 1 and len(builder.templates) == 1
+    assert compact[1]["rets"]["completion"] == {"model": "gpt-4o-mini", "usage": {"prompt_tokens": 10}}
+    assert compact[0]["rets"]["nodes"]["metadatas"] is None
+    documents, templates = set(), set()
+    _collect_refs(compact, documents, templates)
+    assert documents == set(builder.documents) and templates == set(builder.templates)
+
+    rehydrated = _round_trip(compact, builder)
+    assert rehydrated[1]["rets"]["prompt"] == str(prompt)
+    assert rehydrated[1]["args"]["docs"] == [DOCUMENT]
+    assert rehydrated[0]["rets"]["nodes"]["documents"] == [[DOCUMENT]]
+
+
+def test_compressed_calls_decode_to_the_compact_calls():
+    calls, _ = _calls()
+    compact = CompactLogBuilder(min_ref_length=100).compact_calls(calls)
+
+    row = {"log_format": LOG_FORMAT_COMPACT, "calls": None, "calls_compressed": _encode_calls(compact)}
+
+    assert _decode_calls(row) == compact
+    assert _decode_calls({"calls": compact}) == compact
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from log_metrics import DOCUMENT_PREVIEW_LENGTH, completion_cost, compute_log_metrics
+
+
+def _completion(model, prompt_tokens, completion_tokens):
+    return {"model": model, "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                      "total_tokens": prompt_tokens + completion_tokens}}
+
+
+LOG = {
+    "perf": {"start_time": "2026-01-01T10:00:00", "end_time": "2026-01-01T10:00:02.500000"},
+    "calls": [
+        {"call_name": "IntentCommand",
+         "perf": {"start_time": "2026-01-01T10:00:00", "end_time": "2026-01-01T10:00:00.200000"},
+         "rets": {"intent": json.dumps({"INTENT_NAME": "tuition"}),
+                  "completion": _completion("gpt-4o-mini-2024-07-18", 100, 20)}},
+        {"call_name": "AnswerUsingStreamCommand", "args": {"docs": ["x" * 1000, "short"]},
+         "rets": [{"completion": _completion("gpt-4o-mini", 1000, 200)}, {"completion": _completion("gpt-4o-mini", 10, 0)}]},
+        {"call_name": "SaveSessionCommand", "rets": None},
+    ],
+}
+
+
+def test_log_metrics_aggregate_every_completion():
+    metrics = compute_log_metrics(LOG)
+
+    assert metrics["intent"] == "tuition"
+    assert metrics["duration_ms"] == 2500
+    assert (metrics["prompt_tokens"], metrics["completion_tokens"], metrics["total_tokens"]) == (1110, 220, 1330)
+    commands = metrics["metrics"]["commands"]
+    assert [c["call_name"] for c in commands] == ["IntentCommand", "AnswerUsingStreamCommand", "SaveSessionCommand"]
+    assert commands[0]["duration_ms"] == pytest.approx(200) and commands[2]["duration_ms"] is None
+    assert commands[1]["total_tokens"] == 1210
+    assert metrics["cost"] == pytest.approx(sum(c["cost"] for c in commands)) and metrics["cost"] > 0
+    assert [len(doc) for doc in metrics["metrics"]["documents"]] == [DOCUMENT_PREVIEW_LENGTH, 5]
+
+
+def test_dated_snapshots_cost_the_price_of_their_model():
+    assert completion_cost(_completion("gpt-4o-mini-2024-07-18", 1000, 200)) == \
+        completion_cost(_completion("gpt-4o-mini", 1000, 200))
+    assert completion_cost(None) == 0
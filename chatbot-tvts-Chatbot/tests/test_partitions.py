@@ -0,0 +1,57 @@
+import gzip
+from datetime import date, datetime
+
+import sqlalchemy as db
+
+from models import Dialogue, DialogueRollup, metadata
+from partitions import (_add_months, _percentile, apply_retention, convert_to_partitioned, ensure_partitions,
+                        list_partitions, rollup_day)
+
+
+def test_add_months_crosses_years():
+    assert _add_months(date(2025, 11, 1), 3) == date(2026, 2, 1)
+    assert _add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+
+
+def test_percentile_is_nearest_rank():
+    assert _percentile([30, 10, 20, 40], 50) == 20
+    assert _percentile([30, 10, 20, 40], 99) == 40
+    assert _percentile([], 50) is None
+
+
+def _dialogue(created_at, intent, duration_ms, total_tokens):
+    return {"created_at": created_at, "calls": [], "perf": {}, "intent": intent, "duration_ms": duration_ms,
+            "prompt_tokens": total_tokens, "completion_tokens": 0, "total_tokens": total_tokens}
+
+
+def test_existing_rows_are_partitioned_rolled_up_and_archived(pg_engine, tmp_path):
+    metadata.create_all(pg_engine)
+    with pg_engine.connect() as conn:
+        conn.execute(db.insert(Dialogue), [
+            _dialogue(datetime(2026, 1, 5, 10), "tuition", 100.0, 10),
+            _dialogue(datetime(2026, 1, 5, 11), "admission", 300.0, 30),
+            _dialogue(datetime(2026, 3, 1, 9), "tuition", 200.0, 20),
+        ])
+        convert_to_partitioned(conn, "dialogues")
+        ensure_partitions(conn, "dialogues", months_ahead=1, today=date(2026, 3, 15))
+        conn.commit()
+
+        assert [month for _, month in list_partitions(conn, "dialogues")] == [
+            date(2026, 1, 1), date(2026, 2, 1), date(2026, 3, 1), date(2026, 4, 1)]
+        assert conn.execute(db.text("SELECT count(*) FROM dialogues_p202601")).scalar() == 2
+        # the serial keeps working once the legacy table is gone
+        conn.execute(db.insert(Dialogue), [_dialogue(datetime(2026, 3, 2), "tuition", 50.0, 5)])
+
+        assert rollup_day(conn, date(2026, 1, 5)) == 2
+        rollups = {row.intent: row for row in conn.execute(db.select(DialogueRollup))}
+        assert rollups["__all__"].dialogues == 2 and rollups["__all__"].total_tokens == 40
+        assert rollups["__all__"].latency_p50_ms == 100.0 and rollups["tuition"].dialogues == 1
+
+        archived = apply_retention(conn, "dialogues", 1, str(tmp_path), today=date(2026, 3, 15))
+
+        assert [path.rsplit("/", 1)[-1] for path in archived] == ["dialogues_p202601.csv.gz"]
+        with gzip.open(archived[0], "rt") as file:
+            assert len(file.read().splitlines()) == 3
+        assert [month for _, month in list_partitions(conn, "dialogues")][0] == date(2026, 2, 1)
+        assert conn.execute(db.select(db.func.count()).select_from(DialogueRollup).where(
+            DialogueRollup.c.day == date(2026, 1, 5))).scalar() == 3
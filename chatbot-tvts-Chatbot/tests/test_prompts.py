@@ -0,0 +1,50 @@
+import re
+
+import pytest
+
+from foundation import KnowledgeBase
+from log_metrics import compute_log_metrics
+from prompts import MESSAGE_BREAK, PROMPT_TEMPLATES, render_prompt
+
+
+# slots filled from settings, identical for every request
+SETTING_SLOTS = {"MAX_WORDS", "NUMBER_QUESTIONS"}
+
+
+@pytest.mark.parametrize("template_id", sorted(set(PROMPT_TEMPLATES) - {"RANKING_DOCS_USER_PROMPT_TEMPLATE"}))
+def test_static_instructions_come_before_every_slot(template_id):
+    first = PROMPT_TEMPLATES[template_id].split(MESSAGE_BREAK)[0]
+
+    assert set(re.findall(r"\[([A-Z_]+)\]", first)) <= SETTING_SLOTS
+
+
+def test_requests_of_one_template_share_their_first_message():
+    first = render_prompt("ANSWER_PROMPT_TEMPLATE", DOCS=["doc a"], HISTORIES="user: hi", QUERY="q1")
+    second = render_prompt("ANSWER_PROMPT_TEMPLATE", DOCS=["doc b", "doc c"], HISTORIES="", QUERY="q2")
+
+    assert first.messages[0] == second.messages[0]
+    assert first.messages[1:] != second.messages[1:]
+    assert MESSAGE_BREAK not in first and "doc a" in first
+
+
+def test_each_part_is_sent_as_its_own_system_message():
+    prompt = render_prompt("ANSWER_PROMPT_TEMPLATE", DOCS=["doc a"], HISTORIES="user: hi", QUERY="q1")
+    knowledge_base = KnowledgeBase.__new__(KnowledgeBase)
+
+    params = knowledge_base._completion_params("q1", prompt)
+
+    assert [m["role"] for m in params["messages"]] == ["system"] * len(prompt.messages) + ["user"]
+    assert [m["content"] for m in params["messages"][:-1]] == prompt.messages
+
+
+def test_cached_tokens_are_summed_and_priced_lower():
+    def log(cached):
+        usage = {"prompt_tokens": 1000, "completion_tokens": 0, "total_tokens": 1000,
+                 "prompt_tokens_details": {"cached_tokens": cached}}
+        return {"calls": [{"call_name": "AnswerUsingStreamCommand",
+                           "rets": {"completion": {"model": "gpt-4o-mini", "usage": usage}}}]}
+
+    cold, warm = compute_log_metrics(log(0)), compute_log_metrics(log(800))
+
+    assert warm["cached_tokens"] == 800 and cold["cached_tokens"] == 0
+    assert warm["cost"] < cold["cost"]
@@ -0,0 +1,128 @@
+import httpx
+import pytest
+
+import foundation
+from ChatbotAgent.bot import ChatbotV1, ChatCommand
+from foundation import ChatbotController, FaqLookupCommand, GetHistoriesBySessionIdCommand, IntentCommand, LogActivitiesCommand, SearchDocsByChunkIdCommand
+from resilience import CircuitBreaker, CircuitOpenError, CircuitState, Deadline, DeadlineExceeded
+
+
+def fail(error):
+    raise error
+
+
+def test_deadline_caps_stage_timeouts():
+    deadline = Deadline(10)
+    assert deadline.budget(3) == 3
+    assert 9 < deadline.budget(30) <= 10
+
+    expired = Deadline(0)
+    assert expired.expired
+    with pytest.raises(DeadlineExceeded):
+        expired.budget(3)
+
+
+def test_breaker_opens_after_consecutive_failures_and_half_opens(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("resilience.time.monotonic", lambda: now[0])
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(fail, ConnectionError("down"))
+    assert breaker.state == CircuitState.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "ok")
+
+    now[0] += 30
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_failed_trial_call_reopens_the_breaker(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("resilience.time.monotonic", lambda: now[0])
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    with pytest.raises(ConnectionError):
+        breaker.call(fail, ConnectionError("down"))
+
+    now[0] += 30
+    with pytest.raises(ConnectionError):
+        breaker.call(fail, ConnectionError("still down"))
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_chroma_breaker_ignores_errors_of_the_request():
+    breaker = CircuitBreaker("chroma", failure_threshold=1, reset_timeout=30,
+                             failure_types=foundation.chroma_breaker.failure_types)
+
+    with pytest.raises(ValueError):
+        breaker.call(fail, ValueError("Collection test does not exist"))
+    assert breaker.state == CircuitState.CLOSED
+
+    with pytest.raises(httpx.ConnectError):
+        breaker.call(fail, httpx.ConnectError("connection refused"))
+    assert breaker.state == CircuitState.OPEN
+
+
+class FakeController(ChatbotController):
+    def __init__(self):
+        self.commandHistories = []
+        self.degraded = []
+        self.logged = []
+
+    def executeCommand(self, command, **kwargs):
+        if isinstance(command, GetHistoriesBySessionIdCommand):
+            return []
+        if isinstance(command, FaqLookupCommand):
+            return {"match": None, "followup_questions": []}
+        if isinstance(command, IntentCommand):
+            raise TimeoutError("did not finish in 5.0s")
+        if isinstance(command, LogActivitiesCommand):
+            self.logged.append(command)
+            return None
+        raise AssertionError(f"unexpected command {command.__class__.__name__}")
+
+
+def test_answer_after_intent_failure_is_logged_as_degraded():
+    controller = FakeController()
+    run = ChatbotV1().ask("học phí bao nhiêu?", "session", controller=controller)
+    with pytest.raises(StopIteration) as stop:
+        while True:
+            next(run)
+
+    assert stop.value.value.answer == "Hệ thống đang được cập nhật, xin bạn vui lòng qua lại sau."
+    assert len(controller.logged) == 1
+    assert controller.logged[0].degraded == ["intent failed: TimeoutError: did not finish in 5.0s"]
+
+
+class StaleFaqController(FakeController):
+    """Matches a generated FAQ entry (no answer) whose chunk no longer exists."""
+
+    def __init__(self):
+        super().__init__()
+        self.intents = 0
+
+    def executeCommand(self, command, **kwargs):
+        if isinstance(command, FaqLookupCommand):
+            return {"match": {"question": "Học phí?", "answer": "", "chunk_id": "deleted", "similarity": 0.95},
+                    "followup_questions": []}
+        if isinstance(command, SearchDocsByChunkIdCommand):
+            return {"document": None, "node": None}
+        if isinstance(command, IntentCommand):
+            self.intents += 1
+        return super().executeCommand(command, **kwargs)
+
+
+def test_faq_match_without_a_document_falls_through_to_the_pipeline():
+    controller = StaleFaqController()
+    run = ChatbotV1().ask("học phí bao nhiêu?", "session", controller=controller)
+    events = []
+    with pytest.raises(StopIteration):
+        while True:
+            events.append(next(run))
+
+    assert controller.intents == 1
+    assert not any(cmd == ChatCommand.INTENT and "Học phí?" in msg for cmd, msg in events)
+    assert len(controller.logged) == 1
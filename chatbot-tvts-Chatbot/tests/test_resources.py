@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+import resources
+from resources import LazyResource
+
+
+class Client:
+    def ping(self):
+        return "pong"
+
+
+def test_created_once_for_concurrent_callers():
+    created = []
+
+    def factory():
+        time.sleep(0.05)
+        created.append(1)
+        return Client()
+
+    resource = LazyResource("client", factory)
+    threads = [threading.Thread(target=resource.get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert resource.ping() == "pong"
+    assert resource.status()["ready"] and resource.status()["duration_ms"] >= 50
+
+
+def test_failed_creation_is_reported_and_retried():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("chroma is down")
+        return Client()
+
+    resource = LazyResource("chroma", factory)
+    with pytest.raises(ConnectionError):
+        resource.get()
+    assert resource.status() == {"ready": False, "duration_ms": resource.status()["duration_ms"],
+                                 "error": "ConnectionError: chroma is down"}
+
+    assert resource.ping() == "pong"
+    assert resource.status()["error"] is None
+
+
+def test_readiness_waits_for_every_resource(monkeypatch):
+    monkeypatch.setattr(resources, "RESOURCES", {})
+    resources.register("ok", Client)
+    broken = resources.register("broken", lambda: 1 / 0)
+
+    statuses = resources.warmup()
+
+    assert statuses["ok"]["ready"] and not statuses["broken"]["ready"]
+    assert resources.readiness()["ready"] is False
+    broken._factory = Client
+    broken.get()
+    assert resources.readiness()["ready"] is True
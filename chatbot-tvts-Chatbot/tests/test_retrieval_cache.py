@@ -0,0 +1,81 @@
+from retrieval_cache import RetrievalCache, collection_version
+
+
+def _result(terms):
+    return {"ids": [[f"{term}-id"] for term in terms], "distances": [[0.1] for _ in terms],
+            "documents": [[f"{term} doc"] for term in terms], "metadatas": None, "included": ["documents"]}
+
+
+class CountingQuery:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, terms):
+        self.calls.append(list(terms))
+        return _result(terms)
+
+
+def test_only_missed_terms_are_queried():
+    cache = RetrievalCache(max_entries=10, poll_interval=60)
+    query = CountingQuery()
+    version = collection_version(2, {"kms_version": "a"})
+    cache.set_version("docs", version)
+
+    cache.query("docs", version, ["học phí"], 3, query)
+    result = cache.query("docs", version, ["Học phí", "ký túc xá"], 3, query)
+
+    assert query.calls == [["học phí"], ["ký túc xá"]]
+    assert result["ids"] == [["học phí-id"], ["ký túc xá-id"]]
+    assert cache.stats()["hits"] == 1
+
+
+def test_a_new_kms_version_drops_the_entries_of_the_collection():
+    cache = RetrievalCache(max_entries=10, poll_interval=60)
+    query = CountingQuery()
+    old = collection_version(2, {"kms_version": "a"})
+    cache.set_version("docs", old)
+    cache.set_version("faq", old)
+    cache.query("docs", old, ["học phí"], 3, query)
+    cache.query("faq", old, ["học phí"], 3, query)
+
+    # same chunk count, new change token: an update in place
+    new = collection_version(2, {"kms_version": "b"})
+    cache.set_version("docs", new)
+    cache.query("docs", new, ["học phí"], 3, query)
+
+    assert query.calls == [["học phí"], ["học phí"], ["học phí"]]
+    assert cache.stats()["invalidations"] == 1
+    assert cache.stats()["entries"] == 2
+
+
+def test_results_of_a_query_racing_an_update_are_not_cached():
+    cache = RetrievalCache(max_entries=10, poll_interval=60)
+    old = collection_version(2, {"kms_version": "a"})
+    cache.set_version("docs", old)
+
+    def query(terms):
+        cache.set_version("docs", collection_version(3, {"kms_version": "b"}))
+        return _result(terms)
+
+    cache.query("docs", old, ["học phí"], 3, query)
+
+    assert cache.stats()["entries"] == 0
+
+
+def test_polls_at_most_every_poll_interval(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("retrieval_cache.time.monotonic", lambda: now[0])
+    cache = RetrievalCache(max_entries=10, poll_interval=5)
+    polls = []
+
+    def poll():
+        polls.append(now[0])
+        return "1:a"
+
+    cache.version("docs", poll)
+    now[0] = 4
+    cache.version("docs", poll)
+    now[0] = 5
+    cache.version("docs", poll)
+
+    assert polls == [0.0, 5]
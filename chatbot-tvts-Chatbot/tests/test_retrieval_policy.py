@@ -0,0 +1,41 @@
+from foundation import RetrievalDecisionCommand
+from retrieval_policy import RetrievalBranch, decide_retrieval, rank_by_distance
+
+THRESHOLDS = {"confident_distance": 0.3, "min_gap": 0.1, "weak_distance": 0.8, "top_k": 2}
+
+
+def _nodes(*distances):
+    # two queries returning overlapping documents
+    return {
+        "ids": [[f"c{i}" for i in range(len(d))] for d in distances],
+        "documents": [[f"doc {i}" for i in range(len(d))] for d in distances],
+        "metadatas": [[{"source": "a.pdf"} for _ in d] for d in distances],
+        "distances": [list(d) for d in distances],
+    }
+
+
+def test_documents_keep_their_best_distance():
+    assert rank_by_distance(_nodes([0.5, 0.6], [0.2])) == [("doc 0", 0.2), ("doc 1", 0.6)]
+
+
+def test_dominating_chunk_skips_ranking():
+    decision = decide_retrieval(_nodes([0.1, 0.5, 0.6]), **THRESHOLDS)
+
+    assert decision["branch"] == RetrievalBranch.CONFIDENT.value
+    assert decision["documents"] == ["doc 0", "doc 1"]
+    assert decision["gap"] == 0.4
+
+
+def test_close_or_weak_results_are_ranked_or_widened():
+    assert decide_retrieval(_nodes([0.1, 0.15]), **THRESHOLDS)["branch"] == RetrievalBranch.RANKING.value
+    assert decide_retrieval(_nodes([0.9, 1.0]), **THRESHOLDS)["branch"] == RetrievalBranch.WIDEN.value
+    assert decide_retrieval(_nodes([]), **THRESHOLDS)["branch"] == RetrievalBranch.WIDEN.value
+
+
+def test_decision_logs_ids_and_distances_only():
+    nodes = _nodes([0.1, 0.5])
+
+    command = RetrievalDecisionCommand(nodes=nodes)
+
+    assert command.input == {"nodes": {"ids": nodes["ids"], "distances": nodes["distances"]}}
+    assert command.nodes is nodes
@@ -0,0 +1,83 @@
+from ChatbotAgent import shadow
+from ChatbotAgent.bot import ChatCommand, ChatbotResponse
+from ChatbotAgent.shadow import ShadowRun, ShadowRunner
+
+
+class FakeChatbot:
+    def __init__(self):
+        self.kwargs = None
+
+    def ask(self, question, session_id, **kwargs):
+        self.kwargs = kwargs
+        yield ChatCommand.ANSWERING, "Học phí là 10 triệu"
+        return ChatbotResponse(ques=question, ans="Học phí là 10 triệu", followup_ques=[])
+
+
+def _primary_metrics(answer="Học phí là 10 triệu"):
+    return {"answer": answer, "duration_ms": 10.0, "ttfb_ms": 5.0, "total_tokens": 100, "cost": 0.001}
+
+
+def test_candidate_answers_from_a_copy_of_the_primary_histories(monkeypatch):
+    chatbot = FakeChatbot()
+    monkeypatch.setattr(shadow, "get_chatbot_instance", lambda pipeline: chatbot)
+    run = ShadowRun("v1", "v1-lite", "học phí?", "session")
+    histories = [{"role": "user", "content": "chào"}, {"role": "assistant", "content": "Xin chào"}]
+
+    run.share_histories(histories)
+    histories[0]["content"] = "changed by the primary"
+    result = ShadowRunner("v1-lite", 1.0, 1)._run_candidate(run)
+
+    assert chatbot.kwargs["shadow"] is True
+    assert chatbot.kwargs["histories"] == [{"role": "user", "content": "chào"}, {"role": "assistant", "content": "Xin chào"}]
+    assert result["answer"] == "Học phí là 10 triệu"
+    assert result["ttfb_ms"] is not None
+
+
+def test_slot_is_held_until_the_comparison_is_recorded(monkeypatch):
+    runner = ShadowRunner("v1-lite", 1.0, 1)
+    run = ShadowRun("v1", "v1-lite", "học phí?", "session")
+    run._primary_result.set_result(_primary_metrics())
+    slot_free_while_recording = []
+
+    def record(run, primary, candidate, error):
+        acquired = runner._slots.acquire(blocking=False)
+        if acquired:
+            runner._slots.release()
+        slot_free_while_recording.append(acquired)
+
+    monkeypatch.setattr(runner, "_run_candidate", lambda run: _primary_metrics("candidate"))
+    monkeypatch.setattr(runner, "_record", record)
+    assert runner._slots.acquire(blocking=False)
+
+    runner._run(run)
+
+    assert slot_free_while_recording == [False]
+    assert runner._slots.acquire(blocking=False)
+
+
+def test_slot_is_released_when_the_candidate_fails(monkeypatch):
+    runner = ShadowRunner("v1-lite", 1.0, 1)
+    run = ShadowRun("v1", "v1-lite", "học phí?", "session")
+    run._primary_result.set_result(_primary_metrics())
+    recorded = []
+
+    def fail(run):
+        raise RuntimeError("candidate broke")
+
+    monkeypatch.setattr(runner, "_run_candidate", fail)
+    monkeypatch.setattr(runner, "_record", lambda run, primary, candidate, error: recorded.append(error))
+    assert runner._slots.acquire(blocking=False)
+
+    runner._run(run)
+
+    assert recorded == ["RuntimeError: candidate broke"]
+    assert runner._slots.acquire(blocking=False)
+
+
+def test_not_shadowed_when_every_slot_is_busy(monkeypatch):
+    runner = ShadowRunner("v1-lite", 1.0, 1)
+    monkeypatch.setattr(runner._executor, "submit", lambda fn, run: None)
+
+    assert runner.maybe_start("v1", "học phí?", "a") is not None
+    assert runner.maybe_start("v1", "học phí?", "b") is None
+    assert runner.maybe_start("v1-lite", "học phí?", "c") is None
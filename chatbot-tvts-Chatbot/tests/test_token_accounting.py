@@ -0,0 +1,50 @@
+import logging
+import os
+
+import pytest
+
+import token_accounting
+from foundation import KnowledgeBase
+from log_metrics import completion_cost
+from prompts import render_prompt
+from token_accounting import DEFAULT_TOKEN_PRICE, MODEL_PRICES, count_message_tokens, estimate_cost
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_token_accounting_is_the_module_of_the_kms_services():
+    kms_module = os.path.join(os.path.dirname(ROOT_DIR), "chatbot-tvts-KMS", "common", "token_accounting.py")
+    if not os.path.exists(kms_module):
+        pytest.skip("the KMS services are not checked out next to the chatbot")
+    with open(kms_module, encoding="utf-8") as kms, open(token_accounting.__file__, encoding="utf-8") as chatbot:
+        assert chatbot.read() == kms.read()
+
+
+def test_estimate_cost_splits_cached_input_and_output():
+    price = MODEL_PRICES["gpt-4o-mini"]
+    cost = estimate_cost(1_000_000, 1_000_000, "gpt-4o-mini-2024-07-18", cached_tokens=400_000)
+
+    assert cost["input_cost"] == pytest.approx(0.6 * price["input"] + 0.4 * price["cached_input"])
+    assert cost["output_cost"] == pytest.approx(price["output"])
+    assert cost["total_cost"] == pytest.approx(cost["input_cost"] + cost["output_cost"])
+
+
+def test_unknown_models_cost_the_default_price():
+    cost = estimate_cost(1_000_000, 0, "some-local-model")
+
+    assert cost["total_cost"] == pytest.approx(DEFAULT_TOKEN_PRICE["input"])
+    assert completion_cost({"model": "some-local-model", "usage": {"prompt_tokens": 1_000_000}}) == cost["total_cost"]
+
+
+def test_every_completion_request_logs_its_prompt_tokens(caplog):
+    knowledge_base = KnowledgeBase.__new__(KnowledgeBase)
+    system = render_prompt("ANSWER_PROMPT_TEMPLATE", DOCS=["doc"], HISTORIES="")
+
+    with caplog.at_level(logging.INFO, logger="foundation"):
+        params = knowledge_base._completion_params("question", system)
+        knowledge_base._completion_params("question", "plain system prompt")
+
+    records = [record.getMessage() for record in caplog.records if record.name == "foundation"]
+    assert len(records) == 2
+    assert f"{count_message_tokens(params['messages'], params['model'])} tokens" in records[0]
+    assert "ANSWER_PROMPT_TEMPLATE" in records[0]
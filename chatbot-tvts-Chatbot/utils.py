@@ -1,5 +1,6 @@
 from openai.types.chat import ChatCompletion
 import re
+import unicodedata
 
 # Generate between <JSON> and </JSON> tag
 def _extract_tag_content(s: str, tag: str) -> str:
@@ -15,3 +16,8 @@ def _extract_tag_content(s: str, tag: str) -> str:
 def _get_content(c : ChatCompletion) -> str:
     return str(c.choices[0].message.content)
 
+# Lowercase, NFC and strip punctuation so that "Học phí?" and "học phí" compare equal
+def _normalize_text(s: str) -> str:
+    s = unicodedata.normalize("NFC", str(s)).lower()
+    s = re.sub(r"[^\w\s]", " ", s)
+    return " ".join(s.split())
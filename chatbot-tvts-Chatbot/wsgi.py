@@ -1,4 +1,10 @@
 from ChatbotAgent.v1.chatbot_agent_app import app
+from config import WARMUP_ON_START
+from resources import start_warmup
+
+# every gunicorn worker imports this module after the fork
+if WARMUP_ON_START:
+  start_warmup()
 
 if __name__ == "__main__":
   app.run()
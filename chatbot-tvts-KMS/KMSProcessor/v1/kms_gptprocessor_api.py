@@ -1,7 +1,6 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import threading
-import queue
 import time
 import logging
 import sys
@@ -15,6 +14,7 @@ from common.data_manager import DatabaseManager
 from common.chroma_manager import ChromaManager
 from common.gpt_processor import GPTProcessor
 from common.conflict_manager import ConflictManager
+from common.job_queue import JobQueue, PRIORITY_LOW
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -29,11 +29,13 @@ gpt_processor = GPTProcessor()
 logger.info("Using OpenAI for conflict analysis")
 conflict_manager = ConflictManager(data_manager, chroma_manager)
 
-process_queue = queue.Queue()
-retry_queue = queue.Queue()
-
 MAX_RETRIES = 3
 RETRY_DELAY = 5
+PROCESS_WORKERS = int(os.getenv('PROCESS_WORKERS', 5))
+PROCESS_JOB_TIMEOUT = int(os.getenv('PROCESS_JOB_TIMEOUT', 1800))
+# failed attempts are retried by the queue after RETRY_DELAY, 2 * RETRY_DELAY, ...
+process_queue = JobQueue(data_manager, 'process', visibility_timeout=PROCESS_JOB_TIMEOUT,
+                         max_attempts=MAX_RETRIES, retry_delay=RETRY_DELAY)
 KMS_SCANNER_API = os.getenv('KMS_SCANNER_API')
 
 
@@ -62,32 +64,27 @@ def notify_scanner(doc_id, status, error_message=None):
     except Exception as e:
         logger.error(f"Unexpected error notifying scanner for {doc_id}: {str(e)}")
 
-def handle_processing_failure(doc_id, error):
+def handle_processing_failure(job, error):
     """
-    Handle the failure of document processing and update the document's status accordingly.
+    Mark a document as failed once its processing job has used all its attempts.
 
     Args:
-        doc_id (str): The ID of the document that failed processing.
-        error (Exception): The error encountered during document processing.
+        job (Job): The processing job that failed for the last time.
+        error (str): The error of the last attempt.
 
     Returns:
         None
     """
     try:
-        failure_count = data_manager.update_chunk_failure_count(doc_id, increment=True)
-
-        if failure_count >= MAX_RETRIES:
-            data_manager.update_document_status(doc_id, {
-                'processing_status': 'Failed',
-                'chunk_status': 'ChunkingFailed',
-                'error_message': str(error)
-            })
-            notify_scanner(doc_id, 'failed', str(error))
-        else:
-            retry_queue.put(doc_id)
+        data_manager.update_document_status(job.doc_id, {
+            'processing_status': 'Failed',
+            'chunk_status': 'ChunkingFailed',
+            'error_message': str(error)
+        })
+        notify_scanner(job.doc_id, 'failed', str(error))
 
     except Exception as e:
-        logger.error(f"Error handling failure for document {doc_id}: {str(e)}")
+        logger.error(f"Error handling failure for document {job.doc_id}: {str(e)}")
 
 @app.route('/reprocess_failed', methods=['POST'])
 def reprocess_failed_documents():
@@ -97,7 +94,7 @@ def reprocess_failed_documents():
         if doc_id:
             document = data_manager.get_document_by_id(doc_id)
             if document and document['chunk_status'] in ['ChunkingFailed', 'Failed']:
-                process_queue.put({'doc_id': doc_id})
+                process_queue.enqueue(doc_id, priority=PRIORITY_LOW)
                 
                 with data_manager.get_connection() as conn:
                     with conn.cursor() as cursor:
@@ -123,7 +120,7 @@ def reprocess_failed_documents():
         requeued_count = 0
         for doc in failed_docs:
             try:
-                process_queue.put({'doc_id': doc['id']})
+                process_queue.enqueue(doc['id'], priority=PRIORITY_LOW)
                 
                 with data_manager.get_connection() as conn:
                     with conn.cursor() as cursor:
@@ -157,6 +154,21 @@ def reprocess_failed_documents():
         return jsonify({'error': str(e)}), 500
     
 
+@app.route('/backfill_followup_questions', methods=['POST'])
+def backfill_followup_questions():
+    """
+    Precompute follow-up questions for the chunks ingested before they were generated at ingest time.
+    """
+    try:
+        thread = threading.Thread(target=chroma_manager.backfill_followup_questions, daemon=True)
+        thread.start()
+        return jsonify({'message': 'Follow-up questions backfill started'}), 202
+
+    except Exception as e:
+        logger.error(f"Error starting follow-up questions backfill: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/process_doc', methods=['POST'])
 def handle_document():
     """
@@ -206,10 +218,7 @@ def handle_document():
             }), 200
 
         # Queue unique documents for processing
-        process_queue.put({
-            'doc_id': doc_id,
-            'duplicate_info': duplicate_info
-        })
+        process_queue.enqueue(doc_id, {'duplicate_info': duplicate_info})
 
         return jsonify({
             'status': 'success',
@@ -426,94 +435,29 @@ def update_document_status_direct(doc_id, status_data):
         return False
 
 
-def processing_worker():
+def process_job(job):
     """
-    Worker to process documents from the queue.
+    Process the document of a job from the process queue; a failed attempt is retried by the queue.
     """
-    while True:
-        try:
-            data = process_queue.get(timeout=1)
-            doc_id = data['doc_id']
-            duplicate_info = data.get('duplicate_info')
-            
-            success = process_document(doc_id, duplicate_info)
-            if not success:
-                handle_processing_failure(doc_id, "Processing failed")
-                
-            process_queue.task_done()
-            
-        except queue.Empty:
-            time.sleep(1)
-        except Exception as e:
-            logger.error(f"Worker error: {str(e)}")
-            process_queue.task_done()
-            
-def retry_worker():
+    if job.attempts > 1:
+        data_manager.update_chunk_failure_count(job.doc_id, increment=True)
+    if not process_document(job.doc_id, job.payload.get('duplicate_info')):
+        raise RuntimeError("Processing failed")
+
+def processing_worker():
     """
-    Worker to handle document retries from the retry queue.
+    Worker to process documents from the process queue.
     """
-    while True:
-        doc_id = None
-        try:
-            doc_id = retry_queue.get(timeout=1)
-            time.sleep(RETRY_DELAY)
-            success = process_document(doc_id)
-            if not success:
-                handle_processing_failure(doc_id, "Retry failed")
-            retry_queue.task_done()
-        except queue.Empty:
-            time.sleep(1)
-        except Exception as e:
-            logger.error(f"Retry error: {str(e)}")
-            if doc_id:
-                handle_processing_failure(doc_id, str(e))
-            retry_queue.task_done()
+    process_queue.work(process_job, on_give_up=handle_processing_failure)
 
 def start_workers():
     """
-    Start processing and retry workers in separate threads.
+    Start processing workers in separate threads.
     """
-    worker_count = 5  
-    for i in range(worker_count):
+    for i in range(PROCESS_WORKERS):
         worker = threading.Thread(target=processing_worker, daemon=True)
         worker.start()
         logger.info(f"Started processing worker #{i+1}")
- 
-    for i in range(worker_count):
-        worker = threading.Thread(target=retry_worker, daemon=True)
-        worker.start()
-        logger.info(f"Started retry worker #{i+1}")
-
-def check_failed_documents():
-    """
-    Kiểm tra và xử lý lại các tài liệu thất bại
-    """
-    try:
-        failed_docs = data_manager.get_documents_by_status(['ChunkingFailed', 'Processing'])
-        
-        if failed_docs is None or failed_docs.empty:
-            logger.info("No documents to reprocess")
-            return
-            
-        logger.info(f"Found {len(failed_docs)} documents to reprocess")
-        
-        for _, doc in failed_docs.iterrows():
-            try:
-                doc_id = doc['id']
-                process_queue.put({'doc_id': doc_id})
-                data_manager.update_document_status(doc_id, {
-                    'processing_status': 'Queued',
-                    'chunk_status': 'Pending',
-                    'chunk_failure_count': 0
-                })
-                logger.info(f"Re-queued document {doc_id} for processing")
-            except Exception as doc_error:
-                logger.error(f"Error processing document {doc.get('id', 'Unknown')}: {str(doc_error)}")
-                logger.error(traceback.format_exc())
-                continue
-    except Exception as e:
-        logger.error(f"Error when checking documents failed: {str(e)}")
-        logger.error(traceback.format_exc())
 
 @app.route('/chunk_callback', methods=['POST'])
 def chunk_callback():
@@ -572,7 +516,6 @@ def chunk_callback():
 if __name__ == '__main__':
     try:
         start_workers()
-        check_failed_documents()
         port = int(os.getenv('KMS_PROCESSOR_PORT'))
         app.run(host='0.0.0.0', debug=True, port=port)
         
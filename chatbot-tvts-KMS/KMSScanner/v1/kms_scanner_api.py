@@ -1,8 +1,6 @@
 import os
-import queue
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from concurrent.futures import ThreadPoolExecutor
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))) 
 from datetime import datetime
@@ -16,9 +14,12 @@ import json
 from dotenv import load_dotenv
 load_dotenv()
 from common.data_manager import DatabaseManager
-from common.utils import ratio, preprocessing
+from common.similarity_engine import score_against
 from common.chroma_manager import ChromaManager 
 from common.conflict_manager import ConflictManager
+from common.near_duplicate_index import NearDuplicateIndex
+from common.job_queue import JobQueue, PRIORITY_LOW
+from common.document_fingerprint import compute_fingerprint, has_numeric_differences, stored_fingerprint
 
 app = Flask(__name__)
 CORS(app)
@@ -31,9 +32,11 @@ chroma_manager = ChromaManager()
 
 logger.info("Initializing ConflictManager with OpenAI")
 conflict_manager = ConflictManager(data_manager, chroma_manager)
+near_duplicate_index = NearDuplicateIndex(data_manager)
 
-scan_queue = queue.Queue()
-worker_pool = ThreadPoolExecutor(max_workers = 5)
+SCAN_WORKERS = int(os.getenv('SCAN_WORKERS', 5))
+SCAN_JOB_TIMEOUT = int(os.getenv('SCAN_JOB_TIMEOUT', 600))
+scan_queue = JobQueue(data_manager, 'scan', visibility_timeout=SCAN_JOB_TIMEOUT)
 KMS_PROCESSOR_API = os.getenv('KMS_PROCESSOR_API')
 
 
@@ -87,13 +90,18 @@ KMS_PROCESSOR_API = os.getenv('KMS_PROCESSOR_API')
 #         logger.error(f"Error analyzing similarity: {str(e)}")
 #         raise
 
-def analyze_document_similarity(current_doc_id, current_content):
+def analyze_document_similarity(current_doc_id, current_content, document=None):
     """
-    Analyzes the similarity between a given document and all other documents in the system.
+    Analyzes the similarity between a given document and its near duplicate candidates.
+
+    Documents with the same content hash are exact duplicates; the other candidates come
+    from the MinHash/LSH index and are compared on their persisted normalized text. When
+    the document cannot be indexed it is compared with all the other documents.
 
     Args:
         current_doc_id (str): The unique ID of the document being analyzed.
         current_content (str): The content of the current document to be compared.
+        document (dict): The stored row of the document, to reuse its persisted fingerprint.
 
     Returns:
         list: A sorted list of dictionaries representing similar documents. Each dictionary contains:
@@ -108,52 +116,51 @@ def analyze_document_similarity(current_doc_id, current_content):
     """
     try:
         similar_docs = []
-        processed_current = preprocessing(current_content)
-        all_documents = data_manager.get_all_documents()
-
-        def extract_numbers(text):
-            import re
-            return re.findall(r'\b\d+[.,]?\d*\b', text)
-        
-        def has_numeric_differences(text1, text2):
-            numbers1 = extract_numbers(text1)
-            numbers2 = extract_numbers(text2)
-            
-            if len(numbers1) != len(numbers2):
-                return True
-                
-            for n1, n2 in zip(sorted(numbers1), sorted(numbers2)):
-                if n1 != n2:
-                    return True
-                    
-            return False
+        fingerprint = stored_fingerprint(document)
+        if fingerprint is None:
+            fingerprint = data_manager.save_document_fingerprint(current_doc_id, current_content)
+        processed_current = fingerprint['normalized_text']
+        current_numbers = fingerprint['numeric_tokens']
+
+        exact_ids = set(data_manager.get_document_ids_by_content_hash(fingerprint['content_hash'], current_doc_id))
+        if near_duplicate_index.ensure(current_doc_id, current_content, processed_current):
+            candidate_ids = exact_ids | set(near_duplicate_index.candidates(current_doc_id))
+            logger.info(f"{len(candidate_ids)} near duplicate candidates for document {current_doc_id} "
+                        f"({len(exact_ids)} exact)")
+            if not candidate_ids:
+                return []
+            all_documents = data_manager.get_documents_by_ids(list(candidate_ids))
+        else:
+            logger.warning(f"Document {current_doc_id} not indexed, comparing with all documents")
+            all_documents = data_manager.get_all_documents()
 
-        current_numbers = extract_numbers(current_content)
+        documents = [doc for doc in all_documents.to_dict('records') if doc['id'] != current_doc_id]
+        fingerprints = [stored_fingerprint(doc) or compute_fingerprint(doc['content']) for doc in documents]
+        # every candidate scored in one batch; one thread per call, the SCAN_WORKERS scan threads
+        # already run in parallel and a pool per call would oversubscribe the cores
+        scores = score_against(processed_current, [fingerprint['normalized_text'] for fingerprint in fingerprints],
+                               workers=1)
 
-        for _, doc in all_documents.iterrows():
-            if doc['id'] != current_doc_id:
-                try:
-                    processed_doc = preprocessing(doc['content'])
-                    similarity = ratio(processed_current, processed_doc)
-                    
-                    if similarity > 0.99:
-                        doc_numbers = extract_numbers(doc['content'])
-                        
-                        if has_numeric_differences(current_content, doc['content']):
-                            similarity = 0.97
+        for doc, doc_fingerprint, score in zip(documents, fingerprints, scores):
+            try:
+                similarity = 1.0 if doc['id'] in exact_ids else float(score)
+                
+                if similarity > 0.99:
+                    if has_numeric_differences(current_numbers, doc_fingerprint['numeric_tokens']):
+                        similarity = 0.97
     
-                    if similarity > 0.995:  
-                        similar_doc = {
-                            'id': str(doc['id']),
-                            'similarity': float(similarity),
-                            'content': str(doc['content']),
-                            'created_date': doc['created_date']
-                        }
-                        similar_docs.append(similar_doc)
-                        
-                except Exception as e:
-                    logger.error(f"Error comparing with document {doc['id']}: {str(e)}")
-                    continue
+                if similarity > 0.995:  
+                    similar_doc = {
+                        'id': str(doc['id']),
+                        'similarity': float(similarity),
+                        'content': str(doc['content']),
+                        'created_date': doc['created_date']
+                    }
+                    similar_docs.append(similar_doc)
+                    
+            except Exception as e:
+                logger.error(f"Error comparing with document {doc['id']}: {str(e)}")
+                continue
 
         similar_docs.sort(key=lambda x: x['similarity'], reverse=True)
         return similar_docs
@@ -488,7 +495,7 @@ def rescan_null_status():
             try:
                 doc_id = doc['id']
                 
-                scan_queue.put(doc_id)
+                scan_queue.enqueue(doc_id, priority=PRIORITY_LOW)
                 
                 try:
                     with data_manager.get_connection() as conn:
@@ -585,65 +592,6 @@ def rescan_null_status():
             'message': error_msg
         }), 500
 
-def check_and_rescan_documents():
-    """
-    Check and queue documents to be rescanned on startup.
-    """
-    try:
-        
-        documents = data_manager.get_documents_need_rescan()
-        
-        if documents is None or documents.empty:
-            logger.info("No documents need to be rescanned on startup")
-            return
-            
-        logger.info(f"Found {len(documents)} documents that need to be rescanned")
-        count = 0
-        
-        for _, doc in documents.iterrows():
-            try:
-                doc_id = doc['id']
-                current_scan_status = doc.get('scan_status')
-                
-                logger.info(f"Processing document to be rescanned: {doc_id} (status: {current_scan_status})")
-                scan_queue.put(doc_id)
-                
-                try:
-                    with data_manager.get_connection() as conn:
-                        with conn.cursor() as cursor:
-                            cursor.execute("""
-                                BEGIN;
-                                SET session_replication_role = 'replica';
-                                
-                                UPDATE documents 
-                                SET processing_status = 'Queued',
-                                    scan_status = 'Queued',
-                                    modified_date = CURRENT_TIMESTAMP,
-                                    chunk_failure_count = 0
-                                WHERE id = %s;
-                                
-                                SET session_replication_role = 'origin';
-                                COMMIT;
-                            """, (doc_id,))
-                            conn.commit()
-                            logger.info(f"Đã cập nhật trạng thái tài liệu {doc_id} thành Queued")
-                            
-                except Exception as update_error:
-                    logger.warning(f"Error updating status for document {doc_id}: {str(update_error)}")
-                    logger.warning("Continue processing documents in queue despite status update error")
-                count += 1
-                logger.info(f"Document {doc_id} placed in queue for rescan (#{count})")
-                
-            except Exception as e:
-                logger.error(f"Error while enqueuing document {doc.get('id', 'unknown')}: {str(e)}")
-                logger.error(traceback.format_exc())
-                
-        logger.info(f"Successfully put {count}/{len(documents)} documents into the queue for rescan on startup")
-    except Exception as e:
-        logger.error(f"Overall error while checking and rescanning document: {str(e)}")
-        logger.error(traceback.format_exc())
-        
-        
 @app.route('/check_document_status/<doc_id>', methods=['GET'])
 def check_document_status(doc_id):
     try:
@@ -729,6 +677,33 @@ def list_all_documents():
             'message': error_msg
         }), 500
 
+def backfill_similarity_data():
+    """Persist the fingerprints, then index the documents stored before they existed"""
+    try:
+        stats = data_manager.backfill_document_fingerprints()
+        stats.update(near_duplicate_index.backfill())
+        return stats
+    except Exception as e:
+        logger.error(f"Error backfilling similarity data: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise
+
+@app.route('/backfill_near_duplicate_index', methods=['POST'])
+def backfill_near_duplicate_index():
+    try:
+        stats = backfill_similarity_data()
+        return jsonify({
+            'status': 'success',
+            **stats
+        }), 200
+    except Exception as e:
+        error_msg = f"Lỗi khi backfill near duplicate index: {str(e)}"
+        logger.error(error_msg)
+        return jsonify({
+            'status': 'error',
+            'message': error_msg
+        }), 500
+
 @app.route('/rescan_failed_chunks', methods=['POST'])
 def rescan_failed_chunks():
     try:
@@ -755,7 +730,7 @@ def rescan_failed_chunks():
         
         for doc_id in doc_ids:
             try:
-                scan_queue.put(doc_id)
+                scan_queue.enqueue(doc_id, priority=PRIORITY_LOW)
                 
                 try:
                     with data_manager.get_connection() as conn:
@@ -1079,82 +1054,56 @@ def add_conflict_columns():
     except Exception as e:
         return False
 
-def scan_worker():
-    worker_id = threading.get_ident()
-    logger.info(f"Start scanning worker with ID: {worker_id}")
+def scan_job(job):
+    """
+    Scan the document of a job from the scan queue; an exception makes the queue retry it later.
+    """
+    doc_id = job.doc_id
+    doc = data_manager.get_document_by_id(doc_id)
+    if not doc:
+        logger.error(f"Document {doc_id} not found in database")
+        return
+
+    valid_states = ['Processed', 'Queued', 'Edited', 'Pending', 'Failed', 'Processing', 'Scanning']
+    current_status = doc.get('processing_status')
+    current_scan_status = doc.get('scan_status')
     
-    while True:
-        doc_id = None
-        try:
-            doc_id = scan_queue.get(timeout=1)
-            logger.info(f"Worker {worker_id} received document {doc_id} from queue")
-            
-            doc = data_manager.get_document_by_id(doc_id)
-            if not doc:
-                logger.error(f"Worker {worker_id}: Document {doc_id} not found in database")
-                scan_queue.task_done()
-                continue
+    logger.info(f"Document {doc_id} has current status: processing={current_status}, scan={current_scan_status}")
+    if current_status not in valid_states:
+        logger.warning(f"Document {doc_id} has invalid status {current_status}, skipping")
+        return
 
-            valid_states = ['Processed', 'Queued', 'Edited', 'Pending', 'Failed', 'Processing']
-            current_status = doc.get('processing_status')
-            current_scan_status = doc.get('scan_status')
-            
-            logger.info(f"Worker {worker_id}: Document {doc_id} has current status: processing={current_status}, scan={current_scan_status}")
-            if current_status not in valid_states:
-                logger.warning(f"Worker {worker_id}: Document {doc_id} has invalid status {current_status}, skipping")
-                scan_queue.task_done()
-                continue
+    try:
+        with data_manager.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    BEGIN;
+                    SET session_replication_role = 'replica';
+                    
+                    UPDATE documents
+                    SET processing_status = 'Scanning',
+                        scan_status = 'Scanning',
+                        modified_date = CURRENT_TIMESTAMP
+                    WHERE id = %s;
+                    
+                    SET session_replication_role = 'origin';
+                    COMMIT;
+                """, (doc_id,))
+                conn.commit()
+                logger.info(f"Updated document {doc_id} status to Scanning")
+    except Exception as e:
+        logger.error(f"Error updating Scanning status for document {doc_id}: {str(e)}")
 
-            try:
-                with data_manager.get_connection() as conn:
-                    with conn.cursor() as cursor:
-                        cursor.execute("""
-                            BEGIN;
-                            SET session_replication_role = 'replica';
-                            
-                            UPDATE documents
-                            SET processing_status = 'Scanning',
-                                scan_status = 'Scanning',
-                                modified_date = CURRENT_TIMESTAMP
-                            WHERE id = %s;
-                            
-                            SET session_replication_role = 'origin';
-                            COMMIT;
-                        """, (doc_id,))
-                        conn.commit()
-                        logger.info(f"Worker {worker_id}: Updated document {doc_id} status to Scanning")
-            except Exception as e:
-                logger.error(f"Worker {worker_id}: Error updating Scanning status for document {doc_id}: {str(e)}")
+    scan_document(doc_id)
+    logger.info(f"Finished scanning document {doc_id}")
 
-            try:
-                scan_document(doc_id)
-                logger.info(f"Worker {worker_id}: Finished scanning document {doc_id}")
-            except Exception as scan_error:
-                logger.error(f"Worker {worker_id}: Error scanning document {doc_id}: {str(scan_error)}")
-                logger.error(traceback.format_exc())
-                try:
-                    check_and_handle_document_failure(doc_id, f"Scan error: {str(scan_error)}")
-                except Exception as update_error:
-                    logger.error(f"Worker {worker_id}: Error while updating status failed for document {doc_id}: {str(update_error)}")
-                    
-            scan_queue.task_done()
-            
-        except queue.Empty:
-            time.sleep(1)
-            continue
-        
-        except Exception as e:
-            logger.error(f"Worker {worker_id}: Unknown error while processing document {doc_id if doc_id else 'unknown'}: {str(e)}")
-            logger.error(traceback.format_exc())
-            
-            if doc_id:
-                try:
-                    check_and_handle_document_failure(doc_id, f"Unknown error: {str(e)}")
-                except Exception as update_error:
-                    logger.error(f"Worker {worker_id}: Error when updating status failed: {str(update_error)}")
-                scan_queue.task_done()
-            
-            time.sleep(2)
+
+def handle_scan_job_failure(job, error_message):
+    check_and_handle_document_failure(job.doc_id, f"Scan error: {error_message}")
+
+
+def scan_worker():
+    scan_queue.work(scan_job, on_give_up=handle_scan_job_failure)
 
 
 @app.route('/scan_doc', methods=['POST'])
@@ -1177,10 +1126,8 @@ def scan_doc():
             return jsonify({'error': 'Tài liệu không tồn tại', 'doc_id': doc_id}), 404
 
         logger.info(f"Document {doc_id} currently has status: processing={doc.get('processing_status')}, scan={doc.get('scan_status')}")
-        queue_size = scan_queue.qsize()
-        logger.info(f"Current queue size: {queue_size}")
-        scan_queue.put(doc_id)
-        logger.info(f"Added document {doc_id} to scan queue. New queue size: {scan_queue.qsize()}")
+        scan_queue.enqueue(doc_id)
+        logger.info(f"Added document {doc_id} to scan queue. New queue size: {scan_queue.size()}")
         
         try:
             with data_manager.get_connection() as conn:
@@ -1207,7 +1154,7 @@ def scan_doc():
         return jsonify({
             'status': 'success',
             'message': f'Tài liệu {doc_id} đã được đưa vào hàng đợi để quét',
-            'queue_size': scan_queue.qsize()
+            'queue_size': scan_queue.size()
         }), 200
         
     except Exception as e:
@@ -1291,19 +1238,21 @@ def update_document_status_direct(doc_id, status_data):
         logger.error(f"Error updating document status: {str(e)}")
         return False
 
-def scan_document(doc_id, retry_count=0):
+def scan_document(doc_id):
     """
     Scan the document and send it to the processor with improved error handling and logging
 
     Args:
     doc_id (str): ID of the document to scan
-    retry_count (int): Number of retries (for recursion)
 
     Returns:
     bool: True on success, False on failure
+
+    Raises:
+    Exception: Unexpected errors, retried by the scan queue
     """
     try:
-        logger.info(f"Starting scanning document {doc_id} (retry counts: {retry_count})")
+        logger.info(f"Starting scanning document {doc_id}")
         document = data_manager.get_document_by_id(doc_id)
         if not document:
             logger.error(f"Document not found: {doc_id}")
@@ -1344,7 +1293,7 @@ def scan_document(doc_id, retry_count=0):
             return False
 
         logger.info(f"Analyzing similarity for document {doc_id}")
-        similar_docs = analyze_document_similarity(doc_id, content)
+        similar_docs = analyze_document_similarity(doc_id, content, document)
         is_duplicate = False
         duplicate_info = None
 
@@ -1358,8 +1307,7 @@ def scan_document(doc_id, retry_count=0):
                 duplicate_group_id = f"dup_group_{int(time.time())}"
                 
                 try:
-                    documents = data_manager.get_all_documents()
-                    group_docs = documents[documents['id'].isin(related_docs)]
+                    group_docs = data_manager.get_documents_by_ids(related_docs)
                     
                     if not group_docs.empty:
                         original_doc = group_docs.sort_values('created_date').iloc[0]
@@ -1470,15 +1418,7 @@ def scan_document(doc_id, retry_count=0):
 
     except Exception as e:
         logger.error(f"Error scanning document {doc_id}: {str(e)}")
-        logger.error(traceback.format_exc())
-        
-        if retry_count < 3:
-            logger.info(f"Retry {retry_count + 1} for document {doc_id}")
-            time.sleep(5)
-            return scan_document(doc_id, retry_count + 1)
-        else:
-            check_and_handle_document_failure(doc_id, str(e))
-            return False
+        raise
 
 @app.route('/analyze_conflicts/<doc_id>', methods=['POST'])
 def analyze_conflicts(doc_id):
@@ -1513,65 +1453,11 @@ def analyze_conflicts(doc_id):
         }), 500
 
 
-def initialize_scan_queue():
-    """
-    Initializes the scan queue with documents that need to be scanned.
-    """
-    try:
-        documents = data_manager.get_documents_to_scan()
-        
-        if documents.empty:
-            return
-            
-        for _, doc in documents.iterrows():
-            try:
-                doc_id = doc['id']
-                current_scan_status = doc['scan_status']
-                
-                scan_queue.put(doc_id)
-                
-                if current_scan_status != 'Queued':
-                    try:
-                        with data_manager.get_connection() as conn:
-                            with conn.cursor() as cursor:
-                                cursor.execute("""
-                                    CREATE OR REPLACE FUNCTION prepare_for_scan(p_doc_id VARCHAR) 
-                                    RETURNS BOOLEAN AS $
-                                    DECLARE
-                                        v_current_status VARCHAR;
-                                    BEGIN
-                                        SELECT scan_status INTO v_current_status 
-                                        FROM documents 
-                                        WHERE id = p_doc_id;
-                                        
-                                        EXECUTE 'UPDATE documents SET processing_status = ''Queued'', scan_status = ''Queued'', modified_date = CURRENT_TIMESTAMP WHERE id = $1'
-                                        USING p_doc_id;
-                                        
-                                        RETURN TRUE;
-                                    END;
-                                    $ LANGUAGE plpgsql;
-                                """)
-                                conn.commit()
-                                
-                                cursor.execute("SELECT prepare_for_scan(%s)", (doc_id,))
-                                conn.commit()
-                    except Exception as update_error:
-                        logger.warning(f"Failed to update status for {doc_id}: {str(update_error)}")
-                
-                logger.info(f"Document {doc_id} queued for scanning")
-            except Exception as e:
-                logger.error(f"Error adding document {doc_id} to queue: {str(e)}")
-            
-    except Exception as e:
-        logger.error(f"Error initializing scan queue: {str(e)}")
-
-
 if __name__ == '__main__':
     add_conflict_columns()
-    initialize_scan_queue()
-    check_and_rescan_documents()
+    threading.Thread(target=backfill_similarity_data, daemon=True).start()
 
-    for _ in range(worker_pool._max_workers):
+    for _ in range(SCAN_WORKERS):
         worker = threading.Thread(target=scan_worker, daemon=True)
         worker.start()
         logger.info("Started scan worker thread")
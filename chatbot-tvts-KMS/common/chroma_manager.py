@@ -1,18 +1,37 @@
 import chromadb
+import httpx
+import openai
+import requests
 from chromadb.utils import embedding_functions
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 import os
 import time
 import traceback
+import uuid
 import json 
 import logging
 from datetime import datetime
 from common.data_manager import DatabaseManager 
+from common.embedding_cache import EmbeddingCache
 from dotenv import load_dotenv
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# bulk writes are sent to Chroma in batches of at most this many chunks...
+CHROMA_UPSERT_BATCH_SIZE = int(os.getenv('CHROMA_UPSERT_BATCH_SIZE', 500))
+# ...and of at most this many characters of documents and metadata
+CHROMA_UPSERT_BATCH_CHARS = int(os.getenv('CHROMA_UPSERT_BATCH_CHARS', 2_000_000))
+
+# follow-up questions of the chunks of one write are generated on this many threads
+FOLLOWUP_QUESTIONS_WORKERS = int(os.getenv('FOLLOWUP_QUESTIONS_WORKERS', 4))
+
+# connection, timeout and rate limit errors of the embedding API or of Chroma, retried with
+# the whole batch instead of splitting it
+TRANSIENT_UPSERT_ERRORS = (openai.APIConnectionError, openai.RateLimitError, httpx.TransportError,
+                           requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)
+
 class ChromaManager:
     def __init__(self):
         
@@ -32,10 +51,16 @@ class ChromaManager:
 
         self.openai_api_key = os.getenv('OPENAI_API_KEY')
 
+        # follow-up questions precomputed per chunk for the chatbot, 0 to disable
+        self.followup_questions_per_chunk = int(os.getenv('FOLLOWUP_QUESTIONS_PER_CHUNK', 5))
+        self._gpt_processor = None
+
         openai_ef = embedding_functions.OpenAIEmbeddingFunction(
             api_key=self.openai_api_key,
             model_name=self.embedding_model
         )
+        # writes pass their embeddings explicitly, reusing the ones of unchanged contents
+        self.embedding_cache = EmbeddingCache(self.data_manager, openai_ef, self.embedding_model)
         try:
             self.collection = self.client.get_collection(
                 name=self.collection_name,
@@ -52,86 +77,192 @@ class ChromaManager:
             )
             logger.info(f"Created new collection: {self.collection_name}")
 
-    def add_chunks(self, doc_id: str, chunks_data: Dict, unit: str = '', duplicate_info: Dict = None) -> bool:
+    def _bump_collection_version(self):
         """
-        Add chunks to ChromaDB and update document state.
+        Set the 'kms_version' of the collection metadata to a new random token, read by the
+        chatbot to invalidate its cached search results. Unlike a counter, concurrent KMS
+        processes can never write the same version twice. Never fails the write it follows.
+        """
+        try:
+            # fetched again so that the other metadata written by another KMS process is kept
+            collection = self.client.get_collection(name=self.collection_name)
+            metadata = {key: value for key, value in (collection.metadata or {}).items()
+                        if not key.startswith('hnsw:')}  # the distance function cannot be modified
+            metadata['kms_version'] = uuid.uuid4().hex
+            self.collection.modify(metadata=metadata)
+        except Exception as e:
+            logger.warning(f"Could not bump the version of collection {self.collection_name}: {str(e)}")
+
+    def _generate_followup_questions(self, chunk_id: str, content: str) -> str:
+        """
+        Follow-up questions of a chunk as a JSON list, stored in the 'followup_questions' metadata.
 
         Args:
-            doc_id (str): ID of document
-            chunks_data (Dict): Chunk data from GPT
-            unit (str, optional): Unit of document
-            duplicate_info (Dict, optional): Information about duplicate documents
+            chunk_id (str): ID of the chunk
+            content (str): Content of the chunk
 
         Returns:
-            bool: True on success, False on error
+            str: JSON list of questions, empty list when disabled or on error
         """
+        if self.followup_questions_per_chunk <= 0:
+            return json.dumps([])
+        questions = self._followup_processor().generate_followup_questions(
+            content, self.followup_questions_per_chunk, chunk_id=chunk_id)
+        return json.dumps(questions, ensure_ascii=False)
+
+    def _followup_processor(self):
+        if self._gpt_processor is None:
+            from common.gpt_processor import GPTProcessor
+            self._gpt_processor = GPTProcessor()
+        return self._gpt_processor
+
+    def _generate_followup_questions_many(self, chunks: List[Tuple[str, str]]) -> Dict[str, str]:
+        """
+        Follow-up questions of many chunks, generated concurrently on FOLLOWUP_QUESTIONS_WORKERS threads.
+
+        Args:
+            chunks (List[Tuple[str, str]]): (chunk ID, content) of every chunk
+
+        Returns:
+            Dict[str, str]: JSON list of questions by chunk ID
+        """
+        if not chunks:
+            return {}
+        if self.followup_questions_per_chunk <= 0 or FOLLOWUP_QUESTIONS_WORKERS <= 1 or len(chunks) == 1:
+            return {chunk_id: self._generate_followup_questions(chunk_id, content) for chunk_id, content in chunks}
+        # created once here, not by the first threads
+        self._followup_processor()
+        with ThreadPoolExecutor(max_workers=min(FOLLOWUP_QUESTIONS_WORKERS, len(chunks))) as executor:
+            questions = list(executor.map(lambda chunk: self._generate_followup_questions(*chunk), chunks))
+        return {chunk_id: chunk_questions for (chunk_id, _), chunk_questions in zip(chunks, questions)}
+
+    @staticmethod
+    def _has_followup_questions(metadata: Dict) -> bool:
+        """Whether the 'followup_questions' metadata holds at least one question."""
         try:
-            if not doc_id or not isinstance(doc_id, str):
-                return False
-                
-            if not chunks_data or not isinstance(chunks_data, dict):
-                return False
+            return bool(json.loads(metadata.get('followup_questions') or '[]'))
+        except (TypeError, ValueError):
+            return False
+
+    def backfill_followup_questions(self, page_size: int = 100) -> Dict[str, int]:
+        """
+        Generate follow-up questions for the chunks stored before they were precomputed.
+
+        Args:
+            page_size (int): Number of chunks read per page
+
+        Returns:
+            Dict[str, int]: Number of chunks scanned and updated
+        """
+        stats = {"scanned": 0, "updated": 0}
+        if self.followup_questions_per_chunk <= 0:
+            logger.info("Follow-up questions are disabled (FOLLOWUP_QUESTIONS_PER_CHUNK=0)")
+            return stats
+        offset = 0
+        while True:
+            page = self.collection.get(limit=page_size, offset=offset, include=['documents', 'metadatas'])
+            if not page or not page['ids']:
+                break
+            ids, metadatas = [], []
+            missing = []
+            for chunk_id, document, metadata in zip(page['ids'], page['documents'], page['metadatas']):
+                stats["scanned"] += 1
+                metadata = metadata or {}
+                # "[]" was stored when the generation was disabled or failed
+                if not self._has_followup_questions(metadata):
+                    missing.append((chunk_id, document, metadata))
+            generated = self._generate_followup_questions_many(
+                [(chunk_id, document) for chunk_id, document, _ in missing])
+            for chunk_id, _, metadata in missing:
+                if not json.loads(generated[chunk_id]):
+                    continue
+                metadata['followup_questions'] = generated[chunk_id]
+                ids.append(chunk_id)
+                metadatas.append(metadata)
+            if ids:
+                # metadata only, the embeddings are unchanged
+                self.collection.update(ids=ids, metadatas=metadatas)
+                self._bump_collection_version()
+                stats["updated"] += len(ids)
+            offset += len(page['ids'])
+        logger.info(f"Follow-up questions backfill: {stats}")
+        return stats
+
+    def _build_chunk_objects(self, doc_id: str, chunks_data: Dict, unit: str = '',
+                             duplicate_info: Dict = None) -> Optional[List[Dict]]:
+        """
+        Chroma records (id, content, metadata) of the chunks of a document.
+
+        Returns:
+            Optional[List[Dict]]: The records, empty if the document has no chunks,
+                None if chunks_data is invalid
+        """
+        if not doc_id or not isinstance(doc_id, str):
+            return None
             
-            required_fields = ['CHUNKS', 'TOPIC', 'CHUNK_NUMBER']
-            if not all(field in chunks_data for field in required_fields):
-                return False
-                
-            if not chunks_data['CHUNKS']:
-                return True
-                
-            expected_chunks = int(chunks_data['CHUNK_NUMBER'])
-            actual_chunks = len(chunks_data['CHUNKS'])
-            if expected_chunks != actual_chunks:
-                logger.warning(f"Chunk count mismatch for document {doc_id}. Expected: {expected_chunks}, Got: {actual_chunks}")
+        if not chunks_data or not isinstance(chunks_data, dict):
+            return None
+        
+        required_fields = ['CHUNKS', 'TOPIC', 'CHUNK_NUMBER']
+        if not all(field in chunks_data for field in required_fields):
+            return None
             
-            chunk_objects = []
-            doc_topic = chunks_data.get('TOPIC', '').strip()
+        if not chunks_data['CHUNKS']:
+            return []
             
-            for i, chunk in enumerate(chunks_data['CHUNKS'], 1):
-                required_chunk_fields = ['chunk_topic', 'original_chunk', 'revised_chunk', 'index']
-                if not all(field in chunk for field in required_chunk_fields):
-                    continue
-                
-                expected_index = f"Paragraph {i}"
-                if chunk['index'] != expected_index:
-                    chunk['index'] = expected_index
+        expected_chunks = int(chunks_data['CHUNK_NUMBER'])
+        actual_chunks = len(chunks_data['CHUNKS'])
+        if expected_chunks != actual_chunks:
+            logger.warning(f"Chunk count mismatch for document {doc_id}. Expected: {expected_chunks}, Got: {actual_chunks}")
+        
+        chunk_objects = []
+        doc_topic = chunks_data.get('TOPIC', '').strip()
+        
+        for i, chunk in enumerate(chunks_data['CHUNKS'], 1):
+            required_chunk_fields = ['chunk_topic', 'original_chunk', 'revised_chunk', 'index']
+            if not all(field in chunk for field in required_chunk_fields):
+                continue
+            
+            expected_index = f"Paragraph {i}"
+            if chunk['index'] != expected_index:
+                chunk['index'] = expected_index
 
+            
+            if isinstance(chunk['revised_chunk'], list):
+                revised_text = '\n'.join([str(item) for item in chunk['revised_chunk']])
+            else:
+                revised_text = chunk['revised_chunk'].strip()
                 
-                if isinstance(chunk['revised_chunk'], list):
-                    revised_text = '\n'.join([str(item) for item in chunk['revised_chunk']])
-                else:
-                    revised_text = chunk['revised_chunk'].strip()
-                    
-                if isinstance(chunk['original_chunk'], list):
-                    original_text = '\n'.join([str(item) for item in chunk['original_chunk']])
-                else:
-                    original_text = chunk['original_chunk'].strip()
-                
-                if not ('Q:' in revised_text or 'Hỏi:' in revised_text) or not ('A:' in revised_text or 'Đáp:' in revised_text):
-                    logger.warning(f"Chunk {i} in document {doc_id} may not be in proper Q&A format")
-                
-                paragraph_number = str(i)  
-                chunk_id = f"{doc_id}_paragraph_{paragraph_number}"
-                
-                metadata = {
-                    'document_topic': doc_topic,
-                    'chunk_topic': chunk['chunk_topic'].strip(),
-                    'paragraph': chunk['index'],
-                    'original_text': original_text,
-                    'revised_chunk': revised_text,
-                    'original_id': doc_id,
-                    'unit': unit.strip() if unit else ''
-                }
-                
-                if duplicate_info and isinstance(duplicate_info, dict):
-                    if 'duplicate_group_id' in duplicate_info and 'document_ids' in duplicate_info:
-                        metadata.update({
-                            'duplicate_group_id': duplicate_info['duplicate_group_id'],
-                            'is_original': True,
-                            'duplicate_count': len(duplicate_info['document_ids'])
-                        })
-                
-                formatted_chunk = f"""
+            if isinstance(chunk['original_chunk'], list):
+                original_text = '\n'.join([str(item) for item in chunk['original_chunk']])
+            else:
+                original_text = chunk['original_chunk'].strip()
+            
+            if not ('Q:' in revised_text or 'Hỏi:' in revised_text) or not ('A:' in revised_text or 'Đáp:' in revised_text):
+                logger.warning(f"Chunk {i} in document {doc_id} may not be in proper Q&A format")
+            
+            paragraph_number = str(i)  
+            chunk_id = f"{doc_id}_paragraph_{paragraph_number}"
+            
+            metadata = {
+                'document_topic': doc_topic,
+                'chunk_topic': chunk['chunk_topic'].strip(),
+                'paragraph': chunk['index'],
+                'original_text': original_text,
+                'revised_chunk': revised_text,
+                'original_id': doc_id,
+                'unit': unit.strip() if unit else ''
+            }
+            
+            if duplicate_info and isinstance(duplicate_info, dict):
+                if 'duplicate_group_id' in duplicate_info and 'document_ids' in duplicate_info:
+                    metadata.update({
+                        'duplicate_group_id': duplicate_info['duplicate_group_id'],
+                        'is_original': True,
+                        'duplicate_count': len(duplicate_info['document_ids'])
+                    })
+            
+            formatted_chunk = f"""
                 DOCUMENT TOPIC: {doc_topic}
                 CHUNK TOPIC: {chunk['chunk_topic']}
 
@@ -141,42 +272,139 @@ class ChromaManager:
                 ORIGINAL TEXT: 
                 {original_text}
                 """.strip()
-                
-                chunk_objects.append({
-                    'id': chunk_id,
-                    'metadata': metadata,
-                    'content': formatted_chunk
-                })
-            
+
+            chunk_objects.append({
+                'id': chunk_id,
+                'metadata': metadata,
+                'content': formatted_chunk
+            })
+
+        if not chunk_objects:
+            logger.warning(f"No valid chunks to add for document {doc_id}")
+        # one LLM call per chunk, all of them in flight before the first upsert
+        questions = self._generate_followup_questions_many([(c['id'], c['content']) for c in chunk_objects])
+        for chunk in chunk_objects:
+            chunk['metadata']['followup_questions'] = questions[chunk['id']]
+        return chunk_objects
+
+    def add_chunks(self, doc_id: str, chunks_data: Dict, unit: str = '', duplicate_info: Dict = None) -> bool:
+        """
+        Add chunks to ChromaDB and update document state.
+
+        Args:
+            doc_id (str): ID of document
+            chunks_data (Dict): Chunk data from GPT
+            unit (str, optional): Unit of document
+            duplicate_info (Dict, optional): Information about duplicate documents
+
+        Returns:
+            bool: True on success, False on error
+        """
+        try:
+            chunk_objects = self._build_chunk_objects(doc_id, chunks_data, unit, duplicate_info)
+            if chunk_objects is None:
+                return False
+            if not chunks_data['CHUNKS']:
+                return True
             if not chunk_objects:
-                logger.warning(f"No valid chunks to add for document {doc_id}")
                 return False
             
-            retry_count = 0
-            while retry_count < self.max_retries:
-                try:
-                    self.collection.add(
-                        ids=[c['id'] for c in chunk_objects],
-                        documents=[c['content'] for c in chunk_objects],
-                        metadatas=[c['metadata'] for c in chunk_objects]
-                    )
-                    logger.info(f"Successfully added {len(chunk_objects)} chunks for document {doc_id}")
-                    return True
-                    
-                except Exception as e:
-                    retry_count += 1
-                    if retry_count < self.max_retries:
-                        wait_time = self.retry_delay * (2 ** (retry_count - 1))
-                        logger.warning(f"Retry {retry_count}/{self.max_retries} after {wait_time}s for document {doc_id}")
-                        time.sleep(wait_time)
-                    else:
-                        logger.error(f"Failed to add chunks after {self.max_retries} retries for document {doc_id}: {str(e)}")
-                        return False
+            result = self.upsert_chunks(chunk_objects)
+            if result['failed']:
+                logger.error(f"Failed to add {len(result['failed'])} of {len(chunk_objects)} chunks for document {doc_id}: "
+                             f"{json.dumps(result['failed'], ensure_ascii=False)}")
+                return False
+            logger.info(f"Successfully added {len(chunk_objects)} chunks for document {doc_id}")
+            return True
                         
         except Exception as e:
             logger.error(f"Error adding chunks for document {doc_id}: {str(e)}")
             logger.error(traceback.format_exc())
             return False
+
+    def _upsert_batches(self, chunk_objects: List[Dict]) -> List[List[Dict]]:
+        batch_size = CHROMA_UPSERT_BATCH_SIZE
+        try:
+            batch_size = min(batch_size, self.client.get_max_batch_size())
+        except Exception:
+            pass
+        batches, batch, batch_chars = [], [], 0
+        for chunk in chunk_objects:
+            chars = len(chunk['content']) + len(json.dumps(chunk['metadata'], ensure_ascii=False))
+            if batch and (len(batch) >= batch_size or batch_chars + chars > CHROMA_UPSERT_BATCH_CHARS):
+                batches.append(batch)
+                batch, batch_chars = [], 0
+            batch.append(chunk)
+            batch_chars += chars
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _upsert_batch(self, batch: List[Dict], failed: Dict[str, str]):
+        """
+        Upsert one batch. Connection, timeout and rate limit errors of the embedding API or of
+        Chroma retry the whole batch with backoff; any other error is blamed on the records,
+        and the batch is split in halves until the failing chunks are isolated.
+        """
+        retry_count = 0
+        while True:
+            try:
+                embeddings = self.embedding_cache.embed([c['content'] for c in batch])
+                self.collection.upsert(
+                    ids=[c['id'] for c in batch],
+                    embeddings=embeddings,
+                    documents=[c['content'] for c in batch],
+                    metadatas=[c['metadata'] for c in batch]
+                )
+                return
+            except TRANSIENT_UPSERT_ERRORS as e:
+                retry_count += 1
+                if retry_count >= self.max_retries:
+                    logger.error(f"Failed to upsert {len(batch)} chunks after {self.max_retries} attempts: {str(e)}")
+                    failed.update({c['id']: str(e) for c in batch})
+                    return
+                wait_time = self.retry_delay * (2 ** (retry_count - 1))
+                logger.warning(f"Retry {retry_count}/{self.max_retries} after {wait_time}s for a batch of "
+                               f"{len(batch)} chunks: {str(e)}")
+                time.sleep(wait_time)
+            except Exception as e:
+                if len(batch) > 1:
+                    logger.warning(f"Upsert of {len(batch)} chunks failed, splitting the batch: {str(e)}")
+                    middle = len(batch) // 2
+                    self._upsert_batch(batch[:middle], failed)
+                    self._upsert_batch(batch[middle:], failed)
+                else:
+                    logger.error(f"Failed to upsert chunk {batch[0]['id']}: {str(e)}")
+                    failed[batch[0]['id']] = str(e)
+                return
+
+    def upsert_chunks(self, chunk_objects: List[Dict]) -> Dict[str, Any]:
+        """
+        Write chunks of any number of documents with collection.upsert.
+
+        Chunks are sent in batches bounded by CHROMA_UPSERT_BATCH_SIZE chunks and
+        CHROMA_UPSERT_BATCH_CHARS characters, each embedded in one call through the
+        embedding cache. A batch that loses its connection, times out or is rate limited is
+        retried as a whole; any other failure splits it until the failing chunks are found, so
+        one bad chunk neither fails nor re-sends the rest.
+
+        Args:
+            chunk_objects (List[Dict]): id, content and metadata of every chunk
+
+        Returns:
+            Dict[str, Any]: succeeded (chunk IDs) and failed (chunk ID -> error)
+        """
+        failed: Dict[str, str] = {}
+        started = time.time()
+        batches = self._upsert_batches(chunk_objects)
+        for batch in batches:
+            self._upsert_batch(batch, failed)
+        succeeded = [c['id'] for c in chunk_objects if c['id'] not in failed]
+        if succeeded:
+            self._bump_collection_version()
+        logger.info(f"Upserted {len(succeeded)}/{len(chunk_objects)} chunks in {len(batches)} batches "
+                    f"in {time.time() - started:.2f}s")
+        return {"succeeded": succeeded, "failed": failed}
     
     def delete_document_chunks(self, doc_id: str) -> bool:
         """
@@ -197,6 +425,7 @@ class ChromaManager:
                 chunk_ids = results['ids']
                 
                 self.collection.delete(where=where_condition)
+                self._bump_collection_version()
                 
                 logger.info(f"Successfully deleted {len(chunk_ids)} chunks for document {doc_id}")
                 return True
@@ -326,55 +555,68 @@ class ChromaManager:
         Returns:
             bool: True if update successful, False otherwise
         """
+        result = self.update_chunks([{"chunk_id": chunk_id, "new_content": new_content, "metadata": metadata}])
+        return chunk_id in result['succeeded']
+
+    def update_chunks(self, updates: List[Dict]) -> Dict[str, Any]:
+        """
+        Update the content and metadata of many chunks with one read and batched upserts.
+
+        Args:
+            updates (List[Dict]): chunk_id, new_content and optionally metadata of every chunk
+
+        Returns:
+            Dict[str, Any]: succeeded (chunk IDs) and failed (chunk ID -> error)
+        """
+        failed: Dict[str, str] = {}
         try:
-            logger.info(f"Starting update for chunk {chunk_id}")
-            
-            results = self.collection.get(
-                ids=[chunk_id],
-                include=['metadatas', 'documents']  
-            )
+            chunk_ids = [update.get('chunk_id') for update in updates if update.get('chunk_id')]
+            logger.info(f"Starting update for {len(chunk_ids)} chunks")
             
-            if not results or not results['ids']:
-                logger.error(f"Chunk {chunk_id} not found")
-                return False
-                
-            current_metadata = results['metadatas'][0] if results['metadatas'] else {}
-            if metadata:
-                current_metadata.update(metadata)
-            current_metadata['updated_at'] = datetime.now().isoformat()
-
-            embedding_function = self.collection._embedding_function
-            if not embedding_function:
-                logger.error("No embedding function found")
-                return False
-                
-            embeddings = embedding_function([new_content])
-            if not embeddings or len(embeddings) == 0:
-                logger.error("Failed to create new embedding")
-                return False
+            results = self.collection.get(ids=chunk_ids, include=['metadatas', 'documents']) if chunk_ids else None
+            current, stored = {}, {}
+            if results and results['ids']:
+                current = dict(zip(results['ids'], results['metadatas'] or [{}] * len(results['ids'])))
+                stored = dict(zip(results['ids'], results['documents'] or [None] * len(results['ids'])))
 
-            if not isinstance(embeddings, list) or len(embeddings) != 1:
-                logger.error("Invalid embedding format")
-                return False
+            chunk_objects = []
+            regenerate = []
+            for update in updates:
+                chunk_id = update.get('chunk_id')
+                if chunk_id not in current:
+                    logger.error(f"Chunk {chunk_id} not found")
+                    failed[str(chunk_id)] = "Chunk not found"
+                    continue
+                new_content = update.get('new_content', '')
+                metadata = update.get('metadata')
+                current_metadata = current[chunk_id] or {}
+                if metadata:
+                    current_metadata.update(metadata)
+                # the stored questions still fit an unchanged content
+                if (not metadata or 'followup_questions' not in metadata) and new_content != stored.get(chunk_id):
+                    regenerate.append((chunk_id, new_content))
+                current_metadata['updated_at'] = datetime.now().isoformat()
+                chunk_objects.append({
+                    'id': chunk_id,
+                    'metadata': current_metadata,
+                    'content': new_content
+                })
 
-            try:
-                self.collection.update(
-                    ids=[chunk_id],
-                    embeddings=embeddings,  
-                    documents=[new_content],
-                    metadatas=[current_metadata]
-                )
-                logger.info(f"Successfully updated chunk {chunk_id}")
-                return True
-                
-            except Exception as e:
-                logger.error(f"Failed to update chunk: {str(e)}")
-                return False
+            questions = self._generate_followup_questions_many(regenerate)
+            for chunk in chunk_objects:
+                if chunk['id'] in questions:
+                    chunk['metadata']['followup_questions'] = questions[chunk['id']]
+
+            result = self.upsert_chunks(chunk_objects) if chunk_objects else {"succeeded": [], "failed": {}}
+            failed.update(result['failed'])
+            return {"succeeded": result['succeeded'], "failed": failed}
                 
         except Exception as e:
-            logger.error(f"Error updating chunk {chunk_id}: {str(e)}")
+            logger.error(f"Error updating chunks: {str(e)}")
             logger.error(traceback.format_exc())
-            return False
+            for update in updates:
+                failed.setdefault(str(update.get('chunk_id')), str(e))
+            return {"succeeded": [], "failed": failed}
     
     def update_chunk_metadata(self, chunk_id: str, metadata: dict) -> bool:
         """
@@ -451,6 +693,7 @@ class ChromaManager:
                     metadatas=[merged_metadata],
                     documents=[modified_document]
                 )
+                self._bump_collection_version()
                 
                 if is_updating_enabled and doc_id and previous_enabled_state != new_enabled_state:
                     try:
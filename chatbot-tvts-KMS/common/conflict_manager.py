@@ -15,6 +15,12 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# External conflicts are only analyzed between a chunk and its nearest chunks of other
+# documents in the Chroma collection, at most this many per chunk...
+CONFLICT_NEIGHBORS_PER_CHUNK = int(os.getenv('CONFLICT_NEIGHBORS_PER_CHUNK', 5))
+# ...with at least this cosine similarity
+CONFLICT_NEIGHBOR_MIN_SIMILARITY = float(os.getenv('CONFLICT_NEIGHBOR_MIN_SIMILARITY', 0.5))
+
 class ConflictAnalyzer:
     def __init__(self, api_key: str):
         self.cache = {}
@@ -59,7 +65,8 @@ class ConflictAnalyzer:
                 conflicting_parts=[],
                 analyzed_at=datetime.now(),
                 chunk_ids=[],
-                conflict_type=conflict_type
+                conflict_type=conflict_type,
+                error=str(e)
             )
             
     def analyze_content(self, content: str) -> ConflictResult:
@@ -85,7 +92,8 @@ class ConflictAnalyzer:
 
             result = self.analyzer.analyze_conflict(content, conflict_type="content")
             
-            self.cache[cache_key] = result
+            if not result.error:
+                self.cache[cache_key] = result
             
             return result
 
@@ -97,7 +105,8 @@ class ConflictAnalyzer:
                 conflicting_parts=[],
                 analyzed_at=datetime.now(),
                 chunk_ids=[],
-                conflict_type="content"
+                conflict_type="content",
+                error=str(e)
             )
     
     def analyze_chunks(self, chunks: List[tuple[str, str]], conflict_type="internal") -> ConflictResult:
@@ -149,18 +158,14 @@ class ConflictAnalyzer:
                 result.chunk_ids = [c[0] for c in chunks]
                 result.conflict_type = conflict_type
                 
-                if len(chunks) == 2:
+                if len(chunks) == 2 and not result.error:
                     self.cache[pair_key] = result
                     
                 return result
             else:
-                all_conflicts = []
-                for i in range(len(chunks) - 1):
-                    for j in range(i + 1, len(chunks)):
-                        chunk_pair = [chunks[i], chunks[j]]
-                        conflict = self.analyze_chunks(chunk_pair, conflict_type)
-                        if conflict.has_conflict:
-                            all_conflicts.append(conflict)
+                chunk_pairs = [(chunks[i], chunks[j]) for i in range(len(chunks) - 1) for j in range(i + 1, len(chunks))]
+                all_conflicts = [conflict for conflict in self.analyze_chunk_pairs(chunk_pairs, conflict_type)
+                                 if conflict.has_conflict]
                 
                 if all_conflicts:
                     return ConflictResult(
@@ -189,9 +194,58 @@ class ConflictAnalyzer:
                 conflicting_parts=[],
                 analyzed_at=datetime.now(),
                 chunk_ids=[c[0] for c in chunks] if chunks else [],
-                conflict_type=conflict_type  
+                conflict_type=conflict_type,
+                error=str(e)
             )
     
+    def analyze_chunk_pairs(self, chunk_pairs: List[tuple], conflict_type="internal") -> List[ConflictResult]:
+        """Analyzing Conflicts of many chunk pairs, packed into batched OpenAI prompts
+        
+        Args:
+            chunk_pairs: List of ((chunk_id, content), (chunk_id, content)) pairs
+            conflict_type: Type of conflict analysis to perform ('internal', 'external', or others)
+            
+        Returns:
+            List[ConflictResult]: One result per pair, in order
+        """
+        results = [None] * len(chunk_pairs)
+        pending = []
+        for index, (chunk1, chunk2) in enumerate(chunk_pairs):
+            sorted_ids = sorted([chunk1[0], chunk2[0]])
+            pair_key = f"{conflict_type}_{sorted_ids[0]}_{sorted_ids[1]}"
+            if pair_key in self.cache:
+                self.cache_hits += 1
+                results[index] = self.cache[pair_key]
+            else:
+                self.cache_misses += 1
+                pending.append((index, pair_key))
+
+        if pending:
+            try:
+                batch_results = self.analyzer.analyze_pairs(
+                    [(chunk_pairs[index][0][1], chunk_pairs[index][1][1]) for index, _ in pending],
+                    conflict_type=conflict_type
+                )
+            except Exception as e:
+                logger.error(f"Error parsing chunk pairs: {str(e)}")
+                batch_results = [ConflictResult(
+                    has_conflict=False,
+                    explanation=f"Lỗi phân tích: {str(e)}",
+                    conflicting_parts=[],
+                    analyzed_at=datetime.now(),
+                    chunk_ids=[],
+                    conflict_type=conflict_type,
+                    error=str(e)
+                ) for _ in pending]
+            for (index, pair_key), result in zip(pending, batch_results):
+                result.chunk_ids = [chunk_pairs[index][0][0], chunk_pairs[index][1][0]]
+                result.conflict_type = conflict_type
+                # failed analyses are retried by the next run
+                if not result.error:
+                    self.cache[pair_key] = result
+                results[index] = result
+        return results
+    
 class ConflictManager:
     def __init__(self, db_manager: DatabaseManager, chroma_manager: ChromaManager):
         self.db = db_manager
@@ -305,6 +359,8 @@ class ConflictManager:
             return None
     
     def _update_cache(self, key, result):
+        if getattr(result, 'error', None):
+            return
         self.conflict_cache[key] = (result, datetime.now())
 
     def _is_cache_valid(self, doc_id):
@@ -844,6 +900,7 @@ class ConflictManager:
                 return []
             
             results = []
+            pairs_to_analyze = []
             
             for i in range(len(enabled_chunks)):
                 for j in range(i+1, len(enabled_chunks)):
@@ -864,20 +921,23 @@ class ConflictManager:
                             results.append(cached_result)
                         continue
                     
+                    pairs_to_analyze.append((cache_key, chunk1, chunk2))
+            
+            # all pairs of the document go out in a few batched prompts
+            logger.info(f"Analyze {len(pairs_to_analyze)} chunk pairs of document {doc_id}")
+            pair_results = self.analyzer.analyze_chunk_pairs([
+                ((chunk1['id'], chunk1['original_text']), (chunk2['id'], chunk2['original_text']))
+                for _, chunk1, chunk2 in pairs_to_analyze
+            ], conflict_type="internal")
+            
+            for (cache_key, chunk1, chunk2), result in zip(pairs_to_analyze, pair_results):
+                result.conflict_type = "internal"
                 
-                    logger.info(f"Analyze conflict between {chunk1['id']} and {chunk2['id']}")
-                    result = self.analyzer.analyze_chunks([
-                        (chunk1['id'], chunk1['original_text']),
-                        (chunk2['id'], chunk2['original_text'])
-                    ], conflict_type="internal")
-                    
-                    result.conflict_type = "internal"
-                    
-                    self._update_cache(cache_key, result)
-                    
-                    if result.has_conflict:
-                        logger.info(f"Detected a conflict between {chunk1['id']} and {chunk2['id']}")
-                        results.append(result)
+                self._update_cache(cache_key, result)
+                
+                if result.has_conflict:
+                    logger.info(f"Detected a conflict between {chunk1['id']} and {chunk2['id']}")
+                    results.append(result)
                         
             logger.info(f"Detected {len(results)} internal conflicts in document {doc_id}")
             return results
@@ -887,10 +947,83 @@ class ConflictManager:
             logger.error(traceback.format_exc())
             return []
     
+    @staticmethod
+    def _is_enabled(metadata) -> bool:
+        is_enabled = (metadata or {}).get('is_enabled', True)
+        if isinstance(is_enabled, str):
+            is_enabled = is_enabled.lower() == 'true'
+        return bool(is_enabled)
+
+    @staticmethod
+    def _similarity(distance: float, space: str) -> float:
+        # OpenAI embeddings have unit length: l2 distances are squared, 2 - 2 * cosine
+        if space == 'l2':
+            return 1 - distance / 2
+        return 1 - distance
+
+    def _nearest_external_chunks(self, doc_id: str, chunks: List[Dict]) -> Dict[str, List[tuple]]:
+        """
+        Topical neighbours of the chunks of a document among the chunks of all other documents.
+
+        Every chunk is queried with its stored embedding in a single Chroma query for its
+        CONFLICT_NEIGHBORS_PER_CHUNK nearest enabled chunks of other documents with a
+        similarity of at least CONFLICT_NEIGHBOR_MIN_SIMILARITY.
+
+        Args:
+            doc_id (str): ID of the document being analyzed
+            chunks (List[Dict]): Its enabled chunks
+
+        Returns:
+            Dict[str, List[tuple]]: (chunk, neighbour chunk) pairs by ID of the neighbour's document
+        """
+        collection = self.chroma_manager.collection
+        stored = collection.get(ids=[chunk['id'] for chunk in chunks], include=['embeddings'])
+        embeddings = dict(zip(stored['ids'], stored['embeddings'] if stored['embeddings'] is not None else []))
+        queried = [chunk for chunk in chunks if embeddings.get(chunk['id']) is not None]
+        if not queried:
+            return {}
+
+        # the chunks of a duplicate are stored under the document they were chunked from
+        own_sources = sorted({doc_id} | {chunk.get('metadata', {}).get('original_id') for chunk in chunks} - {None})
+        results = collection.query(
+            query_embeddings=[list(embeddings[chunk['id']]) for chunk in queried],
+            # extra results make up for the disabled chunks filtered below
+            n_results=CONFLICT_NEIGHBORS_PER_CHUNK * 2,
+            where={"original_id": {"$nin": own_sources}},
+            include=['documents', 'metadatas', 'distances']
+        )
+        space = (collection.metadata or {}).get('hnsw:space', 'l2')
+
+        pairs_by_doc = {}
+        for chunk, ids, documents, metadatas, distances in zip(
+            queried, results['ids'], results['documents'], results['metadatas'], results['distances']
+        ):
+            kept = 0
+            for neighbour_id, content, metadata, distance in zip(ids, documents, metadatas, distances):
+                if kept >= CONFLICT_NEIGHBORS_PER_CHUNK or self._similarity(distance, space) < CONFLICT_NEIGHBOR_MIN_SIMILARITY:
+                    break
+                if not self._is_enabled(metadata):
+                    continue
+                related_doc_id = metadata.get('original_id')
+                neighbour = {
+                    'id': neighbour_id,
+                    'document_topic': metadata.get('document_topic'),
+                    'chunk_topic': metadata.get('chunk_topic'),
+                    'paragraph': metadata.get('paragraph'),
+                    'original_text': metadata.get('original_text', ''),
+                    'revised_chunk': metadata.get('revised_chunk'),
+                    'metadata': {**metadata, 'doc_id': related_doc_id},
+                    'unit': metadata.get('unit')
+                }
+                pairs_by_doc.setdefault(related_doc_id, []).append((chunk, neighbour))
+                kept += 1
+        return pairs_by_doc
+
     def analyze_external_conflicts(self, doc_id, chunks):
         """
         Analyze conflicts between this document and other documents.
-        Optimized to avoid duplicate analysis and track processed pairs.
+        Documents of its duplicate group are compared chunk by chunk; otherwise each chunk is
+        only compared with its nearest chunks of the whole corpus, see _nearest_external_chunks.
         
         Args:
             doc_id: ID of the document being analyzed
@@ -942,13 +1075,21 @@ class ConflictManager:
                 logger.info(f"Found {len(related_docs)} related documents in the same group")
             
             
+            pairs_by_doc = {}
             if not related_docs:
-                other_docs = self._get_all_documents_except(doc_id)
-                
-                max_docs_to_check = 10 
-                related_docs = other_docs[:max_docs_to_check]
-                
-                logger.info(f"No group found. Using {len(related_docs)} other documents for comparison")
+                try:
+                    pairs_by_doc = self._nearest_external_chunks(doc_id, enabled_chunks)
+                    logger.info(f"No group found. Found {sum(len(pairs) for pairs in pairs_by_doc.values())} "
+                                f"neighbouring chunk pairs in {len(pairs_by_doc)} other documents")
+                except Exception as neighbor_error:
+                    logger.error(f"Nearest chunk search failed, using the latest documents: {str(neighbor_error)}")
+                    logger.error(traceback.format_exc())
+                    other_docs = self._get_all_documents_except(doc_id)
+                    
+                    max_docs_to_check = 10 
+                    related_docs = other_docs[:max_docs_to_check]
+                    
+                    logger.info(f"Using {len(related_docs)} other documents for comparison")
             
             for related_doc in related_docs:
                 related_doc_id = related_doc['id']
@@ -960,59 +1101,49 @@ class ConflictManager:
                     
                 processed_doc_pairs.add(doc_pair)
                 
-                try:
-                    related_chunks = self._get_document_chunks(related_doc_id)
-                    if not related_chunks:
-                        logger.info(f"No chunk found for document {related_doc_id}")
-                        continue
-                        
-                    enabled_related_chunks = []
-                    for chunk in related_chunks:
-                        metadata = chunk.get('metadata', {})
-                        is_enabled = metadata.get('is_enabled', True)
-                        if isinstance(is_enabled, str):
-                            is_enabled = is_enabled.lower() == 'true'
-                        if is_enabled:
-                            if 'metadata' not in chunk:
-                                chunk['metadata'] = {}
-                            chunk['metadata']['doc_id'] = related_doc_id
-                            enabled_related_chunks.append(chunk)
-                        else:
-                            logger.info(f"Skipping disabled chunk {chunk.get('id')} from related document {related_doc_id}")
+                related_chunks = self._get_document_chunks(related_doc_id)
+                if not related_chunks:
+                    logger.info(f"No chunk found for document {related_doc_id}")
+                    continue
                     
-                    if not enabled_related_chunks:
-                        logger.info(f"No enabled chunks found for related document {related_doc_id}")
-                        continue
-                        
-                    logger.info(f"Compare document {doc_id} ({len(enabled_chunks)} chunks) with document {related_doc_id} ({len(enabled_related_chunks)} chunks)")
+                enabled_related_chunks = []
+                for chunk in related_chunks:
+                    if self._is_enabled(chunk.get('metadata', {})):
+                        chunk['metadata']['doc_id'] = related_doc_id
+                        enabled_related_chunks.append(chunk)
+                    else:
+                        logger.info(f"Skipping disabled chunk {chunk.get('id')} from related document {related_doc_id}")
+                
+                if not enabled_related_chunks:
+                    logger.info(f"No enabled chunks found for related document {related_doc_id}")
+                    continue
                     
+                logger.info(f"Compare document {doc_id} ({len(enabled_chunks)} chunks) with document {related_doc_id} ({len(enabled_related_chunks)} chunks)")
+                pairs_by_doc[related_doc_id] = [(chunk1, chunk2) for chunk1 in enabled_chunks for chunk2 in enabled_related_chunks]
+            
+            for related_doc_id, chunk_pairs in pairs_by_doc.items():
+                try:
                     chunk_pairs_to_analyze = []
                     
-                    for chunk1 in enabled_chunks:
-                        chunk1_id = chunk1['id']
+                    for chunk1, chunk2 in chunk_pairs:
+                        pair_key = '_'.join(sorted([chunk1['id'], chunk2['id']]))
                         
-                        for chunk2 in enabled_related_chunks:
-                            chunk2_id = chunk2['id']
-                            
-                            pair_key = '_'.join(sorted([chunk1_id, chunk2_id]))
+                        if pair_key in processed_chunk_pairs:
+                            continue
                             
-                            if pair_key in processed_chunk_pairs:
-                                continue
-                                
-                            processed_chunk_pairs.add(pair_key)
-                            chunk_pairs_to_analyze.append((chunk1, chunk2))
+                        processed_chunk_pairs.add(pair_key)
+                        chunk_pairs_to_analyze.append((chunk1, chunk2))
                     
                     logger.info(f"Analyzing {len(chunk_pairs_to_analyze)} unique chunk pairs between documents {doc_id} and {related_doc_id}")
                     
-                    for chunk1, chunk2 in chunk_pairs_to_analyze:
+                    pair_results = self.analyzer.analyze_chunk_pairs([
+                        ((chunk1['id'], chunk1.get('original_text', '')), (chunk2['id'], chunk2.get('original_text', '')))
+                        for chunk1, chunk2 in chunk_pairs_to_analyze
+                    ], conflict_type="external")
+                    
+                    for (chunk1, chunk2), result in zip(chunk_pairs_to_analyze, pair_results):
                         chunk1_id = chunk1['id']
                         chunk2_id = chunk2['id']
-                        logger.info(f"Analyze external conflicts between {chunk1_id} and {chunk2_id}")
-                        
-                        result = self.analyzer.analyze_chunks([
-                            (chunk1_id, chunk1.get('original_text', '')),
-                            (chunk2_id, chunk2.get('original_text', ''))
-                        ], conflict_type="external")
                         
                         result.conflict_type = "external"
                         
@@ -83,29 +83,20 @@ class ConflictProcessor:
                     })
                 return
 
-            
-            for pair in chunk_pairs:
-                try:
-                    success = self.chroma_manager.update_chunk(
-                        chunk_id=pair.get('chunk_id'),
-                        new_content=pair.get('new_content', '')
-                    )
-                    if success is not True:  
-                        self.logger.error(f"Failed to update chunk {pair.get('chunk_id')}")
-                        if callback:
-                            callback("update", {
-                                "status": "error",
-                                "message": f"Không thể cập nhật chunk {pair.get('chunk_id')}"
-                            })
-                        return
-                except Exception as e:
-                    self.logger.error(f"Error updating chunk: {str(e)}")
-                    if callback:
-                        callback("update", {
-                            "status": "error",
-                            "message": f"Lỗi cập nhật: {str(e)}"
-                        })
-                    return
+            result = self.chroma_manager.update_chunks([
+                {"chunk_id": pair.get('chunk_id'), "new_content": pair.get('new_content', '')}
+                for pair in chunk_pairs
+            ])
+            if result['failed']:
+                self.logger.error(f"Failed to update chunks of doc {doc_id}: {json.dumps(result['failed'], ensure_ascii=False)}")
+                if callback:
+                    callback("update", {
+                        "status": "error",
+                        "message": f"Không thể cập nhật chunk {', '.join(result['failed'])}",
+                        "failed": result['failed'],
+                        "succeeded": result['succeeded']
+                    })
+                return
 
             self.logger.info(f"Successfully updated {len(chunk_pairs)} chunks for doc {doc_id}")
             if callback:
@@ -15,6 +15,8 @@ from typing import List, Dict, Any
 import traceback
 import time
 
+from common.document_fingerprint import compute_fingerprint
+
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -276,6 +278,27 @@ class DatabaseManager:
                     ) THEN
                         ALTER TABLE documents ADD COLUMN original_chunked_doc VARCHAR(100);
                     END IF;
+
+                    IF NOT EXISTS (
+                        SELECT 1 FROM information_schema.columns 
+                        WHERE table_name = 'documents' AND column_name = 'normalized_text'
+                    ) THEN
+                        ALTER TABLE documents ADD COLUMN normalized_text TEXT;
+                    END IF;
+
+                    IF NOT EXISTS (
+                        SELECT 1 FROM information_schema.columns 
+                        WHERE table_name = 'documents' AND column_name = 'content_hash'
+                    ) THEN
+                        ALTER TABLE documents ADD COLUMN content_hash VARCHAR(64);
+                    END IF;
+
+                    IF NOT EXISTS (
+                        SELECT 1 FROM information_schema.columns 
+                        WHERE table_name = 'documents' AND column_name = 'numeric_tokens'
+                    ) THEN
+                        ALTER TABLE documents ADD COLUMN numeric_tokens TEXT[];
+                    END IF;
                 END $$;
             """
 
@@ -452,6 +475,13 @@ class DatabaseManager:
                     ) THEN
                         CREATE INDEX IF NOT EXISTS idx_documents_needs_reanalysis ON documents(needs_conflict_reanalysis);
                     END IF;
+
+                    IF EXISTS (
+                        SELECT 1 FROM information_schema.columns 
+                        WHERE table_name = 'documents' AND column_name = 'content_hash'
+                    ) THEN
+                        CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents(content_hash);
+                    END IF;
                 END $$;
             """
 
@@ -496,6 +526,85 @@ class DatabaseManager:
                 END $$;
             """
 
+            create_near_duplicate_tables = """
+                CREATE TABLE IF NOT EXISTS document_minhash (
+                    doc_id VARCHAR(100) PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+                    signature BYTEA NOT NULL,
+                    params VARCHAR(50) NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+
+                CREATE TABLE IF NOT EXISTS document_lsh_buckets (
+                    band SMALLINT NOT NULL,
+                    bucket BIGINT NOT NULL,
+                    doc_id VARCHAR(100) NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+                    PRIMARY KEY (band, bucket, doc_id)
+                );
+
+                CREATE INDEX IF NOT EXISTS idx_lsh_buckets_doc_id ON document_lsh_buckets(doc_id);
+            """
+
+            create_embedding_cache_table = """
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model VARCHAR(100) NOT NULL,
+                    content_hash CHAR(64) NOT NULL,
+                    embedding BYTEA NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (model, content_hash)
+                );
+            """
+
+            # The first time, the documents left in the in-memory queues are queued: the unscanned
+            # ones for a scan, the scanned ones waiting for or failed in chunking for processing
+            create_jobs_table = """
+                DO $$
+                BEGIN
+                    IF to_regclass('jobs') IS NULL THEN
+                        CREATE TABLE jobs (
+                            id BIGSERIAL PRIMARY KEY,
+                            queue VARCHAR(50) NOT NULL,
+                            doc_id VARCHAR(100) NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+                            payload JSONB NOT NULL DEFAULT '{}',
+                            priority SMALLINT NOT NULL DEFAULT 0,
+                            status VARCHAR(20) NOT NULL DEFAULT 'queued'
+                                CHECK (status IN ('queued', 'running', 'failed')),
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            max_attempts INTEGER NOT NULL DEFAULT 3,
+                            rerun BOOLEAN NOT NULL DEFAULT false,
+                            run_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                            locked_by VARCHAR(255),
+                            locked_until TIMESTAMP,
+                            last_error TEXT,
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        );
+
+                        INSERT INTO jobs (queue, doc_id)
+                        SELECT 'scan', id FROM documents
+                        WHERE is_valid = true
+                        AND (
+                            scan_status IS NULL
+                            OR scan_status IN ('', 'Pending', 'Queued', 'Scanning')
+                        );
+
+                        INSERT INTO jobs (queue, doc_id)
+                        SELECT 'process', id FROM documents
+                        WHERE is_valid = true
+                        AND is_duplicate IS NOT TRUE
+                        AND scan_status NOT IN ('', 'Pending', 'Queued', 'Scanning')
+                        AND (
+                            chunk_status IN ('Processing', 'Chunking', 'ChunkingFailed')
+                            OR processing_status IN ('Queued', 'Processing')
+                        );
+                    END IF;
+
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_doc
+                        ON jobs(queue, doc_id) WHERE status IN ('queued', 'running');
+                    CREATE INDEX IF NOT EXISTS idx_jobs_ready
+                        ON jobs(queue, priority DESC, run_at) WHERE status IN ('queued', 'running');
+                END $$;
+            """
+
             create_conflicts_table = """
                 DO $$
                 BEGIN
@@ -713,6 +822,9 @@ class DatabaseManager:
                 (create_indexes, "Tạo indexes cho documents"),
                 (create_chunks_table, "Tạo bảng chunks"),
                 (create_conflicts_table, "Tạo bảng conflicts"),
+                (create_near_duplicate_tables, "Tạo bảng near duplicate index"),
+                (create_jobs_table, "Tạo bảng jobs"),
+                (create_embedding_cache_table, "Tạo bảng embedding cache"),
                 (create_procedures, "Tạo stored procedures và functions")
             ]
 
@@ -1040,6 +1152,121 @@ class DatabaseManager:
             logger.error(traceback.format_exc())
             return pd.DataFrame()
     
+    def get_documents_by_ids(self, doc_ids):
+        """
+        Get the documents with the given IDs, with the columns of get_all_documents
+        and the persisted fingerprint (normalized_text, content_hash, numeric_tokens)
+
+        Args:
+            doc_ids (List[str]): IDs of the documents
+
+        Returns:
+            pd.DataFrame: The documents found, newest first
+        """
+        if not doc_ids:
+            return pd.DataFrame()
+        try:
+            with self.engine.connect() as conn:
+                query = text("""
+                    SELECT 
+                        id, content, categories, tags, 
+                        start_date, end_date, unit, sender,
+                        created_date, approval_status, approver, 
+                        approval_date, is_duplicate, duplicate_group_id,
+                        processing_status, scan_status, chunk_status,
+                        modified_date, similarity_score, original_chunked_doc,
+                        conflict_status, has_conflicts,
+                        normalized_text, content_hash, numeric_tokens
+                    FROM documents 
+                    WHERE id = ANY(:doc_ids)
+                    ORDER BY created_date DESC
+                """)
+                return pd.read_sql(query, conn, params={"doc_ids": list(doc_ids)})
+        except Exception as e:
+            logger.error(f"Error in get_documents_by_ids: {str(e)}")
+            logger.error(traceback.format_exc())
+            return pd.DataFrame()
+
+    def get_document_ids_by_content_hash(self, content_hash, exclude_id=None):
+        """
+        Get the IDs of the documents whose normalized content has the given hash (exact duplicates)
+
+        Args:
+            content_hash (str): SHA-256 of the normalized content
+            exclude_id (str): ID of a document to leave out
+
+        Returns:
+            List[str]: IDs of the matching documents
+        """
+        try:
+            rows = self.execute_with_retry(
+                "SELECT id FROM documents WHERE content_hash = %s AND id IS DISTINCT FROM %s",
+                (content_hash, exclude_id), fetch=True)
+            return [row[0] for row in rows or []]
+        except Exception as e:
+            logger.error(f"Error in get_document_ids_by_content_hash: {str(e)}")
+            return []
+
+    def save_document_fingerprint(self, doc_id, content):
+        """
+        Compute and persist the fingerprint of a document's content
+
+        Args:
+            doc_id (str): ID of the document
+            content (str): Raw content of the document
+
+        Returns:
+            Dict[str, Any]: The fingerprint, see compute_fingerprint
+        """
+        fingerprint = compute_fingerprint(content)
+        try:
+            self._store_document_fingerprint(doc_id, fingerprint)
+        except Exception as e:
+            logger.error(f"Error saving fingerprint of document {doc_id}: {str(e)}")
+        return fingerprint
+
+    def _store_document_fingerprint(self, doc_id, fingerprint):
+        self.execute_with_retry("""
+            UPDATE documents
+            SET normalized_text = %s, content_hash = %s, numeric_tokens = %s::text[]
+            WHERE id = %s
+        """, (fingerprint['normalized_text'], fingerprint['content_hash'],
+              fingerprint['numeric_tokens'], doc_id))
+
+    def backfill_document_fingerprints(self, batch_size=200):
+        """
+        Compute the fingerprint of the documents stored before fingerprints were persisted
+
+        Args:
+            batch_size (int): Number of documents read per query
+
+        Returns:
+            Dict[str, int]: Number of documents fingerprinted and failed
+        """
+        stats = {"fingerprinted": 0, "failed": 0}
+        # documents whose fingerprint could not be saved are not selected again in this run
+        failed = []
+        while True:
+            rows = self.execute_with_retry("""
+                SELECT id, content FROM documents
+                WHERE content_hash IS NULL
+                  AND NOT (id = ANY(%s::varchar[]))
+                ORDER BY created_date
+                LIMIT %s
+            """, (failed, batch_size), fetch=True)
+            if not rows:
+                break
+            for doc_id, content in rows:
+                try:
+                    self._store_document_fingerprint(doc_id, compute_fingerprint(content or ''))
+                    stats["fingerprinted"] += 1
+                except Exception as e:
+                    logger.error(f"Error saving fingerprint of document {doc_id}: {str(e)}")
+                    failed.append(doc_id)
+                    stats["failed"] += 1
+        logger.info(f"Document fingerprint backfill: {stats}")
+        return stats
+
     def get_document_by_id(self, doc_id):
         try:
             with self.engine.connect() as conn:
@@ -2218,11 +2445,14 @@ class DatabaseManager:
                     id, content, categories, tags,
                     start_date, end_date, unit, sender,
                     processing_status, scan_status, chunk_status,
-                    approval_status, is_valid, created_date
+                    approval_status, is_valid, created_date,
+                    normalized_text, content_hash, numeric_tokens
                 ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                    %s, %s, %s::text[]
                 ) RETURNING id, created_date;
             """
+            fingerprint = compute_fingerprint(doc_data['content'])
             
             params = (
                 doc_id,
@@ -2238,7 +2468,10 @@ class DatabaseManager:
                 'Pending',    # initial chunk_status
                 'Pending',    # initial approval_status
                 doc_data.get('is_valid', True),
-                current_timestamp 
+                current_timestamp,
+                fingerprint['normalized_text'],
+                fingerprint['content_hash'],
+                fingerprint['numeric_tokens']
             )
 
             result = self.execute_with_retry(query, params, fetch=True)
@@ -2246,6 +2479,7 @@ class DatabaseManager:
                 inserted_id = result[0][0]
                 created_date = result[0][1] if len(result[0]) > 1 else None
                 logger.info(f"Document {inserted_id} inserted successfully with created_date: {created_date}")
+                self._index_near_duplicates(inserted_id, doc_data['content'], fingerprint['normalized_text'])
                 return inserted_id
             else:
                 logger.error("No ID returned from insert")
@@ -2256,6 +2490,14 @@ class DatabaseManager:
             logger.error(traceback.format_exc())
             raise
     
+    def _index_near_duplicates(self, doc_id, content, normalized_text=None):
+        # the scanner backfills documents that could not be indexed here
+        try:
+            from common.near_duplicate_index import NearDuplicateIndex
+            NearDuplicateIndex(self).add(doc_id, content, normalized_text)
+        except Exception as e:
+            logger.warning(f"Could not index document {doc_id} for near duplicates: {str(e)}")
+
     def resolve_conflict(self, conflict_id: str, resolved_by: str, resolution_notes: str = "") -> bool:
         try:
 
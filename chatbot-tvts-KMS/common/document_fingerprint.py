@@ -0,0 +1,50 @@
+import hashlib
+import re
+from typing import Any, Dict, List, Optional
+
+from common.utils import preprocessing
+
+NUMBER_PATTERN = re.compile(r'\b\d+[.,]?\d*\b')
+
+
+def extract_numbers(text: str) -> List[str]:
+    return NUMBER_PATTERN.findall(text or '')
+
+
+def has_numeric_differences(numbers1: List[str], numbers2: List[str]) -> bool:
+    if len(numbers1) != len(numbers2):
+        return True
+    return sorted(numbers1) != sorted(numbers2)
+
+
+def compute_fingerprint(content: str) -> Dict[str, Any]:
+    """
+    Everything the similarity scan needs from a document, computed once per content.
+
+    Args:
+        content (str): Raw content of the document
+
+    Returns:
+        Dict[str, Any]: normalized_text, content_hash (SHA-256 of the normalized text,
+            equal for exact duplicates) and numeric_tokens (numbers of the raw content)
+    """
+    normalized_text = preprocessing(content)
+    return {
+        'normalized_text': normalized_text,
+        'content_hash': hashlib.sha256(normalized_text.encode('utf-8')).hexdigest(),
+        'numeric_tokens': extract_numbers(content),
+    }
+
+
+def stored_fingerprint(document) -> Optional[Dict[str, Any]]:
+    """The fingerprint persisted with a document row (dict or Series), None if not computed yet."""
+    if document is None:
+        return None
+    content_hash = document.get('content_hash')
+    if not isinstance(content_hash, str) or not content_hash:
+        return None
+    return {
+        'normalized_text': document.get('normalized_text') or '',
+        'content_hash': content_hash,
+        'numeric_tokens': list(document.get('numeric_tokens') or []),
+    }
@@ -0,0 +1,106 @@
+import hashlib
+import logging
+import os
+import traceback
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+import psycopg2
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 0 embeds every write through the embedding function
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', '1') == '1'
+# texts sent in one call of the embedding function
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 256))
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embeddings of chunk contents in the embedding_cache table, keyed by (model, sha256 of the
+    content), so re-processing a document or re-chunking unchanged paragraphs never pays for
+    the same embedding twice. Vectors are stored as float32 bytes.
+    """
+
+    def __init__(self, data_manager, embedding_function: Callable[[List[str]], Sequence], model: str):
+        self.data_manager = data_manager
+        self.embedding_function = embedding_function
+        self.model = model or ''
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, hashes: List[str]) -> Dict[str, List[float]]:
+        rows = self.data_manager.execute_with_retry("""
+            SELECT content_hash, embedding FROM embedding_cache
+            WHERE model = %s AND content_hash = ANY(%s)
+        """, (self.model, hashes), fetch=True) or []
+        return {row[0]: np.frombuffer(bytes(row[1]), dtype=np.float32).tolist() for row in rows}
+
+    def _store(self, hashes: List[str], embeddings: List[List[float]]):
+        self.data_manager.execute_with_retry("""
+            INSERT INTO embedding_cache (model, content_hash, embedding)
+            SELECT %s, h, e FROM unnest(%s::varchar[], %s::bytea[]) AS c(h, e)
+            ON CONFLICT (model, content_hash) DO NOTHING
+        """, (self.model, hashes,
+              [psycopg2.Binary(np.asarray(embedding, dtype=np.float32).tobytes()) for embedding in embeddings]))
+
+    def _compute(self, texts: List[str]) -> List[List[float]]:
+        embeddings = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = self.embedding_function(texts[start:start + EMBEDDING_BATCH_SIZE])
+            embeddings.extend(np.asarray(embedding, dtype=np.float32).tolist() for embedding in batch)
+        if len(embeddings) != len(texts):
+            raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+        return embeddings
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """
+        Embeddings of texts, from the cache or from one embedding call for all the misses.
+
+        Args:
+            texts (Sequence[str]): Contents to embed
+
+        Returns:
+            List[List[float]]: One embedding per text, in order
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        if not EMBEDDING_CACHE_ENABLED:
+            return self._compute(texts)
+
+        hashes = [content_hash(text) for text in texts]
+        try:
+            cached = self._load(sorted(set(hashes)))
+        except Exception as e:
+            logger.warning(f"Could not read the embedding cache: {str(e)}")
+            cached = {}
+
+        # identical contents of one write are embedded once
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            computed = self._compute(list(missing.values()))
+            cached.update(zip(missing.keys(), computed))
+            try:
+                self._store(list(missing.keys()), computed)
+            except Exception as e:
+                logger.warning(f"Could not store {len(missing)} embeddings in the cache: {str(e)}")
+                logger.debug(traceback.format_exc())
+
+        logger.info(f"Embeddings: {len(texts) - len(missing)} cached, {len(missing)} computed "
+                    f"(model {self.model})")
+        return [cached[text_hash] for text_hash in hashes]
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
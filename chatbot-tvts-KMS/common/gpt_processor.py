@@ -5,14 +5,22 @@ from datetime import datetime
 import os
 import traceback
 import logging
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 import asyncio
+import time
+from common.section_splitter import split_sections
+from common.token_accounting import count_tokens, count_tokens_batch, estimate_cost
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# token budget of one section of a document sent to the chunking model
+CHUNKING_SECTION_TOKENS = int(os.getenv('CHUNKING_SECTION_TOKENS', 1500))
+# sections of one document chunked at the same time
+CHUNKING_CONCURRENCY = int(os.getenv('CHUNKING_CONCURRENCY', 4))
+
 
 class GPTProcessor:
     def __init__(self):
@@ -25,29 +33,15 @@ class GPTProcessor:
         openai.api_key = self.openai_api_key
         self.client = OpenAI()
        
-        self.has_tiktoken = False
-        self.tiktoken = None
-        try:
-            import tiktoken
-            self.has_tiktoken = True
-            self.tiktoken = tiktoken
-        except ImportError:
-            self.logger.warning("tiktoken not installed. Token counting will be estimated.")
-
+        # token limits of the supported models, prices are in common.token_accounting
         self.models_config = {
             "gpt-4": {
-                "input_cost": 0.03,    
-                "output_cost": 0.06,
                 "token_limit": 8192
             },
-            "gpt-4o-mini": {         
-                "input_cost": 0.015,   
-                "output_cost": 0.03,
-                "token_limit": 4096    
+            "gpt-4o-mini": {
+                "token_limit": 4096
             },
             "gpt-3.5-turbo": {
-                "input_cost": 0.0015,  
-                "output_cost": 0.002,
                 "token_limit": 4096
             }
         }
@@ -95,17 +89,22 @@ class GPTProcessor:
             - Use Vietnamese, maintaining the same tone as the original document in the revisions to ensure consistency throughout.
         """
     
-    async def convert_async(self, chunk_id: str, content: str) -> Dict:
+    async def convert_async(self, chunk_id: str, content: str, system_prompt: Optional[str] = None) -> Dict:
         """Convert content to standard format asynchronously"""
+        result, _ = await self._convert_with_usage(chunk_id, content, system_prompt)
+        return result
+
+    async def _convert_with_usage(self, chunk_id: str, content: str, system_prompt: Optional[str] = None):
+        """convert_async, with the usage of the completion (None on error)"""
         try:
             if not content:
                 self.logger.warning(f"Empty content for chunk {chunk_id}")
-                return None
+                return None, None
 
             messages = [
                 {
                     "role": "system",
-                    "content": """Convert the given content into Q&A format and return a JSON object following these rules:
+                    "content": system_prompt or """Convert the given content into Q&A format and return a JSON object following these rules:
                         - Extract key information into question-answer pairs
                         - Keep important details in answers
                         - Use natural, conversational language
@@ -147,37 +146,83 @@ class GPTProcessor:
 
                 result = json.loads(response.choices[0].message.content)
                 self.logger.info(f"Successfully converted chunk {chunk_id}")
-                return result
+                return result, response.usage
                 
             except Exception as api_error:
                 self.logger.error(f"API error for chunk {chunk_id}: {str(api_error)}")
-                return None
+                return None, None
 
         except Exception as e:
             self.logger.error(f"Error converting chunk {chunk_id}: {str(e)}")
-            return None
+            return None, None
         
+    def generate_followup_questions(self, content: str, num: int, chunk_id: Optional[str] = None) -> List[str]:
+        """
+        Generate questions a user is likely to ask next after being answered from a chunk.
+
+        They are stored with the chunk and offered by the chatbot as follow-up questions,
+        instead of one LLM call per answered turn.
+
+        Args:
+            content (str): Chunk content
+            num (int): Number of questions to generate
+            chunk_id (str, optional): Chunk ID, for usage logs
+
+        Returns:
+            List[str]: Generated questions, empty on error
+        """
+        try:
+            if not content or num <= 0:
+                return []
+
+            completion = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": f"""Given a chunk of admission information, write {num} DIFFERENT follow-up questions that a student who has just been answered from this chunk would ask next.
+                        - Each question must be answerable from the chunk or closely related admission topics
+                        - Short, natural questions in Vietnamese
+                        - Return JSON in following format:
+                        {{
+                            "QUESTIONS": ["question 1", "question 2"]
+                        }}"""
+                    },
+                    {
+                        "role": "user",
+                        "content": content
+                    }
+                ],
+                temperature=0,
+                response_format={"type": "json_object"}
+            )
+
+            self._log_token_usage_to_application_logs(
+                chunk_id,
+                completion.usage.prompt_tokens,
+                completion.usage.completion_tokens,
+                completion.usage.total_tokens,
+                self.model
+            )
+
+            questions = json.loads(completion.choices[0].message.content).get("QUESTIONS", [])
+            return [str(q).strip() for q in questions if str(q).strip()][:num]
+
+        except Exception as e:
+            self.logger.error(f"Error generating follow-up questions for chunk {chunk_id}: {str(e)}")
+            return []
+
     def calculate_tokens(self, text: str, model: Optional[str] = None) -> int:
-        """Calculate number of tokens in text"""
+        """Calculate number of tokens in text, capped at the token limit of the model"""
         try:
             if not text:
                 return 0
                 
             model = model or self.model
-            
-            if self.has_tiktoken:
-                encoder = self.tiktoken.encoding_for_model(model)
-                token_count = len(encoder.encode(text))
-            else:
-                words = text.split()
-                token_count = int(len(words) * 1.5)  
-            
-            if token_count < 0:
-                logger.error("Negative token count detected")
-                return 0
+            token_count = count_tokens(text, model)
                 
-            model_limit = self.models_config[model]['token_limit']
-            if token_count > model_limit:
+            model_limit = self.models_config.get(model, {}).get('token_limit')
+            if model_limit and token_count > model_limit:
                 logger.warning(f"Text exceeds model token limit: {token_count} > {model_limit}")
                 return model_limit
                 
@@ -187,6 +232,10 @@ class GPTProcessor:
             logger.error(f"Token calculation error: {str(e)}")
             return len(text.split())  
         
+    def count_tokens(self, text: str) -> int:
+        """Number of tokens of text for the model, not capped at its token limit"""
+        return count_tokens(text, self.model)
+
     # def one_chunk(self, content: str, doc_id: Optional[str] = None) -> Dict:
     #     return {
     #             "CHUNKS": [{
@@ -212,67 +261,8 @@ class GPTProcessor:
 
             if not doc_id:
                 doc_id = f"doc_{int(datetime.now().timestamp())}"
-                
-            topic = ""
-            chunk_topic = ""
-            revised_content = ""
-            
-            try:
-                completion = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": self.SYSTEM_PROMPT},
-                        {"role": "user", "content": f"DOCUMENT: '''{content}'''\nDOC_ID: {doc_id}"}
-                    ],
-                    response_format={"type": "json_object"}
-                )
-                
-                self._log_api_usage(
-                    doc_id,
-                    completion.usage.prompt_tokens,
-                    completion.usage.completion_tokens,
-                    completion.usage.total_tokens,
-                    self.model
-                )
-                
-                result = json.loads(completion.choices[0].message.content)
-                
-                if isinstance(result, dict):
-                    if 'TOPIC' in result:
-                        topic = result['TOPIC']
-                    
-                    if 'CHUNKS' in result and isinstance(result['CHUNKS'], list) and len(result['CHUNKS']) > 0:
-                    
-                        if 'chunk_topic' in result['CHUNKS'][0]:
-                            chunk_topic = result['CHUNKS'][0]['chunk_topic']
-                        
-                        if len(result['CHUNKS']) > 1:
-                            chunks = []
-                            for chunk in result['CHUNKS']:
-                                if isinstance(chunk, dict) and 'revised_chunk' in chunk:
-                                    chunks.append(chunk['revised_chunk'])
-                            
-                            if chunks:
-                                revised_content = "\n\n".join(chunks)
-                        else:
-                            chunk = result['CHUNKS'][0]
-                            if isinstance(chunk, dict) and 'revised_chunk' in chunk:
-                                revised_content = chunk['revised_chunk']
-                    
-            except Exception as api_error:
-                logger.error(f"API error: {str(api_error)}")
-                logger.error(traceback.format_exc())
-            
-            return {
-                "CHUNKS": [{
-                    "chunk_topic": chunk_topic,
-                    "original_chunk": content,
-                    "revised_chunk": revised_content,
-                    "index": "Paragraph 1"
-                }],
-                "TOPIC": topic,
-                "CHUNK_NUMBER": "1"
-            }
+
+            return asyncio.run(self.process_content_async(content, doc_id))
             
         except Exception as e:
             logger.error(f"Error processing document {doc_id}: {str(e)}")
@@ -289,6 +279,91 @@ class GPTProcessor:
                 "CHUNK_NUMBER": "1"
             }
 
+    async def process_content_async(self, content: str, doc_id: str) -> Dict:
+        """
+        Chunk a document section by section, CHUNKING_CONCURRENCY sections at a time.
+
+        The document is split along its headings, paragraphs and tables into sections of at
+        most CHUNKING_SECTION_TOKENS tokens, so a long document takes about the time of its
+        largest section instead of overflowing a single prompt.
+
+        Args:
+            content (str): Document content
+            doc_id (str): Document ID
+
+        Returns:
+            Dict: CHUNKS indexed "Paragraph 1" to "Paragraph n", TOPIC, CHUNK_NUMBER, and
+                SECTIONS with the tokens, latency and number of chunks of every section
+        """
+        started = time.perf_counter()
+        sections = split_sections(content, CHUNKING_SECTION_TOKENS, self.count_tokens) or [content]
+        section_tokens = count_tokens_batch(sections, self.model)
+        semaphore = asyncio.Semaphore(max(CHUNKING_CONCURRENCY, 1))
+
+        async def convert(number, section):
+            async with semaphore:
+                section_started = time.perf_counter()
+                result, usage = await self._convert_with_usage(
+                    f"{doc_id}_section_{number}",
+                    f"DOCUMENT: '''{section}'''\nDOC_ID: {doc_id}",
+                    self.SYSTEM_PROMPT
+                )
+                return result, {
+                    "section": number,
+                    "section_tokens": section_tokens[number - 1],
+                    "prompt_tokens": usage.prompt_tokens if usage else 0,
+                    "completion_tokens": usage.completion_tokens if usage else 0,
+                    "latency_ms": round((time.perf_counter() - section_started) * 1000)
+                }
+
+        results = await asyncio.gather(*(convert(number, section) for number, section in enumerate(sections, 1)))
+
+        chunks = []
+        topic = ""
+        reports = []
+        for section, (result, report) in zip(sections, results):
+            section_chunks = self._section_chunks(section, result)
+            report["chunks"] = len(section_chunks)
+            reports.append(report)
+            chunks.extend(section_chunks)
+            if not topic and isinstance(result, dict):
+                topic = result.get('TOPIC') or ""
+            logger.info(f"Section {report['section']}/{len(sections)} of document {doc_id}: {json.dumps(report)}")
+
+        for number, chunk in enumerate(chunks, 1):
+            chunk['index'] = f"Paragraph {number}"
+
+        logger.info(f"Chunked document {doc_id} into {len(chunks)} chunks from {len(sections)} sections "
+                    f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return {
+            "CHUNKS": chunks,
+            "TOPIC": topic,
+            "CHUNK_NUMBER": str(len(chunks)),
+            "SECTIONS": reports
+        }
+
+    def _section_chunks(self, section: str, result: Optional[Dict]) -> List[Dict]:
+        """Chunks of one section; the section as one unrevised chunk if the model failed"""
+        chunks = []
+        if isinstance(result, dict) and isinstance(result.get('CHUNKS'), list):
+            for chunk in result['CHUNKS']:
+                if not isinstance(chunk, dict) or not chunk.get('revised_chunk'):
+                    continue
+                chunks.append({
+                    "chunk_topic": chunk.get('chunk_topic') or "",
+                    "original_chunk": chunk.get('original_chunk') or section,
+                    "revised_chunk": chunk['revised_chunk'],
+                    "index": ""
+                })
+        if not chunks:
+            chunks.append({
+                "chunk_topic": "",
+                "original_chunk": section,
+                "revised_chunk": "",
+                "index": ""
+            })
+        return chunks
+
     def _log_api_usage(self, doc_id, prompt_tokens, completion_tokens, total_tokens, model):
         """Log API usage details"""
         try:
@@ -401,20 +476,7 @@ class GPTProcessor:
                 logger.error("Invalid token count")
                 return {"input_cost": 0, "output_cost": 0, "total_cost": 0}
             
-            model = model or self.model
-            if model not in self.models_config:
-                logger.warning(f"Invalid model {model}, using default gpt-4o-mini")
-                model = "gpt-4o-mini"
-            
-            rates = self.models_config[model]
-            input_cost = (prompt_tokens / 1000) * rates["input_cost"]
-            output_cost = (completion_tokens / 1000) * rates["output_cost"]
-            
-            return {
-                "input_cost": round(input_cost, 6),
-                "output_cost": round(output_cost, 6),
-                "total_cost": round(input_cost + output_cost, 6)
-            }
+            return estimate_cost(prompt_tokens, completion_tokens, model or self.model)
             
         except Exception as e:
             logger.error(f"Cost calculation error: {str(e)}")
@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+# first retry delay in seconds, doubled on every further attempt
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 5))
+
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 5
+PRIORITY_HIGH = 10
+
+
+class Job:
+    def __init__(self, id: int, queue: str, doc_id: str, payload: Dict[str, Any], attempts: int, max_attempts: int):
+        self.id = id
+        self.queue = queue
+        self.doc_id = doc_id
+        self.payload = payload or {}
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+
+    @property
+    def last_attempt(self) -> bool:
+        return self.attempts >= self.max_attempts
+
+    def __repr__(self):
+        return f"Job({self.queue}#{self.id}, doc={self.doc_id}, attempt {self.attempts}/{self.max_attempts})"
+
+
+class JobQueue:
+    """
+    Durable queue of per-document jobs in the jobs table, shared by every process using it.
+
+    A worker claims the ready job with the highest priority with SELECT ... FOR UPDATE SKIP
+    LOCKED, so any number of workers on any number of hosts take distinct jobs. A claimed
+    job stays invisible for visibility_timeout seconds, extended by a heartbeat while its
+    handler runs; if its worker dies it is claimed again after that, and once max_attempts
+    claims have failed it is kept as failed. There is at most one queued or running job per
+    document and queue: a job submitted again while it runs is run once more when done.
+    """
+
+    def __init__(self, data_manager, name: str, visibility_timeout: float,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, retry_delay: float = JOB_RETRY_DELAY):
+        self.data_manager = data_manager
+        self.name = name
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def enqueue(self, doc_id: str, payload: Optional[Dict[str, Any]] = None,
+                priority: int = PRIORITY_NORMAL, delay: float = 0) -> bool:
+        """
+        Add a job for a document, or update the queued job of the document. A job submitted
+        while it runs is flagged to run again, with this payload, once the current run ends.
+
+        Args:
+            doc_id (str): ID of the document
+            payload (dict): Extra data of the job
+            priority (int): Higher priorities are claimed first
+            delay (float): Seconds before the job can be claimed
+
+        Returns:
+            bool: True if queued or flagged to run again
+        """
+        rows = self.data_manager.execute_with_retry("""
+            INSERT INTO jobs (queue, doc_id, payload, priority, max_attempts, run_at)
+            VALUES (%s, %s, %s, %s, %s, NOW() + make_interval(secs => %s))
+            ON CONFLICT (queue, doc_id) WHERE status IN ('queued', 'running')
+            DO UPDATE SET
+                payload = EXCLUDED.payload,
+                priority = GREATEST(jobs.priority, EXCLUDED.priority),
+                run_at = CASE WHEN jobs.status = 'queued' THEN LEAST(jobs.run_at, EXCLUDED.run_at)
+                              ELSE EXCLUDED.run_at END,
+                rerun = jobs.status = 'running',
+                updated_at = NOW()
+            RETURNING id, rerun
+        """, (self.name, doc_id, json.dumps(payload or {}), priority, self.max_attempts, delay), fetch=True)
+        if rows and rows[0][1]:
+            logger.info(f"Document {doc_id} has a running {self.name} job, it will run again when done")
+        return bool(rows)
+
+    def claim(self, worker_id: str) -> Optional[Job]:
+        """Claim the next ready job, or a running job whose visibility timeout expired."""
+        rows = self.data_manager.execute_with_retry("""
+            UPDATE jobs SET
+                status = 'failed',
+                last_error = 'Visibility timeout expired on the last attempt',
+                locked_by = NULL,
+                locked_until = NULL,
+                updated_at = NOW()
+            WHERE queue = %s AND status = 'running' AND locked_until < NOW() AND attempts >= max_attempts
+              AND NOT rerun;
+
+            UPDATE jobs SET
+                status = 'running',
+                -- a job submitted again while it ran starts over
+                attempts = CASE WHEN rerun THEN 1 ELSE attempts + 1 END,
+                rerun = false,
+                locked_by = %s,
+                locked_until = NOW() + make_interval(secs => %s),
+                updated_at = NOW()
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE queue = %s
+                  AND ((status = 'queued' AND run_at <= NOW())
+                       OR (status = 'running' AND locked_until < NOW()))
+                ORDER BY priority DESC, run_at
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, doc_id, payload, attempts, max_attempts
+        """, (self.name, worker_id, self.visibility_timeout, self.name), fetch=True)
+        if not rows:
+            return None
+        job_id, doc_id, payload, attempts, max_attempts = rows[0]
+        return Job(job_id, self.name, doc_id, payload, attempts, max_attempts)
+
+    def extend(self, job: Job, worker_id: str, seconds: Optional[float] = None) -> bool:
+        """Keep a long job invisible for another visibility timeout."""
+        rows = self.data_manager.execute_with_retry("""
+            UPDATE jobs SET locked_until = NOW() + make_interval(secs => %s), updated_at = NOW()
+            WHERE id = %s AND status = 'running' AND locked_by = %s
+            RETURNING id
+        """, (seconds or self.visibility_timeout, job.id, worker_id), fetch=True)
+        return bool(rows)
+
+    def complete(self, job: Job, worker_id: str):
+        """Delete a finished job, or queue it for a fresh run if it was submitted again while it ran."""
+        self.data_manager.execute_with_retry("""
+            DELETE FROM jobs WHERE id = %s AND status = 'running' AND locked_by = %s AND NOT rerun;
+
+            UPDATE jobs SET
+                status = 'queued',
+                rerun = false,
+                attempts = 0,
+                locked_by = NULL,
+                locked_until = NULL,
+                updated_at = NOW()
+            WHERE id = %s AND status = 'running' AND locked_by = %s AND rerun
+        """, (job.id, worker_id, job.id, worker_id))
+
+    def fail(self, job: Job, worker_id: str, error: str, retry: bool = True) -> bool:
+        """
+        Record a failed attempt and schedule the next one with exponential backoff. A job
+        submitted again while it ran is queued for a fresh run instead.
+
+        Args:
+            job (Job): The claimed job
+            worker_id (str): ID of the worker that claimed it
+            error (str): Error of the attempt
+            retry (bool): False to give up on the job now
+
+        Returns:
+            bool: True if the job will be retried, False if it is failed for good
+        """
+        retry = retry and not job.last_attempt
+        delay = self.retry_delay * (2 ** max(job.attempts - 1, 0))
+        rows = self.data_manager.execute_with_retry("""
+            UPDATE jobs SET
+                status = CASE WHEN rerun OR %s THEN 'queued' ELSE 'failed' END,
+                attempts = CASE WHEN rerun THEN 0 ELSE attempts END,
+                last_error = %s,
+                run_at = CASE WHEN rerun THEN run_at ELSE NOW() + make_interval(secs => %s) END,
+                rerun = false,
+                locked_by = NULL,
+                locked_until = NULL,
+                updated_at = NOW()
+            WHERE id = %s AND status = 'running' AND locked_by = %s
+            RETURNING status
+        """, (retry, error, delay, job.id, worker_id), fetch=True)
+        if not rows:
+            # claimed again by another worker after the visibility timeout
+            return True
+        return rows[0][0] == 'queued'
+
+    def size(self) -> int:
+        rows = self.data_manager.execute_with_retry(
+            "SELECT COUNT(*) FROM jobs WHERE queue = %s AND status IN ('queued', 'running')",
+            (self.name,), fetch=True)
+        return rows[0][0] if rows else 0
+
+    def stats(self) -> Dict[str, int]:
+        rows = self.data_manager.execute_with_retry(
+            "SELECT status, COUNT(*) FROM jobs WHERE queue = %s GROUP BY status",
+            (self.name,), fetch=True)
+        return {status: count for status, count in rows or []}
+
+    def _heartbeat(self, job: Job, worker_id: str, done: threading.Event):
+        # a third of the visibility timeout, so one missed beat does not expose the job
+        while not done.wait(self.visibility_timeout / 3):
+            try:
+                if not self.extend(job, worker_id):
+                    logger.warning(f"{job} is no longer held by {worker_id}")
+                    return
+            except Exception as e:
+                logger.error(f"Could not extend {job}: {str(e)}")
+
+    def run(self, job: Job, worker_id: str, handler: Callable[[Job], Any]):
+        """Run handler(job), extending the visibility timeout of the job until it returns."""
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, worker_id, done), daemon=True)
+        heartbeat.start()
+        try:
+            return handler(job)
+        finally:
+            done.set()
+            heartbeat.join()
+
+    def work(self, handler: Callable[[Job], Any], on_give_up: Optional[Callable[[Job, str], Any]] = None,
+             poll_interval: float = JOB_POLL_INTERVAL):
+        """
+        Worker loop: claim a job, run handler(job), complete it, or retry it if handler raises.
+        The job stays claimed for as long as handler runs, see run().
+
+        Args:
+            handler (Callable): Runs a job; an exception is a failed attempt
+            on_give_up (Callable): Called with the job and its error after its last attempt
+            poll_interval (float): Seconds between two claims when the queue is empty
+        """
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        logger.info(f"Started {self.name} worker {worker_id}")
+        while True:
+            try:
+                job = self.claim(worker_id)
+            except Exception as e:
+                logger.error(f"{self.name} worker {worker_id} could not claim a job: {str(e)}")
+                time.sleep(poll_interval * 5)
+                continue
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+
+            logger.info(f"{self.name} worker {worker_id} claimed {job}")
+            try:
+                self.run(job, worker_id, handler)
+                self.complete(job, worker_id)
+            except Exception as e:
+                error = f"{e.__class__.__name__}: {str(e)}"
+                logger.error(f"{job} failed: {error}")
+                logger.error(traceback.format_exc())
+                try:
+                    if not self.fail(job, worker_id, error) and on_give_up is not None:
+                        on_give_up(job, error)
+                except Exception as fail_error:
+                    logger.error(f"Could not record the failure of {job}: {str(fail_error)}")
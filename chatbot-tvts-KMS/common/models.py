@@ -12,6 +12,8 @@ class ConflictResult:
     conflict_type: str = "unknown"  # content/chunk/document
     severity: str = "medium"  # high/medium/low
     contradictions: List[Dict[str, Any]] = field(default_factory=list)
+    # set when the analysis failed; such results are returned but never cached
+    error: Optional[str] = None
 
     def to_dict(self):
         return {
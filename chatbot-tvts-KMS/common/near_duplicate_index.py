@@ -0,0 +1,210 @@
+import hashlib
+import logging
+import os
+import traceback
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from common.utils import preprocessing
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MINHASH_NUM_PERM = int(os.getenv('MINHASH_NUM_PERM', 128))
+# bands x rows = num_perm; 32 bands of 4 rows make documents with a word-shingle Jaccard
+# similarity of 0.7 candidates with a probability above 0.999, unrelated ones almost never
+MINHASH_LSH_BANDS = int(os.getenv('MINHASH_LSH_BANDS', 32))
+MINHASH_SHINGLE_SIZE = int(os.getenv('MINHASH_SHINGLE_SIZE', 3))
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# fixed so that the signatures stored in the database stay comparable across processes
+_PERMUTATION_SEED = 1
+
+
+def shingles(processed_text: str, size: int) -> set:
+    words = processed_text.split()
+    if len(words) <= size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _permutations(num_perm: int):
+    generator = np.random.RandomState(_PERMUTATION_SEED)
+    a = generator.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = generator.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signature(processed_text: str, num_perm: int = MINHASH_NUM_PERM,
+                      shingle_size: int = MINHASH_SHINGLE_SIZE) -> Optional[np.ndarray]:
+    """
+    MinHash signature of the word shingles of an already preprocessed text.
+
+    Returns:
+        np.ndarray: num_perm uint32 values, None for an empty text
+    """
+    values = shingles(processed_text, shingle_size)
+    if not values:
+        return None
+    hashes = np.array([int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=4).digest(), 'little')
+                       for value in values], dtype=np.uint64)
+    a, b = _permutations(num_perm)
+    with np.errstate(over='ignore'):
+        permuted = np.bitwise_and((np.outer(hashes, a) + b) % _MERSENNE_PRIME, _MAX_HASH)
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def band_buckets(signature: np.ndarray, bands: int = MINHASH_LSH_BANDS) -> List[int]:
+    """One bucket per band, a signed 64 bits hash of the rows of the band (BIGINT)."""
+    rows = len(signature) // bands
+    return [int.from_bytes(hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(), digest_size=8).digest(),
+                           'little', signed=True)
+            for band in range(bands)]
+
+
+class NearDuplicateIndex:
+    """
+    Persistent MinHash/LSH index of the documents (tables document_minhash and
+    document_lsh_buckets, rows deleted with their document). Documents sharing at least
+    one band bucket with a document are its near-duplicate candidates, to be verified
+    with the exact similarity.
+    """
+
+    def __init__(self, data_manager, num_perm: int = MINHASH_NUM_PERM, bands: int = MINHASH_LSH_BANDS,
+                 shingle_size: int = MINHASH_SHINGLE_SIZE):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.data_manager = data_manager
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        # rows indexed with other parameters are reindexed by backfill()
+        self.params = f"{num_perm}:{bands}:{shingle_size}"
+
+    def signature(self, content: str) -> Optional[np.ndarray]:
+        return minhash_signature(preprocessing(content), self.num_perm, self.shingle_size)
+
+    def add(self, doc_id: str, content: str, processed_text: Optional[str] = None) -> bool:
+        """
+        Index (or reindex) a document.
+
+        Args:
+            doc_id (str): ID of the document
+            content (str): Raw content of the document
+            processed_text (str): Persisted normalized text of the content, if already computed
+
+        Returns:
+            bool: True if indexed, False for an empty document or on error
+        """
+        try:
+            if processed_text is None:
+                signature = self.signature(content)
+            else:
+                signature = minhash_signature(processed_text, self.num_perm, self.shingle_size)
+            with self.data_manager.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM document_lsh_buckets WHERE doc_id = %s", (doc_id,))
+                    if signature is None:
+                        cur.execute("DELETE FROM document_minhash WHERE doc_id = %s", (doc_id,))
+                        conn.commit()
+                        return False
+                    cur.execute("""
+                        INSERT INTO document_minhash (doc_id, signature, params, updated_at)
+                        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                        ON CONFLICT (doc_id) DO UPDATE SET
+                            signature = EXCLUDED.signature,
+                            params = EXCLUDED.params,
+                            updated_at = CURRENT_TIMESTAMP
+                    """, (doc_id, signature.tobytes(), self.params))
+                    buckets = band_buckets(signature, self.bands)
+                    cur.execute("""
+                        INSERT INTO document_lsh_buckets (band, bucket, doc_id)
+                        SELECT band, bucket, %s FROM unnest(%s::smallint[], %s::bigint[]) AS b(band, bucket)
+                        ON CONFLICT DO NOTHING
+                    """, (doc_id, list(range(self.bands)), buckets))
+                conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error indexing document {doc_id} for near duplicates: {str(e)}")
+            logger.error(traceback.format_exc())
+            return False
+
+    def is_indexed(self, doc_id: str) -> bool:
+        rows = self.data_manager.execute_with_retry(
+            "SELECT 1 FROM document_minhash WHERE doc_id = %s AND params = %s",
+            (doc_id, self.params), fetch=True)
+        return bool(rows)
+
+    def ensure(self, doc_id: str, content: str, processed_text: Optional[str] = None) -> bool:
+        """Index a document unless it already is with the current parameters."""
+        try:
+            if self.is_indexed(doc_id):
+                return True
+        except Exception as e:
+            logger.error(f"Error checking the near duplicate index for {doc_id}: {str(e)}")
+        return self.add(doc_id, content, processed_text)
+
+    def remove(self, doc_id: str) -> bool:
+        try:
+            self.data_manager.execute_with_retry(
+                "DELETE FROM document_lsh_buckets WHERE doc_id = %s; DELETE FROM document_minhash WHERE doc_id = %s",
+                (doc_id, doc_id))
+            return True
+        except Exception as e:
+            logger.error(f"Error removing document {doc_id} from the near duplicate index: {str(e)}")
+            return False
+
+    def candidates(self, doc_id: str) -> List[str]:
+        """
+        IDs of the indexed documents sharing a band bucket with an indexed document.
+
+        Args:
+            doc_id (str): ID of an indexed document
+
+        Returns:
+            List[str]: Candidate document IDs, without doc_id itself
+        """
+        rows = self.data_manager.execute_with_retry("""
+            SELECT DISTINCT other.doc_id
+            FROM document_lsh_buckets own
+            JOIN document_lsh_buckets other
+              ON other.band = own.band AND other.bucket = own.bucket AND other.doc_id <> own.doc_id
+            WHERE own.doc_id = %s
+        """, (doc_id,), fetch=True)
+        return [row[0] for row in rows or []]
+
+    def backfill(self, batch_size: int = 200) -> Dict[str, int]:
+        """
+        Index the documents that are not indexed yet, or were indexed with other parameters.
+
+        Args:
+            batch_size (int): Number of documents read per query
+
+        Returns:
+            Dict[str, int]: Number of documents indexed and skipped (empty or failed)
+        """
+        stats = {"indexed": 0, "skipped": 0}
+        # documents without a signature stay unindexed, they are not selected again in this run
+        skipped = []
+        while True:
+            rows = self.data_manager.execute_with_retry("""
+                SELECT d.id, d.content, d.normalized_text
+                FROM documents d
+                LEFT JOIN document_minhash m ON m.doc_id = d.id
+                WHERE (m.doc_id IS NULL OR m.params <> %s)
+                  AND NOT (d.id = ANY(%s::varchar[]))
+                ORDER BY d.created_date
+                LIMIT %s
+            """, (self.params, skipped, batch_size), fetch=True)
+            if not rows:
+                break
+            for doc_id, content, normalized_text in rows:
+                if self.add(doc_id, content or '', normalized_text):
+                    stats["indexed"] += 1
+                else:
+                    skipped.append(doc_id)
+                    stats["skipped"] += 1
+        logger.info(f"Near duplicate index backfill: {stats}")
+        return stats
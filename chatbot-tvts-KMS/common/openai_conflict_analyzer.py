@@ -1,4 +1,4 @@
-from typing import List, Dict, Optional, Union
+from typing import List, Dict, Optional, Tuple, Union
 from datetime import datetime
 import json
 import asyncio
@@ -7,14 +7,23 @@ from openai import OpenAI
 import os
 from dotenv import load_dotenv
 import time
+import threading
 import hashlib
 from common.models import ConflictResult
+from common.token_accounting import count_message_tokens, count_tokens, usage_cost
+from concurrent.futures import ThreadPoolExecutor
 import traceback
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Batched analysis packs many chunk pairs into one prompt: at most this many tokens of
+# chunk contents...
+CONFLICT_BATCH_PROMPT_TOKENS = int(os.getenv('CONFLICT_BATCH_PROMPT_TOKENS', 6000))
+# ...and at most this many pairs per prompt, so the answer stays within the output limit
+CONFLICT_BATCH_MAX_PAIRS = int(os.getenv('CONFLICT_BATCH_MAX_PAIRS', 15))
+
 class OpenAIConflictAnalyzer:
     """
     Contradiction analysis layer using OpenAI API within and between documents
@@ -33,11 +42,16 @@ class OpenAIConflictAnalyzer:
         self.cache_hits = 0
         self.cache_misses = 0
         
+        self.usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_cost": 0.0}
+        # batches of analyze_pairs record their usage from several threads
+        self.usage_lock = threading.Lock()
+        
         self.timeout = 30  
         self.max_retries = 3  
         self.retry_delay = 5 
         
         self.analyzed_pairs = set()
+        self.max_workers = max_workers
         
         logger.info(f"Initializing OpenAI Conflict Analyzer with model {self.model}")
         
@@ -59,6 +73,21 @@ class OpenAIConflictAnalyzer:
             combined = f"{text1[:1000]}|{conflict_type}"
         return hashlib.md5(combined.encode()).hexdigest()
     
+    def _record_usage(self, response, estimated_prompt_tokens: int):
+        """Log the tokens and cost of a response and add them to the usage totals"""
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        costs = usage_cost(usage, self.model)
+        with self.usage_lock:
+            self.usage["requests"] += 1
+            self.usage["prompt_tokens"] += usage.prompt_tokens
+            self.usage["completion_tokens"] += usage.completion_tokens
+            self.usage["total_cost"] = round(self.usage["total_cost"] + costs["total_cost"], 6)
+        logger.info(f"Conflict analysis usage: {usage.prompt_tokens} prompt tokens "
+                    f"(estimated {estimated_prompt_tokens}), {usage.completion_tokens} completion tokens, "
+                    f"${costs['total_cost']:.6f}")
+
     def _create_content_conflict_prompt(self, content: str) -> List[Dict]:
         """
         Create a prompt to analyze conflicts in a document
@@ -257,6 +286,7 @@ class OpenAIConflictAnalyzer:
                 if not content2:
                     raise ValueError("Need second content to analyze conflict between paragraphs")
                 messages = self._create_comparison_conflict_prompt(content1, content2, conflict_type)
+            prompt_tokens = count_message_tokens(messages, self.model)
 
             response = await asyncio.to_thread(
                 self.client.chat.completions.create,
@@ -266,6 +296,7 @@ class OpenAIConflictAnalyzer:
                 response_format={"type": "json_object"},
                 timeout=self.timeout
             )
+            self._record_usage(response, prompt_tokens)
 
             try:
                 result_json = json.loads(response.choices[0].message.content)
@@ -276,7 +307,7 @@ class OpenAIConflictAnalyzer:
 
             result = self._process_result(result_json, conflict_type)
 
-            if self.use_cache:
+            if self.use_cache and not result.error:
                 self.cache[cache_key] = result
 
             return result
@@ -292,7 +323,8 @@ class OpenAIConflictAnalyzer:
                 analyzed_at=datetime.now(),
                 chunk_ids=[],
                 conflict_type=conflict_type,
-                severity="medium"
+                severity="medium",
+                error=str(e)
             )
     
     # def _create_comparison_conflict_prompt(self, content1: str, content2: str, conflict_type: str = "internal") -> List[Dict]:
@@ -606,6 +638,7 @@ class OpenAIConflictAnalyzer:
                 if not content2:
                     raise ValueError("Need second content to analyze conflict between paragraphs")
                 messages = self._create_comparison_conflict_prompt(content1, content2, conflict_type)
+            prompt_tokens = count_message_tokens(messages, self.model)
 
             start_time = time.time()
             
@@ -619,6 +652,7 @@ class OpenAIConflictAnalyzer:
                         response_format={"type": "json_object"},
                         timeout=self.timeout
                     )
+                    self._record_usage(response, prompt_tokens)
                     
                     try:
                         result_json = json.loads(response.choices[0].message.content)
@@ -643,7 +677,7 @@ class OpenAIConflictAnalyzer:
                 
             result = self._process_result(result_json, conflict_type)
             
-            if self.use_cache:
+            if self.use_cache and not result.error:
                 self.cache[cache_key] = result
             
             return result
@@ -659,9 +693,202 @@ class OpenAIConflictAnalyzer:
                 analyzed_at=datetime.now(),
                 chunk_ids=[],
                 conflict_type=conflict_type,
-                severity="medium"
+                severity="medium",
+                error=str(e)
             )
 
+    def _create_batch_conflict_prompt(self, contents: Dict[str, str], pairs: List[Tuple[str, str, str]],
+                                      conflict_type: str = "internal") -> List[Dict]:
+        """
+        Create a prompt to analyze many pairs of paragraphs at once
+        
+        Args:
+            contents: Content of every paragraph by label ("C1", "C2"...), each sent once
+            pairs: (pair_id, label1, label2) of the pairs to analyze
+            conflict_type: Conflict type ("internal" or "external")
+        
+        Returns:
+            List[Dict]: List of messages for the request
+        """
+        conflict_type_text = "trong cùng một tài liệu" if conflict_type == "internal" else "giữa các tài liệu khác nhau"
+        paragraphs = "\n\n".join(f"ĐOẠN {label}:\n{content}" for label, content in contents.items())
+        pair_lines = "\n".join(f"{pair_id}: {label1} - {label2}" for pair_id, label1, label2 in pairs)
+        
+        return [
+            {
+                "role": "system",
+                "content": f"""Bạn là chuyên gia phân tích mâu thuẫn {conflict_type_text} về dữ liệu tuyển sinh đại học.
+                    
+            ĐỊNH NGHĨA MÂU THUẪN:
+            KIỂM TRA CÂU CÓ CẤU TRÚC GIỐNG NHAU:
+            - So sánh cấu trúc ngữ pháp và từ vựng của hai câu
+            - Nếu hai câu có nội dung rất giống nhau nhưng số liệu khác nhau, đó có thể là mâu thuẫn
+            - Kiểm tra xem hai câu có đang nói về cùng một đối tượng, cùng một thời điểm không
+            - Nếu hai câu giống nhau 80% trở lên và chỉ khác số liệu → CÓ KHẢ NĂNG MÂU THUẪN
+
+            KHI PHÂN TÍCH, HÃY:
+            1. Phân tích RIÊNG từng cặp đoạn văn được liệt kê, độc lập với các cặp khác
+            2. Xác định chính xác đối tượng/phạm vi mỗi thông tin đề cập đến
+            3. So sánh cấu trúc câu để phát hiện các câu giống nhau nhưng khác số liệu
+            4. Chỉ kết luận mâu thuẫn khi hai câu có cấu trúc tương tự nhưng số liệu khác nhau
+
+            Trả lời theo cấu trúc JSON tiếng Việt sau, với ĐÚNG MỘT phần tử cho mỗi cặp được liệt kê:
+            ```json
+            {{
+                "results": [
+                    {{
+                        "pair_id": "<mã cặp, ví dụ P1>",
+                        "reasoning_process": "Phân tích ngắn gọn về đối tượng, phạm vi và mức độ tương đồng về cấu trúc của hai đoạn",
+                        "has_contradiction": "yes/no",
+                        "contradiction_count": <số lượng mâu thuẫn tìm thấy>,
+                        "contradictions": [
+                            {{
+                                "id": 1,
+                                "description": "Mô tả ngắn gọn về mâu thuẫn",
+                                "explanation": "Giải thích chi tiết tại sao đây là mâu thuẫn",
+                                "calculation": "Các phép tính cụ thể chứng minh mâu thuẫn",
+                                "conflicting_parts": ["Trích dẫn từ đoạn thứ nhất", "Trích dẫn từ đoạn thứ hai"],
+                                "severity": "low/medium/high"
+                            }}
+                        ],
+                        "explanation": "Tóm tắt về các mâu thuẫn hoặc lý do không có mâu thuẫn",
+                        "conflicting_parts": ["Trích dẫn từ đoạn thứ nhất", "Trích dẫn từ đoạn thứ hai"],
+                        "conflict_type": "{conflict_type}"
+                    }}
+                ]
+            }}
+            ```
+                            
+            Chỉ trả về JSON hợp lệ, KHÔNG thêm bất kỳ giải thích nào bên ngoài cấu trúc JSON."""
+            },
+            {
+                "role": "user",
+                "content": f"""CÁC ĐOẠN VĂN:
+
+{paragraphs}
+
+CÁC CẶP CẦN PHÂN TÍCH:
+{pair_lines}"""
+            }
+        ]
+
+    def _pack_pairs(self, pairs: List[Tuple[str, str]]) -> List[List[int]]:
+        """Indexes of pairs grouped into batches within CONFLICT_BATCH_PROMPT_TOKENS and CONFLICT_BATCH_MAX_PAIRS"""
+        tokens = {}
+        batches, batch, batch_contents, batch_tokens = [], [], set(), 0
+        for index, (content1, content2) in enumerate(pairs):
+            new_contents = {content1, content2} - batch_contents
+            for content in new_contents:
+                if content not in tokens:
+                    tokens[content] = count_tokens(content, self.model)
+            # a paragraph shared with the pairs already in the batch is only sent once
+            added = sum(tokens[content] for content in new_contents) + 10
+            if batch and (len(batch) >= CONFLICT_BATCH_MAX_PAIRS or batch_tokens + added > CONFLICT_BATCH_PROMPT_TOKENS):
+                batches.append(batch)
+                batch, batch_contents, batch_tokens = [], set(), 0
+                new_contents = {content1, content2}
+                added = sum(tokens[content] for content in new_contents) + 10
+            batch.append(index)
+            batch_contents |= new_contents
+            batch_tokens += added
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _analyze_batch(self, pairs: List[Tuple[str, str]], conflict_type: str) -> Dict[int, ConflictResult]:
+        """One request for a batch of (content1, content2) pairs, results by index in the batch"""
+        labels = {}
+        for content1, content2 in pairs:
+            for content in (content1, content2):
+                labels.setdefault(content, f"C{len(labels) + 1}")
+        contents = {label: content for content, label in labels.items()}
+        pair_ids = [(f"P{index + 1}", labels[content1], labels[content2])
+                    for index, (content1, content2) in enumerate(pairs)]
+        messages = self._create_batch_conflict_prompt(contents, pair_ids, conflict_type)
+        prompt_tokens = count_message_tokens(messages, self.model)
+
+        for attempt in range(self.max_retries):
+            try:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=0.1,
+                    response_format={"type": "json_object"},
+                    timeout=self.timeout * 2
+                )
+                self._record_usage(response, prompt_tokens)
+                items = json.loads(response.choices[0].message.content).get("results", [])
+                break
+            except Exception as e:
+                logger.error(f"Batch API error on attempt {attempt+1}: {str(e)}")
+                if attempt == self.max_retries - 1:
+                    raise
+                time.sleep(self.retry_delay)
+
+        results = {}
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            pair_id = str(item.get("pair_id", ""))
+            if pair_id.startswith("P") and pair_id[1:].isdigit() and 0 < int(pair_id[1:]) <= len(pairs):
+                results[int(pair_id[1:]) - 1] = self._process_result(item, conflict_type)
+        return results
+
+    def analyze_pairs(self, pairs: List[Tuple[str, str]], conflict_type: str = "internal") -> List[ConflictResult]:
+        """
+        Batched conflict analysis of many pairs of contents
+        
+        Uncached pairs are packed into prompts of at most CONFLICT_BATCH_PROMPT_TOKENS tokens
+        of contents and CONFLICT_BATCH_MAX_PAIRS pairs, each content sent once per prompt, and
+        the prompts run on max_workers threads. Pairs missing from an answer, or of a failed
+        prompt, are analyzed one by one with analyze_conflict.
+
+        Args:
+        pairs: (content1, content2) of every pair
+        conflict_type: Conflict type ("internal", "external")
+
+        Returns:
+        List[ConflictResult]: One result per pair, in order
+        """
+        results: List[Optional[ConflictResult]] = [None] * len(pairs)
+        pending = []
+        for index, (content1, content2) in enumerate(pairs):
+            if self.use_cache:
+                cached_result = self.cache.get(self._generate_cache_key(content1, content2, conflict_type))
+                if cached_result:
+                    self.cache_hits += 1
+                    results[index] = cached_result
+                    continue
+                self.cache_misses += 1
+            pending.append(index)
+
+        batches = self._pack_pairs([pairs[index] for index in pending])
+        logger.info(f"Analyzing {len(pending)} pairs in {len(batches)} prompts "
+                    f"({len(pairs) - len(pending)} cached)")
+
+        def run(batch):
+            batch_pairs = [pairs[pending[i]] for i in batch]
+            try:
+                return batch, self._analyze_batch(batch_pairs, conflict_type)
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} pairs failed, analyzing them one by one: {str(e)}")
+                return batch, {}
+
+        with ThreadPoolExecutor(max_workers=max(self.max_workers, 1)) as executor:
+            for batch, batch_results in executor.map(run, batches):
+                for position, i in enumerate(batch):
+                    index = pending[i]
+                    content1, content2 = pairs[index]
+                    result = batch_results.get(position)
+                    if result is None:
+                        # analyze_conflict reads and fills the cache itself
+                        results[index] = self.analyze_conflict(content1, content2, conflict_type)
+                        continue
+                    if self.use_cache and not result.error:
+                        self.cache[self._generate_cache_key(content1, content2, conflict_type)] = result
+                    results[index] = result
+        return results
+
     def _process_result(self, result_json: Dict, conflict_type: str) -> ConflictResult:
         """
         Process JSON result from API to convert into ConflictResult
@@ -737,7 +964,8 @@ class OpenAIConflictAnalyzer:
                 chunk_ids=[],
                 conflict_type=conflict_type,
                 severity="medium",
-                contradictions=[]
+                contradictions=[],
+                error=error_message
             )
     
     def clear_cache(self):
@@ -748,11 +976,14 @@ class OpenAIConflictAnalyzer:
         logger.info(f"Cleared cache ({cache_size} entries)")
         
     def get_cache_stats(self):
+        with self.usage_lock:
+            usage = dict(self.usage)
         return {
             "cache_size": len(self.cache),
             "cache_hits": self.cache_hits,
             "cache_misses": self.cache_misses,
-            "hit_ratio": self.cache_hits / (self.cache_hits + self.cache_misses) if (self.cache_hits + self.cache_misses) > 0 else 0
+            "hit_ratio": self.cache_hits / (self.cache_hits + self.cache_misses) if (self.cache_hits + self.cache_misses) > 0 else 0,
+            "usage": usage
         }
 
     def shutdown(self):
@@ -0,0 +1,166 @@
+import re
+from typing import Callable, List, Tuple
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+
+# Splits a document into sections of at most max_tokens tokens, to be chunked separately.
+# Blocks are never cut unless a single block is too large: a heading starts a new section
+# (once the current one holds at least a quarter of the budget), paragraphs and tables are
+# packed in order, oversized tables are split by rows with their header repeated and
+# oversized paragraphs by lines, then sentences, then words.
+
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+WRAPPER_TAGS = {'html', 'body', 'div', 'section', 'article', 'main'}
+
+HEADING = 'heading'
+TABLE = 'table'
+PARAGRAPH = 'paragraph'
+
+_TEXT_HEADING = re.compile(r'^(#{1,6}\s+\S|[IVXLC]+\.\s+\S|\d+(\.\d+)*\.?\s+\S)')
+_SENTENCE_END = re.compile(r'(?<=[.!?;:])\s+')
+
+
+def _html_blocks(content: str) -> List[Tuple[str, str]]:
+    root = BeautifulSoup(content, 'html.parser')
+    # documents from the editor are often wrapped in a single container
+    while True:
+        children = [child for child in root.contents if isinstance(child, Tag) or str(child).strip()]
+        if len(children) == 1 and isinstance(children[0], Tag) and children[0].name in WRAPPER_TAGS:
+            root = children[0]
+        else:
+            break
+
+    blocks = []
+    for child in root.contents:
+        if isinstance(child, NavigableString):
+            if str(child).strip():
+                blocks.append((PARAGRAPH, str(child).strip()))
+        elif child.name in HEADING_TAGS:
+            blocks.append((HEADING, str(child)))
+        elif child.name == 'table':
+            blocks.append((TABLE, str(child)))
+        elif child.get_text(strip=True):
+            blocks.append((PARAGRAPH, str(child)))
+    return blocks
+
+
+def _text_blocks(content: str) -> List[Tuple[str, str]]:
+    blocks = []
+    for paragraph in re.split(r'\n\s*\n', content):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        lines = paragraph.splitlines()
+        if all(line.lstrip().startswith('|') for line in lines):
+            blocks.append((TABLE, paragraph))
+        elif len(lines) == 1 and len(paragraph) <= 120 and _TEXT_HEADING.match(paragraph):
+            blocks.append((HEADING, paragraph))
+        else:
+            blocks.append((PARAGRAPH, paragraph))
+    return blocks
+
+
+def split_blocks(content: str) -> List[Tuple[str, str]]:
+    """Headings, paragraphs and tables of an HTML or plain text document, in order."""
+    if re.search(r'<[a-zA-Z][^>]*>', content):
+        return _html_blocks(content)
+    return _text_blocks(content)
+
+
+def _pack(parts: List[str], separator: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    packed, current = [], []
+    for part in parts:
+        candidate = separator.join(current + [part])
+        if current and count_tokens(candidate) > max_tokens:
+            packed.append(separator.join(current))
+            current = [part]
+        else:
+            current.append(part)
+    if current:
+        packed.append(separator.join(current))
+    return packed
+
+
+def _split_text(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    for pattern, separator in ((r'\n', '\n'), (_SENTENCE_END, ' '), (r'\s+', ' ')):
+        parts = [part for part in re.split(pattern, text) if part.strip()]
+        if len(parts) > 1:
+            pieces = []
+            for piece in _pack(parts, separator, max_tokens, count_tokens):
+                if count_tokens(piece) > max_tokens and piece != text:
+                    pieces.extend(_split_text(piece, max_tokens, count_tokens))
+                else:
+                    pieces.append(piece)
+            return pieces
+    return [text]
+
+
+def _split_table(table: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    if table.lstrip().startswith('|'):
+        lines = table.splitlines()
+        header = lines[:2]
+        rows = lines[2:]
+        return ['\n'.join(header + part.splitlines())
+                for part in _pack(rows, '\n', max_tokens - count_tokens('\n'.join(header)), count_tokens)]
+
+    soup = BeautifulSoup(table, 'html.parser')
+    rows = [str(row) for row in soup.find_all('tr')]
+    if len(rows) < 2:
+        return _split_text(soup.get_text('\n', strip=True), max_tokens, count_tokens)
+    header = rows[0]
+    budget = max_tokens - count_tokens(f"<table>{header}</table>")
+    return [f"<table>{header}{part}</table>" for part in _pack(rows[1:], '', budget, count_tokens)]
+
+
+def split_sections(content: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """
+    Split a document into sections of at most max_tokens tokens along its structure.
+
+    Args:
+        content (str): Document content, HTML or plain text
+        max_tokens (int): Token budget of a section
+        count_tokens (Callable[[str], int]): Token counter of the chunking model
+
+    Returns:
+        List[str]: Sections in document order, keeping their markup
+    """
+    sections, current, current_tokens = [], [], 0
+    headings = []  # headings at the end of current
+
+    def flush(keep_headings: bool = False):
+        # kept headings open the next section instead of closing this one
+        nonlocal current, current_tokens, headings
+        kept = headings if keep_headings and len(headings) < len(current) else []
+        if len(current) > len(kept):
+            sections.append('\n'.join(current[:len(current) - len(kept)]))
+        current = list(kept)
+        current_tokens = sum(count_tokens(heading) for heading in kept)
+        headings = list(kept)
+
+    for kind, text in split_blocks(content):
+        tokens = count_tokens(text)
+        if kind == HEADING and len(headings) < len(current) and current_tokens >= max_tokens // 4:
+            flush(keep_headings=True)
+        if tokens > max_tokens:
+            # the headings right before the block go with its first piece
+            prefix = '\n'.join(headings)
+            current = current[:len(current) - len(headings)]
+            flush()
+            budget = max_tokens - count_tokens(prefix)
+            if kind == TABLE:
+                pieces = _split_table(text, budget, count_tokens)
+            else:
+                if text.lstrip().startswith('<'):
+                    text = BeautifulSoup(text, 'html.parser').get_text('\n', strip=True)
+                pieces = _split_text(text, budget, count_tokens)
+            if prefix and pieces:
+                pieces[0] = f"{prefix}\n{pieces[0]}"
+            sections.extend(pieces)
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            flush(keep_headings=sum(count_tokens(heading) for heading in headings) + tokens <= max_tokens)
+        current.append(text)
+        current_tokens += tokens
+        headings = headings + [text] if kind == HEADING else []
+    flush()
+    return sections
@@ -0,0 +1,75 @@
+import argparse
+import random
+import time
+
+from common.similarity_engine import score_against, similar_pairs
+from common.utils import ratio
+
+# Benchmark of the similarity engine on synthetic Vietnamese corpora:
+#   python -m common.similarity_benchmark --sizes 1000 10000 50000
+# A share of the documents are near duplicates of another one (a few words changed).
+
+SYLLABLES = (
+    "sinh viên học phí trường đại học khoa công nghệ thông tin đăng ký môn học kỳ năm "
+    "thời gian nộp hồ sơ tuyển sinh xét tuyển điểm chuẩn ngành chương trình đào tạo "
+    "quy định thông báo phòng ban giám hiệu lịch thi cuối giữa kỳ học bổng miễn giảm "
+    "tín chỉ tốt nghiệp luận văn giảng viên hướng dẫn ký túc xá thư viện thẻ căn cước "
+    "ngày tháng theo của các những được và là có không trong cho với khi phải đến từ"
+).split()
+
+
+def synthetic_corpus(size: int, words: int = 120, duplicate_share: float = 0.05, seed: int = 42):
+    generator = random.Random(seed)
+    texts = []
+    for i in range(size):
+        if texts and generator.random() < duplicate_share:
+            tokens = generator.choice(texts).split()
+            for _ in range(generator.randint(1, 3)):
+                tokens[generator.randrange(len(tokens))] = generator.choice(SYLLABLES)
+        else:
+            tokens = [generator.choice(SYLLABLES) for _ in range(words)]
+            tokens[generator.randrange(words)] = str(generator.randint(1, 2025))
+        texts.append(' '.join(tokens))
+    return texts
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def run(size: int, threshold: float, exhaustive_max: int, loop_max: int):
+    texts = synthetic_corpus(size)
+    query, candidates = texts[-1], texts[:-1]
+    print(f"--- {size} documents")
+
+    if size <= loop_max:
+        loop_scores, loop_time = _timed(lambda: [ratio(query, text) for text in candidates])
+        print(f"one vs all, ratio() loop:      {loop_time:8.3f}s")
+    batch_scores, batch_time = _timed(lambda: score_against(query, candidates))
+    print(f"one vs all, score_against:     {batch_time:8.3f}s")
+    if size <= loop_max:
+        drift = max(abs(a - b) for a, b in zip(loop_scores, batch_scores))
+        print(f"max score difference:          {drift:.2e}")
+
+    lsh_pairs, lsh_time = _timed(lambda: {(i, j) for i, j, _ in similar_pairs(texts, threshold, method='lsh')})
+    print(f"all pairs, lsh:                {lsh_time:8.3f}s  {len(lsh_pairs)} pairs")
+    if size <= exhaustive_max:
+        pairs, exhaustive_time = _timed(
+            lambda: {(i, j) for i, j, _ in similar_pairs(texts, threshold, method='exhaustive')})
+        recall = len(lsh_pairs & pairs) / len(pairs) if pairs else 1.0
+        print(f"all pairs, exhaustive:         {exhaustive_time:8.3f}s  {len(pairs)} pairs, lsh recall {recall:.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the batched similarity engine")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--threshold', type=float, default=0.98)
+    parser.add_argument('--exhaustive-max', type=int, default=10000,
+                        help="largest corpus scored exhaustively in all-pairs mode")
+    parser.add_argument('--loop-max', type=int, default=50000,
+                        help="largest corpus scored with the per-pair ratio() loop")
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.threshold, args.exhaustive_max, args.loop_max)
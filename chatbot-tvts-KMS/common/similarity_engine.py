@@ -0,0 +1,175 @@
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from rapidfuzz.distance import Indel
+from rapidfuzz.process import cdist
+
+from common.near_duplicate_index import MINHASH_LSH_BANDS, band_buckets, minhash_signature
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Batched similarity scoring. Indel.normalized_similarity is the score of Levenshtein.ratio
+# used by common.utils.ratio; cdist runs it as a matrix over native worker threads.
+# Threads of one call, 0 uses every core; the scanner passes 1 per scan thread instead.
+SIMILARITY_WORKERS = int(os.getenv('SIMILARITY_WORKERS', 0))
+# rows of the all-pairs matrix computed at once (block_size x corpus float32 scores)
+SIMILARITY_BLOCK_SIZE = int(os.getenv('SIMILARITY_BLOCK_SIZE', 512))
+
+
+def _workers(workers: Optional[int]) -> int:
+    workers = SIMILARITY_WORKERS if workers is None else workers
+    return -1 if workers <= 0 else workers
+
+
+def _normalize(text) -> str:
+    # same normalization as common.utils.ratio
+    if not isinstance(text, str):
+        return ''
+    return ' '.join(text.lower().split())
+
+
+def score_against(query: str, candidates: Sequence[str], workers: Optional[int] = None) -> np.ndarray:
+    """
+    Similarity of one text with each candidate, equal to common.utils.ratio for every pair.
+
+    Args:
+        query (str): Normalized text of the document being scanned
+        candidates (Sequence[str]): Normalized texts of the candidates
+        workers (int): Number of threads, None for SIMILARITY_WORKERS
+
+    Returns:
+        np.ndarray: One score in [0, 1] per candidate, 0 for empty texts
+    """
+    if not len(candidates):
+        return np.zeros(0, dtype=np.float32)
+    query = _normalize(query)
+    choices = [_normalize(candidate) for candidate in candidates]
+    if not query:
+        return np.zeros(len(choices), dtype=np.float32)
+    scores = cdist([query], choices, scorer=Indel.normalized_similarity, dtype=np.float32,
+                   workers=_workers(workers))[0]
+    scores[[not choice for choice in choices]] = 0.0
+    return scores
+
+
+def _exhaustive_pairs(texts: List[str], threshold: float, workers: int,
+                      block_size: int) -> Iterator[Tuple[int, int, float]]:
+    empty = np.array([not text for text in texts])
+    for start in range(0, len(texts), block_size):
+        # only the upper triangle: rows of the block against themselves and the following texts
+        block = texts[start:start + block_size]
+        scores = cdist(block, texts[start:], scorer=Indel.normalized_similarity, dtype=np.float32,
+                       score_cutoff=threshold, workers=workers)
+        rows, cols = np.nonzero(scores >= threshold)
+        for row, col in zip(rows, cols):
+            i, j = start + row, start + col
+            if i < j and not empty[i] and not empty[j]:
+                yield i, j, float(scores[row, col])
+
+
+def _lsh_pairs(texts: List[str], threshold: float) -> Iterator[Tuple[int, int, float]]:
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    for i, text in enumerate(texts):
+        signature = minhash_signature(text)
+        if signature is None:
+            continue
+        for band, bucket in enumerate(band_buckets(signature, MINHASH_LSH_BANDS)):
+            buckets.setdefault((band, bucket), []).append(i)
+    candidates = set()
+    for members in buckets.values():
+        for a in range(len(members)):
+            for b in range(a + 1, len(members)):
+                candidates.add((members[a], members[b]))
+    for i, j in sorted(candidates):
+        score = Indel.normalized_similarity(texts[i], texts[j], score_cutoff=threshold)
+        if score >= threshold:
+            yield i, j, score
+
+
+def similar_pairs(texts: Sequence[str], threshold: float, method: str = 'exhaustive',
+                  workers: Optional[int] = None, block_size: int = SIMILARITY_BLOCK_SIZE) -> Iterator[Tuple[int, int, float]]:
+    """
+    All pairs of texts with a similarity of at least threshold.
+
+    Args:
+        texts (Sequence[str]): Normalized texts of the corpus
+        threshold (float): Minimum similarity of a pair
+        method (str): 'exhaustive' scores every pair in blocks of a cdist matrix;
+            'lsh' only scores the pairs sharing a MinHash band bucket, for large corpora
+        workers (int): Number of threads of the exhaustive method, None for SIMILARITY_WORKERS
+        block_size (int): Rows of the matrix computed at once by the exhaustive method
+
+    Returns:
+        Iterator[Tuple[int, int, float]]: (i, j, score) with i < j
+    """
+    texts = [_normalize(text) for text in texts]
+    if method == 'exhaustive':
+        return _exhaustive_pairs(texts, threshold, _workers(workers), block_size)
+    if method == 'lsh':
+        return _lsh_pairs(texts, threshold)
+    raise ValueError(f"Unknown similarity method: {method}")
+
+
+def duplicate_groups(ids: Sequence[str], texts: Sequence[str], threshold: float = 0.98,
+                     method: str = 'exhaustive', workers: Optional[int] = None) -> List[List[str]]:
+    """
+    Cluster a corpus into duplicate groups, the connected components of the similar pairs.
+
+    Args:
+        ids (Sequence[str]): Document IDs
+        texts (Sequence[str]): Normalized texts, in the order of ids
+        threshold (float): Minimum similarity of two duplicates
+        method (str): See similar_pairs
+        workers (int): See similar_pairs
+
+    Returns:
+        List[List[str]]: Groups of at least two document IDs, largest first
+    """
+    parent = list(range(len(ids)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j, _ in similar_pairs(texts, threshold, method=method, workers=workers):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups: Dict[int, List[str]] = {}
+    for i, doc_id in enumerate(ids):
+        groups.setdefault(find(i), []).append(doc_id)
+    return sorted((group for group in groups.values() if len(group) > 1), key=len, reverse=True)
+
+
+def recluster_documents(data_manager, threshold: float = 0.98, method: str = 'lsh') -> List[List[str]]:
+    """Duplicate groups of every stored document, from the persisted normalized texts."""
+    from common.utils import preprocessing
+
+    rows = data_manager.execute_with_retry(
+        "SELECT id, normalized_text, content FROM documents ORDER BY created_date", fetch=True) or []
+    ids = [row[0] for row in rows]
+    texts = [row[1] if row[1] is not None else preprocessing(row[2] or '') for row in rows]
+    started = time.perf_counter()
+    groups = duplicate_groups(ids, texts, threshold=threshold, method=method)
+    logger.info(f"Clustered {len(ids)} documents into {len(groups)} duplicate groups "
+                f"in {time.perf_counter() - started:.1f}s")
+    return groups
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Re-cluster all stored documents into duplicate groups")
+    parser.add_argument('--threshold', type=float, default=0.98)
+    parser.add_argument('--method', choices=['exhaustive', 'lsh'], default='lsh')
+    args = parser.parse_args()
+
+    from common.data_manager import DatabaseManager
+    print(json.dumps(recluster_documents(DatabaseManager(), args.threshold, args.method), indent=2))
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+
+# Token counts and USD costs of the KMS services and the chatbot. Each service is built from
+# its own directory, so this file is shipped twice, as chatbot-tvts-KMS/common/token_accounting.py
+# and chatbot-tvts-Chatbot/token_accounting.py; keep them identical (the tests compare them).
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+    logger.warning("tiktoken not installed. Token counting will be estimated.")
+
+# The one pricing table, in USD per 1M tokens, keyed by model name prefix (the longest
+# matching prefix wins, so dated snapshots use the price of their model)
+MODEL_PRICES = json.loads(os.getenv('MODEL_PRICES', json.dumps({
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.6},
+    "gpt-4o": {"input": 2.5, "cached_input": 1.25, "output": 10.0},
+    "gpt-4": {"input": 30.0, "output": 60.0},
+    "gpt-3.5-turbo": {"input": 0.5, "output": 1.5},
+})))
+# price of the models missing from MODEL_PRICES, same shape as its entries
+DEFAULT_TOKEN_PRICE = json.loads(os.getenv('DEFAULT_TOKEN_PRICE', json.dumps(MODEL_PRICES["gpt-4o-mini"])))
+# encoding of the models unknown to tiktoken
+DEFAULT_ENCODING = os.getenv('DEFAULT_ENCODING', 'o200k_base')
+
+# tokens added by the chat format around every message and before the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+@lru_cache(maxsize=None)
+def encoder_for(model: str):
+    """The tiktoken encoding of a model, built once per model; None without tiktoken."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def _estimate(text: str) -> int:
+    return int(len(text.split()) * 1.5)
+
+
+def count_tokens(text: str, model: str) -> int:
+    """Number of tokens of text for a model, estimated from its words without tiktoken."""
+    if not text:
+        return 0
+    encoder = encoder_for(model)
+    if encoder is None:
+        return _estimate(text)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def count_tokens_batch(texts: Sequence[str], model: str) -> List[int]:
+    """
+    Number of tokens of each text, encoded in one batch over tiktoken's native threads.
+
+    Args:
+        texts (Sequence[str]): Texts to count
+        model (str): Model the texts are sent to
+
+    Returns:
+        List[int]: Token count of every text, in order
+    """
+    texts = [text or '' for text in texts]
+    encoder = encoder_for(model)
+    if encoder is None:
+        return [_estimate(text) for text in texts]
+    return [len(tokens) for tokens in encoder.encode_batch(texts, disallowed_special=())]
+
+
+def count_message_tokens(messages: Sequence[Dict], model: str) -> int:
+    """Prompt tokens of a chat completion request, as billed by the API."""
+    contents = [message.get('content') or '' for message in messages]
+    return sum(count_tokens_batch(contents, model)) + TOKENS_PER_MESSAGE * len(contents) + TOKENS_PER_REPLY
+
+
+def model_price(model: Optional[str]) -> Dict[str, float]:
+    matches = [prefix for prefix in MODEL_PRICES if model and model.startswith(prefix)]
+    if not matches:
+        return DEFAULT_TOKEN_PRICE
+    return MODEL_PRICES[max(matches, key=len)]
+
+
+def estimate_cost(prompt_tokens: int, completion_tokens: int, model: Optional[str],
+                  cached_tokens: int = 0) -> Dict[str, float]:
+    """
+    Cost of a request from MODEL_PRICES.
+
+    Args:
+        prompt_tokens (int): Prompt tokens, cached ones included
+        completion_tokens (int): Completion tokens
+        model (str): Model of the request
+        cached_tokens (int): Prompt tokens served from the prompt cache
+
+    Returns:
+        Dict[str, float]: input_cost, output_cost and total_cost in USD
+    """
+    price = model_price(model)
+    prompt_tokens = max(prompt_tokens or 0, 0)
+    cached_tokens = min(max(cached_tokens or 0, 0), prompt_tokens)
+    input_cost = ((prompt_tokens - cached_tokens) * price.get("input", 0)
+                  + cached_tokens * price.get("cached_input", price.get("input", 0))) / 1_000_000
+    output_cost = max(completion_tokens or 0, 0) * price.get("output", 0) / 1_000_000
+    return {
+        "input_cost": round(input_cost, 6),
+        "output_cost": round(output_cost, 6),
+        "total_cost": round(input_cost + output_cost, 6)
+    }
+
+
+def usage_cost(usage, model: Optional[str]) -> Dict[str, float]:
+    """Cost of the usage of an OpenAI response, counting its cached prompt tokens."""
+    if usage is None:
+        return estimate_cost(0, 0, model)
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = getattr(details, 'cached_tokens', 0) or 0
+    return estimate_cost(usage.prompt_tokens, usage.completion_tokens, model, cached_tokens)
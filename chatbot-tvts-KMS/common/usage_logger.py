@@ -4,6 +4,7 @@ import logging
 from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 from common.data_manager import DatabaseManager
+from common.token_accounting import estimate_cost
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -51,7 +52,9 @@ class UsageLogger:
             completion_tokens = usage_data.get("completion_tokens", 0)
             total_tokens = usage_data.get("total_tokens", 0)
             
-            costs = usage_data.get("costs", {})
+            # priced from the shared table unless the caller already did
+            costs = usage_data.get("costs") or estimate_cost(
+                prompt_tokens, completion_tokens, model, usage_data.get("cached_tokens", 0))
             input_cost = costs.get("input_cost", 0)
             output_cost = costs.get("output_cost", 0)
             total_cost = costs.get("total_cost", 0)
@@ -0,0 +1,146 @@
+import os
+import sys
+import uuid
+
+import httpx
+import psycopg2
+import pytest
+from sqlalchemy import create_engine
+
+# the services import the shared modules as "common.*" from the KMS root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# read at import time by the shared modules; tests never reach the real services
+for name, value in {
+    "OPENAI_API_KEY": "test",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "DB_USER": "postgres",
+    "DB_PASSWORD": "postgres",
+    "DB_NAME": "kms",
+    "CHROMA_HOST": "localhost",
+    "CHROMA_PORT": "8000",
+    "CHROMA_DB": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture
+def data_manager():
+    """DatabaseManager on a throwaway schema of TEST_DATABASE_URL; database tests are skipped without it."""
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    from common.data_manager import DatabaseManager
+
+    # the same URL as the chatbot tests, psycopg2 takes the plain postgresql:// form
+    dsn = url.replace("postgresql+psycopg2://", "postgresql://", 1)
+    sqlalchemy_url = dsn.replace("postgresql://", "postgresql+psycopg2://", 1)
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {schema}")
+
+    # built by hand: __init__ would create the configured database
+    manager = DatabaseManager.__new__(DatabaseManager)
+    manager.max_retries = 1
+    manager.retry_delay = 0
+    manager.db_name = None
+    manager.db_params = {"dsn": dsn, "options": f"-csearch_path={schema}"}
+    manager.engine = create_engine(sqlalchemy_url, connect_args={"options": f"-csearch_path={schema}"})
+    manager.init_db()
+    yield manager
+    manager.engine.dispose()
+    with admin.cursor() as cur:
+        cur.execute(f"DROP SCHEMA {schema} CASCADE")
+    admin.close()
+
+
+class FakeCollection:
+    """
+    In-memory Chroma collection, records by chunk ID. Upserts of the chunks in bad_ids are
+    rejected, and the first transient_failures upserts lose the connection.
+    """
+
+    def __init__(self, metadatas=None, documents=None, metadata=None, bad_ids=(), transient_failures=0):
+        self.metadatas = dict(metadatas or {})
+        self.documents = dict(documents or {})
+        self.metadata = dict(metadata or {})
+        self.bad_ids = set(bad_ids)
+        self.transient_failures = transient_failures
+        self.upserts = []
+        self.updates = []
+
+    def get(self, ids=None, limit=None, offset=0, include=()):
+        ids = list(self.metadatas) if ids is None else [chunk_id for chunk_id in ids if chunk_id in self.metadatas]
+        if limit is not None:
+            ids = ids[offset:offset + limit]
+        return {"ids": ids, "documents": [self.documents.get(chunk_id, f"content of {chunk_id}") for chunk_id in ids],
+                "metadatas": [dict(self.metadatas[chunk_id]) for chunk_id in ids]}
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.upserts.append(list(ids))
+        if self.transient_failures:
+            self.transient_failures -= 1
+            raise httpx.ConnectError("connection refused")
+        if self.bad_ids.intersection(ids):
+            raise ValueError("invalid metadata")
+        self.documents.update(zip(ids, documents))
+        self.metadatas.update(zip(ids, metadatas))
+
+    def update(self, ids, metadatas):
+        self.updates.append(list(ids))
+        self.metadatas.update(zip(ids, metadatas))
+
+    def modify(self, metadata):
+        self.metadata = metadata
+
+
+class FakeChromaClient:
+    def __init__(self, collection, max_batch_size=100):
+        self.collection = collection
+        self.max_batch_size = max_batch_size
+
+    def get_max_batch_size(self):
+        return self.max_batch_size
+
+    def get_collection(self, name):
+        return self.collection
+
+
+class FakeEmbeddingCache:
+    """One-dimensional embeddings; the next `failures` calls raise `error`, texts in bad_texts are rejected."""
+
+    def __init__(self):
+        self.failures = 0
+        self.error = RuntimeError("embedding API unavailable")
+        self.bad_texts = set()
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append(list(texts))
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        if self.bad_texts.intersection(texts):
+            raise ValueError("input too long")
+        return [[1.0] for _ in texts]
+
+
+@pytest.fixture
+def chroma_manager():
+    """ChromaManager on a FakeCollection, without retry delays and follow-up questions."""
+    from common.chroma_manager import ChromaManager
+
+    # built by hand: __init__ would connect to Chroma and OpenAI
+    manager = ChromaManager.__new__(ChromaManager)
+    manager.collection = FakeCollection()
+    manager.client = FakeChromaClient(manager.collection)
+    manager.collection_name = "test"
+    manager.embedding_cache = FakeEmbeddingCache()
+    manager.max_retries = 3
+    manager.retry_delay = 0
+    manager.followup_questions_per_chunk = 0
+    manager._gpt_processor = None
+    return manager
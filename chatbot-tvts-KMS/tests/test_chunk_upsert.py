@@ -0,0 +1,77 @@
+import httpx
+import openai
+
+from common import chroma_manager as chroma_manager_module
+
+
+def _chunks(count, content="text"):
+    return [{"id": f"c{i}", "content": content, "metadata": {"original_id": "doc"}} for i in range(count)]
+
+
+def test_batches_are_bounded_by_size_and_characters(chroma_manager, monkeypatch):
+    monkeypatch.setattr(chroma_manager_module, "CHROMA_UPSERT_BATCH_SIZE", 4)
+    chroma_manager.client.max_batch_size = 3
+
+    assert [len(batch) for batch in chroma_manager._upsert_batches(_chunks(7))] == [3, 3, 1]
+
+    monkeypatch.setattr(chroma_manager_module, "CHROMA_UPSERT_BATCH_CHARS", 100)
+    assert [len(batch) for batch in chroma_manager._upsert_batches(_chunks(3, content="x" * 60))] == [1, 1, 1]
+
+
+def test_a_dropped_connection_retries_the_whole_batch(chroma_manager):
+    collection = chroma_manager.collection
+    collection.transient_failures = 2
+
+    result = chroma_manager.upsert_chunks(_chunks(4))
+
+    assert result["failed"] == {}
+    assert collection.upserts == [["c0", "c1", "c2", "c3"]] * 3
+    assert "kms_version" in collection.metadata
+
+
+def test_a_rate_limited_embedding_retries_the_whole_batch(chroma_manager):
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    chroma_manager.embedding_cache.error = openai.RateLimitError(
+        "rate limited", response=httpx.Response(429, request=request), body=None)
+    chroma_manager.embedding_cache.failures = 1
+
+    result = chroma_manager.upsert_chunks(_chunks(4))
+
+    assert result["failed"] == {} and len(chroma_manager.embedding_cache.calls) == 2
+    assert chroma_manager.collection.upserts == [["c0", "c1", "c2", "c3"]]
+
+
+def test_a_batch_failing_every_attempt_fails_all_its_chunks(chroma_manager):
+    collection = chroma_manager.collection
+    collection.transient_failures = 3
+
+    result = chroma_manager.upsert_chunks(_chunks(2))
+
+    assert sorted(result["failed"]) == ["c0", "c1"] and result["succeeded"] == []
+    assert len(collection.upserts) == 3
+    assert collection.metadata == {}
+
+
+def test_a_rejected_record_is_isolated_by_splitting(chroma_manager):
+    collection = chroma_manager.collection
+    collection.bad_ids = {"c2"}
+
+    result = chroma_manager.upsert_chunks(_chunks(4))
+
+    assert list(result["failed"]) == ["c2"]
+    assert result["succeeded"] == ["c0", "c1", "c3"]
+    assert sorted(collection.documents) == ["c0", "c1", "c3"]
+    # the rejected chunk is not retried
+    assert collection.upserts.count(["c2"]) == 1
+
+
+def test_a_rejected_embedding_input_is_isolated_without_retries(chroma_manager):
+    chroma_manager.embedding_cache.bad_texts = {"too long"}
+    chunks = _chunks(4)
+    chunks[1]["content"] = "too long"
+
+    result = chroma_manager.upsert_chunks(chunks)
+
+    assert list(result["failed"]) == ["c1"]
+    assert result["succeeded"] == ["c0", "c2", "c3"]
+    assert chroma_manager.embedding_cache.calls.count(["too long"]) == 1
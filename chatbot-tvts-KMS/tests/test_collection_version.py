@@ -0,0 +1,31 @@
+def test_every_bump_writes_a_new_version(chroma_manager):
+    collection = chroma_manager.collection
+    collection.metadata = {"chunking_method": "gpt", "hnsw:space": "cosine", "kms_version": 4}
+
+    versions = set()
+    for _ in range(3):
+        chroma_manager._bump_collection_version()
+        versions.add(collection.metadata["kms_version"])
+
+    assert len(versions) == 3 and 4 not in versions
+    assert collection.metadata["chunking_method"] == "gpt"
+    assert "hnsw:space" not in collection.metadata
+
+
+def test_processes_bumping_from_the_same_read_write_different_versions(chroma_manager):
+    collection = chroma_manager.collection
+    collection.metadata = {"kms_version": "a"}
+    chroma_manager._bump_collection_version()
+    first = collection.metadata["kms_version"]
+
+    # a second process that read the same metadata
+    collection.metadata = {"kms_version": "a"}
+    chroma_manager._bump_collection_version()
+
+    assert collection.metadata["kms_version"] not in ("a", first)
+
+
+def test_bump_failures_do_not_fail_the_write(chroma_manager):
+    chroma_manager.client = None
+
+    chroma_manager._bump_collection_version()
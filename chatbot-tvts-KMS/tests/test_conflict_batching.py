@@ -0,0 +1,123 @@
+import json
+import threading
+from types import SimpleNamespace
+
+from common import openai_conflict_analyzer
+from common.conflict_manager import ConflictAnalyzer, ConflictManager
+from common.openai_conflict_analyzer import OpenAIConflictAnalyzer
+
+
+class FakeCompletions:
+    """Answers batch prompts with the given results, fails single-pair prompts, keeps the messages it was sent."""
+
+    def __init__(self, results):
+        self.results = results
+        self.requests = []
+
+    def create(self, messages, **kwargs):
+        self.requests.append(messages)
+        if "CÁC CẶP CẦN PHÂN TÍCH" not in messages[-1]["content"]:
+            raise RuntimeError("rate limited")
+        content = json.dumps({"results": self.results})
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=10, prompt_tokens_details=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+class FailingAnalyzer:
+    def __init__(self):
+        self.calls = 0
+
+    def analyze_pairs(self, pairs, conflict_type="internal"):
+        self.calls += 1
+        raise RuntimeError("OpenAI is down")
+
+
+def _analyzer(results=()):
+    analyzer = OpenAIConflictAnalyzer.__new__(OpenAIConflictAnalyzer)
+    analyzer.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(list(results))))
+    analyzer.model = "gpt-4o-mini"
+    analyzer.use_cache = True
+    analyzer.cache = {}
+    analyzer.cache_hits = 0
+    analyzer.cache_misses = 0
+    analyzer.timeout = 30
+    analyzer.max_retries = 1
+    analyzer.retry_delay = 0
+    analyzer.max_workers = 1
+    analyzer.usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_cost": 0.0}
+    analyzer.usage_lock = threading.Lock()
+    return analyzer
+
+
+def _result(pair_id, has_contradiction="no"):
+    return {"pair_id": pair_id, "has_contradiction": has_contradiction, "explanation": pair_id}
+
+
+def test_pairs_are_packed_by_count(monkeypatch):
+    monkeypatch.setattr(openai_conflict_analyzer, "CONFLICT_BATCH_MAX_PAIRS", 2)
+
+    assert _analyzer()._pack_pairs([("a", "b"), ("a", "c"), ("b", "c"), ("c", "d"), ("d", "e")]) == [[0, 1], [2, 3], [4]]
+
+
+def test_pairs_are_packed_by_tokens_counting_shared_paragraphs_once(monkeypatch):
+    monkeypatch.setattr(openai_conflict_analyzer, "count_tokens", lambda text, model: len(text))
+    monkeypatch.setattr(openai_conflict_analyzer, "CONFLICT_BATCH_PROMPT_TOKENS", 100)
+    a, b, c, d = "a" * 30, "b" * 30, "c" * 15, "d" * 60
+
+    # (a, b) takes 70 tokens, (a, c) only adds c: 95; d no longer fits
+    assert _analyzer()._pack_pairs([(a, b), (a, c), (c, d)]) == [[0, 1], [2]]
+
+
+def test_a_batch_sends_every_paragraph_once_and_maps_results_by_pair_id():
+    analyzer = _analyzer([_result("P2", "yes"), _result("P1"), _result("P9"), "not a result"])
+
+    results = analyzer._analyze_batch([("first", "second"), ("first", "third")], "internal")
+
+    assert sorted(results) == [0, 1]
+    assert results[0].explanation == "P1" and not results[0].has_conflict
+    assert results[1].has_conflict
+    prompt = analyzer.client.chat.completions.requests[0][1]["content"]
+    assert prompt.count("first") == 1
+    assert "P1: C1 - C2" in prompt and "P2: C1 - C3" in prompt
+
+
+def test_pairs_missing_from_the_answer_are_analyzed_again_and_errors_not_cached():
+    # the batch answers P1 only and the single-pair retry of P2 fails
+    analyzer = _analyzer([_result("P1")])
+
+    results = analyzer.analyze_pairs([("first", "second"), ("third", "fourth")])
+
+    assert results[0].error is None and results[1].error
+    assert list(analyzer.cache.values()) == [results[0]]
+
+
+def test_usage_of_concurrent_batches_is_fully_counted(monkeypatch):
+    monkeypatch.setattr(openai_conflict_analyzer, "CONFLICT_BATCH_MAX_PAIRS", 1)
+    analyzer = _analyzer([_result("P1")])
+    analyzer.max_workers = 8
+
+    analyzer.analyze_pairs([(f"first {i}", f"second {i}") for i in range(200)])
+
+    usage = analyzer.get_cache_stats()["usage"]
+    assert usage["requests"] == 200
+    assert usage["prompt_tokens"] == 200 * 100 and usage["completion_tokens"] == 200 * 10
+
+
+def test_failed_chunk_pair_analyses_are_not_cached():
+    analyzer = ConflictAnalyzer.__new__(ConflictAnalyzer)
+    analyzer.analyzer = FailingAnalyzer()
+    analyzer.cache = {}
+    analyzer.cache_hits = 0
+    analyzer.cache_misses = 0
+    pairs = [(("c1", "first"), ("c2", "second"))]
+
+    first = analyzer.analyze_chunk_pairs(pairs)
+    analyzer.analyze_chunk_pairs(pairs)
+
+    assert first[0].error and first[0].chunk_ids == ["c1", "c2"]
+    assert analyzer.cache == {} and analyzer.analyzer.calls == 2
+
+    manager = ConflictManager.__new__(ConflictManager)
+    manager.conflict_cache = {}
+    manager._update_cache("internal_c1_c2", first[0])
+    assert manager.conflict_cache == {}
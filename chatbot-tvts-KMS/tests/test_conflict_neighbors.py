@@ -0,0 +1,92 @@
+import pytest
+
+from common import conflict_manager
+from common.conflict_manager import ConflictManager
+
+
+class FakeCollection:
+    """Stores embeddings of chunk IDs and answers every query with the same ranked neighbours."""
+
+    def __init__(self, embeddings, neighbours, space="l2"):
+        self.embeddings = embeddings
+        self.neighbours = neighbours
+        self.metadata = {"hnsw:space": space}
+        self.queries = []
+
+    def get(self, ids, include):
+        found = [chunk_id for chunk_id in ids if chunk_id in self.embeddings]
+        return {"ids": found, "embeddings": [self.embeddings[chunk_id] for chunk_id in found]}
+
+    def query(self, query_embeddings, n_results, where, include):
+        self.queries.append({"query_embeddings": query_embeddings, "n_results": n_results, "where": where})
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for _ in query_embeddings:
+            results["ids"].append([neighbour[0] for neighbour in self.neighbours])
+            results["documents"].append(["" for _ in self.neighbours])
+            results["metadatas"].append([neighbour[1] for neighbour in self.neighbours])
+            results["distances"].append([neighbour[2] for neighbour in self.neighbours])
+        return results
+
+
+class FakeChromaManager:
+    def __init__(self, collection):
+        self.collection = collection
+
+
+def _manager(collection):
+    manager = ConflictManager.__new__(ConflictManager)
+    manager.chroma_manager = FakeChromaManager(collection)
+    return manager
+
+
+def _chunk(chunk_id, original_id="doc"):
+    return {"id": chunk_id, "metadata": {"original_id": original_id}}
+
+
+def test_similarity_of_squared_l2_and_cosine_distances():
+    assert ConflictManager._similarity(0.0, "l2") == 1
+    assert ConflictManager._similarity(1.0, "l2") == pytest.approx(0.5)
+    assert ConflictManager._similarity(0.3, "cosine") == pytest.approx(0.7)
+
+
+def test_neighbours_are_pruned_by_similarity_count_and_state(monkeypatch):
+    monkeypatch.setattr(conflict_manager, "CONFLICT_NEIGHBORS_PER_CHUNK", 2)
+    monkeypatch.setattr(conflict_manager, "CONFLICT_NEIGHBOR_MIN_SIMILARITY", 0.5)
+    collection = FakeCollection({"a": [1.0, 0.0]}, [
+        ("x1", {"original_id": "other", "is_enabled": "false"}, 0.1),
+        ("x2", {"original_id": "other"}, 0.2),
+        ("y1", {"original_id": "third"}, 0.4),
+        ("y2", {"original_id": "third"}, 0.5),
+    ])
+
+    pairs = _manager(collection)._nearest_external_chunks("doc", [_chunk("a")])
+
+    assert {related: [neighbour["id"] for _, neighbour in found] for related, found in pairs.items()} == \
+        {"other": ["x2"], "third": ["y1"]}
+    assert pairs["other"][0][1]["metadata"]["doc_id"] == "other"
+    assert collection.queries[0]["n_results"] == 4
+
+
+def test_far_neighbours_are_never_compared(monkeypatch):
+    monkeypatch.setattr(conflict_manager, "CONFLICT_NEIGHBOR_MIN_SIMILARITY", 0.9)
+    collection = FakeCollection({"a": [1.0]}, [("x1", {"original_id": "other"}, 0.4)])
+
+    assert _manager(collection)._nearest_external_chunks("doc", [_chunk("a")]) == {}
+
+
+def test_one_query_for_the_stored_chunks_outside_the_own_documents():
+    collection = FakeCollection({"a": [1.0], "b": [0.5]}, [])
+
+    _manager(collection)._nearest_external_chunks(
+        "dup", [_chunk("a", "source"), _chunk("b", "source"), _chunk("missing", "source")])
+
+    assert len(collection.queries) == 1
+    assert collection.queries[0]["query_embeddings"] == [[1.0], [0.5]]
+    assert collection.queries[0]["where"] == {"original_id": {"$nin": ["dup", "source"]}}
+
+
+def test_chunks_without_stored_embeddings_are_not_queried():
+    collection = FakeCollection({}, [])
+
+    assert _manager(collection)._nearest_external_chunks("doc", [_chunk("a")]) == {}
+    assert collection.queries == []
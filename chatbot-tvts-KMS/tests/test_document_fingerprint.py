@@ -0,0 +1,44 @@
+from common.data_manager import DatabaseManager
+from common.document_fingerprint import compute_fingerprint, has_numeric_differences, stored_fingerprint
+
+
+def test_exact_duplicates_share_a_content_hash():
+    a = compute_fingerprint("<p>Học phí   năm 2024 là 10.500.000 VNĐ</p>")
+    b = compute_fingerprint("học phí năm 2024 là 10.500.000 vnđ")
+    c = compute_fingerprint("học phí năm 2025 là 10.500.000 vnđ")
+
+    assert a["content_hash"] == b["content_hash"]
+    assert a["content_hash"] != c["content_hash"]
+    assert a["numeric_tokens"] == ["2024", "10.500", "000"]
+
+
+def test_numeric_differences_ignore_the_order_of_numbers():
+    assert not has_numeric_differences(["2024", "15"], ["15", "2024"])
+    assert has_numeric_differences(["2024", "15"], ["2024", "20"])
+    assert has_numeric_differences(["2024"], ["2024", "2024"])
+
+
+def test_stored_fingerprint_of_a_row():
+    assert stored_fingerprint(None) is None
+    assert stored_fingerprint({"content_hash": None, "normalized_text": "x"}) is None
+    assert stored_fingerprint({"content_hash": "abc", "normalized_text": None, "numeric_tokens": ("1",)}) == {
+        "normalized_text": "", "content_hash": "abc", "numeric_tokens": ["1"]}
+
+
+def test_backfill_skips_documents_it_cannot_save(data_manager, monkeypatch):
+    for doc_id in ("a", "b", "c"):
+        data_manager.execute_with_retry(
+            "INSERT INTO documents (id, content) VALUES (%s, %s)", (doc_id, f"Tài liệu {doc_id} năm 2024"))
+    store = DatabaseManager._store_document_fingerprint
+
+    def failing_store(self, doc_id, fingerprint):
+        if doc_id == "b":
+            raise RuntimeError("value too long")
+        store(self, doc_id, fingerprint)
+
+    monkeypatch.setattr(DatabaseManager, "_store_document_fingerprint", failing_store)
+
+    assert data_manager.backfill_document_fingerprints(batch_size=1) == {"fingerprinted": 2, "failed": 1}
+    rows = data_manager.execute_with_retry(
+        "SELECT id FROM documents WHERE content_hash IS NULL", fetch=True)
+    assert rows == [("b",)]
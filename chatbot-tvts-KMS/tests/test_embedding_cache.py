@@ -0,0 +1,66 @@
+import pytest
+
+from common import embedding_cache
+from common.embedding_cache import EmbeddingCache
+
+
+class FakeEmbeddingFunction:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 0.5] for text in texts]
+
+
+class BrokenDatabase:
+    def execute_with_retry(self, *args, **kwargs):
+        raise RuntimeError("database is down")
+
+
+def test_second_embed_is_served_from_the_cache(data_manager):
+    embed = FakeEmbeddingFunction()
+    cache = EmbeddingCache(data_manager, embed, "text-embedding-3-small")
+
+    first = cache.embed(["alpha", "beta", "alpha"])
+    second = cache.embed(["beta", "alpha"])
+
+    assert embed.calls == [["alpha", "beta"]]
+    assert first == [[5.0, 0.5], [4.0, 0.5], [5.0, 0.5]]
+    assert second == [[4.0, 0.5], [5.0, 0.5]]
+    assert cache.stats() == {"hits": 3, "misses": 2}
+
+
+def test_cache_entries_belong_to_one_model(data_manager):
+    embed = FakeEmbeddingFunction()
+    EmbeddingCache(data_manager, embed, "model-a").embed(["alpha"])
+    other = EmbeddingCache(data_manager, embed, "model-b")
+
+    other.embed(["alpha"])
+
+    assert embed.calls == [["alpha"], ["alpha"]]
+    assert other.stats() == {"hits": 0, "misses": 1}
+
+
+def test_misses_are_embedded_in_batches(data_manager, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_BATCH_SIZE", 2)
+    embed = FakeEmbeddingFunction()
+
+    EmbeddingCache(data_manager, embed, "model").embed(["a", "bb", "ccc"])
+
+    assert embed.calls == [["a", "bb"], ["ccc"]]
+
+
+def test_an_unreachable_cache_still_embeds():
+    embed = FakeEmbeddingFunction()
+    cache = EmbeddingCache(BrokenDatabase(), embed, "model")
+
+    assert cache.embed(["alpha", "alpha"]) == [[5.0, 0.5], [5.0, 0.5]]
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+
+def test_a_short_embedding_batch_is_an_error():
+    cache = EmbeddingCache(BrokenDatabase(), lambda texts: [[1.0]], "model")
+
+    with pytest.raises(ValueError):
+        cache.embed(["alpha", "beta"])
@@ -0,0 +1,78 @@
+import json
+import threading
+
+
+class FakeGPTProcessor:
+    def __init__(self, failing=(), concurrent=0):
+        self.failing = set(failing)
+        self.calls = []
+        # every call waits for `concurrent` calls in flight, serial calls time out
+        self.barrier = threading.Barrier(concurrent, timeout=5) if concurrent else None
+
+    def generate_followup_questions(self, content, num, chunk_id=None):
+        self.calls.append(chunk_id)
+        if self.barrier:
+            self.barrier.wait()
+        return [] if chunk_id in self.failing else [f"next question about {chunk_id}"]
+
+
+def _with_questions(chroma_manager, metadatas=None, per_chunk=3, failing=(), concurrent=0):
+    chroma_manager.collection.metadatas.update(metadatas or {})
+    chroma_manager.followup_questions_per_chunk = per_chunk
+    chroma_manager._gpt_processor = FakeGPTProcessor(failing, concurrent)
+    return chroma_manager
+
+
+def test_backfill_retries_chunks_stored_with_an_empty_list(chroma_manager):
+    manager = _with_questions(chroma_manager, {
+        "done": {"followup_questions": json.dumps(["q"])},
+        "failed_before": {"followup_questions": "[]"},
+        "missing": {},
+        "failing_again": {"followup_questions": "[]"},
+    }, failing={"failing_again"})
+
+    stats = manager.backfill_followup_questions(page_size=3)
+
+    assert stats == {"scanned": 4, "updated": 2}
+    assert sorted(manager._gpt_processor.calls) == ["failed_before", "failing_again", "missing"]
+    assert json.loads(manager.collection.metadatas["missing"]["followup_questions"]) == ["next question about missing"]
+    assert manager.collection.metadatas["failing_again"]["followup_questions"] == "[]"
+
+
+def test_backfill_does_nothing_when_disabled(chroma_manager):
+    manager = _with_questions(chroma_manager, {"missing": {}}, per_chunk=0)
+
+    assert manager.backfill_followup_questions() == {"scanned": 0, "updated": 0}
+    assert manager.collection.updates == []
+
+
+def _chunks_data(count):
+    return {"TOPIC": "Tuyển sinh", "CHUNK_NUMBER": count, "CHUNKS": [
+        {"chunk_topic": f"topic {i}", "original_chunk": f"text {i}", "revised_chunk": f"Q: q{i}\nA: a{i}",
+         "index": f"Paragraph {i}"} for i in range(1, count + 1)]}
+
+
+def test_questions_of_a_document_are_generated_concurrently(chroma_manager):
+    manager = _with_questions(chroma_manager, concurrent=3)
+
+    chunks = manager._build_chunk_objects("doc", _chunks_data(3))
+
+    assert [json.loads(chunk["metadata"]["followup_questions"]) for chunk in chunks] == \
+        [[f"next question about doc_paragraph_{i}"] for i in range(1, 4)]
+
+
+def test_updates_keep_the_questions_of_unchanged_contents(chroma_manager):
+    manager = _with_questions(chroma_manager, {
+        "same": {"followup_questions": json.dumps(["kept"])},
+        "edited": {"followup_questions": json.dumps(["outdated"])},
+    })
+
+    result = manager.update_chunks([
+        {"chunk_id": "same", "new_content": "content of same", "metadata": {"is_enabled": True}},
+        {"chunk_id": "edited", "new_content": "new content"},
+    ])
+
+    assert sorted(result["succeeded"]) == ["edited", "same"]
+    assert manager._gpt_processor.calls == ["edited"]
+    assert json.loads(manager.collection.metadatas["same"]["followup_questions"]) == ["kept"]
+    assert json.loads(manager.collection.metadatas["edited"]["followup_questions"]) == ["next question about edited"]
@@ -0,0 +1,146 @@
+import threading
+import time
+
+from common.job_queue import PRIORITY_HIGH, PRIORITY_LOW, JobQueue
+
+
+def _documents(data_manager, *doc_ids, **columns):
+    names = ", ".join(["id", *columns])
+    placeholders = ", ".join(["%s"] * (len(columns) + 1))
+    for doc_id in doc_ids:
+        data_manager.execute_with_retry(
+            f"INSERT INTO documents ({names}) VALUES ({placeholders})", (doc_id, *columns.values()))
+
+
+def _jobs(data_manager):
+    return data_manager.execute_with_retry(
+        "SELECT queue, doc_id, status, attempts, rerun FROM jobs ORDER BY queue, doc_id", fetch=True)
+
+
+def test_concurrent_workers_claim_distinct_jobs(data_manager):
+    doc_ids = [f"doc{i:02d}" for i in range(20)]
+    _documents(data_manager, *doc_ids)
+    queue = JobQueue(data_manager, "scan", visibility_timeout=60)
+    for doc_id in doc_ids:
+        queue.enqueue(doc_id)
+    claimed, lock = [], threading.Lock()
+
+    def worker(worker_id):
+        while True:
+            job = queue.claim(worker_id)
+            if job is None:
+                return
+            with lock:
+                claimed.append(job.doc_id)
+
+    workers = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    assert sorted(claimed) == doc_ids
+    assert queue.stats() == {"running": 20}
+
+
+def test_priority_then_age_and_ack(data_manager):
+    _documents(data_manager, "old", "new", "urgent")
+    queue = JobQueue(data_manager, "scan", visibility_timeout=60)
+    queue.enqueue("old", priority=PRIORITY_LOW)
+    queue.enqueue("new", priority=PRIORITY_LOW)
+    queue.enqueue("urgent", priority=PRIORITY_HIGH)
+
+    jobs = [queue.claim("w") for _ in range(3)]
+    assert [job.doc_id for job in jobs] == ["urgent", "old", "new"]
+    assert queue.claim("w") is None
+
+    queue.complete(jobs[1], "w")
+    assert [row[1] for row in _jobs(data_manager)] == ["new", "urgent"]
+
+
+def test_expired_jobs_are_reclaimed_and_failed_after_max_attempts(data_manager):
+    _documents(data_manager, "doc")
+    queue = JobQueue(data_manager, "scan", visibility_timeout=0.2, max_attempts=2)
+    queue.enqueue("doc")
+
+    first = queue.claim("dead worker")
+    assert queue.claim("w2") is None
+    time.sleep(0.3)
+    second = queue.claim("w2")
+    assert (second.id, second.attempts) == (first.id, 2)
+
+    # the dead worker's late ack does not remove the job of the new owner
+    queue.complete(first, "dead worker")
+    assert _jobs(data_manager) == [("scan", "doc", "running", 2, False)]
+
+    time.sleep(0.3)
+    assert queue.claim("w3") is None
+    assert queue.stats() == {"failed": 1}
+
+
+def test_failed_attempts_back_off_then_give_up(data_manager):
+    _documents(data_manager, "doc")
+    queue = JobQueue(data_manager, "process", visibility_timeout=60, max_attempts=2, retry_delay=0.2)
+    queue.enqueue("doc")
+
+    assert queue.fail(queue.claim("w"), "w", "boom") is True
+    assert queue.claim("w") is None
+    time.sleep(0.3)
+    assert queue.fail(queue.claim("w"), "w", "boom again") is False
+    assert queue.stats() == {"failed": 1}
+
+
+def test_resubmission_while_running_runs_again(data_manager):
+    _documents(data_manager, "doc")
+    queue = JobQueue(data_manager, "scan", visibility_timeout=60, max_attempts=1)
+    queue.enqueue("doc", {"version": 1})
+    job = queue.claim("w")
+
+    assert queue.enqueue("doc", {"version": 2}) is True
+    assert queue.claim("w2") is None
+    queue.complete(job, "w")
+
+    rerun = queue.claim("w2")
+    assert (rerun.payload, rerun.attempts) == ({"version": 2}, 1)
+
+    # a resubmission during a failed last attempt is not given up either
+    queue.enqueue("doc", {"version": 3})
+    assert queue.fail(rerun, "w2", "boom") is True
+    assert queue.claim("w3").payload == {"version": 3}
+
+
+def test_heartbeat_keeps_a_long_job_claimed(data_manager):
+    _documents(data_manager, "doc")
+    queue = JobQueue(data_manager, "process", visibility_timeout=0.3)
+    queue.enqueue("doc")
+    job = queue.claim("w")
+    stolen = []
+
+    def handler(job):
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            stolen.append(queue.claim("other"))
+            time.sleep(0.1)
+
+    queue.run(job, "w", handler)
+
+    assert not any(stolen)
+    time.sleep(0.4)
+    assert queue.claim("other").id == job.id
+
+
+def test_first_migration_queues_the_documents_of_the_old_queues(data_manager):
+    _documents(data_manager, "unscanned", scan_status="Pending")
+    _documents(data_manager, "scanning", scan_status="Scanning", processing_status="Scanning")
+    _documents(data_manager, "sent", scan_status="Completed", processing_status="Processing", chunk_status="Pending")
+    _documents(data_manager, "chunking_failed", scan_status="Completed", processing_status="Failed",
+               chunk_status="ChunkingFailed")
+    _documents(data_manager, "done", scan_status="Completed", processing_status="Processed", chunk_status="Chunked")
+    _documents(data_manager, "duplicate", scan_status="Completed", processing_status="Processing",
+               is_duplicate=True)
+    data_manager.execute_with_retry("DROP TABLE jobs")
+
+    data_manager.init_db()
+
+    assert [row[:2] for row in _jobs(data_manager)] == [
+        ("process", "chunking_failed"), ("process", "sent"), ("scan", "scanning"), ("scan", "unscanned")]
@@ -0,0 +1,53 @@
+import numpy as np
+
+from common.near_duplicate_index import NearDuplicateIndex, band_buckets, minhash_signature, shingles
+
+BASE = ("Sinh viên đăng ký học phần trực tuyến trong tuần thứ hai của học kỳ, học phí được đóng "
+        "qua ngân hàng trước ngày mười lăm, sinh viên không đóng đúng hạn sẽ bị hủy học phần đã đăng ký "
+        "và phải đăng ký lại vào học kỳ sau theo quy định của nhà trường")
+NEAR = BASE.replace("ngày mười lăm", "ngày hai mươi")
+OTHER = ("Ký túc xá mở cửa từ sáu giờ sáng đến mười một giờ đêm, khách đến thăm phải đăng ký tại "
+         "phòng bảo vệ và rời khỏi khu nội trú trước chín giờ tối hằng ngày kể cả cuối tuần")
+
+
+def _jaccard(a, b):
+    a, b = shingles(a.lower(), 3), shingles(b.lower(), 3)
+    return len(a & b) / len(a | b)
+
+
+def _shared_buckets(a, b):
+    return sum(x == y for x, y in zip(band_buckets(minhash_signature(a.lower())),
+                                      band_buckets(minhash_signature(b.lower()))))
+
+
+def test_signatures_are_stable_across_calls():
+    assert np.array_equal(minhash_signature(BASE.lower()), minhash_signature(BASE.lower()))
+    assert minhash_signature("") is None
+
+
+def test_signature_agreement_estimates_jaccard_similarity():
+    a, b = minhash_signature(BASE.lower()), minhash_signature(NEAR.lower())
+
+    assert abs(float(np.mean(a == b)) - _jaccard(BASE, NEAR)) < 0.15
+
+
+def test_near_duplicates_share_buckets_unrelated_documents_do_not():
+    assert _shared_buckets(BASE, NEAR) > 0
+    assert _shared_buckets(BASE, OTHER) == 0
+
+
+def test_candidates_come_from_shared_buckets(data_manager):
+    for doc_id, content in (("base", BASE), ("near", NEAR), ("other", OTHER), ("empty", "")):
+        data_manager.execute_with_retry(
+            "INSERT INTO documents (id, content) VALUES (%s, %s)", (doc_id, content))
+    index = NearDuplicateIndex(data_manager)
+
+    stats = index.backfill(batch_size=2)
+
+    assert stats == {"indexed": 3, "skipped": 1}
+    assert index.candidates("base") == ["near"]
+    assert index.candidates("other") == []
+    assert index.backfill() == {"indexed": 0, "skipped": 1}
+
+    data_manager.execute_with_retry("DELETE FROM documents WHERE id = %s", ("near",))
+    assert index.candidates("base") == []
@@ -0,0 +1,95 @@
+from common.section_splitter import HEADING, PARAGRAPH, TABLE, split_blocks, split_sections
+
+
+def words(text):
+    return len(text.split())
+
+
+def _paragraph(n, word="chữ"):
+    return " ".join([word] * n)
+
+
+def test_blocks_of_plain_text():
+    content = "1. Học phí\n\nSinh viên đóng học phí theo tín chỉ.\n\n| Ngành | Học phí |\n|---|---|\n| CNTT | 10 |"
+
+    assert [kind for kind, _ in split_blocks(content)] == [HEADING, PARAGRAPH, TABLE]
+
+
+def test_blocks_of_html_inside_a_wrapper():
+    content = "<div><h2>Học phí</h2><p>Đóng theo tín chỉ.</p><table><tr><td>CNTT</td></tr></table><p> </p></div>"
+
+    assert [kind for kind, _ in split_blocks(content)] == [HEADING, PARAGRAPH, TABLE]
+
+
+def test_small_documents_stay_in_one_section():
+    content = f"# Học phí\n\n{_paragraph(10)}\n\n{_paragraph(10)}"
+
+    assert split_sections(content, 100, words) == [content.replace("\n\n", "\n")]
+
+
+def test_sections_break_at_headings_and_respect_the_budget():
+    content = "\n\n".join([
+        "# Học phí", _paragraph(30), _paragraph(30),
+        "# Ký túc xá", _paragraph(30),
+    ])
+
+    sections = split_sections(content, 100, words)
+
+    assert len(sections) == 2
+    assert sections[1].startswith("# Ký túc xá")
+    assert all(words(section) <= 100 for section in sections)
+
+
+def test_oversized_paragraph_is_split_by_sentences_with_its_heading():
+    sentences = " ".join(f"Câu số {i} nói về học phí của sinh viên." for i in range(40))
+    content = f"# Học phí\n\n{sentences}"
+
+    sections = split_sections(content, 50, words)
+
+    assert len(sections) > 1
+    assert sections[0].startswith("# Học phí\n")
+    assert all(words(section) <= 50 for section in sections)
+    assert " ".join(sections).replace("# Học phí\n", "").split() == sentences.split()
+
+
+def test_oversized_tables_repeat_their_header():
+    rows = "\n".join(f"| Ngành {i} | {i} triệu |" for i in range(30))
+    content = f"| Ngành | Học phí |\n|---|---|\n{rows}"
+
+    sections = split_sections(content, 40, words)
+
+    assert len(sections) > 1
+    assert all(section.startswith("| Ngành | Học phí |\n|---|---|\n") for section in sections)
+    assert sum(section.count("triệu") for section in sections) == 30
+
+
+def test_oversized_html_tables_repeat_their_header_row():
+    rows = "".join(f"<tr><td>Ngành {i}</td><td>{i}</td></tr>" for i in range(30))
+    content = f"<table><tr><th>Ngành</th><th>Học phí</th></tr>{rows}</table>"
+
+    sections = split_sections(content, 20, lambda text: text.count("<td>") + text.count("<th>"))
+
+    assert len(sections) > 1
+    assert all(section.startswith("<table><tr><th>Ngành</th><th>Học phí</th></tr>") for section in sections)
+    assert sum(section.count("<tr><td>") for section in sections) == 30
+
+
+def test_nested_headings_stay_with_their_content():
+    content = (f"<h1>Thông tin tuyển sinh</h1><p>{_paragraph(20)}</p>"
+               f"<h2>Học phí năm</h2><h3>Ngành kỹ thuật</h3><p>{_paragraph(60)}</p>")
+
+    sections = split_sections(content, 100, words)
+
+    assert sections == [f"<h1>Thông tin tuyển sinh</h1>\n<p>{_paragraph(20)}</p>",
+                        f"<h2>Học phí năm</h2>\n<h3>Ngành kỹ thuật</h3>\n<p>{_paragraph(60)}</p>"]
+
+
+def test_headings_are_never_repeated_before_a_split_block():
+    sentences = " ".join(f"Câu số {i} nói về ký túc xá." for i in range(20))
+    content = "\n\n".join([_paragraph(10), "# Học phí", "# Ký túc xá", sentences])
+
+    sections = split_sections(content, 50, words)
+
+    assert sections[0] == _paragraph(10)
+    assert sections[1].startswith("# Học phí\n# Ký túc xá\n")
+    assert sum(section.count("# Học phí") for section in sections) == 1
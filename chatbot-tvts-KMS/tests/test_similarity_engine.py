@@ -0,0 +1,46 @@
+import pytest
+
+from common.similarity_benchmark import synthetic_corpus
+from common.similarity_engine import duplicate_groups, score_against, similar_pairs
+from common.utils import ratio
+
+
+def test_batched_scores_equal_ratio():
+    texts = synthetic_corpus(50, words=30)
+    query, candidates = texts[-1], texts[:-1] + ["", None]
+
+    scores = score_against(query, candidates, workers=1)
+
+    assert len(scores) == len(candidates)
+    for candidate, score in zip(candidates, scores):
+        assert score == pytest.approx(ratio(query, candidate) if candidate else 0.0, abs=1e-6)
+
+
+def test_one_thread_and_every_core_give_the_same_scores():
+    texts = synthetic_corpus(50, words=30)
+
+    assert list(score_against(texts[0], texts, workers=1)) == list(score_against(texts[0], texts, workers=0))
+
+
+def test_lsh_pairs_find_the_exhaustive_pairs_of_near_duplicates():
+    texts = synthetic_corpus(300, words=120, duplicate_share=0.1)
+
+    exhaustive = {(i, j) for i, j, _ in similar_pairs(texts, 0.98, method='exhaustive', workers=1, block_size=64)}
+    lsh = {(i, j) for i, j, _ in similar_pairs(texts, 0.98, method='lsh')}
+
+    assert exhaustive
+    assert lsh == exhaustive
+
+
+def test_duplicate_groups_are_connected_components():
+    base = "sinh viên đăng ký học phần trực tuyến trong tuần thứ hai của học kỳ mùa thu năm nay"
+    texts = [base, base + " nhé", "ký túc xá mở cửa lúc sáu giờ sáng", base + " nhé!", ""]
+
+    groups = duplicate_groups(["a", "b", "c", "d", "e"], texts, threshold=0.95, workers=1)
+
+    assert groups == [["a", "b", "d"]]
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError):
+        similar_pairs(["a"], 0.9, method='fuzzy')
@@ -11,10 +11,10 @@ class DialogueRepository:
         self.database_name = "DB_NAME_CHATBOT"
         self.conn = psycopg2.connect(**get_database_params(self.database_name))
     
-    def query_database(self, query):
+    def query_database(self, query, params=None):
         self.conn = psycopg2.connect(**get_database_params(self.database_name))
         cur = self.conn.cursor()
-        cur.execute(query)
+        cur.execute(query, params)
         rows = cur.fetchall()
         self.conn.commit()
         cur.close()
@@ -33,14 +33,27 @@ class DialogueRepository:
         query = "SELECT * FROM dialogues limit 5"
         return self.query_database(query)
     
+    # Rows as dicts keyed by column name, whatever the column order of the table
+    def query_database_dicts(self, query, params=None):
+        self.conn = psycopg2.connect(**get_database_params(self.database_name))
+        cur = self.conn.cursor()
+        cur.execute(query, params)
+        columns = [column[0] for column in cur.description]
+        rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+        self.conn.commit()
+        cur.close()
+        self.conn.close()
+        return rows
+
     def get_dialogue_by_date(self, date: datetime):
         date_from = date.strftime(DatetimeFormat.YYYYMMDD)
         date_to = (date + timedelta(days=1)).strftime(DatetimeFormat.YYYYMMDD)
-        query = """SELECT * FROM dialogues  
+        query = """SELECT id, record_id, conversation_id, app_id, main_input, main_output, main_error,
+                perf, calls, created_at, log_format, calls_compressed FROM dialogues
                 WHERE CAST('{date_from}' AS DATE) < created_at 
                 and created_at < CAST('{date_to}' AS DATE)""".format(date_from = date_from, date_to = date_to)
         
-        return self.query_database(query)
+        return self.query_database_dicts(query)
     
     def get_dialogue_record_id_by_date(self, date: datetime):
         date_from = date.strftime(DatetimeFormat.YYYYMMDD)
@@ -51,4 +64,10 @@ class DialogueRepository:
         
         return self.query_database(query)
 
+    def get_log_documents(self, content_hashes: list[str]):
+        query = "SELECT content_hash, content FROM log_documents WHERE content_hash = ANY(%s)"
+        return self.query_database(query, (list(content_hashes),))
 
+    def get_log_prompt_templates(self, template_hashes: list[str]):
+        query = "SELECT template_hash, template_id, content FROM log_prompt_templates WHERE template_hash = ANY(%s)"
+        return self.query_database(query, (list(template_hashes),))
@@ -9,6 +9,7 @@ from shared.constant.callName import CallName
 from datetime import datetime
 from shared.constant.datetimeFormat import DatetimeFormat
 from shared.utils.utils import truncate_string
+from shared.utils.dialogueLog import LOG_FORMAT_COMPACT, decode_calls, collect_refs, rehydrate
 import uuid 
 
 class SyncDataService():
@@ -25,7 +26,7 @@ class SyncDataService():
         print("[{date}] | SYNCING DATA | Start".format(date=datetime.today()))
 
         # Get all dialogues in date
-        result = self.dialogue_epository.get_dialogue_by_date(date)
+        result = self.rehydrate_dialogues(self.dialogue_epository.get_dialogue_by_date(date))
         print("[{date}] | SYNCING DATA | Found {dialogues} new dialogues".format(date=datetime.today(), dialogues=len(result)))
 
         # Mapping dialogues to records
@@ -49,18 +50,41 @@ class SyncDataService():
         return result
 
     
+    # Compact dialogues (log_format = 2) are expanded back to the full calls shape
+    def rehydrate_dialogues(self, dialogues):
+        dialogues = [dict(x) for x in dialogues]
+        compact = [x for x in dialogues if x.get("log_format") == LOG_FORMAT_COMPACT]
+
+        document_hashes, template_hashes = set(), set()
+        for dialogue in compact:
+            dialogue["calls"] = decode_calls(dialogue["calls"], dialogue.get("calls_compressed"))
+            collect_refs(dialogue["calls"], document_hashes, template_hashes)
+
+        documents = {}
+        if len(document_hashes) > 0:
+            documents = {row[0]: row[1] for row in self.dialogue_epository.get_log_documents(document_hashes)}
+        templates = {}
+        if len(template_hashes) > 0:
+            templates = {row[0]: (row[1], row[2]) for row in self.dialogue_epository.get_log_prompt_templates(template_hashes)}
+
+        for dialogue in compact:
+            dialogue["calls"] = rehydrate(dialogue["calls"], documents, templates)
+        for dialogue in dialogues:
+            dialogue.pop("calls_compressed", None)
+        return dialogues
+
     def map_dialogues_to_records(self, dialogue) -> list[CreateRecordDto]:
         # Get raw data
-        dialogue_id = dialogue[0]
-        record_id = dialogue[1]
-        conversation_id = dialogue[2]
-        app_id = dialogue[3]
-        main_input = dialogue[4]
-        main_output = dialogue[5]
-        main_error = dialogue[6]
-        perf = dialogue[7]
-        calls = dialogue[8]
-        created_at = dialogue[9]
+        dialogue_id = dialogue["id"]
+        record_id = dialogue["record_id"]
+        conversation_id = dialogue["conversation_id"]
+        app_id = dialogue["app_id"]
+        main_input = dialogue["main_input"]
+        main_output = dialogue["main_output"]
+        main_error = dialogue["main_error"]
+        perf = dialogue["perf"]
+        calls = dialogue["calls"]
+        created_at = dialogue["created_at"]
 
         # Manipulate data
         #main_input = truncate_string(main_input, 250) # only need to store first 255 character
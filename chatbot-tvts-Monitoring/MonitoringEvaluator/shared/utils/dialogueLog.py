@@ -0,0 +1,54 @@
+import json
+import zlib
+
+# Compact dialogue logs written by the chatbot agent (see chatbot log_format.py)
+# reference long strings in log_documents and prompts in log_prompt_templates.
+# These helpers turn them back into the full calls shape used by RecordService.
+
+LOG_FORMAT_COMPACT = 2
+
+
+def decode_calls(calls, calls_compressed):
+    if calls_compressed is not None:
+        return json.loads(zlib.decompress(bytes(calls_compressed)).decode("utf-8"))
+    return calls or []
+
+
+def collect_refs(value, documents: set, templates: set):
+    if isinstance(value, dict):
+        if "$doc" in value:
+            documents.add(value["$doc"])
+            return
+        if "$prompt" in value:
+            templates.add(value["$prompt"])
+        for v in value.values():
+            collect_refs(v, documents, templates)
+    elif isinstance(value, list):
+        for v in value:
+            collect_refs(v, documents, templates)
+
+
+# Same layout as the chatbot's SLOT_FORMATTERS
+def format_slot(template_id, name, value):
+    if not isinstance(value, list):
+        return str(value)
+    if template_id == "RANKING_DOCS_USER_PROMPT_TEMPLATE" and name == "DOCS":
+        return json.dumps([{"chunk_id": f"id_{i}", "text": doc} for i, doc in enumerate(value)])
+    return "\n".join(value)
+
+
+def rehydrate(value, documents: dict, templates: dict):
+    if isinstance(value, dict):
+        if "$doc" in value:
+            return documents.get(value["$doc"], "")
+        if "$prompt" in value:
+            template_id, text = templates.get(value["$prompt"], ("", ""))
+            for name, slot in value["slots"].items():
+                slot = rehydrate(slot, documents, templates)
+                text = text.replace(f"[{name}]", format_slot(template_id, name, slot))
+            # separates the messages of cache-friendly templates
+            return text.replace("[MESSAGE_BREAK]", "")
+        return {k: rehydrate(v, documents, templates) for k, v in value.items()}
+    if isinstance(value, list):
+        return [rehydrate(v, documents, templates) for v in value]
+    return value
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the evaluator imports its packages from its own directory, as in the Dockerfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,52 @@
+import json
+import zlib
+from datetime import datetime
+
+from service.syncDataService import SyncDataService
+from shared.utils.dialogueLog import LOG_FORMAT_COMPACT
+
+
+class FakeDialogueRepository:
+    def get_log_documents(self, content_hashes):
+        return [("h1", "Học phí là 10 triệu")]
+
+    def get_log_prompt_templates(self, template_hashes):
+        return []
+
+
+def _service():
+    service = SyncDataService.__new__(SyncDataService)
+    service.dialogue_epository = FakeDialogueRepository()
+    return service
+
+
+def _dialogue(**columns):
+    # column order differs from the table on purpose: rows are read by name
+    dialogue = {"calls_compressed": None, "log_format": None, "created_at": datetime(2026, 1, 1),
+                "calls": [], "perf": {"start_time": "2026-01-01T00:00:00"}, "main_error": None,
+                "main_output": "answer", "main_input": "question", "app_id": "app",
+                "conversation_id": "c", "record_id": "r", "id": 1}
+    dialogue.update(columns)
+    return dialogue
+
+
+def test_compact_and_compressed_dialogues_are_rehydrated_by_column_name():
+    calls = [{"call_name": "SearchDocsCommand", "rets": {"document": {"$doc": "h1"}}}]
+    full = _dialogue(id=1, calls=[{"call_name": "IntentCommand", "rets": {}}])
+    compact = _dialogue(id=2, log_format=LOG_FORMAT_COMPACT, calls=calls)
+    compressed = _dialogue(id=3, log_format=LOG_FORMAT_COMPACT, calls=None,
+                           calls_compressed=zlib.compress(json.dumps(calls).encode("utf-8")))
+
+    dialogues = _service().rehydrate_dialogues([full, compact, compressed])
+
+    assert dialogues[0]["calls"] == full["calls"]
+    for dialogue in dialogues[1:]:
+        assert dialogue["calls"] == [{"call_name": "SearchDocsCommand", "rets": {"document": "Học phí là 10 triệu"}}]
+    assert all("calls_compressed" not in dialogue for dialogue in dialogues)
+
+
+def test_records_are_mapped_by_column_name():
+    record = _service().map_dialogues_to_records(_dialogue())
+
+    assert (record.id, record.conversation_id) == ("r", "c")
+    assert record.record_data["main_input"] == record.main_input == "question"